@@ -0,0 +1,98 @@
+"""Batch and grouped evaluators against evaluate_predictions and sklearn, with tied and NaN scores."""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import average_precision_score, roc_auc_score
+
+from tools.evaluate import evaluate_groups, evaluate_predictions, evaluate_predictions_batch
+
+N_SAMPLES = 300
+TOP_N_FR, TOP_N_TTIF = 100, 20
+PATIENTS = np.array([f"p{i}" for i in range(6)])
+MODELS = ["continuous", "rounded", "integer", "constant", "continuous_nan", "rounded_nan"]
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    y = (rng.random(N_SAMPLES) < 0.15).astype(int)
+    patients = rng.choice(PATIENTS, N_SAMPLES)
+    # One patient with no positives: degenerate in every model
+    y[patients == "p5"] = 0
+    base = y + rng.normal(0, 1.0, N_SAMPLES)
+    missing = rng.random(N_SAMPLES) < 0.15
+    scores = np.stack([
+        base,
+        np.round(base, 1),                       # many ties, some across the top-N cutoffs
+        np.clip(np.round(base), -1, 2),          # few distinct values
+        np.zeros(N_SAMPLES),                     # everything tied
+        np.where(missing, np.nan, base),
+        np.where(missing, np.nan, np.round(base, 1)),
+    ])
+    return y, scores, patients
+
+
+def _stable_top(y, s, n):
+    """Positives among the top n, ties taken in input order."""
+    return y[np.argsort(-s, kind="stable")][:n].sum()
+
+
+def _tied_at(s, n):
+    """Whether a tie spans the top-n cutoff."""
+    ranked = np.sort(s)[::-1]
+    return n < len(ranked) and ranked[n - 1] == ranked[n]
+
+
+def test_batch_matches_evaluate_predictions(data):
+    y, scores, _ = data
+    table = evaluate_predictions_batch(y, scores, names=MODELS, top_n_fr=TOP_N_FR, top_n_ttif=TOP_N_TTIF)
+
+    for row, s in zip(table.itertuples(index=False), scores):
+        expected = evaluate_predictions(y, s, name=row.name, top_n_fr=TOP_N_FR, top_n_ttif=TOP_N_TTIF)
+        for key in ["n_total", "n_positive", "n_negative"]:
+            assert getattr(row, key) == expected[key], (row.name, key)
+        for key in ["auc_roc", "auprc", "f1_median_threshold", "precision_median_threshold",
+                    "recall_median_threshold"]:
+            np.testing.assert_allclose(getattr(row, key), expected[key], rtol=1e-12, err_msg=f"{row.name} {key}")
+
+        # FR/TTIF take ties in input order; evaluate_predictions agrees unless a tie spans the cutoff
+        valid = ~np.isnan(s)
+        yv, sv = y[valid], s[valid]
+        np.testing.assert_allclose(row.fr_top100, _stable_top(yv, sv, TOP_N_FR) / yv.sum(), rtol=1e-12)
+        np.testing.assert_allclose(row.ttif_top20, _stable_top(yv, sv, TOP_N_TTIF) / TOP_N_TTIF, rtol=1e-12)
+        if not _tied_at(sv, TOP_N_FR):
+            np.testing.assert_allclose(row.fr_top100, expected["fr_top100"], rtol=1e-12)
+        if not _tied_at(sv, TOP_N_TTIF):
+            np.testing.assert_allclose(row.ttif_top20, expected["ttif_top20"], rtol=1e-12)
+
+
+def test_groups_match_sklearn(data):
+    y, scores, patients = data
+    table = evaluate_groups(y, scores, {"patient_id": patients}, names=MODELS,
+                            top_n_fr=TOP_N_FR, top_n_ttif=TOP_N_TTIF)
+    assert len(table) == len(MODELS) * len(PATIENTS)
+
+    for row in table.itertuples(index=False):
+        s = scores[MODELS.index(row.model)]
+        keep = (patients == row.group) & ~np.isnan(s)
+        yg, sg = y[keep], s[keep]
+        n_pos = yg.sum()
+        assert (row.n_total, row.n_positive) == (len(yg), n_pos), (row.model, row.group)
+        assert row.degenerate == (n_pos == 0 or n_pos == len(yg))
+        if row.degenerate:
+            assert np.isnan(row.auc_roc)
+        else:
+            np.testing.assert_allclose(row.auc_roc, roc_auc_score(yg, sg), rtol=1e-12)
+            np.testing.assert_allclose(row.auprc, average_precision_score(yg, sg), rtol=1e-12)
+            np.testing.assert_allclose(row.fr_top100, _stable_top(yg, sg, TOP_N_FR) / n_pos, rtol=1e-12)
+        np.testing.assert_allclose(row.ttif_top20, _stable_top(yg, sg, TOP_N_TTIF) / min(TOP_N_TTIF, len(yg)),
+                                   rtol=1e-12)
+
+
+def test_groups_drop_all_nan_group(data):
+    y, scores, patients = data
+    s = scores[0].copy()
+    s[patients == "p0"] = np.nan
+    table = evaluate_groups(y, s, pd.DataFrame({"patient_id": patients}))
+    assert "p0" not in set(table["group"])
+    assert table["n_total"].sum() == (~np.isnan(s)).sum()
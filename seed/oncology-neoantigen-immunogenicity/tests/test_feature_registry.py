@@ -0,0 +1,60 @@
+"""Vectorized registry producers against the per-row feature functions they replace."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.feature_engineering import engineer_features
+from tools.feature_registry import FEATURE_SETS, compute_features
+from tools.iedb_transfer import compute_sequence_features, reconstruct_wt_and_compute_diff
+
+# Non-standard residues (X, B, U, Z) get zero properties on both paths
+RESIDUES = np.array(list("ACDEFGHIKLMNPQRSTVWY") + list("XBUZ"))
+ALLELES = ["HLA-A*02:01", "HLA-A*24:02", "HLA-B*07:02", "HLA-B*44:02", "HLA-C*07:01"]
+MUTATION_SITE = ["mut_blosum_self", "mut_aa_rarity", "mut_residue_hydro", "mut_residue_charge",
+                 "mut_residue_size", "mut_residue_aromatic", "mut_residue_polar"]
+N_JOBS = [(1, None), (3, 37)]
+
+
+@pytest.fixture(scope="module")
+def peptides():
+    rng = np.random.default_rng(0)
+    n = 400
+    lengths = rng.integers(8, 15, n)
+    # Positions run past both ends of the peptide, with some missing
+    positions = rng.integers(-2, 17, n).astype(float)
+    positions[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({
+        "peptide": ["".join(rng.choice(RESIDUES, k)) for k in lengths],
+        "allele": rng.choice(ALLELES, n),
+        "mutation_position": positions,
+        "peptide_length": lengths,
+    })
+
+
+def _assert_columns_equal(expected, got, columns):
+    for col in columns:
+        np.testing.assert_allclose(got[col].to_numpy(float), expected[col].to_numpy(float),
+                                   rtol=1e-12, atol=1e-12, equal_nan=True, err_msg=col)
+
+
+@pytest.mark.parametrize("n_jobs,shard_rows", N_JOBS)
+def test_novel_matches_engineer_features(peptides, n_jobs, shard_rows):
+    got = compute_features(peptides, FEATURE_SETS["novel"], n_jobs=n_jobs, shard_rows=shard_rows)
+    _assert_columns_equal(engineer_features(peptides), got, FEATURE_SETS["novel"])
+
+
+@pytest.mark.parametrize("n_jobs,shard_rows", N_JOBS)
+def test_iedb_sequence_matches_compute_sequence_features(peptides, n_jobs, shard_rows):
+    expected = pd.DataFrame([compute_sequence_features(p) for p in peptides["peptide"]])
+    got = compute_features(peptides[["peptide"]], FEATURE_SETS["iedb_sequence"],
+                           n_jobs=n_jobs, shard_rows=shard_rows)
+    assert set(got.columns) == set(expected.columns)
+    _assert_columns_equal(expected, got, FEATURE_SETS["iedb_sequence"])
+
+
+@pytest.mark.parametrize("n_jobs,shard_rows", N_JOBS)
+def test_mutation_site_matches_reconstruct_wt(peptides, n_jobs, shard_rows):
+    expected = pd.DataFrame([reconstruct_wt_and_compute_diff(p, pos) for p, pos
+                             in zip(peptides["peptide"], peptides["mutation_position"])])
+    got = compute_features(peptides, MUTATION_SITE, n_jobs=n_jobs, shard_rows=shard_rows)
+    _assert_columns_equal(expected, got, MUTATION_SITE)
@@ -0,0 +1,30 @@
+"""FlatForest predictions against sklearn's predict_proba."""
+import numpy as np
+import pytest
+from sklearn.ensemble import ExtraTreesClassifier, GradientBoostingClassifier, RandomForestClassifier
+
+from tools.flat_forest import FlatForest
+
+MODELS = {
+    "rf": lambda: RandomForestClassifier(n_estimators=30, max_depth=8, class_weight="balanced", random_state=0),
+    "et": lambda: ExtraTreesClassifier(n_estimators=30, min_samples_leaf=3, random_state=0),
+    "gb": lambda: GradientBoostingClassifier(n_estimators=40, max_depth=3, random_state=0),
+}
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(1200, 6))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(size=len(X)) > 0.5).astype(int)
+    return X[:800], y[:800], X[800:]
+
+
+@pytest.mark.parametrize("name", list(MODELS))
+@pytest.mark.parametrize("quantized", [False, True])
+def test_matches_predict_proba(data, name, quantized):
+    X, y, X_eval = data
+    model = MODELS[name]().fit(X, y)
+    flat = FlatForest.from_sklearn(model)
+    np.testing.assert_allclose(flat.predict_proba(X_eval, quantized=quantized), model.predict_proba(X_eval),
+                               rtol=0, atol=1e-12)
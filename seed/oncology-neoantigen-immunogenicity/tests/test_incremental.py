@@ -0,0 +1,52 @@
+"""Drift metrics of incremental updates accumulate since the last rebuild."""
+import numpy as np
+import pandas as pd
+
+from tools.incremental import build_patients, population_stability, update_patients
+
+FEATURES = ["f0", "f1"]
+SMALL_RF = {"n_estimators": 5}
+
+
+def _patients(ids, n_rows=40, shift=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for pid in ids:
+        X = rng.normal(shift, 1.0, size=(n_rows, len(FEATURES)))
+        frames.append(pd.DataFrame(X, columns=FEATURES).assign(
+            peptide=[f"{pid}_{i}" for i in range(n_rows)], allele="HLA-A*02:01", patient_id=pid,
+            immunogenic=(np.arange(n_rows) % 4 == 0).astype(int)))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_growth_accumulates_until_rebuild():
+    cohort = _patients(["p0", "p1", "p2", "p3"])
+    state = build_patients(cohort, FEATURES, SMALL_RF)
+
+    # Each batch adds 20% of the rebuild's rows: well under the 0.5 growth
+    # limit on its own, over it once three are counted together
+    for k, pid in enumerate(["p4", "p5", "p6"]):
+        cohort = pd.concat([cohort, _patients([pid], n_rows=32, seed=k + 1)], ignore_index=True)
+        state, record = update_patients(state, cohort, thresholds={"psi": np.inf})
+        assert np.isclose(record["growth"], (k + 1) * 0.2)
+        assert record["action"].startswith("rebuilt (growth" if k == 2 else "extended")
+    assert state["since_rebuild"]["added"] == 0
+    assert state["reference"]["n_rows"] == len(cohort)
+
+
+def test_psi_covers_all_rows_added_since_rebuild():
+    cohort = _patients(["p0", "p1", "p2", "p3"])
+    state = build_patients(cohort, FEATURES, SMALL_RF)
+    no_rebuild = {"psi": np.inf, "growth": np.inf}
+
+    added = []
+    for k, pid in enumerate(["p4", "p5", "p6"]):
+        batch = _patients([pid], n_rows=20, shift=1.0, seed=k + 1)
+        cohort = pd.concat([cohort, batch], ignore_index=True)
+        state, record = update_patients(state, cohort, thresholds=no_rebuild)
+        added.append(batch)
+        assert record["action"].startswith("extended")
+
+    X_added = state["scaler"].transform(state["imputer"].transform(pd.concat(added)[FEATURES].values))
+    assert np.isclose(record["psi"], population_stability(state["reference"], X_added).max())
+    assert state["since_rebuild"]["added"] == 60
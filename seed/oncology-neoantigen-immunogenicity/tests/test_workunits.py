@@ -0,0 +1,102 @@
+"""SpoolBackend lease and retry behaviour with local multi-process workers."""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import pytest
+
+from tools.workunits import Coordinator, SpoolBackend, run_spool_worker, unit_kind
+
+if not hasattr(os, "fork"):
+    pytest.skip("workers are forked to inherit the test unit kinds", allow_module_level=True)
+fork = multiprocessing.get_context("fork")
+
+
+@unit_kind("test_sleep")
+def _sleep(payload):
+    """Sleep, then record one execution in the payload's log file."""
+    time.sleep(payload["seconds"])
+    with open(payload["log"], "a") as f:
+        f.write(f"{payload['name']}\n")
+    return payload["name"]
+
+
+@unit_kind("test_flaky")
+def _flaky(payload):
+    """Fail on the first execution, succeed afterwards."""
+    marker = Path(payload["marker"])
+    if not marker.exists():
+        marker.touch()
+        raise ValueError("first attempt fails")
+    return payload["value"]
+
+
+def _start_workers(root, n, **kwargs):
+    workers = [fork.Process(target=run_spool_worker, args=(root,), kwargs={"idle_exit_s": 1.0, "poll_s": 0.05,
+                                                                           **kwargs})
+               for _ in range(n)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def _run_async(coordinator, units):
+    """Coordinator.run on a daemon thread, so a hung run fails the test instead of blocking it."""
+    future = Future()
+
+    def target():
+        try:
+            future.set_result(coordinator.run(units))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def _run(coordinator, units, timeout=60):
+    return _run_async(coordinator, units).result(timeout=timeout)
+
+
+def _executions(log):
+    return sorted(Path(log).read_text().split())
+
+
+def test_lease_counts_from_claim_not_enqueue(tmp_path):
+    backend = SpoolBackend(tmp_path / "spool", lease_s=1.0, poll_s=0.05)
+    coordinator = Coordinator(backend)
+    log = tmp_path / "log"
+    units = [("test_sleep", {"seconds": 0.6, "log": str(log), "name": f"u{i}"}) for i in range(3)]
+    running = _run_async(coordinator, units)
+    time.sleep(1.5)  # units wait in pending/ for longer than the lease
+    workers = _start_workers(tmp_path / "spool", 2)
+    assert running.result(timeout=60) == ["u0", "u1", "u2"]
+    for worker in workers:
+        worker.join()
+    coordinator.close()
+    assert _executions(log) == ["u0", "u1", "u2"]
+
+
+def test_heartbeat_keeps_long_unit_claimed(tmp_path):
+    coordinator = Coordinator(SpoolBackend(tmp_path / "spool", lease_s=1.0, poll_s=0.05))
+    log = tmp_path / "log"
+    workers = _start_workers(tmp_path / "spool", 2, heartbeat_s=0.2)
+    assert _run(coordinator, [("test_sleep", {"seconds": 2.5, "log": str(log), "name": "long"})]) == ["long"]
+    for worker in workers:
+        worker.join()
+    coordinator.close()
+    assert _executions(log) == ["long"]
+
+
+def test_failed_unit_is_retried(tmp_path):
+    coordinator = Coordinator(SpoolBackend(tmp_path / "spool", poll_s=0.05))
+    workers = _start_workers(tmp_path / "spool", 2)
+    units = [("test_flaky", {"marker": str(tmp_path / f"m{i}"), "value": i}) for i in range(4)]
+    assert _run(coordinator, units) == [0, 1, 2, 3]
+    assert coordinator.stats["retried"] == 4
+    for worker in workers:
+        worker.join()
+    coordinator.close()
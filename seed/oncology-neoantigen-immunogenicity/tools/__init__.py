@@ -0,0 +1,8 @@
+"""
+Neoantigen immunogenicity prediction tools.
+
+Modules are imported on demand; importing the package itself loads nothing
+else. Command-line entry point (see tools/cli.py):
+
+    python -m tools --help
+"""
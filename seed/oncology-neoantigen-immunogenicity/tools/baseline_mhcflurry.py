@@ -8,54 +8,36 @@ This tests the hypothesis: "Is binding affinity alone a good predictor of immuno
 Spoiler: It's decent but not great -- that's the gap we're trying to close.
 """
 import sys
+from pathlib import Path
 import numpy as np
-sys.path.insert(0, ".")
+import pandas as pd
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from tools.data_loader import load_tesla
+from tools.data_loader import load_tesla, load_presentation_predictor, prefetch
 from tools.evaluate import evaluate_predictions, print_metrics, compare_models
+from tools.ledger import start_session
+from tools.oof_store import record_oof
 
 
 def run_mhcflurry_predictions(tesla_df):
-    """Run MHCflurry binding predictions on TESLA peptides."""
-    from mhcflurry import Class1PresentationPredictor
-
-    predictor = Class1PresentationPredictor.load()
-
-    results = []
-    for _, row in tesla_df.iterrows():
-        allele = row["allele"]
-        peptide = row["peptide"]
-
-        try:
-            pred = predictor.predict(
-                peptides=[peptide],
-                alleles=[allele],
-                verbose=0,
-            )
-            # presentation_score is the combined binding + processing score
-            presentation_score = pred["presentation_score"].values[0]
-            affinity = pred["affinity"].values[0]
-            processing_score = pred["processing_score"].values[0]
-
-            results.append({
-                "peptide": peptide,
-                "allele": allele,
-                "mhcflurry_presentation": presentation_score,
-                "mhcflurry_affinity": affinity,
-                "mhcflurry_processing": processing_score,
-            })
-        except Exception as e:
-            print(f"  Warning: Failed for {allele} {peptide}: {e}")
-            results.append({
-                "peptide": peptide,
-                "allele": allele,
-                "mhcflurry_presentation": np.nan,
-                "mhcflurry_affinity": np.nan,
-                "mhcflurry_processing": np.nan,
-            })
-
-    import pandas as pd
-    return pd.DataFrame(results)
+    """
+    Run MHCflurry binding predictions on TESLA peptides (batched and
+    deduplicated; rows of a failing allele get NaN).
+    """
+    from tools.error_analysis_and_multifeature import predict_mhcflurry
+
+    scores = predict_mhcflurry(tesla_df["peptide"], tesla_df["allele"], predictor=load_presentation_predictor())
+    return pd.concat([tesla_df[["peptide", "allele"]].reset_index(drop=True), scores], axis=1)
+
+
+FEATURE_BASELINES = [
+    # (column, name, higher_is_better)
+    ("predicted_affinity", "NetMHCpan affinity (inverted)", False),
+    ("binding_stability", "Binding stability", True),
+    ("tumor_abundance", "Tumor abundance (TPM)", True),
+    ("frac_hydrophobic", "Fraction hydrophobic", True),
+    ("foreignness", "Foreignness", True),
+]
 
 
 def run_feature_baselines(tesla_df):
@@ -67,16 +49,7 @@ def run_feature_baselines(tesla_df):
     all_results = []
 
     # Each feature as a standalone predictor
-    feature_configs = [
-        # (column, name, higher_is_better)
-        ("predicted_affinity", "NetMHCpan affinity (inverted)", False),
-        ("binding_stability", "Binding stability", True),
-        ("tumor_abundance", "Tumor abundance (TPM)", True),
-        ("frac_hydrophobic", "Fraction hydrophobic", True),
-        ("foreignness", "Foreignness", True),
-    ]
-
-    for col, name, higher_is_better in feature_configs:
+    for col, name, higher_is_better in FEATURE_BASELINES:
         scores = tesla_df[col].values.copy()
         valid = ~np.isnan(scores)
         if valid.sum() < 100:
@@ -94,8 +67,11 @@ def run_feature_baselines(tesla_df):
 
 
 if __name__ == "__main__":
+    # MHCflurry loads in the background during the feature baselines
+    prefetch("tesla", "predictor")
     print("Loading TESLA benchmark data...")
     tesla = load_tesla()
+    start_session("baseline_mhcflurry", data=tesla)
     y_true = tesla["immunogenic"].astype(int).values
 
     all_results = []
@@ -140,3 +116,23 @@ if __name__ == "__main__":
 
     # 4. Comparison table
     compare_models(all_results)
+
+    # 5. Uncertainty: patient-stratified bootstrap CIs and paired tests vs the best
+    from tools.significance import compare_models_significance
+    np.random.seed(42)
+    score_rows = {"Random": np.random.rand(len(tesla))}
+    for col, name, higher_is_better in FEATURE_BASELINES:
+        scores = tesla[col].to_numpy(dtype=float)
+        if (~np.isnan(scores)).sum() >= 100:
+            score_rows[name] = scores if higher_is_better else -scores
+    score_rows["MHCflurry presentation"] = mhcflurry_preds["mhcflurry_presentation"].to_numpy(dtype=float)
+    score_rows["MHCflurry affinity (inv.)"] = -mhcflurry_preds["mhcflurry_affinity"].to_numpy(dtype=float)
+    compare_models_significance(
+        y_true, np.vstack(list(score_rows.values())), list(score_rows),
+        groups=tesla["patient_id"].values,
+    )
+
+    # 6. Keep every out-of-sample score for stacking (tools.stacking)
+    for name, scores in score_rows.items():
+        if name != "Random":
+            record_oof(name, scores, y_true, tesla["patient_id"].values)
@@ -0,0 +1,336 @@
+"""
+Hot-path benchmark suite on synthetic IEDB/TESLA-shaped data.
+
+Times each pipeline stage at several scales without the licensed datasets
+(see tools/synthetic.py) and writes machine-readable results, optionally
+compared with a stored baseline:
+
+    python -m tools.benchmark                          # 1k, 100k scales
+    python -m tools.benchmark --scales 1k,100k,1m
+    python -m tools.benchmark --stages deduplicate_iedb,evaluate_batch
+    python -m tools.benchmark --save-baseline          # store as the new baseline
+    python -m tools.benchmark --no-startup             # skip import-time measurements
+
+Row-wise legacy stages are capped (max_rows) so the 1M scale finishes; their
+result records the rows actually timed. Stages whose optional dependency is
+missing (MHCflurry) are reported as skipped. Startup cost (interpreter plus
+imports of the CLI and core modules, in a fresh process) is reported under the
+"startup" scale.
+
+Results JSON:
+    {"meta": {...}, "results": [{"stage", "scale", "n_rows", "seconds", "rows_per_s", "status"}]}
+"""
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PROJECT_ROOT = Path(__file__).parent.parent
+BENCHMARK_DIR = PROJECT_ROOT / "benchmarks"
+DEFAULT_OUTPUT = BENCHMARK_DIR / "latest.json"
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_SCALES = ("1k", "100k")
+
+# Relative slowdown vs baseline that counts as a regression (ignoring tiny absolute changes)
+REGRESSION_TOLERANCE = 0.25
+MIN_DELTA_S = 0.05
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# STAGES
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# Each stage runs on one synthetic frame ("iedb" or "tesla") and may cap the
+# rows it times ("max_rows") or need an optional module ("requires").
+
+def _dedup(df):
+    from tools.data_loader import deduplicate_iedb
+    deduplicate_iedb(df)
+
+
+def _sequence_rowwise(df):
+    from tools.iedb_transfer import compute_sequence_features
+    [compute_sequence_features(p) for p in df["peptide"]]
+
+
+def _sequence_registry(df):
+    from tools.feature_registry import FEATURE_SETS, compute_features
+    compute_features(df, FEATURE_SETS["iedb_sequence"])
+
+
+def _engineer_rowwise(df):
+    from tools.feature_engineering import engineer_features
+    engineer_features(df)
+
+
+def _novel_registry(df):
+    from tools.feature_registry import FEATURE_SETS, compute_features
+    compute_features(df, FEATURE_SETS["novel"])
+
+
+def _substitution(df):
+    from tools.feature_registry import FEATURE_SETS, compute_features
+    compute_features(df, FEATURE_SETS["substitution"])
+
+
+def _score(df, k=0):
+    """Deterministic synthetic model score (affinity-driven, with noise)."""
+    rng = np.random.default_rng(k)
+    return -np.log(df["predicted_affinity"].to_numpy()) + rng.normal(0, 2.0, len(df))
+
+
+def _evaluate(df):
+    from tools.evaluate import evaluate_predictions
+    evaluate_predictions(df["immunogenic"].to_numpy(), _score(df))
+
+
+def _evaluate_batch(df):
+    from tools.evaluate import evaluate_predictions_batch
+    scores = np.vstack([_score(df, k) for k in range(20)])
+    evaluate_predictions_batch(df["immunogenic"].to_numpy(), scores)
+
+
+def _evaluate_groups(df):
+    from tools.evaluate import evaluate_groups
+    evaluate_groups(df["immunogenic"].to_numpy(), _score(df),
+                    {key: df[key].to_numpy() for key in ("patient_id", "allele", "peptide_length")})
+
+
+def _mhcflurry(df):
+    from tools.error_analysis_and_multifeature import predict_mhcflurry
+    predict_mhcflurry(df["peptide"], df["allele"])
+
+
+STAGES = {
+    "deduplicate_iedb": {"data": "iedb", "run": _dedup},
+    "sequence_features_rowwise": {"data": "iedb", "run": _sequence_rowwise, "max_rows": 20_000},
+    "sequence_features_registry": {"data": "iedb", "run": _sequence_registry},
+    "engineer_features_rowwise": {"data": "tesla", "run": _engineer_rowwise, "max_rows": 20_000},
+    "novel_features_registry": {"data": "tesla", "run": _novel_registry},
+    "blosum_substitution": {"data": "tesla", "run": _substitution},
+    "evaluate_predictions": {"data": "tesla", "run": _evaluate},
+    "evaluate_batch": {"data": "tesla", "run": _evaluate_batch},
+    "evaluate_groups": {"data": "tesla", "run": _evaluate_groups},
+    "mhcflurry_scoring": {"data": "tesla", "run": _mhcflurry, "max_rows": 10_000,
+                          "requires": "mhcflurry"},
+}
+
+
+# Fresh-interpreter commands whose wall time is the startup cost users see
+STARTUP = {
+    "startup_python": ["-c", "pass"],
+    "startup_cli_help": ["-m", "tools", "--help"],
+    "import_evaluate": ["-c", "import tools.evaluate"],
+    "import_feature_registry": ["-c", "import tools.feature_registry"],
+    "import_experiment_scripts": ["-c", "import tools.iedb_transfer, tools.error_analysis_and_multifeature"],
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# RUNNER
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _time_stage(run, df, repeat):
+    """Best-of-repeat wall time; stage output is discarded."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            run(df)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, stages=None, repeat=3, seed=0):
+    """
+    Time every stage at every scale.
+
+    Args:
+        scales: Keys of SCALES.
+        stages: Stage names (default: all).
+        repeat: Timed runs per stage (best is kept); 1 at scales >= 1M.
+        seed: Synthetic data seed.
+
+    Returns:
+        list of result dicts (stage, scale, n_rows, seconds, rows_per_s, status)
+    """
+    from tools.synthetic import synthetic_iedb, synthetic_tesla
+
+    stages = list(stages or STAGES)
+    results = []
+    for scale in scales:
+        n_rows = SCALES[scale]
+        needed = {STAGES[name]["data"] for name in stages}
+        frames = {}
+        if "iedb" in needed:
+            frames["iedb"] = synthetic_iedb(n_rows, seed=seed)
+        if "tesla" in needed:
+            frames["tesla"] = synthetic_tesla(n_rows, seed=seed, with_wt=True)
+
+        for name in stages:
+            spec = STAGES[name]
+            record = {"stage": name, "scale": scale}
+            requires = spec.get("requires")
+            if requires and importlib.util.find_spec(requires) is None:
+                results.append({**record, "n_rows": 0, "seconds": None, "rows_per_s": None,
+                                "status": f"skipped ({requires} not installed)"})
+                print(f"  {scale:>5s}  {name:30s}  skipped ({requires} not installed)")
+                continue
+
+            df = frames[spec["data"]]
+            max_rows = spec.get("max_rows")
+            if max_rows is not None and len(df) > max_rows:
+                df = df.iloc[:max_rows].reset_index(drop=True)
+            try:
+                seconds = _time_stage(spec["run"], df, 1 if n_rows >= 1_000_000 else repeat)
+                status = "ok" if len(df) == n_rows else f"capped at {len(df):,} rows"
+            except Exception as e:
+                seconds, status = None, f"error: {type(e).__name__}: {e}"
+            results.append({
+                **record,
+                "n_rows": len(df),
+                "seconds": seconds,
+                "rows_per_s": len(df) / seconds if seconds else None,
+                "status": status,
+            })
+            timing = f"{seconds:9.4f}s  {len(df) / seconds:12,.0f} rows/s" if seconds else ""
+            print(f"  {scale:>5s}  {name:30s}  {timing}  {status if status != 'ok' else ''}")
+    return results
+
+
+def run_startup_benchmarks(repeat=3):
+    """
+    Time each STARTUP command in a fresh interpreter (best of repeat).
+
+    Returns list of result dicts with scale "startup" and n_rows 0.
+    """
+    env = {k: v for k, v in os.environ.items() if k != "OPENSCIENCE_TRACE"}
+    results = []
+    for name, argv in STARTUP.items():
+        times = []
+        status = "ok"
+        for _ in range(repeat):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable] + argv, cwd=PROJECT_ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            times.append(time.perf_counter() - start)
+            if proc.returncode != 0:
+                status = f"error: {proc.stderr.decode().strip().splitlines()[-1]}"
+                break
+        seconds = min(times) if status == "ok" else None
+        results.append({"stage": name, "scale": "startup", "n_rows": 0, "seconds": seconds,
+                        "rows_per_s": None, "status": status})
+        timing = f"{seconds:9.4f}s" if seconds else ""
+        print(f"  {'start':>5s}  {name:30s}  {timing}  {status if status != 'ok' else ''}")
+    return results
+
+
+def _meta(repeat, seed):
+    from tools.ledger import git_commit
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Match results to baseline entries by (stage, scale).
+
+    Returns list of dicts with stage, scale, seconds, baseline_s, ratio, regression.
+    """
+    base = {(r["stage"], r["scale"]): r for r in baseline["results"]}
+    rows = []
+    for r in results:
+        b = base.get((r["stage"], r["scale"]))
+        if r["seconds"] is None or b is None or not b.get("seconds") or b["n_rows"] != r["n_rows"]:
+            continue
+        ratio = r["seconds"] / b["seconds"]
+        rows.append({
+            "stage": r["stage"],
+            "scale": r["scale"],
+            "seconds": r["seconds"],
+            "baseline_s": b["seconds"],
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance and r["seconds"] - b["seconds"] > MIN_DELTA_S,
+        })
+    return rows
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.benchmark",
+                                     description="Benchmark pipeline stages on synthetic data")
+    parser.add_argument("--scales", default=",".join(DEFAULT_SCALES),
+                        help=f"Comma-separated scales from {list(SCALES)}")
+    parser.add_argument("--stages", help=f"Comma-separated stages (default: all of {list(STAGES)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (best kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT), help="Results JSON path")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Relative slowdown that counts as a regression")
+    parser.add_argument("--no-startup", action="store_true", help="Skip import/startup timings")
+    args = parser.parse_args(argv)
+
+    scales = [s.strip().lower() for s in args.scales.split(",") if s.strip()]
+    stages = [s.strip() for s in args.stages.split(",")] if args.stages else None
+    for s in scales:
+        if s not in SCALES:
+            parser.error(f"unknown scale {s!r}")
+    for s in stages or []:
+        if s not in STAGES:
+            parser.error(f"unknown stage {s!r}")
+
+    print(f"Benchmarking {len(stages or STAGES)} stages at scales {scales}...")
+    results = [] if args.no_startup else run_startup_benchmarks(args.repeat)
+    results += run_benchmarks(scales, stages, args.repeat, args.seed)
+    report = {"meta": _meta(args.repeat, args.seed), "results": results}
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=1))
+    print(f"\nResults written to {output}")
+
+    baseline_path = Path(args.baseline)
+    exit_code = 0
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text())
+        rows = compare_to_baseline(report["results"], baseline, args.tolerance)
+        print(f"\n=== vs baseline ({baseline['meta'].get('git_commit', '?')[:8]}, "
+              f"{baseline['meta'].get('timestamp', '?')}) ===")
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"  {row['scale']:>5s}  {row['stage']:30s}  {row['seconds']:9.4f}s  "
+                  f"baseline {row['baseline_s']:9.4f}s  x{row['ratio']:.2f}{flag}")
+        n_regressions = sum(row["regression"] for row in rows)
+        print(f"\n{n_regressions} regression(s)")
+        exit_code = 1 if n_regressions else 0
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=1))
+        print(f"Baseline written to {baseline_path}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+Single command-line entry point for the tools package.
+
+Run from the project root:
+
+    python -m tools load tesla                                   # dataset summary
+    python -m tools load iedb --dedup majority --output iedb.csv
+    python -m tools features --input tesla --set novel --output novel.csv
+    python -m tools features --list
+    python -m tools score --input tesla --wt-column wt_peptide --output mhcflurry.csv
+    python -m tools evaluate --input preds.csv --score model_a model_b --group patient_id
+    python -m tools experiment iedb_transfer
+    python -m tools cache info
+    python -m tools cache prune --fold-models-gb 0               # also empty the fold model cache
+    python -m tools ledger query --last 10
+    python -m tools pipeline run --set iedb_model.max_depth=12
+    python -m tools replay verify 3f2a --folds 2                 # re-check a recorded finding
+    python -m tools search --model rf --features tesla novel --n-jobs 8
+    python -m tools evolve --rounds 5 --n-jobs 8                 # evolutionary model search
+    python -m tools stacking --combiners greedy logistic         # ensembles over stored OOF scores
+    python -m tools worker --spool /shared/spool               # contributor work-unit worker
+
+Only argparse is imported at startup. Each command imports what it needs
+(pandas, sklearn, MHCflurry/TensorFlow) when it runs, so evaluation and cache
+inspection start in well under a second.
+
+Inputs (--input) are "tesla", "iedb" or a .csv/.tsv/.parquet path; outputs
+are written in the format given by the extension.
+"""
+import argparse
+import sys
+
+# Experiment scripts runnable by name (module run as __main__)
+EXPERIMENTS = {
+    "explore_iedb": "tools.explore_iedb",
+    "baseline": "tools.baseline_mhcflurry",
+    "error_analysis": "tools.error_analysis_and_multifeature",
+    "feature_engineering": "tools.feature_engineering",
+    "iedb_transfer": "tools.iedb_transfer",
+}
+
+
+# Commands handing all their arguments to another module's main(argv)
+PASSTHROUGH = {
+    "ledger": "tools.ledger",
+    "pipeline": "tools.pipeline",
+    "search": "tools.search",
+    "evolve": "tools.evolve",
+    "stacking": "tools.stacking",
+    "replay": "tools.replay",
+    "incremental": "tools.incremental",
+    "artifact": "tools.model_artifact",
+    "importance": "tools.importance",
+    "homology": "tools.homology",
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# I/O
+# ══════════════════════════════════════════════════════════════════════════════
+
+def read_frame(source):
+    """Load "tesla", "iedb" (filtered, not deduplicated) or a table file."""
+    if source == "tesla":
+        from tools.data_loader import load_tesla
+        return load_tesla()
+    if source == "iedb":
+        from tools.data_loader import load_iedb
+        return load_iedb()
+
+    import pandas as pd
+    if source.endswith(".parquet"):
+        return pd.read_parquet(source)
+    return pd.read_csv(source, sep="\t" if source.endswith(".tsv") else ",")
+
+
+def write_frame(df, path):
+    """Write df to path (.csv/.tsv/.parquet), or print its head if path is None."""
+    if path is None:
+        print(df.head(20).to_string())
+        if len(df) > 20:
+            print(f"... {len(df):,} rows x {len(df.columns)} columns")
+        return
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, sep="\t" if path.endswith(".tsv") else ",", index=False)
+    print(f"Wrote {len(df):,} rows x {len(df.columns)} columns to {path}")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMANDS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def cmd_load(args):
+    df = read_frame(args.dataset)
+    if args.dedup:
+        from tools.data_loader import deduplicate_iedb
+        df = deduplicate_iedb(df, strategy=args.dedup)
+    print(f"{args.dataset}: {len(df):,} rows x {len(df.columns)} columns")
+    if "immunogenic" in df.columns:
+        print(f"  {int(df['immunogenic'].sum()):,} immunogenic ({df['immunogenic'].mean():.1%})")
+    if "patient_id" in df.columns:
+        print(f"  Patients: {df['patient_id'].nunique()}")
+    if "allele" in df.columns:
+        print(f"  Alleles: {df['allele'].nunique()}")
+    if args.output:
+        write_frame(df, args.output)
+    return 0
+
+
+def cmd_features(args):
+    from tools.feature_registry import FEATURE_SETS, feature_families, add_features, compute_features
+
+    if args.list:
+        print("Feature sets:")
+        for name, columns in FEATURE_SETS.items():
+            print(f"  {name:18s} {len(columns):4d} columns")
+        families = {}
+        for column, family in feature_families().items():
+            families.setdefault(family, []).append(column)
+        print("\nFamilies:")
+        for family, columns in families.items():
+            print(f"  {family:18s} {len(columns):4d} columns")
+        return 0
+
+    if args.input is None or (args.set is None and args.columns is None):
+        print("features: --input and one of --set/--columns are required (or --list)")
+        return 2
+    if args.set is not None and args.set not in FEATURE_SETS:
+        print(f"features: unknown set {args.set!r}; choose from {list(FEATURE_SETS)}")
+        return 2
+    columns = FEATURE_SETS[args.set] if args.set else [c.strip() for c in args.columns.split(",")]
+
+    df = read_frame(args.input)
+    if args.keep_input:
+        out = add_features(df, columns, n_jobs=args.n_jobs)
+    else:
+        out = compute_features(df, columns, n_jobs=args.n_jobs)
+    write_frame(out, args.output)
+    return 0
+
+
+def cmd_score(args):
+    from tools.error_analysis_and_multifeature import add_mhcflurry_features
+
+    df = read_frame(args.input)
+    print(f"Scoring {len(df):,} peptides with MHCflurry...")
+    scored = add_mhcflurry_features(df, wt_peptide_col=args.wt_column)
+    if not args.keep_input:
+        scored = scored[["peptide", "allele"] + [c for c in scored.columns if c.startswith("mhcflurry_")]]
+    write_frame(scored, args.output)
+    return 0
+
+
+def cmd_evaluate(args):
+    import numpy as np
+    from tools.evaluate import evaluate_predictions_batch, evaluate_groups, print_group_breakdown
+
+    df = read_frame(args.input)
+    missing = [c for c in [args.label] + args.score + (args.group or []) if c not in df.columns]
+    if missing:
+        print(f"evaluate: columns not in {args.input}: {missing}")
+        return 2
+
+    y_true = df[args.label].astype(int).to_numpy()
+    invert = set(args.lower_is_better or [])
+    scores = np.vstack([
+        -df[col].to_numpy(dtype=float) if col in invert else df[col].to_numpy(dtype=float)
+        for col in args.score
+    ])
+    table = evaluate_predictions_batch(y_true, scores, names=args.score,
+                                       top_n_fr=args.top_n_fr, top_n_ttif=args.top_n_ttif)
+    cols = ["name", "n_total", "n_positive", "auc_roc", "auprc", "fr_top100", "ttif_top20"]
+    print(table[cols].sort_values("auprc", ascending=False).to_string(index=False, float_format="%.4f"))
+
+    if args.group:
+        breakdown = evaluate_groups(y_true, scores, {key: df[key].to_numpy() for key in args.group},
+                                    names=args.score, top_n_fr=args.top_n_fr, top_n_ttif=args.top_n_ttif)
+        for name in args.score:
+            for key in args.group:
+                print(f"\n{name} by {key}:")
+                print_group_breakdown(breakdown, key, model=name)
+    return 0
+
+
+def cmd_experiment(args):
+    import runpy
+
+    module = EXPERIMENTS[args.name]
+    # Scripts read sys.argv like any __main__ module
+    sys.argv = [module] + args.args
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    return 0
+
+
+def cmd_cache(args):
+    from tools.feature_store import DEFAULT_STORE_ROOT, FeatureStore
+    from tools.importance import MAX_FOLD_MODEL_BYTES, fold_model_cache_bytes, prune_fold_models
+
+    store = FeatureStore(args.root or DEFAULT_STORE_ROOT)
+    if args.action == "prune":
+        removed = store.prune()
+        for path in removed:
+            print(f"  Removed {path}")
+        print(f"{len(removed)} stale version(s) removed")
+        limit = MAX_FOLD_MODEL_BYTES if args.fold_models_gb is None else int(args.fold_models_gb * 1024 ** 3)
+        removed = prune_fold_models(max_bytes=limit)
+        print(f"{len(removed)} cached fold model(s) removed")
+        return 0
+
+    print(f"Feature store: {store.root}")
+    total = 0
+    for row in store.info():
+        total += row["bytes"]
+        print(f"  {row['group']:16s} v{row['version']:<3d} {row['n_keys']:10,d} keys "
+              f"{row['n_features']:4d} features {row['bytes'] / 1024 ** 2:9.1f} MB")
+    print(f"  Total: {total / 1024 ** 2:.1f} MB")
+    print(f"Fold model cache: {fold_model_cache_bytes() / 1024 ** 2:.1f} MB "
+          f"(limit {MAX_FOLD_MODEL_BYTES / 1024 ** 2:,.0f} MB)")
+    return 0
+
+
+def cmd_worker(args):
+    from tools.workunits import DEFAULT_HEARTBEAT_S, run_spool_worker
+    run_spool_worker(args.spool, idle_exit_s=args.idle_exit, heartbeat_s=args.heartbeat or DEFAULT_HEARTBEAT_S)
+    return 0
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PARSER
+# ══════════════════════════════════════════════════════════════════════════════
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m tools",
+                                     description="Neoantigen immunogenicity pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("load", help="Load a dataset and print a summary")
+    p.add_argument("dataset", help='"tesla", "iedb" or a table path')
+    p.add_argument("--dedup", choices=["majority", "any_positive", "strict_positive"],
+                   help="Deduplicate peptide-allele pairs (IEDB)")
+    p.add_argument("--output", help="Write the loaded table")
+    p.set_defaults(func=cmd_load)
+
+    p = sub.add_parser("features", help="Compute registry features for a table")
+    p.add_argument("--input", help='"tesla", "iedb" or a table path')
+    p.add_argument("--set", help="Named feature set (see --list)")
+    p.add_argument("--columns", help="Comma-separated feature columns")
+    p.add_argument("--keep-input", action="store_true", help="Include the input columns in the output")
+    p.add_argument("--n-jobs", type=int, default=1, help="Worker processes (-1 = all cores)")
+    p.add_argument("--output", help="Output table (default: print the head)")
+    p.add_argument("--list", action="store_true", help="List feature sets and families")
+    p.set_defaults(func=cmd_features)
+
+    p = sub.add_parser("score", help="Score peptide-allele pairs with MHCflurry")
+    p.add_argument("--input", required=True, help='"tesla", "iedb" or a table with peptide, allele')
+    p.add_argument("--wt-column", help="Wild-type peptide column for paired (agretopicity) scores")
+    p.add_argument("--keep-input", action="store_true", help="Include all input columns in the output")
+    p.add_argument("--output", help="Output table (default: print the head)")
+    p.set_defaults(func=cmd_score)
+
+    p = sub.add_parser("evaluate", help="TESLA metrics for score columns of a table")
+    p.add_argument("--input", required=True, help="Table with labels and score columns")
+    p.add_argument("--label", default="immunogenic", help="Binary label column")
+    p.add_argument("--score", nargs="+", required=True, help="Score columns (higher = immunogenic)")
+    p.add_argument("--lower-is-better", nargs="+", help="Score columns to negate (e.g. affinity nM)")
+    p.add_argument("--group", nargs="+", help="Also break down by these columns")
+    p.add_argument("--top-n-fr", type=int, default=100)
+    p.add_argument("--top-n-ttif", type=int, default=20)
+    p.set_defaults(func=cmd_evaluate)
+
+    p = sub.add_parser("experiment", help="Run an experiment script")
+    p.add_argument("name", choices=list(EXPERIMENTS))
+    p.add_argument("args", nargs=argparse.REMAINDER, help="Arguments passed to the script")
+    p.set_defaults(func=cmd_experiment)
+
+    p = sub.add_parser("cache", help="Inspect or prune the feature store and the fold model cache")
+    p.add_argument("action", nargs="?", default="info", choices=["info", "prune"])
+    p.add_argument("--root", help="Store directory (default: data/feature_store)")
+    p.add_argument("--fold-models-gb", type=float,
+                   help="prune: fold model cache size to keep (default: importance.MAX_FOLD_MODEL_BYTES, 0 clears)")
+    p.set_defaults(func=cmd_cache)
+
+    p = sub.add_parser("ledger", help="Query the results ledger (see python -m tools.ledger -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("pipeline", help="Run the cached stage pipeline (see python -m tools.pipeline -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("search", help="Successive-halving hyperparameter search (see python -m tools.search -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("evolve", help="Evolutionary model search (see python -m tools.evolve -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("stacking", help="Stack stored out-of-fold predictions (see python -m tools.stacking -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("replay", help="List or verify replay bundles (see python -m tools.replay -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("incremental", help="Incremental retraining on new data (see python -m tools.incremental -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("artifact", help="Pack or inspect compact model artifacts (see python -m tools.model_artifact -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("importance", help="Out-of-fold permutation importance (see python -m tools.importance -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("homology", help="Homology clusters of peptides as CV groups (see python -m tools.homology -h)",
+                       add_help=False)
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("worker", help="Execute work units from a shared spool directory")
+    p.add_argument("--spool", required=True, help="SpoolBackend directory")
+    p.add_argument("--idle-exit", type=float, help="Exit after this many idle seconds")
+    p.add_argument("--heartbeat", type=float, help="Seconds between lease refreshes of a running unit (default 60)")
+    p.set_defaults(func=cmd_worker)
+    return parser
+
+
+def main(argv=None):
+    import importlib
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Dispatched before argparse so options (including -h) reach the module
+    if argv and argv[0] in PASSTHROUGH:
+        return importlib.import_module(PASSTHROUGH[argv[0]]).main(argv[1:])
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
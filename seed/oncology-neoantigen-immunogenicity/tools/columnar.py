@@ -0,0 +1,179 @@
+"""
+Append-only columnar storage on local disk.
+
+A ColumnarLog is a directory with one raw binary file per column plus a small
+JSON manifest holding the schema and the number of committed rows:
+
+    <path>/_manifest.json
+    <path>/<column>.bin
+    <path>/<column>.off     (variable-length "str" columns only)
+
+Fixed-width columns store NumPy values back to back. "str" columns store the
+UTF-8 bytes of all values in <column>.bin and each row's end offset (int64)
+in <column>.off.
+
+Appends write each column file and then atomically replace the manifest, so a
+crash mid-append leaves the previously committed rows intact (the partial tail
+is truncated on the next append). Reads memory-map the column files, so
+opening a large log is cheap and only the touched pages are loaded.
+
+Usage:
+    from tools.columnar import ColumnarLog
+    log = ColumnarLog("data/cache/example", {"key": "S16", "value": "f8"})
+    log.append({"key": keys, "value": values})
+    cols = log.read()
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+MANIFEST = "_manifest.json"
+
+# Schema marker for variable-length UTF-8 string columns
+STR = "str"
+OFFSET_DTYPE = np.dtype("<i8")
+
+
+def _normalize_dtype(dtype):
+    return STR if dtype == STR else np.dtype(dtype).str
+
+
+class ColumnarLog:
+    """Append-only table of NumPy and string columns backed by memory-mapped files."""
+
+    def __init__(self, path, schema=None):
+        """
+        Args:
+            path: Directory for the log (created on first append).
+            schema: dict of column name -> NumPy dtype string or STR. Required
+                    when the log does not exist yet; ignored for an existing log.
+        """
+        self.path = Path(path)
+        manifest_path = self.path / MANIFEST
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+            self.schema = manifest["columns"]
+            self.n_rows = manifest["n_rows"]
+        elif schema is not None:
+            self.schema = {name: _normalize_dtype(dtype) for name, dtype in schema.items()}
+            self.n_rows = 0
+        else:
+            raise FileNotFoundError(f"No columnar log at {self.path} and no schema given")
+
+    def __len__(self):
+        return self.n_rows
+
+    @staticmethod
+    def exists(path):
+        return (Path(path) / MANIFEST).exists()
+
+    def _column_path(self, name):
+        return self.path / f"{name}.bin"
+
+    def _offset_path(self, name):
+        return self.path / f"{name}.off"
+
+    def _committed_blob_size(self, name):
+        """Bytes of committed string data (end offset of the last committed row)."""
+        if self.n_rows == 0:
+            return 0
+        with open(self._offset_path(name), "rb") as f:
+            f.seek((self.n_rows - 1) * OFFSET_DTYPE.itemsize)
+            return int(np.frombuffer(f.read(OFFSET_DTYPE.itemsize), dtype=OFFSET_DTYPE)[0])
+
+    @staticmethod
+    def _append_bytes(path, committed, data):
+        with open(path, "ab") as f:
+            # Drop any uncommitted tail left by an interrupted append
+            if f.tell() != committed:
+                f.truncate(committed)
+                f.seek(committed)
+            f.write(data)
+
+    def _write_manifest(self):
+        tmp = self.path / (MANIFEST + ".tmp")
+        tmp.write_text(json.dumps({"columns": self.schema, "n_rows": self.n_rows}, indent=1))
+        os.replace(tmp, self.path / MANIFEST)
+
+    def append(self, columns):
+        """
+        Append rows. columns maps every schema column to an array of equal length.
+        """
+        missing = set(self.schema) - set(columns)
+        if missing:
+            raise ValueError(f"Missing columns for append: {sorted(missing)}")
+        arrays = {}
+        for name, dtype in self.schema.items():
+            if dtype == STR:
+                arrays[name] = [str(v).encode("utf-8") for v in columns[name]]
+            else:
+                arrays[name] = np.ascontiguousarray(columns[name], dtype=dtype)
+        lengths = {len(a) for a in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        n_new = lengths.pop()
+        if n_new == 0:
+            return
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name, arr in arrays.items():
+            if self.schema[name] == STR:
+                blob_size = self._committed_blob_size(name)
+                ends = blob_size + np.cumsum([len(v) for v in arr], dtype=OFFSET_DTYPE)
+                self._append_bytes(self._column_path(name), blob_size, b"".join(arr))
+                self._append_bytes(self._offset_path(name), self.n_rows * OFFSET_DTYPE.itemsize,
+                                   ends.astype(OFFSET_DTYPE).tobytes())
+            else:
+                committed = self.n_rows * np.dtype(self.schema[name]).itemsize
+                self._append_bytes(self._column_path(name), committed, arr.tobytes())
+        self.n_rows += n_new
+        self._write_manifest()
+
+    def read(self, columns=None, mmap=True):
+        """
+        Read committed rows.
+
+        Args:
+            columns: Column names to read (default: all).
+            mmap: Memory-map the files (read-only) instead of loading them.
+                  String columns are always decoded into object arrays.
+
+        Returns:
+            dict of column name -> array of length len(self)
+        """
+        result = {}
+        for name in columns or self.schema:
+            if self.schema[name] == STR:
+                result[name] = self._read_strings(name)
+                continue
+            dtype = np.dtype(self.schema[name])
+            if self.n_rows == 0:
+                result[name] = np.empty(0, dtype=dtype)
+            elif mmap:
+                result[name] = np.memmap(self._column_path(name), dtype=dtype, mode="r",
+                                         shape=(self.n_rows,))
+            else:
+                result[name] = np.fromfile(self._column_path(name), dtype=dtype,
+                                           count=self.n_rows)
+        return result
+
+    def _read_strings(self, name):
+        """Decode a string column into an object array."""
+        if self.n_rows == 0:
+            return np.empty(0, dtype=object)
+        ends = np.fromfile(self._offset_path(name), dtype=OFFSET_DTYPE, count=self.n_rows)
+        blob = self._column_path(name).read_bytes()[:int(ends[-1])]
+        starts = np.concatenate([[0], ends[:-1]])
+        return np.array([blob[a:b].decode("utf-8") for a, b in zip(starts, ends)], dtype=object)
+
+    def nbytes(self):
+        """Committed size on disk in bytes."""
+        total = 0
+        for name, dtype in self.schema.items():
+            if dtype == STR:
+                total += self.n_rows * OFFSET_DTYPE.itemsize + self._committed_blob_size(name)
+            else:
+                total += self.n_rows * np.dtype(dtype).itemsize
+        return total
@@ -4,32 +4,92 @@ Data loading utilities for neoantigen immunogenicity prediction.
 Provides clean, standardized access to:
 1. IEDB T-cell epitope data (training)
 2. TESLA benchmark data (evaluation)
+3. The MHCflurry presentation predictor
+
+The TESLA xlsx parse, the IEDB CSV parse and the predictor load are
+independent and dominate cold start. prefetch() starts them on background
+threads; the load functions then return the prefetched result (waiting if
+it is not ready yet), so a script can compute TESLA features while IEDB and
+MHCflurry are still loading:
+
+    prefetch("tesla", "iedb", "predictor")
+    tesla = load_tesla()                        # waits for the xlsx only
 """
+import functools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
+try:
+    from tools.trace import span, traced
+except ImportError:  # run as tools/data_loader.py or imported with tools/ on sys.path: no tracing
+    import contextlib
+
+    def span(name, **attrs):
+        return contextlib.nullcontext()
+
+    def traced(name=None, rows_from=None):
+        return lambda fn: fn
+
 PROJECT_ROOT = Path(__file__).parent.parent
+IEDB_FILTERED_PATH = PROJECT_ROOT / "data" / "iedb" / "iedb_human_mhci_tcell.csv"
+IEDB_FULL_PATH = PROJECT_ROOT / "data" / "iedb" / "tcell_full_v3.csv"
+TESLA_PATH = PROJECT_ROOT / "data" / "tesla" / "tesla_table_s4.xlsx"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CONCURRENT STARTUP
+# ══════════════════════════════════════════════════════════════════════════════
+
+_PREFETCH_LOCK = threading.Lock()
+_PREFETCHED = {}  # (loader, bound arguments) -> Future
+_PREFETCH_POOL = None
+
+
+def _call_key(fn, args, kwargs):
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return fn.__name__, tuple(sorted(bound.arguments.items()))
+
+
+def _prefetchable(fn):
+    """Serve fn's result from a matching prefetch() if one was started."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _PREFETCH_LOCK:
+            future = _PREFETCHED.get(_call_key(fn, args, kwargs))
+        if future is None:
+            return fn(*args, **kwargs)
+        result = future.result()
+        # Callers may modify what they get; the prefetched frame is shared
+        return result.copy() if isinstance(result, pd.DataFrame) else result
+    wrapper.uncached = fn
+    return wrapper
 
 
-def load_iedb(filtered=True):
+@traced("load.iedb")
+@_prefetchable
+def load_iedb(filtered=True, path=None):
     """
     Load IEDB T-cell epitope data.
 
     Args:
         filtered: If True, load pre-filtered human MHC-I data (122K rows).
                   If False, load full dataset (567K rows, slow).
+        path: Read this export (in the chosen format) instead of the default file.
 
     Returns:
         DataFrame with columns: peptide, allele, qualitative, immunogenic, peptide_length
     """
     if filtered:
-        path = PROJECT_ROOT / "data" / "iedb" / "iedb_human_mhci_tcell.csv"
-        df = pd.read_csv(path)
+        df = pd.read_csv(path or IEDB_FILTERED_PATH)
         df.columns = ["peptide", "allele", "qualitative", "immunogenic", "peptide_length"]
     else:
-        path = PROJECT_ROOT / "data" / "iedb" / "tcell_full_v3.csv"
-        df = pd.read_csv(path, skiprows=[1], low_memory=False)
+        df = pd.read_csv(path or IEDB_FULL_PATH, skiprows=[1], low_memory=False)
         df = df.rename(columns={
             "Epitope.2": "peptide",
             "MHC Restriction": "allele",
@@ -38,6 +98,8 @@ def load_iedb(filtered=True):
     return df
 
 
+@traced("load.tesla")
+@_prefetchable
 def load_tesla():
     """
     Load TESLA benchmark dataset (Table S4 from Wells et al., Cell 2020).
@@ -58,8 +120,7 @@ def load_tesla():
         - patient_id: patient identifier
         - tissue_type: PBMC or TIL
     """
-    path = PROJECT_ROOT / "data" / "tesla" / "tesla_table_s4.xlsx"
-    df = pd.read_excel(path, sheet_name="master-bindings-selected")
+    df = pd.read_excel(TESLA_PATH, sheet_name="master-bindings-selected")
 
     df = df.rename(columns={
         "ALT_EPI_SEQ": "peptide",
@@ -84,6 +145,7 @@ def load_tesla():
     return df
 
 
+@traced("load.deduplicate_iedb", rows_from="df")
 def deduplicate_iedb(df, strategy="majority"):
     """
     Handle duplicate peptide-allele pairs with conflicting labels in IEDB.
@@ -101,50 +163,95 @@ def deduplicate_iedb(df, strategy="majority"):
     Returns:
         DataFrame with one row per unique peptide-allele pair
     """
-    grouped = df.groupby(["peptide", "allele"])
-
-    if strategy == "majority":
-        result = grouped.agg(
-            immunogenic=("immunogenic", lambda x: int(x.mean() > 0.5)),
-            n_assays=("immunogenic", "count"),
-            n_positive=("immunogenic", "sum"),
-            peptide_length=("peptide_length", "first"),
-        ).reset_index()
-    elif strategy == "any_positive":
-        result = grouped.agg(
-            immunogenic=("immunogenic", "max"),
-            n_assays=("immunogenic", "count"),
-            n_positive=("immunogenic", "sum"),
-            peptide_length=("peptide_length", "first"),
-        ).reset_index()
-    elif strategy == "strict_positive":
-        result = grouped.agg(
-            immunogenic=("immunogenic", "min"),
-            n_assays=("immunogenic", "count"),
-            n_positive=("immunogenic", "sum"),
-            peptide_length=("peptide_length", "first"),
-        ).reset_index()
-    else:
+    if strategy not in DEDUP_STRATEGIES:
         raise ValueError(f"Unknown strategy: {strategy}")
-
+    result = df.groupby(["peptide", "allele"]).agg(
+        n_assays=("immunogenic", "count"),
+        n_positive=("immunogenic", "sum"),
+        peptide_length=("peptide_length", "first"),
+    ).reset_index()
+    result.insert(2, "immunogenic", label_from_counts(result["n_positive"], result["n_assays"], strategy))
     return result
 
 
-def get_iedb_train_data(allele=None, peptide_lengths=None, deduplicate=True, strategy="majority"):
+# Deduplication strategy -> label of a peptide-allele pair from its assay counts
+DEDUP_STRATEGIES = {
+    "majority": lambda n_positive, n_assays: 2 * n_positive > n_assays,
+    "any_positive": lambda n_positive, n_assays: n_positive > 0,
+    "strict_positive": lambda n_positive, n_assays: n_positive == n_assays,
+}
+
+
+def label_from_counts(n_positive, n_assays, strategy="majority"):
+    """0/1 labels of peptide-allele pairs from positive and total assay counts."""
+    return DEDUP_STRATEGIES[strategy](np.asarray(n_positive), np.asarray(n_assays)).astype(int)
+
+
+@traced("load.mhcflurry_predictor")
+@_prefetchable
+def load_presentation_predictor():
+    """Load MHCflurry's Class1PresentationPredictor (TensorFlow; several seconds)."""
+    from mhcflurry import Class1PresentationPredictor
+    return Class1PresentationPredictor.load()
+
+
+# Names accepted by prefetch() -> (loader, keyword arguments)
+PREFETCH_LOADERS = {
+    "tesla": (load_tesla, {}),
+    "iedb": (load_iedb, {"filtered": True}),
+    "iedb_full": (load_iedb, {"filtered": False}),
+    "predictor": (load_presentation_predictor, {}),
+}
+
+
+def prefetch(*names):
     """
-    Get ready-to-train IEDB data with optional filtering.
+    Start loads in background threads and return immediately.
+
+    Later calls to the same loader with the same arguments (load_tesla(),
+    load_iedb(), get_iedb_train_data(), load_presentation_predictor()) wait
+    for and reuse the result instead of loading again. Errors are raised at
+    that call, as they would be without prefetching.
 
     Args:
-        allele: Filter to specific allele (e.g., "HLA-A*02:01"). None = all alleles.
-        peptide_lengths: List of peptide lengths to include (e.g., [9, 10]). None = all.
-        deduplicate: Whether to deduplicate peptide-allele pairs.
-        strategy: Deduplication strategy (see deduplicate_iedb).
+        names: Keys of PREFETCH_LOADERS.
 
     Returns:
-        DataFrame with columns: peptide, allele, immunogenic, peptide_length
+        dict name -> Future
+    """
+    global _PREFETCH_POOL
+    futures = {}
+    with _PREFETCH_LOCK:
+        if _PREFETCH_POOL is None:
+            _PREFETCH_POOL = ThreadPoolExecutor(max_workers=len(PREFETCH_LOADERS),
+                                                thread_name_prefix="prefetch")
+        for name in names:
+            if name not in PREFETCH_LOADERS:
+                raise KeyError(f"Unknown loader {name!r}; choose from {list(PREFETCH_LOADERS)}")
+            loader, kwargs = PREFETCH_LOADERS[name]
+            key = _call_key(loader.uncached, (), kwargs)
+            if key not in _PREFETCHED:
+                _PREFETCHED[key] = _PREFETCH_POOL.submit(_run_prefetch, name, loader.uncached, kwargs)
+            futures[name] = _PREFETCHED[key]
+    return futures
+
+
+def _run_prefetch(name, loader, kwargs):
+    with span(f"prefetch.{name}"):
+        return loader(**kwargs)
+
+
+def clear_prefetched():
+    """Drop prefetched results (frees memory; later loads read from disk again)."""
+    with _PREFETCH_LOCK:
+        _PREFETCHED.clear()
+
+
+def filter_iedb(df, allele=None, peptide_lengths=None):
+    """
+    Restrict IEDB assays to one allele and/or peptide lengths, dropping
+    generic allele names (not useful for prediction).
     """
-    df = load_iedb(filtered=True)
-
     # Filter by allele
     if allele is not None:
         df = df[df["allele"] == allele]
@@ -155,7 +262,23 @@ def get_iedb_train_data(allele=None, peptide_lengths=None, deduplicate=True, str
 
     # Remove entries with generic allele names (not useful for prediction)
     generic_alleles = ["HLA class I", "HLA class II", "HLA-A2", "HLA-B7"]
-    df = df[~df["allele"].isin(generic_alleles)]
+    return df[~df["allele"].isin(generic_alleles)]
+
+
+def get_iedb_train_data(allele=None, peptide_lengths=None, deduplicate=True, strategy="majority"):
+    """
+    Get ready-to-train IEDB data with optional filtering.
+
+    Args:
+        allele: Filter to specific allele (e.g., "HLA-A*02:01"). None = all alleles.
+        peptide_lengths: List of peptide lengths to include (e.g., [9, 10]). None = all.
+        deduplicate: Whether to deduplicate peptide-allele pairs.
+        strategy: Deduplication strategy (see deduplicate_iedb).
+
+    Returns:
+        DataFrame with columns: peptide, allele, immunogenic, peptide_length
+    """
+    df = filter_iedb(load_iedb(filtered=True), allele=allele, peptide_lengths=peptide_lengths)
 
     # Deduplicate
     if deduplicate:
@@ -13,59 +13,132 @@ Part 2: Multi-Feature Baselines
 import sys
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LogisticRegression
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import LeaveOneGroupOut, cross_val_predict
-from sklearn.impute import SimpleImputer
+from pathlib import Path
 
-sys.path.insert(0, ".")
-from tools.data_loader import load_tesla
-from tools.evaluate import evaluate_predictions, print_metrics, compare_models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tools.data_loader import load_tesla, load_presentation_predictor, prefetch
+from tools.evaluate import (
+    evaluate_predictions, print_metrics, compare_models, evaluate_groups, print_group_breakdown,
+)
+from tools.feature_registry import FEATURE_SETS
+from tools.importance import column_groups, fold_models, permutation_importance, print_importance
+from tools.ledger import start_session, annotate
+from tools.oof_store import record_oof
+from tools.replay import record_finding
+from tools.trace import span, traced
 
 
 # ── Features available in TESLA ──────────────────────────────────────────────
-TESLA_FEATURES = [
-    "predicted_affinity",    # NetMHCpan binding affinity (nM) -- lower = stronger
-    "binding_stability",     # pMHC stability (hours)
-    "tumor_abundance",       # RNA expression (TPM)
-    "frac_hydrophobic",      # Fraction hydrophobic residues
-    "agretopicity",          # Mutant/wildtype binding ratio
-    "foreignness",           # Foreignness score
-    "mutation_position",     # Position of mutation in peptide
-    "peptide_length",        # Length of peptide (9, 10, 11-mers)
-]
-
-
-def add_mhcflurry_features(tesla_df):
-    """Run MHCflurry and add presentation/affinity/processing scores."""
-    from mhcflurry import Class1PresentationPredictor
-    predictor = Class1PresentationPredictor.load()
-
-    pres_scores = []
-    aff_scores = []
-    proc_scores = []
-
-    for _, row in tesla_df.iterrows():
-        try:
-            pred = predictor.predict(
-                peptides=[row["peptide"]],
-                alleles=[row["allele"]],
-                verbose=0,
-            )
-            pres_scores.append(pred["presentation_score"].values[0])
-            aff_scores.append(pred["affinity"].values[0])
-            proc_scores.append(pred["processing_score"].values[0])
-        except Exception as e:
-            print(f"  Warning: Failed for {row['allele']} {row['peptide']}: {e}")
-            pres_scores.append(np.nan)
-            aff_scores.append(np.nan)
-            proc_scores.append(np.nan)
+TESLA_FEATURES = FEATURE_SETS["tesla"]
 
+
+MHCFLURRY_COLUMNS = {
+    "presentation_score": "mhcflurry_presentation",
+    "affinity": "mhcflurry_affinity",
+    "processing_score": "mhcflurry_processing",
+}
+
+
+def _predict_unique_pairs(predictor, unique):
+    """
+    Score unique (peptide, allele) pairs in a single MHCflurry call.
+
+    Each allele is passed as its own one-allele sample, so every peptide is
+    scored against its own allele only. If the batch fails (e.g. an
+    unsupported allele), fall back to one batch per allele so a single bad
+    allele only blanks its own rows.
+    """
+    scores = pd.DataFrame(np.nan, index=unique.index, columns=list(MHCFLURRY_COLUMNS.values()))
+    if len(unique) == 0:
+        return scores
+
+    def _predict(chunk):
+        pred = predictor.predict(
+            peptides=chunk["peptide"].tolist(),
+            alleles={a: [a] for a in chunk["allele"].unique()},
+            sample_names=chunk["allele"].tolist(),
+            verbose=0,
+        )
+        if "peptide_num" in pred.columns:
+            pred = pred.sort_values("peptide_num")
+        out = pred[list(MHCFLURRY_COLUMNS)].rename(columns=MHCFLURRY_COLUMNS)
+        out.index = chunk.index
+        return out
+
+    try:
+        scores.loc[:, :] = _predict(unique).values
+    except Exception as e:
+        print(f"  Warning: batched MHCflurry call failed ({e}); retrying per allele")
+        for allele, chunk in unique.groupby("allele", sort=False):
+            try:
+                scores.loc[chunk.index, :] = _predict(chunk).values
+            except Exception as e:
+                print(f"  Warning: Failed for {allele} ({len(chunk)} peptides): {e}")
+    return scores
+
+
+@traced("predict.mhcflurry", rows_from="peptides")
+def predict_mhcflurry(peptides, alleles, predictor=None):
+    """
+    Batched, deduplicated MHCflurry scoring of (peptide, allele) pairs.
+
+    Each unique pair is scored once, in one predictor call, and the scores are
+    broadcast back to the input rows. Missing peptides get NaN.
+
+    Returns DataFrame aligned with the inputs with columns
+    mhcflurry_presentation, mhcflurry_affinity, mhcflurry_processing.
+    """
+    if predictor is None:
+        predictor = load_presentation_predictor()
+
+    pairs = pd.DataFrame({"peptide": list(peptides), "allele": list(alleles)})
+    unique = pairs.dropna().drop_duplicates().reset_index(drop=True)
+    scores = _predict_unique_pairs(predictor, unique)
+    scored = pd.concat([unique, scores], axis=1)
+    result = pairs.merge(scored, on=["peptide", "allele"], how="left")
+    return result[list(MHCFLURRY_COLUMNS.values())]
+
+
+def add_mhcflurry_features(tesla_df, wt_peptide_col=None, predictor=None):
+    """
+    Run MHCflurry and add presentation/affinity/processing scores.
+
+    Paired mode (wt_peptide_col given): mutant and wild-type peptides share
+    the row's allele. The union of both sets is deduplicated and scored in one
+    batch, and mutant-vs-WT comparisons are added:
+    - mhcflurry_wt_affinity, mhcflurry_wt_presentation
+    - mhcflurry_agretopicity: mutant / WT affinity (nM), TESLA's definition
+    - mhcflurry_affinity_delta: mutant - WT affinity (nM)
+    - mhcflurry_presentation_ratio, mhcflurry_presentation_delta: mutant vs WT presentation
+    Rows without a WT peptide get NaN paired features.
+    """
     tesla_df = tesla_df.copy()
-    tesla_df["mhcflurry_presentation"] = pres_scores
-    tesla_df["mhcflurry_affinity"] = aff_scores
-    tesla_df["mhcflurry_processing"] = proc_scores
+    n = len(tesla_df)
+    peptides = tesla_df["peptide"].tolist()
+    alleles = tesla_df["allele"].tolist()
+    if wt_peptide_col is not None:
+        peptides += tesla_df[wt_peptide_col].tolist()
+        alleles += alleles
+
+    scores = predict_mhcflurry(peptides, alleles, predictor=predictor)
+    mut = scores.iloc[:n]
+    for col in MHCFLURRY_COLUMNS.values():
+        tesla_df[col] = mut[col].values
+
+    if wt_peptide_col is not None:
+        wt = scores.iloc[n:]
+        mut_aff = mut["mhcflurry_affinity"].values
+        wt_aff = wt["mhcflurry_affinity"].values
+        mut_pres = mut["mhcflurry_presentation"].values
+        wt_pres = wt["mhcflurry_presentation"].values
+        tesla_df["mhcflurry_wt_affinity"] = wt_aff
+        tesla_df["mhcflurry_wt_presentation"] = wt_pres
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tesla_df["mhcflurry_agretopicity"] = mut_aff / wt_aff
+            tesla_df["mhcflurry_presentation_ratio"] = mut_pres / wt_pres
+        tesla_df["mhcflurry_affinity_delta"] = mut_aff - wt_aff
+        tesla_df["mhcflurry_presentation_delta"] = mut_pres - wt_pres
+
     return tesla_df
 
 
@@ -127,36 +200,33 @@ def error_analysis(tesla_df):
     # ── Pattern analysis ──
     print("\n--- PATTERN ANALYSIS ---")
 
+    # Rank statistics for every patient / allele / length in one pass
+    breakdown = evaluate_groups(
+        y_true, scores,
+        {key: df[key].values for key in ("patient_id", "allele", "peptide_length")},
+        names=["MHCflurry presentation"],
+    )
+
     # By patient
     print("\nImmunogenic detection rate by patient:")
-    for patient in sorted(df["patient_id"].unique()):
-        p_df = df[df["patient_id"] == patient]
-        p_imm = p_df[p_df["immunogenic"] == True]
-        p_imm_top100 = p_imm[p_imm["rank"] <= 100]
-        n_imm = len(p_imm)
-        if n_imm > 0:
-            print(f"  {patient}: {len(p_imm_top100)}/{n_imm} immunogenic in top-100"
-                  f" ({len(p_imm_top100)/n_imm:.0%}), "
-                  f"{len(p_df)} total peptides")
+    for row in breakdown[breakdown["key"] == "patient_id"].itertuples(index=False):
+        if row.n_positive > 0:
+            print(f"  {row.group}: {row.n_positive_global_top}/{row.n_positive} immunogenic in top-100"
+                  f" ({row.n_positive_global_top/row.n_positive:.0%}), "
+                  f"{row.n_total} total peptides")
 
     # By allele
     print("\nImmunogenic detection rate by HLA allele:")
-    for allele in sorted(df["allele"].unique()):
-        a_df = df[df["allele"] == allele]
-        a_imm = a_df[a_df["immunogenic"] == True]
-        n_imm = len(a_imm)
-        if n_imm > 0:
-            a_imm_top100 = a_imm[a_imm["rank"] <= 100]
-            print(f"  {allele}: {len(a_imm_top100)}/{n_imm} in top-100, "
-                  f"{len(a_df)} total peptides")
+    for row in breakdown[breakdown["key"] == "allele"].itertuples(index=False):
+        if row.n_positive > 0:
+            print(f"  {row.group}: {row.n_positive_global_top}/{row.n_positive} in top-100, "
+                  f"{row.n_total} total peptides")
 
     # By peptide length
     print("\nImmunogenic rate by peptide length:")
-    for length in sorted(df["peptide_length"].unique()):
-        l_df = df[df["peptide_length"] == length]
-        l_imm = l_df[l_df["immunogenic"] == True]
-        print(f"  {length}-mer: {len(l_imm)}/{len(l_df)} immunogenic "
-              f"({len(l_imm)/len(l_df):.1%} if {len(l_df)} > 10 else 'too few')")
+    for row in breakdown[breakdown["key"] == "peptide_length"].itertuples(index=False):
+        rate = f"{row.n_positive/row.n_total:.1%}" if row.n_total > 10 else "too few"
+        print(f"  {row.group}-mer: {row.n_positive}/{row.n_total} immunogenic ({rate})")
 
     # Feature comparison: immunogenic vs non-immunogenic
     print("\nFeature means -- Immunogenic vs Non-immunogenic:")
@@ -187,24 +257,25 @@ def error_analysis(tesla_df):
 # PART 2: MULTI-FEATURE BASELINES
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def prepare_features(tesla_df, feature_cols):
-    """Prepare feature matrix with imputation and scaling."""
-    X = tesla_df[feature_cols].values.copy()
+# Heavy-tailed columns (nM affinities, TPM) that are log1p-transformed before scaling
+LOG_FEATURES = ("predicted_affinity", "tumor_abundance", "mhcflurry_affinity")
 
-    # Log-transform affinity (nM scale varies hugely)
-    aff_idx = feature_cols.index("predicted_affinity") if "predicted_affinity" in feature_cols else None
-    if aff_idx is not None:
-        X[:, aff_idx] = np.log1p(X[:, aff_idx])
 
-    # Log-transform tumor abundance (TPM varies hugely)
-    tpm_idx = feature_cols.index("tumor_abundance") if "tumor_abundance" in feature_cols else None
-    if tpm_idx is not None:
-        X[:, tpm_idx] = np.log1p(X[:, tpm_idx])
+def _log_transform(tesla_df, feature_cols):
+    X = tesla_df[feature_cols].values.astype(float)
+    for i, col in enumerate(feature_cols):
+        if col in LOG_FEATURES:
+            X[:, i] = np.log1p(X[:, i])
+    return X
 
-    # Log-transform MHCflurry affinity if present
-    mhc_aff_idx = feature_cols.index("mhcflurry_affinity") if "mhcflurry_affinity" in feature_cols else None
-    if mhc_aff_idx is not None:
-        X[:, mhc_aff_idx] = np.log1p(X[:, mhc_aff_idx])
+
+def prepare_features(tesla_df, feature_cols):
+    """Prepare feature matrix with imputation and scaling."""
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
+
+    # Log-transform affinities and tumor abundance (scales vary hugely)
+    X = _log_transform(tesla_df, feature_cols)
 
     # Impute missing values with median
     imputer = SimpleImputer(strategy="median")
@@ -217,6 +288,11 @@ def prepare_features(tesla_df, feature_cols):
     return X, imputer, scaler
 
 
+def apply_features(tesla_df, feature_cols, imputer, scaler):
+    """Feature matrix of new rows with the imputer and scaler fit by prepare_features()."""
+    return scaler.transform(imputer.transform(_log_transform(tesla_df, feature_cols)))
+
+
 def run_multifeature_baselines(tesla_df, feature_cols, label=""):
     """
     Train and evaluate multi-feature models using leave-one-patient-out CV.
@@ -226,6 +302,10 @@ def run_multifeature_baselines(tesla_df, feature_cols, label=""):
     2. In clinical use, the model must generalize to new patients
     3. This matches how the TESLA paper evaluated their ensemble
     """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import LeaveOneGroupOut, cross_val_predict
+
     y = tesla_df["immunogenic"].astype(int).values
     groups = tesla_df["patient_id"].values
     X, _, _ = prepare_features(tesla_df, feature_cols)
@@ -242,8 +322,12 @@ def run_multifeature_baselines(tesla_df, feature_cols, label=""):
         C=1.0,
         random_state=42,
     )
-    lr_probs = cross_val_predict(lr, X, y, cv=logo, groups=groups, method="predict_proba")[:, 1]
-    lr_metrics = evaluate_predictions(y, lr_probs, name=f"Logistic Regression {label}")
+    with annotate(features=feature_cols, params=lr.get_params()):
+        with span("cv.fit", model="LR", features=label, rows=len(X)):
+            lr_probs = cross_val_predict(lr, X, y, cv=logo, groups=groups, method="predict_proba")[:, 1]
+        lr_metrics = evaluate_predictions(y, lr_probs, name=f"Logistic Regression {label}")
+    record_finding(lr, X, y, groups, lr_probs, lr_metrics, features=feature_cols)
+    record_oof(lr_metrics["name"], lr_probs, y, groups, lr_metrics, feature_cols, lr.get_params())
     print_metrics(lr_metrics)
     all_results.append(lr_metrics)
 
@@ -262,41 +346,36 @@ def run_multifeature_baselines(tesla_df, feature_cols, label=""):
         min_samples_leaf=5,
         random_state=42,
     )
-    rf_probs = cross_val_predict(rf, X, y, cv=logo, groups=groups, method="predict_proba")[:, 1]
-    rf_metrics = evaluate_predictions(y, rf_probs, name=f"Random Forest {label}")
+    with annotate(features=feature_cols, params=rf.get_params()):
+        with span("cv.fit", model="RF", features=label, rows=len(X)):
+            rf_models, rf_probs = fold_models(rf, X, y, groups)
+        rf_metrics = evaluate_predictions(y, rf_probs, name=f"Random Forest {label}")
+    record_finding(rf, X, y, groups, rf_probs, rf_metrics, features=feature_cols)
+    record_oof(rf_metrics["name"], rf_probs, y, groups, rf_metrics, feature_cols, rf.get_params())
     print_metrics(rf_metrics)
     all_results.append(rf_metrics)
 
-    # Feature importance
-    rf.fit(X, y)
-    print("\n  Feature importances (full-data fit):")
-    for feat, imp in sorted(zip(feature_cols, rf.feature_importances_), key=lambda x: -x[1]):
-        print(f"    {feat:30s}  {imp:.3f}")
+    # Permutation importance of the fold models on their held-out patients
+    for by in ("family", "column"):
+        importance = permutation_importance(rf_models, X, y, groups, column_groups(feature_cols, by))
+        print_importance(importance, f"Permutation importance by {by} (out-of-fold)")
 
     # ── Per-patient breakdown (for the best model) ──
     best_model_probs = lr_probs if lr_metrics["auprc"] >= rf_metrics["auprc"] else rf_probs
     best_name = "LR" if lr_metrics["auprc"] >= rf_metrics["auprc"] else "RF"
     print(f"\n--- Per-patient breakdown ({best_name}) ---")
-    for patient in sorted(tesla_df["patient_id"].unique()):
-        mask = tesla_df["patient_id"].values == patient
-        p_y = y[mask]
-        p_scores = best_model_probs[mask]
-        n_imm = p_y.sum()
-        if n_imm > 0 and (p_y == 0).sum() > 0:
-            from sklearn.metrics import roc_auc_score, average_precision_score
-            auc = roc_auc_score(p_y, p_scores)
-            ap = average_precision_score(p_y, p_scores)
-            print(f"  {patient}: AUC-ROC={auc:.3f}, AUPRC={ap:.3f} "
-                  f"({n_imm} immunogenic / {mask.sum()} total)")
-        else:
-            print(f"  {patient}: {n_imm} immunogenic / {mask.sum()} total (can't compute AUC)")
+    breakdown = evaluate_groups(y, best_model_probs, {"patient_id": groups}, names=[best_name])
+    print_group_breakdown(breakdown, "patient_id")
 
     return all_results
 
 
 if __name__ == "__main__":
+    # MHCflurry loads in the background while TESLA is parsed
+    prefetch("tesla", "predictor")
     print("Loading TESLA benchmark data...")
     tesla = load_tesla()
+    start_session("error_analysis_and_multifeature", data=tesla)
 
     print("Running MHCflurry on TESLA peptides...")
     tesla = add_mhcflurry_features(tesla)
@@ -316,18 +395,12 @@ if __name__ == "__main__":
     all_results = []
 
     # Model A: TESLA features only (what was available in the original paper)
-    tesla_only_features = [
-        "predicted_affinity", "binding_stability", "tumor_abundance",
-        "frac_hydrophobic", "agretopicity", "foreignness",
-        "mutation_position", "peptide_length",
-    ]
+    tesla_only_features = TESLA_FEATURES
     results_a = run_multifeature_baselines(tesla, tesla_only_features, label="(TESLA features)")
     all_results.extend(results_a)
 
     # Model B: TESLA features + MHCflurry scores
-    all_features = tesla_only_features + [
-        "mhcflurry_presentation", "mhcflurry_affinity", "mhcflurry_processing",
-    ]
+    all_features = tesla_only_features + FEATURE_SETS["mhcflurry"]
     results_b = run_multifeature_baselines(tesla, all_features, label="(TESLA + MHCflurry)")
     all_results.extend(results_b)
 
@@ -342,6 +415,8 @@ if __name__ == "__main__":
         name="MHCflurry presentation (single)"
     )
     all_results.append(mhcf_metrics)
+    record_oof(mhcf_metrics["name"], tesla["mhcflurry_presentation"].values, y_true,
+               tesla["patient_id"].values, mhcf_metrics)
 
     # Random
     np.random.seed(42)
@@ -10,18 +10,25 @@ Implements the TESLA evaluation metrics:
 Usage:
     from evaluate import evaluate_predictions
     metrics = evaluate_predictions(y_true, y_score, name="MHCflurry")
+
+    # Many candidates against the same labels, one vectorized pass
+    from evaluate import evaluate_predictions_batch
+    results = evaluate_predictions_batch(y_true, score_matrix, names=names)
+
+    # Per-patient / per-allele breakdown for several models at once
+    from evaluate import evaluate_groups
+    table = evaluate_groups(y_true, score_matrix, {"patient_id": patients}, names=names)
 """
 import numpy as np
-from sklearn.metrics import (
-    precision_recall_curve,
-    roc_auc_score,
-    average_precision_score,
-    f1_score,
-    precision_score,
-    recall_score,
-)
+
+try:
+    from tools.trace import traced
+except ImportError:  # run as tools/evaluate.py or imported with tools/ on sys.path: no tracing
+    def traced(name=None, rows_from=None):
+        return lambda fn: fn
 
 
+@traced("evaluate.predictions", rows_from="y_true")
 def evaluate_predictions(y_true, y_score, name="model", top_n_fr=100, top_n_ttif=20):
     """
     Evaluate immunogenicity predictions using TESLA-style metrics.
@@ -36,6 +43,15 @@ def evaluate_predictions(y_true, y_score, name="model", top_n_fr=100, top_n_ttif
     Returns:
         dict with all metrics
     """
+    # Imported here: sklearn costs ~1s of startup that the batch/grouped paths don't need
+    from sklearn.metrics import (
+        roc_auc_score,
+        average_precision_score,
+        f1_score,
+        precision_score,
+        recall_score,
+    )
+
     y_true = np.asarray(y_true, dtype=int)
     y_score = np.asarray(y_score, dtype=float)
 
@@ -88,9 +104,319 @@ def evaluate_predictions(y_true, y_score, name="model", top_n_fr=100, top_n_ttif
         "recall_median_threshold": recall,
     }
 
+    # Results ledger (no-op unless a session is open). Optional: evaluation
+    # never fails because the ledger cannot be imported or written.
+    try:
+        from tools.ledger import record_evaluation
+    except ImportError:
+        record_evaluation = None
+    if record_evaluation is not None:
+        try:
+            record_evaluation(metrics, y_true)
+        except Exception as e:
+            print(f"  Warning: results ledger not updated ({type(e).__name__}: {e})")
+
     return metrics
 
 
+def _segment_rank_metrics(y, s, seg, n_seg, top_ns=()):
+    """
+    Rank metrics for many segments in one cumsum pass.
+
+    Args:
+        y: 0/1 labels (float), grouped by segment and sorted by descending score within it.
+        s: Scores in the same order (no NaN).
+        seg: Segment id per element, non-decreasing.
+        n_seg: Number of segments.
+        top_ns: Cutoffs for which to count positives among each segment's top-N.
+
+    Returns dict of per-segment arrays: n_total, n_positive, n_negative,
+    auc_roc, auprc (NaN when undefined) and top_{N} positive counts.
+
+    Tied scores form one threshold, as in roc_auc_score / average_precision_score.
+    """
+    n = len(y)
+    counts = np.bincount(seg, minlength=n_seg)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(int)
+    n_pos = np.bincount(seg, weights=y, minlength=n_seg)
+    n_neg = counts - n_pos
+    result = {"n_total": counts, "n_positive": n_pos, "n_negative": n_neg}
+
+    ctp = np.cumsum(y)
+    cfp = np.cumsum(1.0 - y)
+    # Cumulative counts before each segment
+    base_tp = np.zeros(n_seg)
+    base_fp = np.zeros(n_seg)
+    nonempty = counts > 0
+    base_tp[nonempty] = ctp[starts[nonempty]] - y[starts[nonempty]]
+    base_fp[nonempty] = cfp[starts[nonempty]] - (1.0 - y[starts[nonempty]])
+
+    # Last element of each tie group = one threshold
+    last = np.ones(n, dtype=bool)
+    last[:-1] = (s[1:] != s[:-1]) | (seg[1:] != seg[:-1])
+    # Cumulative counts at the previous threshold (segment ends are thresholds,
+    # so the running max never leaks across segments)
+    prev_tp = np.zeros(n)
+    prev_fp = np.zeros(n)
+    prev_tp[1:] = np.maximum.accumulate(np.where(last, ctp, 0.0))[:-1]
+    prev_fp[1:] = np.maximum.accumulate(np.where(last, cfp, 0.0))[:-1]
+
+    idx = np.flatnonzero(last)
+    g = seg[idx]
+    tp = ctp[idx] - base_tp[g]
+    fp = cfp[idx] - base_fp[g]
+    tp_prev = prev_tp[idx] - base_tp[g]
+    fp_prev = prev_fp[idx] - base_fp[g]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ap_terms = (tp - tp_prev) * tp / (tp + fp)
+        auc_terms = (fp - fp_prev) * (tp + tp_prev)
+        auprc = np.bincount(g, weights=ap_terms, minlength=n_seg) / n_pos
+        auc = np.bincount(g, weights=auc_terms, minlength=n_seg) / (2 * n_pos * n_neg)
+    result["auprc"] = np.where(n_pos > 0, auprc, np.nan)
+    result["auc_roc"] = np.where((n_pos > 0) & (n_neg > 0), auc, np.nan)
+
+    rank = np.arange(n) - starts[seg]
+    for top_n in top_ns:
+        in_top = rank < top_n
+        result[f"top_{top_n}"] = np.bincount(seg[in_top], weights=y[in_top], minlength=n_seg)
+    return result
+
+
+def _sort_score_matrix(y_true, score_matrix):
+    """
+    Flatten an (n_models, n_samples) score matrix into segments sorted by
+    descending score, dropping NaN scores. y_true may be (n_samples,) or
+    one label row per model.
+
+    Returns (y, s, seg, order) where order is the per-row argsort used.
+    """
+    scores = np.atleast_2d(np.asarray(score_matrix, dtype=float))
+    labels = np.broadcast_to(np.asarray(y_true, dtype=float), scores.shape)
+    # NaN sorts last, stable so ties keep their input order
+    order = np.argsort(-scores, axis=1, kind="stable")
+    s = np.take_along_axis(scores, order, axis=1)
+    y = np.take_along_axis(labels, order, axis=1)
+    seg = np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape)
+    valid = ~np.isnan(s)
+    return y[valid], s[valid], seg[valid], order
+
+
+def _rank_metrics(y_true, score_matrix, top_n_fr=100, top_n_ttif=20):
+    """
+    AUC-ROC, AUPRC, FR and TTIF for every row of a score matrix.
+
+    Returns (metrics, sorted) where metrics maps metric name -> per-row array
+    and sorted is the (y, s, seg) triple from _sort_score_matrix().
+    """
+    scores = np.atleast_2d(np.asarray(score_matrix, dtype=float))
+    y, s, seg, _ = _sort_score_matrix(y_true, scores)
+    m = _segment_rank_metrics(y, s, seg, scores.shape[0], top_ns=(top_n_fr, top_n_ttif))
+    n_pos = m["n_positive"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m["fr_top100"] = np.where(n_pos > 0, m[f"top_{top_n_fr}"] / n_pos, 0.0)
+        m["ttif_top20"] = m[f"top_{top_n_ttif}"] / np.minimum(top_n_ttif, m["n_total"])
+    return m, (y, s, seg)
+
+
+def rank_metrics(y_true, score_matrix, top_n_fr=100, top_n_ttif=20):
+    """
+    Per-row ranking metrics of a score matrix, without building a DataFrame.
+
+    The lightweight core of evaluate_predictions_batch() for inner loops
+    (combiner fits, bootstrap replicates, permutations).
+
+    Returns:
+        dict mapping metric name (auc_roc, auprc, fr_top100, ttif_top20,
+        n_positive, n_total, ...) -> array with one value per row
+    """
+    return _rank_metrics(y_true, score_matrix, top_n_fr, top_n_ttif)[0]
+
+
+@traced("evaluate.batch", rows_from="y_true")
+def evaluate_predictions_batch(y_true, score_matrix, names=None, top_n_fr=100, top_n_ttif=20):
+    """
+    Evaluate many score vectors against the same labels in one vectorized pass.
+
+    Computes the same metrics as evaluate_predictions() for every row of
+    score_matrix, without sklearn calls: one stable argsort over the matrix,
+    then cumulative sums per row. NaN scores are dropped per row. Scores tied
+    across a top-N cutoff are taken in input order (evaluate_predictions()
+    uses an unstable sort there), so FR/TTIF can differ from it only on ties.
+
+    Args:
+        y_true: Binary labels, shape (n_samples,) or (n_models, n_samples)
+        score_matrix: Scores, shape (n_models, n_samples)
+        names: Model names (default: model_0, model_1, ...)
+        top_n_fr: Top-N cutoff for Fraction Ranked metric
+        top_n_ttif: Top-N cutoff for TTIF metric
+
+    Returns:
+        DataFrame with one row per model and the evaluate_predictions() keys
+        as columns (accepted by compare_models()).
+    """
+    import pandas as pd
+
+    scores = np.atleast_2d(np.asarray(score_matrix, dtype=float))
+    n_models = scores.shape[0]
+    if names is None:
+        names = [f"model_{i}" for i in range(n_models)]
+
+    m, (y, s, seg) = _rank_metrics(y_true, scores, top_n_fr, top_n_ttif)
+    n_total = m["n_total"]
+    n_pos = m["n_positive"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Median-threshold precision / recall / F1 (scores sorted descending per row)
+        starts = np.concatenate([[0], np.cumsum(n_total)[:-1]]).astype(int)
+        lo = np.clip(starts + (n_total - 1) // 2, 0, max(len(s) - 1, 0))
+        hi = np.clip(starts + n_total // 2, 0, max(len(s) - 1, 0))
+        threshold = (s[lo] + s[hi]) / 2 if len(s) else np.full(n_models, np.nan)
+        predicted = s >= threshold[seg]
+        n_pred = np.bincount(seg, weights=predicted, minlength=n_models)
+        tp = np.bincount(seg, weights=predicted * y, minlength=n_models)
+        precision = np.where(n_pred > 0, tp / n_pred, 0.0)
+        recall = np.where(n_pos > 0, tp / n_pos, 0.0)
+        f1 = np.where(n_pred + n_pos > 0, 2 * tp / (n_pred + n_pos), 0.0)
+
+    return pd.DataFrame({
+        "name": list(names),
+        "n_total": n_total.astype(int),
+        "n_positive": n_pos.astype(int),
+        "n_negative": m["n_negative"].astype(int),
+        "auc_roc": m["auc_roc"],
+        "auprc": m["auprc"],
+        "fr_top100": m["fr_top100"],
+        "ttif_top20": m["ttif_top20"],
+        "f1_median_threshold": f1,
+        "precision_median_threshold": precision,
+        "recall_median_threshold": recall,
+    })
+
+
+@traced("evaluate.groups", rows_from="y_true")
+def evaluate_groups(y_true, score_matrix, groups, names=None, top_n_fr=100, top_n_ttif=20,
+                    global_top_n=100):
+    """
+    Per-group TESLA metrics for several models and grouping keys in one pass.
+
+    All (model, key, group) segments are ordered by a single lexsort and
+    scored by the same cumulative-sum kernel as evaluate_predictions_batch(),
+    so the cost grows with models x keys x samples, not with the number of groups.
+
+    Args:
+        y_true: Binary labels, shape (n_samples,)
+        score_matrix: Scores, shape (n_samples,) or (n_models, n_samples). NaN scores are dropped.
+        groups: dict (or DataFrame) of key name -> group label per sample,
+                e.g. {"patient_id": ..., "allele": ..., "peptide_length": ...}
+        names: Model names (default: model_0, model_1, ...)
+        top_n_fr: Top-N cutoff for within-group Fraction Ranked
+        top_n_ttif: Top-N cutoff for within-group TTIF
+        global_top_n: Cutoff for counting a group's positives in the model's overall ranking
+
+    Returns:
+        DataFrame with one row per (model, key, group): n_total, n_positive,
+        n_negative, auc_roc, auprc, fr_top100, ttif_top20 (within the group),
+        median_rank_positive and n_positive_global_top (positions in the
+        model's overall ranking), and degenerate (no positives or no
+        negatives; AUC/AUPRC are NaN there).
+    """
+    import pandas as pd
+
+    y_true = np.asarray(y_true, dtype=float)
+    scores = np.atleast_2d(np.asarray(score_matrix, dtype=float))
+    n_models, n_samples = scores.shape
+    if names is None:
+        names = [f"model_{i}" for i in range(n_models)]
+    keys = list(groups)
+
+    # Overall 1-indexed rank of every sample within its model (NaN ranked last)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(1, n_samples + 1)[None, :], axis=1)
+
+    # Segment id = (model, key, group); groups of every key laid out consecutively
+    codes, labels = [], []
+    for key in keys:
+        key_codes, key_labels = pd.factorize(pd.Series(np.asarray(groups[key])), sort=True,
+                                             use_na_sentinel=False)
+        codes.append(key_codes)
+        labels.append(key_labels)
+    sizes = np.array([len(l) for l in labels])
+    key_offset = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    n_groups = int(sizes.sum())
+    group_ids = np.stack([c + o for c, o in zip(codes, key_offset)])          # (n_keys, n_samples)
+    seg = (np.arange(n_models)[:, None, None] * n_groups + group_ids[None]).ravel()
+
+    flat_scores = np.broadcast_to(scores[:, None, :], (n_models, len(keys), n_samples)).ravel()
+    flat_y = np.broadcast_to(y_true, (n_models, len(keys), n_samples)).ravel()
+    flat_rank = np.broadcast_to(rank[:, None, :], (n_models, len(keys), n_samples)).ravel()
+    valid = ~np.isnan(flat_scores)
+    seg, s, y, r = seg[valid], flat_scores[valid], flat_y[valid], flat_rank[valid]
+
+    # The one sort: by segment, then descending score (stable, like the overall rank)
+    order = np.lexsort((-s, seg))
+    seg, s, y, r = seg[order], s[order], y[order], r[order]
+    n_seg = n_models * n_groups
+    m = _segment_rank_metrics(y, s, seg, n_seg, top_ns=(top_n_fr, top_n_ttif))
+    n_total, n_pos, n_neg = m["n_total"], m["n_positive"], m["n_negative"]
+
+    # Positives appear in ascending overall rank within each segment
+    pos = y == 1
+    pos_rank, pos_seg = r[pos], seg[pos]
+    pos_start = np.concatenate([[0], np.cumsum(n_pos)[:-1]]).astype(int)
+    n_pos_int = n_pos.astype(int)
+    last = max(len(pos_rank) - 1, 0)
+    lo = np.clip(pos_start + (n_pos_int - 1) // 2, 0, last)
+    hi = np.clip(pos_start + n_pos_int // 2, 0, last)
+    median_rank = np.full(n_seg, np.nan)
+    has_pos = n_pos > 0
+    median_rank[has_pos] = (pos_rank[lo[has_pos]] + pos_rank[hi[has_pos]]) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fr = np.where(n_pos > 0, m[f"top_{top_n_fr}"] / n_pos, 0.0)
+        ttif = m[f"top_{top_n_ttif}"] / np.minimum(top_n_ttif, n_total)
+    in_global_top = np.bincount(pos_seg[pos_rank <= global_top_n], minlength=n_seg)
+
+    seg_model = np.repeat(np.arange(n_models), n_groups)
+    seg_key = np.tile(np.repeat(np.arange(len(keys)), sizes), n_models)
+    seg_label = np.tile(np.concatenate([np.asarray(l, dtype=object) for l in labels]), n_models)
+    table = pd.DataFrame({
+        "model": np.asarray(names, dtype=object)[seg_model],
+        "key": np.asarray(keys, dtype=object)[seg_key],
+        "group": seg_label,
+        "n_total": n_total.astype(int),
+        "n_positive": n_pos_int,
+        "n_negative": n_neg.astype(int),
+        "auc_roc": m["auc_roc"],
+        "auprc": m["auprc"],
+        "fr_top100": fr,
+        "ttif_top20": ttif,
+        "median_rank_positive": median_rank,
+        "n_positive_global_top": in_global_top,
+        "degenerate": (n_pos == 0) | (n_neg == 0),
+    })
+    # Groups whose samples all had NaN scores for a model
+    return table[table["n_total"] > 0].reset_index(drop=True)
+
+
+def print_group_breakdown(table, key, model=None, prefix=""):
+    """
+    Print per-group AUC-ROC/AUPRC lines for one key of an evaluate_groups() table.
+
+    Degenerate groups (no positives or no negatives) are reported without AUC.
+    """
+    rows = table[table["key"] == key]
+    if model is not None:
+        rows = rows[rows["model"] == model]
+    for row in rows.itertuples(index=False):
+        if row.degenerate:
+            print(f"  {prefix}{row.group}: {row.n_positive} immunogenic / {row.n_total} total "
+                  f"(can't compute AUC)")
+        else:
+            print(f"  {prefix}{row.group}: AUC-ROC={row.auc_roc:.3f}, AUPRC={row.auprc:.3f} "
+                  f"({row.n_positive} immunogenic / {row.n_total} total)")
+
+
 def print_metrics(metrics):
     """Pretty-print evaluation metrics."""
     print(f"\n{'='*50}")
@@ -0,0 +1,456 @@
+"""
+Evolutionary model search (docs/rl-environment-design.md, programmatic loop).
+
+A candidate is a config: a combination of FEATURE_SETS, a model type and
+its hyperparameters. Each round spawns offspring from the current top-K by
+mutation (toggle a feature set, switch model, step one hyperparameter) and
+crossover (features of one parent, model of another), scores them, and
+keeps the best K of parents and offspring by LOGO AUPRC on TESLA
+(AUC-ROC breaks ties).
+
+Fitness is cheap to compute in bulk:
+- feature columns are computed once for the whole feature pool (columns
+  already in the input table are reused) and each feature-set combination's
+  matrix is prepared once per run
+- every (candidate, patient fold) fit of a round is a work unit on one
+  Coordinator, so folds run in parallel and identical units are computed once
+- all out-of-fold predictions of a round are scored in one
+  evaluate_predictions_batch call
+
+Equivalent candidates (same columns, model and effective params, e.g. feature
+sets listed in another order) share a key and are scored only once per run.
+Each round is capped by a compute budget in tree-fits (n_estimators x folds;
+a linear model counts as LINEAR_FIT_COST trees). The population, the archive
+of every scored key, the per-round history and the RNG state are saved after
+every round, so an interrupted search resumes where it stopped.
+
+Usage:
+    python -m tools.evolve --rounds 5 --n-jobs 8
+    python -m tools.evolve --features tesla novel mhcflurry --budget 20000 --checkpoint run.json
+    python -m tools.evolve --checkpoint run.json --resume --rounds 3     # 3 more rounds
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.search import SEARCH_SPACES, build_estimator
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_CHECKPOINT = PROJECT_ROOT / "data" / "evolve" / "population.json"
+
+DEFAULT_FEATURE_POOL = ("tesla", "novel", "mhcflurry", "substitution")
+DEFAULT_POPULATION = 8
+DEFAULT_OFFSPRING = 24
+DEFAULT_ROUND_BUDGET = 40_000
+DEFAULT_TREES = 200
+# Budget units charged for one linear-model fold fit
+LINEAR_FIT_COST = 10
+# Offspring draws per round before giving up on finding new candidates
+MAX_DRAWS_PER_OFFSPRING = 20
+
+# Model type -> estimator, fixed params and mutable grid. Ensembles use the
+# search grids with n_estimators fixed for the whole run.
+MODELS = {
+    "rf": {**SEARCH_SPACES["rf"], "trees": True},
+    "gb": {**SEARCH_SPACES["gb"], "trees": True},
+    "lr": {
+        "estimator": "sklearn.linear_model.LogisticRegression",
+        "fixed": {"class_weight": "balanced", "max_iter": 1000, "random_state": 42},
+        "grid": {"C": [0.01, 0.03, 0.1, 0.3, 1.0, 3.0]},
+        "trees": False,
+    },
+}
+
+# Starting hyperparameters: the ones hard-coded in the experiment scripts
+SCRIPT_PARAMS = {
+    "rf": {"max_depth": 5, "min_samples_leaf": 5, "max_features": "sqrt"},
+    "gb": {"max_depth": 3, "learning_rate": 0.05, "min_samples_leaf": 5, "subsample": 0.8},
+    "lr": {"C": 1.0},
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CANDIDATES
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# A candidate is a JSON-friendly dict:
+#     {"features": ["novel", "tesla"], "model": "rf", "params": {"max_depth": 5, ...}}
+
+def candidate_columns(candidate):
+    """Feature columns of a candidate, in pool order without duplicates."""
+    from tools.feature_registry import FEATURE_SETS
+
+    return list(dict.fromkeys(col for name in candidate["features"] for col in FEATURE_SETS[name]))
+
+
+def build_model(candidate, trees=DEFAULT_TREES):
+    """Unfitted estimator of a candidate."""
+    model = build_estimator(MODELS[candidate["model"]]).set_params(**candidate["params"])
+    if MODELS[candidate["model"]]["trees"]:
+        model.set_params(n_estimators=trees)
+    return model
+
+
+def candidate_key(candidate, trees=DEFAULT_TREES):
+    """Identical for candidates that fit the same model on the same columns."""
+    params = build_model(candidate, trees).get_params()
+    return json.dumps([sorted(candidate_columns(candidate)), candidate["model"], params],
+                      sort_keys=True, default=str)
+
+
+def candidate_cost(candidate, n_folds, trees=DEFAULT_TREES):
+    """Compute charged against the round budget (tree-fits)."""
+    return n_folds * (trees if MODELS[candidate["model"]]["trees"] else LINEAR_FIT_COST)
+
+
+def describe(candidate):
+    params = ", ".join(f"{k}={v}" for k, v in sorted(candidate["params"].items()))
+    return f"{candidate['model']} [{'+'.join(candidate['features'])}] {params}"
+
+
+def seed_population(feature_pool):
+    """One candidate per (feature set, model) with the scripts' hyperparameters."""
+    return [
+        {"features": [name], "model": model, "params": dict(SCRIPT_PARAMS[model])}
+        for name in feature_pool for model in MODELS
+    ]
+
+
+def _py(value):
+    """numpy scalar -> Python scalar, so candidates stay JSON-serializable."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def mutate(candidate, feature_pool, rng):
+    """Copy of candidate with one change: a feature set, the model, or one hyperparameter."""
+    child = {"features": list(candidate["features"]), "model": candidate["model"],
+             "params": dict(candidate["params"])}
+    op = rng.choice(["features", "model", "param"], p=[0.4, 0.2, 0.4])
+    if op == "features":
+        name = feature_pool[rng.integers(len(feature_pool))]
+        if name in child["features"] and len(child["features"]) > 1:
+            child["features"].remove(name)
+        elif name not in child["features"]:
+            child["features"].append(name)
+    elif op == "model":
+        others = [m for m in MODELS if m != child["model"]]
+        child["model"] = others[rng.integers(len(others))]
+        child["params"] = dict(SCRIPT_PARAMS[child["model"]])
+    else:
+        grid = MODELS[child["model"]]["grid"]
+        key = list(grid)[rng.integers(len(grid))]
+        values = grid[key]
+        # Step to a neighbouring grid value (grids are ordered)
+        i = values.index(child["params"][key]) if child["params"].get(key) in values else 0
+        child["params"][key] = values[int(np.clip(i + rng.choice([-1, 1]), 0, len(values) - 1))]
+    child["features"] = [name for name in feature_pool if name in child["features"]]
+    child["params"] = {k: _py(v) for k, v in child["params"].items()}
+    return child
+
+
+def crossover(a, b, feature_pool, rng):
+    """Feature sets from one parent, model and hyperparameters from the other."""
+    if rng.random() < 0.5:
+        a, b = b, a
+    features = set(a["features"]) | (set(b["features"]) if rng.random() < 0.3 else set())
+    return {"features": [name for name in feature_pool if name in features],
+            "model": b["model"], "params": dict(b["params"])}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FITNESS
+# ══════════════════════════════════════════════════════════════════════════════
+
+class FitnessEvaluator:
+    """LOGO fitness of candidate batches on one TESLA table."""
+
+    def __init__(self, tesla, coordinator=None, trees=DEFAULT_TREES):
+        from tools.workunits import Coordinator
+
+        self.tesla = tesla
+        self.y = tesla["immunogenic"].astype(int).values
+        self.groups = tesla["patient_id"].values
+        self.n_folds = len(np.unique(self.groups))
+        self.coordinator = coordinator or Coordinator()
+        self.trees = trees
+        self.matrices = {}  # sorted column tuple -> prepared X
+
+    def matrix(self, candidate):
+        from tools.error_analysis_and_multifeature import prepare_features
+
+        columns = candidate_columns(candidate)
+        key = tuple(sorted(columns))
+        if key not in self.matrices:
+            self.matrices[key], _, _ = prepare_features(self.tesla, columns)
+        return self.matrices[key]
+
+    def evaluate(self, candidates):
+        """evaluate_predictions_batch table for candidates, in order."""
+        from tools.evaluate import evaluate_predictions_batch
+        from tools.workunits import logo_units, merge_folds
+
+        units, owner = [], []
+        for i, candidate in enumerate(candidates):
+            fold_units = logo_units(build_model(candidate, self.trees), self.matrix(candidate),
+                                    self.y, self.groups)
+            units += fold_units
+            owner += [i] * len(fold_units)
+        results = self.coordinator.run(units)
+
+        owner = np.asarray(owner)
+        oof = np.vstack([
+            merge_folds([results[j] for j in np.flatnonzero(owner == i)], len(self.y))
+            for i in range(len(candidates))
+        ])
+        return evaluate_predictions_batch(self.y, oof, names=[describe(c) for c in candidates])
+
+
+def _fitness(entry):
+    return (entry["auprc"], entry["auc_roc"])
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SEARCH
+# ══════════════════════════════════════════════════════════════════════════════
+
+class EvolutionarySearch:
+    """
+    (K + N) evolution over candidates with checkpointed state.
+
+    State (all JSON): round, population (top-K entries), archive (key ->
+    entry for every candidate scored), history (one row per round) and the
+    RNG state. An entry is the candidate plus its metrics.
+    """
+
+    def __init__(self, evaluator, feature_pool=DEFAULT_FEATURE_POOL, population_size=DEFAULT_POPULATION,
+                 n_offspring=DEFAULT_OFFSPRING, round_budget=DEFAULT_ROUND_BUDGET,
+                 checkpoint=DEFAULT_CHECKPOINT, seed=0):
+        self.evaluator = evaluator
+        self.feature_pool = list(feature_pool)
+        self.population_size = population_size
+        self.n_offspring = n_offspring
+        self.round_budget = round_budget
+        self.checkpoint = Path(checkpoint) if checkpoint else None
+        self.rng = np.random.default_rng(seed)
+        self.round = 0
+        self.population = []
+        self.archive = {}
+        self.history = []
+
+    # ── State ──
+
+    def state(self):
+        return {
+            "round": self.round,
+            "feature_pool": self.feature_pool,
+            "trees": self.evaluator.trees,
+            "population": self.population,
+            "archive": self.archive,
+            "history": self.history,
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def save(self):
+        if self.checkpoint is None:
+            return
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.checkpoint.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state(), default=str))
+        os.replace(tmp, self.checkpoint)
+
+    def load(self):
+        """Restore state from the checkpoint; False if there is none."""
+        if self.checkpoint is None or not self.checkpoint.exists():
+            return False
+        state = json.loads(self.checkpoint.read_text())
+        if state["trees"] != self.evaluator.trees:
+            print(f"  Warning: checkpoint used {state['trees']} trees, now {self.evaluator.trees}; "
+                  f"archived scores are not comparable")
+        self.round = state["round"]
+        self.feature_pool = state["feature_pool"]
+        self.population = state["population"]
+        self.archive = state["archive"]
+        self.history = state["history"]
+        self.rng.bit_generator.state = state["rng"]
+        return True
+
+    # ── Rounds ──
+
+    def _score(self, candidates):
+        """Entries for candidates (all new keys)."""
+        if not candidates:
+            return []
+        table = self.evaluator.evaluate(candidates)
+        entries = []
+        for candidate, row in zip(candidates, table.to_dict("records")):
+            entry = {**candidate, "round": self.round,
+                     **{k: float(row[k]) for k in ("auc_roc", "auprc", "fr_top100", "ttif_top20")}}
+            self.archive[candidate_key(candidate, self.evaluator.trees)] = entry
+            entries.append(entry)
+        return entries
+
+    def _offspring(self):
+        """New, distinct candidates within the round budget, plus the duplicate count."""
+        children, keys, cost, duplicates = [], set(), 0, 0
+        for _ in range(self.n_offspring * MAX_DRAWS_PER_OFFSPRING):
+            if len(children) >= self.n_offspring:
+                break
+            if len(self.population) > 1 and self.rng.random() < 0.3:
+                i, j = self.rng.choice(len(self.population), size=2, replace=False)
+                child = crossover(self.population[i], self.population[j], self.feature_pool, self.rng)
+                if self.rng.random() < 0.5:
+                    child = mutate(child, self.feature_pool, self.rng)
+            else:
+                parent = self.population[self.rng.integers(len(self.population))]
+                child = mutate(parent, self.feature_pool, self.rng)
+            key = candidate_key(child, self.evaluator.trees)
+            if key in self.archive or key in keys:
+                duplicates += 1
+                continue
+            child_cost = candidate_cost(child, self.evaluator.n_folds, self.evaluator.trees)
+            if cost + child_cost > self.round_budget:
+                continue
+            children.append(child)
+            keys.add(key)
+            cost += child_cost
+        return children, cost, duplicates
+
+    def step(self):
+        """Run one round (round 0 scores the seed population) and checkpoint."""
+        start = time.perf_counter()
+        if self.round == 0 and not self.population:
+            candidates, duplicates = [], 0
+            for candidate in seed_population(self.feature_pool):
+                key = candidate_key(candidate, self.evaluator.trees)
+                if key in self.archive or any(candidate_key(c, self.evaluator.trees) == key
+                                              for c in candidates):
+                    duplicates += 1
+                else:
+                    candidates.append(candidate)
+            cost = sum(candidate_cost(c, self.evaluator.n_folds, self.evaluator.trees) for c in candidates)
+        else:
+            candidates, cost, duplicates = self._offspring()
+
+        entries = self._score(candidates)
+        pool = self.population + entries
+        self.population = sorted(pool, key=_fitness, reverse=True)[:self.population_size]
+        elapsed = time.perf_counter() - start
+
+        best = self.population[0]
+        self.history.append({
+            "round": self.round,
+            "evaluated": len(entries),
+            "duplicates": duplicates,
+            "compute": cost,
+            "wall_s": elapsed,
+            "candidates_per_hour": len(entries) / elapsed * 3600 if elapsed > 0 else float("nan"),
+            "best_auprc": best["auprc"],
+            "best": describe(best),
+        })
+        self.round += 1
+        self.save()
+        return self.history[-1]
+
+    def run(self, rounds, report=True):
+        """Run rounds more rounds; returns the final population."""
+        for _ in range(rounds):
+            row = self.step()
+            if report:
+                print(f"  Round {row['round']:2d}: {row['evaluated']:3d} evaluated, "
+                      f"{row['duplicates']:3d} duplicates skipped, {row['compute']:8,d} tree-fits, "
+                      f"{row['wall_s']:6.1f}s ({row['candidates_per_hour']:,.0f} candidates/h), "
+                      f"best AUPRC {row['best_auprc']:.4f}")
+        return self.population
+
+
+def print_summary(search, top=None):
+    history = pd.DataFrame(search.history)
+    total_s = history["wall_s"].sum()
+    n = int(history["evaluated"].sum())
+    print(f"\n{n} candidates in {total_s:.1f}s ({n / total_s * 3600:,.0f} candidates/h), "
+          f"{int(history['duplicates'].sum())} duplicates skipped, "
+          f"{int(history['compute'].sum()):,} tree-fits")
+    print(f"\nTop {top or len(search.population)} (LOGO on TESLA):")
+    print(f"  {'AUPRC':>6s} {'AUC':>6s} {'FR100':>6s} {'TTIF20':>6s} {'round':>5s}  candidate")
+    for e in search.population[:top]:
+        print(f"  {e['auprc']:6.4f} {e['auc_roc']:6.4f} {e['fr_top100']:6.4f} {e['ttif_top20']:6.4f} "
+              f"{e['round']:5d}  {describe(e)}")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.evolve", description=__doc__.split("\n")[1])
+    parser.add_argument("--input", default="tesla", help='"tesla" or a TESLA table with feature columns')
+    parser.add_argument("--features", nargs="+", default=list(DEFAULT_FEATURE_POOL),
+                        help="Feature set pool (FEATURE_SETS names)")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds to run (after round 0 / resume)")
+    parser.add_argument("--population", type=int, default=DEFAULT_POPULATION, help="Survivors per round (K)")
+    parser.add_argument("--offspring", type=int, default=DEFAULT_OFFSPRING, help="Offspring per round (N)")
+    parser.add_argument("--budget", type=int, default=DEFAULT_ROUND_BUDGET, help="Tree-fits per round")
+    parser.add_argument("--trees", type=int, default=DEFAULT_TREES, help="n_estimators of RF/GB candidates")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint", default=str(DEFAULT_CHECKPOINT), help="Population state file")
+    parser.add_argument("--resume", action="store_true", help="Continue from --checkpoint")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from tools.cli import read_frame
+    from tools.feature_registry import FEATURE_SETS, add_features, plan
+    from tools.workunits import Coordinator, InlineBackend, LocalProcessBackend
+
+    unknown = [name for name in args.features if name not in FEATURE_SETS]
+    if unknown:
+        print(f"evolve: unknown feature sets {unknown}; choose from {list(FEATURE_SETS)}")
+        return 2
+
+    tesla = read_frame(args.input)
+    # Sets whose raw inputs the table lacks (e.g. substitution without a WT column) leave the pool
+    pool = []
+    for name in args.features:
+        try:
+            plan(FEATURE_SETS[name], available=tesla.columns)
+        except KeyError as e:
+            print(f"  Warning: dropping feature set {name!r} from the pool: {e.args[0]}")
+            continue
+        pool.append(name)
+    if not pool:
+        print("evolve: no feature set can be computed from the input")
+        return 2
+    needed = list(dict.fromkeys(col for name in pool for col in FEATURE_SETS[name]))
+    missing = [col for col in needed if col not in tesla.columns]
+    if missing:
+        print(f"Computing {len(missing)} feature columns...")
+        tesla = add_features(tesla, missing)
+
+    backend = LocalProcessBackend(args.n_jobs) if args.n_jobs != 1 else InlineBackend()
+    coordinator = Coordinator(backend)
+    search = EvolutionarySearch(
+        FitnessEvaluator(tesla, coordinator, trees=args.trees), pool,
+        population_size=args.population, n_offspring=args.offspring,
+        round_budget=args.budget, checkpoint=args.checkpoint, seed=args.seed,
+    )
+    if args.resume and search.load():
+        print(f"Resumed {args.checkpoint} at round {search.round} ({len(search.archive)} candidates scored)")
+    try:
+        search.run(args.rounds + (1 if search.round == 0 else 0))
+    finally:
+        coordinator.close()
+    print_summary(search, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,8 +5,9 @@ Identifies key columns for immunogenicity prediction and produces summary stats.
 IEDB CSV structure: Row 0 is sub-headers (field descriptions), actual data starts row 1.
 """
 import pandas as pd
+from pathlib import Path
 
-DATA_PATH = "data/iedb/tcell_full_v3.csv"
+DATA_PATH = Path(__file__).parent.parent / "data" / "iedb" / "tcell_full_v3.csv"
 
 print("Loading IEDB T-cell data...")
 df = pd.read_csv(DATA_PATH, skiprows=[1], low_memory=False)
@@ -67,7 +68,7 @@ print(f"\nPeptide length distribution:")
 print(filtered["peptide_length"].value_counts().sort_index().head(20).to_string())
 
 # Save filtered dataset for model training
-output_path = "data/iedb/iedb_human_mhci_tcell.csv"
+output_path = DATA_PATH.parent / "iedb_human_mhci_tcell.csv"
 cols_to_save = [COL_PEPTIDE_SEQ, COL_MHC_ALLELE, COL_QUALITATIVE, "immunogenic", "peptide_length"]
 filtered[cols_to_save].to_csv(output_path, index=False)
 print(f"\nSaved filtered dataset: {output_path} ({len(filtered):,} rows)")
@@ -19,10 +19,13 @@ Features computed:
 5. Mutant-vs-WT property differences (when WT is known)
 """
 import sys
+from pathlib import Path
 import numpy as np
 import pandas as pd
 
-sys.path.insert(0, ".")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.trace import span, traced
 
 # ══════════════════════════════════════════════════════════════════════════════
 # AMINO ACID PROPERTY TABLES
@@ -331,12 +334,23 @@ def compute_tcr_facing_features(peptide, mutation_pos, allele, peptide_length):
     return features
 
 
-def engineer_features(tesla_df):
+@traced("features.engineer_features", rows_from="tesla_df")
+def engineer_features(tesla_df, store=None):
     """
     Compute all novel features for a TESLA-format DataFrame.
 
+    Args:
+        tesla_df: DataFrame with peptide, allele and (optionally) mutation_position.
+        store: Optional tools.feature_store.FeatureStore. Features are then read
+               from the store and only computed for unseen (peptide, allele,
+               mutation_position) keys; peptide length is taken from the sequence.
+
     Returns DataFrame with original columns plus new feature columns.
     """
+    if store is not None:
+        feature_df = store.get_many(tesla_df, ['mutation_site', 'peptide_global', 'tcr_surface'])
+        return pd.concat([tesla_df.reset_index(drop=True), feature_df], axis=1)
+
     all_features = []
 
     for _, row in tesla_df.iterrows():
@@ -373,8 +387,16 @@ def engineer_features(tesla_df):
 # ══════════════════════════════════════════════════════════════════════════════
 
 if __name__ == "__main__":
-    from tools.data_loader import load_tesla
-    from tools.evaluate import evaluate_predictions, print_metrics, compare_models
+    from tools.data_loader import load_tesla, prefetch
+    # MHCflurry loads in the background while sklearn imports and features compute
+    prefetch("tesla", "predictor")
+    from tools.ledger import start_session, annotate
+    from tools.oof_store import record_oof
+    from tools.replay import record_finding
+    from tools.importance import column_groups, fold_models, permutation_importance, print_importance
+    from tools.evaluate import (
+        evaluate_predictions, print_metrics, compare_models, evaluate_groups, print_group_breakdown,
+    )
     from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
     from sklearn.linear_model import LogisticRegression
     from sklearn.preprocessing import StandardScaler
@@ -383,9 +405,14 @@ if __name__ == "__main__":
 
     print("Loading TESLA data...")
     tesla = load_tesla()
+    start_session("feature_engineering", data=tesla)
+
+    from tools.feature_registry import FEATURE_SETS, add_features
 
     print("Computing novel features...")
-    tesla = engineer_features(tesla)
+    # Cached per (peptide, allele, mutation_position); the registry fills in the rest
+    from tools.feature_store import FeatureStore
+    tesla = add_features(engineer_features(tesla, store=FeatureStore()), FEATURE_SETS['novel'])
 
     # Add MHCflurry features
     print("Running MHCflurry...")
@@ -397,38 +424,21 @@ if __name__ == "__main__":
 
     # ── Define feature sets ──
     # Set A: TESLA original features only (baseline comparison)
-    tesla_features = [
-        'predicted_affinity', 'binding_stability', 'tumor_abundance',
-        'frac_hydrophobic', 'agretopicity', 'foreignness',
-        'mutation_position', 'peptide_length',
-    ]
+    tesla_features = FEATURE_SETS['tesla']
 
     # Set B: Our novel position-aware features
-    novel_features = [
-        'mut_at_anchor', 'mut_at_tcr_contact', 'mut_at_p2', 'mut_at_cterm',
-        'mut_position_normalized', 'mut_distance_from_center',
-        'mut_residue_hydrophobicity', 'mut_residue_molecular_weight',
-        'mut_residue_charge', 'mut_residue_aromatic', 'mut_residue_polar',
-        'context_hydrophobicity_mean', 'context_charge_sum',
-        'mut_hydrophobicity_vs_context', 'mut_creates_charge_break',
-        'peptide_hydrophobicity_mean', 'peptide_hydrophobicity_std',
-        'peptide_net_charge', 'peptide_has_positive_charge',
-        'peptide_has_negative_charge', 'peptide_n_aromatic',
-        'peptide_frac_polar', 'peptide_sequence_entropy',
-        'tcr_surface_hydrophobicity', 'tcr_surface_charge',
-        'tcr_surface_n_aromatic', 'tcr_surface_frac_polar',
-    ]
+    novel_features = FEATURE_SETS['novel']
 
     # Set C: MHCflurry features
-    mhcflurry_features = [
-        'mhcflurry_presentation', 'mhcflurry_affinity', 'mhcflurry_processing',
-    ]
+    mhcflurry_features = FEATURE_SETS['mhcflurry']
 
     # Set D: ALL features combined
     all_features = tesla_features + novel_features + mhcflurry_features
 
     logo = LeaveOneGroupOut()
     all_results = []
+    rf_fold_models = {}  # feature set -> (LOGO fold models, X), reused for importance
+    oof_scores = {}  # model name -> out-of-fold scores (NaN where unscored), for the per-patient breakdown
 
     feature_sets = {
         'TESLA only': tesla_features,
@@ -462,35 +472,51 @@ if __name__ == "__main__":
             n_estimators=500, class_weight='balanced',
             max_depth=5, min_samples_leaf=5, random_state=42
         )
-        rf_probs = cross_val_predict(rf, X, y, cv=logo, groups=groups, method='predict_proba')[:, 1]
-        rf_metrics = evaluate_predictions(y, rf_probs, name=f'RF ({name})')
+        with annotate(features=feat_cols, params=rf.get_params()):
+            with span("cv.fit", model="RF", features=name, rows=len(X)):
+                rf_models, rf_probs = fold_models(rf, X, y, groups)
+            rf_metrics = evaluate_predictions(y, rf_probs, name=f'RF ({name})')
+        rf_fold_models[name] = (rf_models, X)
+        record_finding(rf, X, y, groups, rf_probs, rf_metrics, features=feat_cols)
+        record_oof(rf_metrics["name"], rf_probs, y, groups, rf_metrics, feat_cols, rf.get_params())
         print_metrics(rf_metrics)
         all_results.append(rf_metrics)
+        oof_scores[rf_metrics['name']] = rf_probs
 
         # Gradient Boosting (often better for heterogeneous features)
         gb = GradientBoostingClassifier(
             n_estimators=200, max_depth=3, learning_rate=0.05,
             min_samples_leaf=5, random_state=42, subsample=0.8,
         )
-        gb_probs = cross_val_predict(gb, X, y, cv=logo, groups=groups, method='predict_proba')[:, 1]
-        gb_metrics = evaluate_predictions(y, gb_probs, name=f'GB ({name})')
+        with annotate(features=feat_cols, params=gb.get_params()):
+            with span("cv.fit", model="GB", features=name, rows=len(X)):
+                gb_probs = cross_val_predict(gb, X, y, cv=logo, groups=groups, method='predict_proba')[:, 1]
+            gb_metrics = evaluate_predictions(y, gb_probs, name=f'GB ({name})')
+        record_finding(gb, X, y, groups, gb_probs, gb_metrics, features=feat_cols)
+        record_oof(gb_metrics["name"], gb_probs, y, groups, gb_metrics, feat_cols, gb.get_params())
         print_metrics(gb_metrics)
         all_results.append(gb_metrics)
+        oof_scores[gb_metrics['name']] = gb_probs
 
     # ── Add baselines for comparison ──
     # MHCflurry single feature
     valid = ~tesla['mhcflurry_presentation'].isna()
-    mhcf = evaluate_predictions(
-        y[valid.values],
-        tesla.loc[valid, 'mhcflurry_presentation'].values,
-        name='MHCflurry single'
-    )
+    with annotate(features=['mhcflurry_presentation']):
+        mhcf = evaluate_predictions(
+            y[valid.values],
+            tesla.loc[valid, 'mhcflurry_presentation'].values,
+            name='MHCflurry single'
+        )
     all_results.append(mhcf)
+    oof_scores[mhcf['name']] = tesla['mhcflurry_presentation'].to_numpy(dtype=float)
 
     # Random
     np.random.seed(42)
-    rand = evaluate_predictions(y, np.random.rand(len(tesla)), name='Random')
+    with annotate():
+        rand_scores = np.random.rand(len(tesla))
+        rand = evaluate_predictions(y, rand_scores, name='Random')
     all_results.append(rand)
+    oof_scores[rand['name']] = rand_scores
 
     # ── Final comparison ──
     print("\n\n" + "=" * 70)
@@ -501,26 +527,12 @@ if __name__ == "__main__":
 
     # ── Feature importance for best model ──
     print("\n\n" + "=" * 70)
-    print("  FEATURE IMPORTANCE (RF, ALL features)")
+    print("  FEATURE IMPORTANCE (RF, ALL features, out-of-fold permutation)")
     print("=" * 70)
-    X_all = tesla[all_features].values.copy()
-    for i, col in enumerate(all_features):
-        if col in ['predicted_affinity', 'tumor_abundance', 'mhcflurry_affinity']:
-            X_all[:, i] = np.log1p(X_all[:, i])
-    X_all = SimpleImputer(strategy='median').fit_transform(X_all)
-    X_all = StandardScaler().fit_transform(X_all)
-
-    rf_full = RandomForestClassifier(
-        n_estimators=500, class_weight='balanced',
-        max_depth=5, min_samples_leaf=5, random_state=42
-    )
-    rf_full.fit(X_all, y)
-
-    importances = sorted(zip(all_features, rf_full.feature_importances_), key=lambda x: -x[1])
-    print("\nTop 20 features:")
-    for feat, imp in importances[:20]:
-        bar = '█' * int(imp * 200)
-        print(f"  {feat:35s} {imp:.4f} {bar}")
+    rf_models, X_all = rf_fold_models['ALL features']
+    for by, top in (("family", None), ("column", 20)):
+        importance = permutation_importance(rf_models, X_all, y, groups, column_groups(all_features, by))
+        print_importance(importance, f"Permutation importance by {by}", top=top)
 
     # ── Per-patient analysis with best model ──
     print("\n\n" + "=" * 70)
@@ -531,28 +543,8 @@ if __name__ == "__main__":
     best = max(all_results, key=lambda x: x['auprc'])
     print(f"\nBest model: {best['name']} (AUPRC={best['auprc']:.4f})")
 
-    # Re-run best config for per-patient
-    X_best = tesla[all_features].values.copy()
-    for i, col in enumerate(all_features):
-        if col in ['predicted_affinity', 'tumor_abundance', 'mhcflurry_affinity']:
-            X_best[:, i] = np.log1p(X_best[:, i])
-    X_best = SimpleImputer(strategy='median').fit_transform(X_best)
-    X_best = StandardScaler().fit_transform(X_best)
-
-    rf_best = RandomForestClassifier(
-        n_estimators=500, class_weight='balanced',
-        max_depth=5, min_samples_leaf=5, random_state=42
-    )
-    best_probs = cross_val_predict(rf_best, X_best, y, cv=logo, groups=groups, method='predict_proba')[:, 1]
-
-    from sklearn.metrics import roc_auc_score, average_precision_score
-    for patient in sorted(tesla['patient_id'].unique()):
-        mask = groups == patient
-        p_y = y[mask]
-        p_scores = best_probs[mask]
-        n_imm = p_y.sum()
-        if n_imm > 0 and (p_y == 0).sum() > 0:
-            auc = roc_auc_score(p_y, p_scores)
-            ap = average_precision_score(p_y, p_scores)
-            print(f"  Patient {patient}: AUC-ROC={auc:.3f}, AUPRC={ap:.3f} "
-                  f"({n_imm} immunogenic / {mask.sum()} total)")
+    # The scores that were actually compared above (NaN rows are dropped per patient)
+    best_probs = oof_scores[best['name']]
+
+    breakdown = evaluate_groups(y, best_probs, {"patient_id": groups}, names=[best["name"]])
+    print_group_breakdown(breakdown, "patient_id", prefix="Patient ")
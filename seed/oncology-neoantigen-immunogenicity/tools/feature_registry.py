@@ -0,0 +1,785 @@
+"""
+Declarative feature registry with dependency-aware lazy computation.
+
+Every feature column is declared once, together with the producer that
+computes it and the inputs that producer needs. Inputs are either DataFrame
+columns (peptide, allele, mutation_position, ...) or shared intermediates
+such as the encoded peptide matrix and the per-residue property tensor.
+
+Given a list of requested columns, compute_features() walks the dependency
+graph, runs only the producers those columns need (in dependency order, each
+once, over the whole batch) and shares intermediates between them. A narrow
+ablation such as ["tcr_surface_charge"] never touches the entropy or
+context code.
+
+Producers are vectorized re-implementations of the per-row functions in
+feature_engineering.py and iedb_transfer.py, which remain the reference
+definitions. Non-standard residues get zero properties, as in the per-row
+code.
+
+The named feature lists used by the experiment scripts live in FEATURE_SETS.
+
+Usage:
+    from tools.feature_registry import FEATURE_SETS, add_features
+    tesla = add_features(tesla, FEATURE_SETS["novel"])
+"""
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from tools.feature_engineering import AA_PROPERTY_TABLES, get_anchor_positions, get_tcr_positions
+from tools.iedb_transfer import (
+    AA_LIST, PAD_IDX, AA_CODE_LUT, BLOSUM62_SELF, AA_FREQ,
+    encode_wt_peptides, rebuild_wt_peptides, substitution_features_from_codes, wt_code_matrix,
+)
+from tools.trace import span
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REGISTRY
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Producer name -> {"inputs", "outputs", "family", "compute", "shardable"}
+PRODUCERS = {}
+
+# Output name (feature column or intermediate) -> producer name
+OUTPUT_PRODUCER = {}
+
+# Inputs that must come from the DataFrame
+RAW_INPUTS = {"peptide", "allele", "wt_residue"}
+
+# Intermediates a DataFrame column supplies directly, bypassing their producer:
+# intermediate -> (column, function(ctx) returning the intermediates from it)
+COLUMN_STAND_INS = {}
+
+# Extra explanation when a raw input is missing
+MISSING_INPUT_HINTS = {
+    "wt_residue": "substitution and paired MHCflurry features need a wt_peptide column, or wt_residue "
+                  "(the WT residue at mutation_position) to rebuild it",
+}
+
+
+def register(name, inputs, outputs, family=None, shardable=True):
+    """
+    Register a producer.
+
+    Args:
+        name: Producer name.
+        inputs: Names of the DataFrame columns / intermediates it reads.
+        outputs: Names it produces. Feature producers set family; producers
+                 without a family are intermediates and never returned.
+        family: Feature family (position, mutation_site, context, global,
+                tcr_surface, sequence, substitution, mhcflurry).
+        shardable: False if the producer cannot run on a row slice in a
+                   worker process (e.g. it calls an external predictor).
+
+    The decorated function takes the computation context (a dict of input
+    name -> array) and returns a dict of output name -> array.
+    """
+    def decorator(fn):
+        PRODUCERS[name] = {
+            "inputs": tuple(inputs),
+            "outputs": tuple(outputs),
+            "family": family,
+            "compute": fn,
+            "shardable": shardable,
+        }
+        for output in outputs:
+            if output in OUTPUT_PRODUCER:
+                raise ValueError(f"{output} already produced by {OUTPUT_PRODUCER[output]}")
+            OUTPUT_PRODUCER[output] = name
+        return fn
+    return decorator
+
+
+def feature_columns(family=None):
+    """All registered feature columns, optionally restricted to one family."""
+    return [
+        out for spec in PRODUCERS.values() if spec["family"] is not None
+        and (family is None or spec["family"] == family)
+        for out in spec["outputs"]
+    ]
+
+
+def feature_families():
+    """Feature column -> family."""
+    return {
+        out: spec["family"] for spec in PRODUCERS.values() if spec["family"] is not None
+        for out in spec["outputs"]
+    }
+
+
+def plan(columns, available=()):
+    """
+    Producers needed to compute columns, in dependency order.
+
+    Names in available (e.g. columns already in the DataFrame) are not
+    recomputed.
+    """
+    available = set(available)
+    order = []
+    visited = set()
+
+    def visit(name):
+        if name in available or COLUMN_STAND_INS.get(name, (None,))[0] in available:
+            return
+        if name not in OUTPUT_PRODUCER:
+            if name in RAW_INPUTS:
+                hint = f" ({MISSING_INPUT_HINTS[name]})" if name in MISSING_INPUT_HINTS else ""
+                raise KeyError(f"Input column '{name}' is required but missing{hint}")
+            raise KeyError(f"Unknown feature: {name}")
+        producer = OUTPUT_PRODUCER[name]
+        if producer in visited:
+            return
+        visited.add(producer)
+        for inp in PRODUCERS[producer]["inputs"]:
+            visit(inp)
+        order.append(producer)
+
+    for col in columns:
+        visit(col)
+    return order
+
+
+class _Context(dict):
+    """Computed values, falling back to DataFrame columns on first access."""
+
+    def __init__(self, df, options):
+        super().__init__()
+        self.df = df
+        self.options = options
+
+    def __missing__(self, key):
+        if key in self.df.columns:
+            value = self.df[key].to_numpy()
+            self[key] = value
+            return value
+        if key in COLUMN_STAND_INS and COLUMN_STAND_INS[key][0] in self.df.columns:
+            self.update(COLUMN_STAND_INS[key][1](self))
+            return self[key]
+        raise KeyError(key)
+
+
+def run_producers(ctx, producers):
+    """Run producers in order, storing their outputs in ctx."""
+    for name in producers:
+        with span(f"features.{name}"):
+            ctx.update(PRODUCERS[name]["compute"](ctx))
+    return ctx
+
+
+def compute_features(df, columns, n_jobs=1, shard_rows=None, **options):
+    """
+    Compute the requested feature columns for df.
+
+    Columns already present in df are passed through unchanged; everything
+    else is computed by the producers it depends on. Keyword options are
+    visible to producers (e.g. predictor= for the MHCflurry producers).
+
+    Args:
+        df: Input DataFrame (needs peptide; allele / mutation_position /
+            wt_peptide or wt_residue depending on the requested columns).
+        columns: Feature columns to return.
+        n_jobs: Worker processes for shardable producers (-1 = all cores).
+                Results are bit-identical to n_jobs=1.
+        shard_rows: Rows per shard (default: split evenly, 4 shards per worker).
+
+    Returns DataFrame with exactly the requested columns, RangeIndex.
+    """
+    columns = list(columns)
+    df = df.reset_index(drop=True)
+    ctx = _Context(df, options)
+    producers = plan(columns, available=df.columns)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    with span("features.compute", rows=len(df), n_columns=len(columns), n_jobs=n_jobs):
+        if n_jobs > 1 and len(df) > 1:
+            _run_sharded(ctx, producers, columns, n_jobs, shard_rows)
+        else:
+            run_producers(ctx, producers)
+        return pd.DataFrame({col: ctx[col] for col in columns})
+
+
+def add_features(df, columns, n_jobs=1, **options):
+    """Return a copy of df with the requested columns that are not yet present added."""
+    df = df.reset_index(drop=True)
+    missing = [col for col in columns if col not in df.columns]
+    if not missing:
+        return df.copy()
+    return pd.concat([df, compute_features(df, missing, n_jobs=n_jobs, **options)], axis=1)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SHARDED EXECUTION
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# Producers that read strings (peptide, allele) or call external predictors
+# run in the parent. Their numeric outputs (the byte matrix, anchor masks,
+# DataFrame columns, ...) are copied once into shared memory; workers attach
+# to them, run the remaining producers on a row range and write results
+# straight into a preallocated shared (n_rows, n_columns) float64 array.
+# Only block names, shapes and row bounds cross the process boundary.
+#
+# All shardable producers are row-local (per-row reductions over positions),
+# so each row's result does not depend on how rows are split.
+
+def _runs_in_parent(name):
+    spec = PRODUCERS[name]
+    return not spec["shardable"] or any(inp in RAW_INPUTS for inp in spec["inputs"])
+
+
+def _attach_shared(name):
+    """
+    Attach to a block created by the parent. Workers share the parent's
+    resource tracker, which only forgets the block when the parent unlinks it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _shared_view(shm, spec):
+    shape, dtype = spec
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _run_shard(task):
+    """Worker: compute one row range of the sharded producers into shared output."""
+    inputs, output, producers, columns, lo, hi = task
+    blocks = []
+    try:
+        ctx = _Context(pd.DataFrame(), {})
+        for key, (block_name, spec) in inputs.items():
+            shm = _attach_shared(block_name)
+            blocks.append(shm)
+            ctx[key] = _shared_view(shm, spec)[lo:hi]
+        run_producers(ctx, producers)
+
+        out_shm = _attach_shared(output[0])
+        blocks.append(out_shm)
+        out = _shared_view(out_shm, output[1])
+        for j, col in enumerate(columns):
+            out[lo:hi, j] = ctx[col]
+        del out, ctx
+    finally:
+        for shm in blocks:
+            shm.close()
+    return hi - lo
+
+
+def _run_sharded(ctx, producers, columns, n_jobs, shard_rows):
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Parent-bound producers and everything they depend on run in the parent
+    in_parent = set()
+    parent_inputs = set()
+    for name in reversed(producers):
+        spec = PRODUCERS[name]
+        if _runs_in_parent(name) or parent_inputs & set(spec["outputs"]):
+            in_parent.add(name)
+            parent_inputs.update(spec["inputs"])
+    parent = [p for p in producers if p in in_parent]
+    worker = [p for p in producers if p not in in_parent]
+    run_producers(ctx, parent)
+
+    worker_outputs = {out for p in worker for out in PRODUCERS[p]["outputs"]}
+    needed = {inp for p in worker for inp in PRODUCERS[p]["inputs"]} - worker_outputs
+    sharded_columns = [col for col in columns if col in worker_outputs]
+    if not sharded_columns:
+        run_producers(ctx, worker)
+        return
+
+    n_rows = len(ctx.df)
+    blocks = []
+    try:
+        inputs = {}
+        for key in sorted(needed):
+            arr = np.ascontiguousarray(ctx[key])
+            if arr.dtype == object:
+                arr = arr.astype(float)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            blocks.append(shm)
+            _shared_view(shm, (arr.shape, arr.dtype))[...] = arr
+            inputs[key] = (shm.name, (arr.shape, arr.dtype.str))
+
+        out_spec = ((n_rows, len(sharded_columns)), np.dtype(np.float64).str)
+        out_shm = shared_memory.SharedMemory(create=True, size=max(n_rows * len(sharded_columns) * 8, 1))
+        blocks.append(out_shm)
+
+        if shard_rows is None:
+            shard_rows = -(-n_rows // (n_jobs * 4))
+        bounds = [(lo, min(lo + shard_rows, n_rows)) for lo in range(0, n_rows, shard_rows)]
+        tasks = [(inputs, (out_shm.name, out_spec), worker, sharded_columns, lo, hi)
+                 for lo, hi in bounds]
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks))) as pool:
+            for _ in pool.map(_run_shard, tasks):
+                pass
+
+        out = _shared_view(out_shm, out_spec)
+        for j, col in enumerate(sharded_columns):
+            ctx[col] = out[:, j].copy()
+        del out
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# LOOKUP TABLES (indexed by encoded residue, PAD_IDX = padding / non-standard)
+# ══════════════════════════════════════════════════════════════════════════════
+
+PROPERTY_NAMES = list(AA_PROPERTY_TABLES)
+PROPERTY_MATRIX = np.zeros((PAD_IDX + 1, len(PROPERTY_NAMES)))
+for _j, _prop in enumerate(PROPERTY_NAMES):
+    for _aa, _i in zip(AA_LIST, range(PAD_IDX)):
+        PROPERTY_MATRIX[_i, _j] = AA_PROPERTY_TABLES[_prop].get(_aa, 0.0)
+HYDRO, MW, CHARGE, AROMATIC, POLAR = range(len(PROPERTY_NAMES))
+
+BLOSUM_SELF_TABLE = np.array([BLOSUM62_SELF[aa] for aa in AA_LIST] + [4], dtype=float)
+AA_FREQ_TABLE = np.array([AA_FREQ[aa] for aa in AA_LIST] + [0.01])
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# INTERMEDIATES
+# ══════════════════════════════════════════════════════════════════════════════
+
+@register("raw", inputs=("peptide",), outputs=("raw",))
+def _raw(ctx):
+    """Peptides as a zero-padded (n, max_len) uint8 byte matrix."""
+    peptides = np.asarray(ctx["peptide"], dtype=str)
+    width = max(int(np.char.str_len(peptides).max()), 1) if len(peptides) else 1
+    raw = peptides.astype(f"S{width}").view(np.uint8).reshape(len(peptides), width)
+    return {"raw": raw}
+
+
+@register("length", inputs=("raw",), outputs=("length", "residue_mask"))
+def _length(ctx):
+    mask = ctx["raw"] != 0
+    return {"length": mask.sum(axis=1), "residue_mask": mask}
+
+
+@register("encoded", inputs=("raw",), outputs=("encoded",))
+def _encoded(ctx):
+    return {"encoded": AA_CODE_LUT[ctx["raw"]]}
+
+
+@register("properties", inputs=("encoded",), outputs=("properties",))
+def _properties(ctx):
+    """(n, max_len, n_properties) property tensor in PROPERTY_NAMES order."""
+    return {"properties": PROPERTY_MATRIX[ctx["encoded"]]}
+
+
+@register("property_stats", inputs=("properties", "residue_mask", "length"),
+          outputs=("property_sums", "hydro_mean", "hydro_std"))
+def _property_stats(ctx):
+    props = ctx["properties"]
+    mask = ctx["residue_mask"]
+    n = ctx["length"]
+    sums = props.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums[:, HYDRO] / n
+        dev = np.where(mask, props[:, :, HYDRO] - mean[:, None], 0.0)
+        std = np.sqrt((dev ** 2).sum(axis=1) / n)
+    return {"property_sums": sums, "hydro_mean": mean, "hydro_std": std}
+
+
+@register("peptide_length", inputs=("length",), outputs=("peptide_length",))
+def _peptide_length(ctx):
+    """Fallback when the DataFrame has no peptide_length column."""
+    return {"peptide_length": ctx["length"]}
+
+
+@register("mutation_position", inputs=("length",), outputs=("mutation_position",))
+def _mutation_position(ctx):
+    """Fallback when the DataFrame has no mutation_position column."""
+    return {"mutation_position": np.full(len(ctx["length"]), np.nan)}
+
+
+@register("mutation_index", inputs=("mutation_position", "length"),
+          outputs=("mut_idx", "mut_valid"))
+def _mutation_index(ctx):
+    """0-based mutation index and whether it falls inside the peptide."""
+    pos = np.asarray(ctx["mutation_position"], dtype=float)
+    pos_int = np.where(np.isnan(pos), 0, pos).astype(int)
+    valid = ~np.isnan(pos) & (pos_int >= 1) & (pos_int <= ctx["length"])
+    return {"mut_idx": np.where(valid, pos_int - 1, 0), "mut_valid": valid}
+
+
+def _position_table_width(peptide_length):
+    return max(int(np.max(peptide_length, initial=0)), 10)
+
+
+@register("anchor_mask", inputs=("allele", "peptide_length"), outputs=("anchor_mask",))
+def _anchor_mask(ctx):
+    """(n, width) mask of get_anchor_positions(), built once per (allele, length)."""
+    lengths = np.asarray(ctx["peptide_length"], dtype=int)
+    width = _position_table_width(lengths)
+    allele_codes, alleles = pd.factorize(pd.Series(ctx["allele"], dtype=object), use_na_sentinel=False)
+    pairs, codes = np.unique(allele_codes * (width + 1) + lengths, return_inverse=True)
+    table = np.zeros((len(pairs), width), dtype=bool)
+    for k, pair in enumerate(pairs):
+        allele, length = alleles[pair // (width + 1)], pair % (width + 1)
+        anchors = [a - 1 for a in get_anchor_positions(allele, int(length)) if 1 <= a <= width]
+        table[k, anchors] = True
+    return {"anchor_mask": table[codes.ravel()]}
+
+
+@register("tcr_contact_mask", inputs=("peptide_length",), outputs=("tcr_contact_mask",))
+def _tcr_contact_mask(ctx):
+    """(n, width) mask of get_tcr_positions(), built once per length."""
+    lengths = np.asarray(ctx["peptide_length"], dtype=int)
+    width = _position_table_width(lengths)
+    table = np.zeros((width + 1, width), dtype=bool)
+    for length in np.unique(lengths):
+        positions = [p - 1 for p in get_tcr_positions(int(length)) if 1 <= p <= width]
+        table[length, positions] = True
+    return {"tcr_contact_mask": table[lengths]}
+
+
+def _row_entropy(codes, totals):
+    """
+    Shannon entropy (bits) of the nonzero codes in each row of an integer
+    matrix, with frequencies relative to totals. Rows are sorted in place
+    (small), then run lengths give the per-code counts.
+    """
+    n, width = codes.shape
+    if n == 0 or width == 0:
+        return np.zeros(n)
+    flat = np.sort(codes, axis=1).ravel()
+    new_run = np.ones(len(flat), dtype=bool)
+    new_run[1:] = flat[1:] != flat[:-1]
+    new_run[::width] = True
+    starts = np.flatnonzero(new_run)
+    counts = np.diff(np.append(starts, len(flat)))
+    keep = flat[starts] != 0
+    rows = starts[keep] // width
+    with np.errstate(divide="ignore", invalid="ignore"):
+        freqs = counts[keep] / totals[rows]
+        terms = freqs * np.log2(freqs + 1e-10)
+    return -np.bincount(rows, weights=terms, minlength=n)
+
+
+@register("entropies", inputs=("raw", "length"), outputs=("residue_entropy", "dipeptide_entropy"))
+def _entropies(ctx):
+    """Residue and dipeptide entropies over the raw characters (as Counter does)."""
+    raw = ctx["raw"].astype(np.uint16)
+    n = ctx["length"]
+    residue = _row_entropy(raw, n)
+    dipeptides = np.where((raw[:, :-1] != 0) & (raw[:, 1:] != 0), raw[:, :-1] * 256 + raw[:, 1:], 0)
+    dipeptide = np.where(n >= 2, _row_entropy(dipeptides, n - 1), np.nan)
+    return {"residue_entropy": residue, "dipeptide_entropy": dipeptide}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FEATURE PRODUCERS (feature_engineering.py)
+# ══════════════════════════════════════════════════════════════════════════════
+
+@register("position",
+          inputs=("mutation_position", "peptide_length", "anchor_mask", "tcr_contact_mask"),
+          outputs=("mut_at_anchor", "mut_at_tcr_contact", "mut_at_p2", "mut_at_cterm",
+                   "mut_position_normalized", "mut_distance_from_center"),
+          family="position")
+def _position(ctx):
+    """Vectorized compute_position_features."""
+    pos = np.asarray(ctx["mutation_position"], dtype=float)
+    length = np.asarray(ctx["peptide_length"], dtype=float)
+    missing = np.isnan(pos)
+    m = np.where(missing, 0, pos).astype(int)
+    rows = np.arange(len(pos))
+
+    def lookup(mask):
+        in_table = (m >= 1) & (m <= mask.shape[1])
+        hit = mask[rows, np.clip(m - 1, 0, mask.shape[1] - 1)] & in_table
+        return np.where(missing, np.nan, hit.astype(float))
+
+    center = (length + 1) / 2
+    return {
+        "mut_at_anchor": lookup(ctx["anchor_mask"]),
+        "mut_at_tcr_contact": lookup(ctx["tcr_contact_mask"]),
+        "mut_at_p2": np.where(missing, np.nan, (m == 2).astype(float)),
+        "mut_at_cterm": np.where(missing, np.nan, (m == length).astype(float)),
+        "mut_position_normalized": np.where(missing, np.nan, (m - 1) / np.maximum(length - 1, 1)),
+        "mut_distance_from_center": np.where(missing, np.nan, np.abs(m - center) / center),
+    }
+
+
+@register("mutation_site", inputs=("properties", "mut_idx", "mut_valid"),
+          outputs=tuple(f"mut_residue_{p}" for p in PROPERTY_NAMES),
+          family="mutation_site")
+def _mutation_site(ctx):
+    """Vectorized compute_mutation_site_properties."""
+    props = ctx["properties"][np.arange(len(ctx["mut_idx"])), ctx["mut_idx"]]
+    props = np.where(ctx["mut_valid"][:, None], props, np.nan)
+    return {f"mut_residue_{p}": props[:, j] for j, p in enumerate(PROPERTY_NAMES)}
+
+
+@register("context", inputs=("properties", "mut_idx", "mut_valid", "length"),
+          outputs=("context_hydrophobicity_mean", "context_charge_sum",
+                   "mut_hydrophobicity_vs_context", "mut_creates_charge_break"),
+          family="context")
+def _context(ctx):
+    """Vectorized compute_context_features (window of +-1 around the mutation)."""
+    props = ctx["properties"]
+    idx = ctx["mut_idx"]
+    valid = ctx["mut_valid"]
+    rows = np.arange(len(idx))
+    last = props.shape[1] - 1
+
+    has_left = valid & (idx > 0)
+    has_right = valid & (idx < ctx["length"] - 1)
+    left = props[rows, np.clip(idx - 1, 0, last)]
+    right = props[rows, np.clip(idx + 1, 0, last)]
+    n_flank = has_left.astype(int) + has_right
+    flank_sum = np.where(has_left[:, None], left, 0.0) + np.where(has_right[:, None], right, 0.0)
+
+    context_hydro = np.where(n_flank > 0, flank_sum[:, HYDRO] / np.maximum(n_flank, 1), 0.0)
+    context_charge = flank_sum[:, CHARGE]
+    mut = props[rows, idx]
+    charge_break = np.abs(mut[:, CHARGE] - context_charge / np.maximum(n_flank, 1))
+    return {
+        "context_hydrophobicity_mean": np.where(valid, context_hydro, np.nan),
+        "context_charge_sum": np.where(valid, context_charge, np.nan),
+        "mut_hydrophobicity_vs_context": np.where(valid, mut[:, HYDRO] - context_hydro, np.nan),
+        "mut_creates_charge_break": np.where(valid, charge_break, np.nan),
+    }
+
+
+@register("peptide_global",
+          inputs=("properties", "residue_mask", "length", "property_sums", "hydro_mean", "hydro_std"),
+          outputs=("peptide_hydrophobicity_mean", "peptide_hydrophobicity_std",
+                   "peptide_net_charge", "peptide_has_positive_charge",
+                   "peptide_has_negative_charge", "peptide_n_aromatic", "peptide_frac_polar"),
+          family="global")
+def _peptide_global(ctx):
+    """Vectorized compute_peptide_global_features (without entropy)."""
+    charge = np.where(ctx["residue_mask"], ctx["properties"][:, :, CHARGE], 0.0)
+    sums = ctx["property_sums"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac_polar = sums[:, POLAR] / ctx["length"]
+    return {
+        "peptide_hydrophobicity_mean": ctx["hydro_mean"],
+        "peptide_hydrophobicity_std": ctx["hydro_std"],
+        "peptide_net_charge": sums[:, CHARGE],
+        "peptide_has_positive_charge": (charge > 0).any(axis=1).astype(float),
+        "peptide_has_negative_charge": (charge < 0).any(axis=1).astype(float),
+        "peptide_n_aromatic": sums[:, AROMATIC],
+        "peptide_frac_polar": frac_polar,
+    }
+
+
+@register("peptide_entropy", inputs=("residue_entropy",),
+          outputs=("peptide_sequence_entropy",), family="global")
+def _peptide_entropy(ctx):
+    return {"peptide_sequence_entropy": ctx["residue_entropy"]}
+
+
+@register("tcr_surface", inputs=("properties", "residue_mask", "tcr_contact_mask"),
+          outputs=("tcr_surface_hydrophobicity", "tcr_surface_charge",
+                   "tcr_surface_n_aromatic", "tcr_surface_frac_polar"),
+          family="tcr_surface")
+def _tcr_surface(ctx):
+    """Vectorized compute_tcr_facing_features."""
+    props = ctx["properties"]
+    width = props.shape[1]
+    contact = ctx["tcr_contact_mask"]
+    mask = np.zeros(ctx["residue_mask"].shape, dtype=bool)
+    k = min(width, contact.shape[1])
+    mask[:, :k] = contact[:, :k]
+    mask &= ctx["residue_mask"]
+
+    n_tcr = mask.sum(axis=1)
+    sums = np.where(mask[:, :, None], props, 0.0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hydro = sums[:, HYDRO] / n_tcr
+        frac_polar = sums[:, POLAR] / n_tcr
+    has = n_tcr > 0
+    return {
+        "tcr_surface_hydrophobicity": np.where(has, hydro, np.nan),
+        "tcr_surface_charge": np.where(has, sums[:, CHARGE], np.nan),
+        "tcr_surface_n_aromatic": np.where(has, sums[:, AROMATIC], np.nan),
+        "tcr_surface_frac_polar": np.where(has, frac_polar, np.nan),
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FEATURE PRODUCERS (iedb_transfer.py)
+# ══════════════════════════════════════════════════════════════════════════════
+
+@register("aa_composition", inputs=("encoded", "length"),
+          outputs=tuple(f"aa_frac_{aa}" for aa in AA_LIST), family="sequence")
+def _aa_composition(ctx):
+    encoded = ctx["encoded"].astype(np.int64)
+    n, width = encoded.shape
+    row_codes = np.arange(n)[:, None] * (PAD_IDX + 1) + encoded
+    counts = np.bincount(row_codes.ravel(), minlength=n * (PAD_IDX + 1)).reshape(n, PAD_IDX + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fracs = counts[:, :PAD_IDX] / ctx["length"][:, None]
+    return {f"aa_frac_{aa}": fracs[:, i] for i, aa in enumerate(AA_LIST)}
+
+
+@register("sequence_properties",
+          inputs=("properties", "residue_mask", "length", "property_sums", "hydro_mean", "hydro_std"),
+          outputs=("seq_hydro_mean", "seq_hydro_std", "seq_hydro_min", "seq_hydro_max",
+                   "seq_charge_sum", "seq_n_charged", "seq_n_aromatic", "seq_frac_polar",
+                   "seq_length"),
+          family="sequence")
+def _sequence_properties(ctx):
+    """Vectorized property statistics of compute_sequence_features."""
+    props = ctx["properties"]
+    mask = ctx["residue_mask"]
+    sums = ctx["property_sums"]
+    hydro = props[:, :, HYDRO]
+    charge = props[:, :, CHARGE]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac_polar = sums[:, POLAR] / ctx["length"]
+    return {
+        "seq_hydro_mean": ctx["hydro_mean"],
+        "seq_hydro_std": ctx["hydro_std"],
+        "seq_hydro_min": np.where(mask, hydro, np.inf).min(axis=1, initial=np.inf),
+        "seq_hydro_max": np.where(mask, hydro, -np.inf).max(axis=1, initial=-np.inf),
+        "seq_charge_sum": sums[:, CHARGE],
+        "seq_n_charged": ((np.abs(charge) > 0.5) & mask).sum(axis=1).astype(float),
+        "seq_n_aromatic": sums[:, AROMATIC],
+        "seq_frac_polar": frac_polar,
+        "seq_length": ctx["length"].astype(float),
+    }
+
+
+@register("sequence_entropy", inputs=("residue_entropy", "dipeptide_entropy"),
+          outputs=("seq_dipeptide_entropy", "seq_entropy"), family="sequence")
+def _sequence_entropy(ctx):
+    return {"seq_dipeptide_entropy": ctx["dipeptide_entropy"], "seq_entropy": ctx["residue_entropy"]}
+
+
+@register("mutant_residue", inputs=("encoded", "properties", "mut_idx", "mut_valid"),
+          outputs=("mut_blosum_self", "mut_aa_rarity", "mut_residue_hydro", "mut_residue_size"),
+          family="mutation_site")
+def _mutant_residue(ctx):
+    """
+    Vectorized reconstruct_wt_and_compute_diff. Its charge/aromatic/polar
+    columns are identical to mut_residue_charge/aromatic/polar from the
+    mutation_site producer and are served from there.
+    """
+    rows = np.arange(len(ctx["mut_idx"]))
+    valid = ctx["mut_valid"]
+    code = ctx["encoded"][rows, ctx["mut_idx"]]
+    props = ctx["properties"][rows, ctx["mut_idx"]]
+    return {
+        "mut_blosum_self": np.where(valid, BLOSUM_SELF_TABLE[code], np.nan),
+        "mut_aa_rarity": np.where(valid, -np.log(AA_FREQ_TABLE[code]), np.nan),
+        "mut_residue_hydro": np.where(valid, props[:, HYDRO], np.nan),
+        "mut_residue_size": np.where(valid, props[:, MW] / 200.0, np.nan),
+    }
+
+
+@register("wt_peptide", inputs=("peptide", "mutation_position", "wt_residue"), outputs=("wt_peptide",),
+          shardable=False)
+def _wt_peptide(ctx):
+    return {"wt_peptide": rebuild_wt_peptides(ctx["peptide"], ctx["mutation_position"], ctx["wt_residue"])}
+
+
+@register("wt_encoded", inputs=("encoded", "length", "mutation_position", "wt_residue"),
+          outputs=("wt_encoded", "wt_paired"), shardable=False)
+def _wt_encoded(ctx):
+    """WT code matrix: the mutant codes with the WT residue written at the mutation position."""
+    wt_enc, paired = wt_code_matrix(ctx["encoded"], ctx["length"], ctx["mutation_position"], ctx["wt_residue"])
+    return {"wt_encoded": wt_enc, "wt_paired": paired}
+
+
+def _wt_encoded_from_column(ctx):
+    wt_enc, paired = encode_wt_peptides(ctx["wt_peptide"], ctx["length"], ctx["encoded"].shape[1])
+    return {"wt_encoded": wt_enc, "wt_paired": paired}
+
+
+# A wt_peptide column (which may differ from the mutant at several positions) takes precedence
+COLUMN_STAND_INS["wt_encoded"] = COLUMN_STAND_INS["wt_paired"] = ("wt_peptide", _wt_encoded_from_column)
+
+
+@register("blosum_substitution", inputs=("encoded", "wt_encoded", "wt_paired", "length", "mutation_position"),
+          outputs=("mut_wt_blosum", "tcr_blosum_weighted", "tcr_n_substitutions"),
+          family="substitution", shardable=False)
+def _blosum_substitution(ctx):
+    feats = substitution_features_from_codes(
+        ctx["encoded"], ctx["wt_encoded"], ctx["wt_paired"], ctx["length"], ctx["mutation_position"],
+    )
+    return {col: feats[col].to_numpy() for col in feats.columns}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FEATURE PRODUCERS (MHCflurry)
+# ══════════════════════════════════════════════════════════════════════════════
+
+@register("mhcflurry", inputs=("peptide", "allele"),
+          outputs=("mhcflurry_presentation", "mhcflurry_affinity", "mhcflurry_processing"),
+          family="mhcflurry", shardable=False)
+def _mhcflurry(ctx):
+    from tools.error_analysis_and_multifeature import predict_mhcflurry
+    scores = predict_mhcflurry(ctx["peptide"], ctx["allele"], predictor=ctx.options.get("predictor"))
+    return {col: scores[col].to_numpy() for col in scores.columns}
+
+
+@register("mhcflurry_paired", inputs=("peptide", "allele", "wt_peptide"),
+          outputs=("mhcflurry_wt_affinity", "mhcflurry_wt_presentation", "mhcflurry_agretopicity",
+                   "mhcflurry_presentation_ratio", "mhcflurry_affinity_delta",
+                   "mhcflurry_presentation_delta"),
+          family="mhcflurry", shardable=False)
+def _mhcflurry_paired(ctx):
+    from tools.error_analysis_and_multifeature import add_mhcflurry_features
+    pairs = pd.DataFrame({"peptide": ctx["peptide"], "allele": ctx["allele"], "wt_peptide": ctx["wt_peptide"]})
+    scored = add_mhcflurry_features(pairs, wt_peptide_col="wt_peptide", predictor=ctx.options.get("predictor"))
+    outputs = PRODUCERS["mhcflurry_paired"]["outputs"]
+    return {col: scored[col].to_numpy() for col in outputs}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# NAMED FEATURE SETS
+# ══════════════════════════════════════════════════════════════════════════════
+
+FEATURE_SETS = {
+    # TESLA's precomputed features (Wells et al. 2020)
+    "tesla": [
+        "predicted_affinity",    # NetMHCpan binding affinity (nM) -- lower = stronger
+        "binding_stability",     # pMHC stability (hours)
+        "tumor_abundance",       # RNA expression (TPM)
+        "frac_hydrophobic",      # Fraction hydrophobic residues
+        "agretopicity",          # Mutant/wildtype binding ratio
+        "foreignness",           # Foreignness score
+        "mutation_position",     # Position of mutation in peptide
+        "peptide_length",        # Length of peptide (9, 10, 11-mers)
+    ],
+    # Novel position-aware features (feature_engineering.py)
+    "novel": [
+        "mut_at_anchor", "mut_at_tcr_contact", "mut_at_p2", "mut_at_cterm",
+        "mut_position_normalized", "mut_distance_from_center",
+        "mut_residue_hydrophobicity", "mut_residue_molecular_weight",
+        "mut_residue_charge", "mut_residue_aromatic", "mut_residue_polar",
+        "context_hydrophobicity_mean", "context_charge_sum",
+        "mut_hydrophobicity_vs_context", "mut_creates_charge_break",
+        "peptide_hydrophobicity_mean", "peptide_hydrophobicity_std",
+        "peptide_net_charge", "peptide_has_positive_charge",
+        "peptide_has_negative_charge", "peptide_n_aromatic",
+        "peptide_frac_polar", "peptide_sequence_entropy",
+        "tcr_surface_hydrophobicity", "tcr_surface_charge",
+        "tcr_surface_n_aromatic", "tcr_surface_frac_polar",
+    ],
+    "mhcflurry": ["mhcflurry_presentation", "mhcflurry_affinity", "mhcflurry_processing"],
+    "mhcflurry_paired": [
+        "mhcflurry_wt_affinity", "mhcflurry_wt_presentation", "mhcflurry_agretopicity",
+        "mhcflurry_presentation_ratio", "mhcflurry_affinity_delta", "mhcflurry_presentation_delta",
+    ],
+    # IEDB sequence model inputs (iedb_transfer.compute_sequence_features)
+    "iedb_sequence": feature_columns("sequence"),
+    # Hybrid IEDB-transfer model (iedb_transfer.py)
+    "hybrid": [
+        "predicted_affinity", "binding_stability", "tumor_abundance", "agretopicity",
+        "mhcflurry_presentation", "mhcflurry_affinity", "mhcflurry_processing",
+        "iedb_score",
+        "mut_blosum_self", "mut_aa_rarity",
+        "mut_residue_hydro", "mut_residue_charge", "mut_residue_size",
+    ],
+    "substitution": feature_columns("substitution"),
+}
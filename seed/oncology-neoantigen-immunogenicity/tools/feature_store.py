@@ -0,0 +1,244 @@
+"""
+Content-addressed per-peptide feature store.
+
+Most engineered features depend only on (peptide, allele, mutation_position),
+and the same peptides recur across IEDB deduplication variants, TESLA and
+new-patient runs. The store caches each feature group under a hash of the
+inputs it depends on, so features are only computed for keys it has not seen.
+
+Layout (one append-only, memory-mapped ColumnarLog per group and version):
+
+    data/feature_store/<group>/v<version>/
+
+Bumping a group's version in FEATURE_GROUPS points it at a fresh directory,
+invalidating that group only. Stale versions can be removed with prune().
+
+Usage:
+    from tools.feature_store import FeatureStore
+    store = FeatureStore()
+    feats = store.get_many(tesla_df, ["mutation_site", "peptide_global", "tcr_surface"])
+"""
+import hashlib
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tools.columnar import ColumnarLog
+from tools.trace import span
+
+DEFAULT_STORE_ROOT = Path(__file__).parent.parent / "data" / "feature_store"
+
+KEY_COLUMN = "_key"
+KEY_DTYPE = "S16"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FEATURE GROUPS
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# Each group declares its version, the input columns its features depend on,
+# and a producer that maps a DataFrame of unseen unique keys to a DataFrame of
+# features (one row per key, same order). Bump "version" whenever a producer's
+# output changes.
+
+def _compute_mutation_site(keys):
+    from tools.feature_engineering import (
+        compute_position_features, compute_mutation_site_properties, compute_context_features,
+    )
+    rows = []
+    for peptide, allele, mut_pos in zip(keys["peptide"], keys["allele"], keys["mutation_position"]):
+        features = {}
+        features.update(compute_position_features(peptide, mut_pos, allele, len(peptide)))
+        features.update(compute_mutation_site_properties(peptide, mut_pos))
+        features.update(compute_context_features(peptide, mut_pos))
+        rows.append(features)
+    return pd.DataFrame(rows)
+
+
+def _compute_peptide_global(keys):
+    from tools.feature_engineering import compute_peptide_global_features
+    return pd.DataFrame([compute_peptide_global_features(p) for p in keys["peptide"]])
+
+
+def _compute_tcr_surface(keys):
+    from tools.feature_engineering import compute_tcr_facing_features
+    return pd.DataFrame([
+        compute_tcr_facing_features(peptide, mut_pos, allele, len(peptide))
+        for peptide, allele, mut_pos in zip(keys["peptide"], keys["allele"], keys["mutation_position"])
+    ])
+
+
+def _compute_sequence(keys):
+    from tools.iedb_transfer import compute_sequence_features
+    return pd.DataFrame([compute_sequence_features(p) for p in keys["peptide"]])
+
+
+def _compute_mutant_residue(keys):
+    from tools.iedb_transfer import reconstruct_wt_and_compute_diff
+    return pd.DataFrame([
+        reconstruct_wt_and_compute_diff(peptide, mut_pos)
+        for peptide, mut_pos in zip(keys["peptide"], keys["mutation_position"])
+    ])
+
+
+FEATURE_GROUPS = {
+    # feature_engineering.py: position + mutation-site properties + context
+    "mutation_site": {
+        "version": 1,
+        "keys": ("peptide", "allele", "mutation_position"),
+        "compute": _compute_mutation_site,
+    },
+    # feature_engineering.compute_peptide_global_features
+    "peptide_global": {
+        "version": 1,
+        "keys": ("peptide",),
+        "compute": _compute_peptide_global,
+    },
+    # feature_engineering.compute_tcr_facing_features
+    "tcr_surface": {
+        "version": 1,
+        "keys": ("peptide", "allele", "mutation_position"),
+        "compute": _compute_tcr_surface,
+    },
+    # iedb_transfer.compute_sequence_features
+    "sequence": {
+        "version": 1,
+        "keys": ("peptide",),
+        "compute": _compute_sequence,
+    },
+    # iedb_transfer.reconstruct_wt_and_compute_diff
+    "mutant_residue": {
+        "version": 1,
+        "keys": ("peptide", "mutation_position"),
+        "compute": _compute_mutant_residue,
+    },
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# KEYS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _key_frame(df, key_columns):
+    """Canonical string form of the key columns (mutation_position as an integer or empty)."""
+    keys = pd.DataFrame(index=range(len(df)))
+    for col in key_columns:
+        if col == "mutation_position":
+            pos = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+            keys[col] = pos
+            keys[col + "_str"] = np.where(np.isnan(pos), "", np.nan_to_num(pos).astype(int).astype(str))
+        else:
+            keys[col] = df[col].astype(str).to_numpy()
+    return keys
+
+
+def hash_keys(df, key_columns):
+    """
+    16-byte BLAKE2 digest per row of the key columns.
+
+    Returns (digests, key_frame); only unique key strings are hashed.
+    """
+    keys = _key_frame(df, key_columns)
+    parts = [keys[c + "_str"] if c == "mutation_position" else keys[c] for c in key_columns]
+    joined = parts[0].astype(str)
+    for part in parts[1:]:
+        joined = joined + "\x1f" + part.astype(str)
+    codes, uniques = pd.factorize(joined)
+    unique_digests = np.array(
+        [hashlib.blake2b(u.encode(), digest_size=16).digest() for u in uniques],
+        dtype=KEY_DTYPE,
+    )
+    return unique_digests[codes] if len(codes) else np.empty(0, dtype=KEY_DTYPE), keys
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# STORE
+# ══════════════════════════════════════════════════════════════════════════════
+
+class FeatureStore:
+    """Per-group, versioned, append-only feature cache keyed by input content."""
+
+    def __init__(self, root=DEFAULT_STORE_ROOT, groups=None):
+        self.root = Path(root)
+        self.groups = groups if groups is not None else FEATURE_GROUPS
+
+    def _group_path(self, group):
+        return self.root / group / f"v{self.groups[group]['version']}"
+
+    def get(self, df, group):
+        """
+        Features of one group for every row of df, computing only unseen keys.
+
+        Returns DataFrame with a fresh RangeIndex aligned to df's rows.
+        """
+        with span(f"feature_store.{group}", rows=len(df)) as s:
+            return self._get(df, group, s)
+
+    def _get(self, df, group, trace_span):
+        spec = self.groups[group]
+        digests, keys = hash_keys(df, spec["keys"])
+        path = self._group_path(group)
+
+        log = ColumnarLog(path) if ColumnarLog.exists(path) else None
+        stored_keys = log.read([KEY_COLUMN])[KEY_COLUMN] if log is not None else np.empty(0, KEY_DTYPE)
+        index = pd.Index(np.asarray(stored_keys))
+        positions = index.get_indexer(digests) if len(index) else np.full(len(digests), -1)
+
+        # Compute features for unseen keys only (each unique key once)
+        unseen = positions < 0
+        if unseen.any():
+            new_digests, first = np.unique(digests[unseen], return_index=True)
+            new_keys = keys.loc[np.flatnonzero(unseen)[first], list(spec["keys"])].reset_index(drop=True)
+            trace_span.set(n_computed=len(new_keys))
+            new_feats = spec["compute"](new_keys).astype(float)
+
+            if log is None:
+                schema = {KEY_COLUMN: KEY_DTYPE}
+                schema.update({col: "f8" for col in new_feats.columns})
+                log = ColumnarLog(path, schema)
+            feature_cols = [c for c in log.schema if c != KEY_COLUMN]
+            new_feats = new_feats.reindex(columns=feature_cols)
+            columns = {KEY_COLUMN: new_digests}
+            columns.update({col: new_feats[col].to_numpy() for col in feature_cols})
+            log.append(columns)
+
+            stored_keys = log.read([KEY_COLUMN])[KEY_COLUMN]
+            positions = pd.Index(np.asarray(stored_keys)).get_indexer(digests)
+
+        feature_cols = [c for c in log.schema if c != KEY_COLUMN]
+        stored = log.read(feature_cols)
+        return pd.DataFrame({col: np.asarray(stored[col])[positions] for col in feature_cols})
+
+    def get_many(self, df, groups):
+        """Concatenate the features of several groups, in the given order."""
+        return pd.concat([self.get(df, group) for group in groups], axis=1)
+
+    def info(self):
+        """Rows, columns and size on disk for the current version of every group."""
+        summary = []
+        for group, spec in self.groups.items():
+            path = self._group_path(group)
+            log = ColumnarLog(path) if ColumnarLog.exists(path) else None
+            summary.append({
+                "group": group,
+                "version": spec["version"],
+                "n_keys": len(log) if log is not None else 0,
+                "n_features": len(log.schema) - 1 if log is not None else 0,
+                "bytes": log.nbytes() if log is not None else 0,
+            })
+        return summary
+
+    def prune(self):
+        """Delete stored versions that no longer match FEATURE_GROUPS."""
+        removed = []
+        for group, spec in self.groups.items():
+            group_dir = self.root / group
+            if not group_dir.exists():
+                continue
+            for version_dir in group_dir.iterdir():
+                if version_dir.is_dir() and version_dir.name != f"v{spec['version']}":
+                    shutil.rmtree(version_dir)
+                    removed.append(str(version_dir))
+        return removed
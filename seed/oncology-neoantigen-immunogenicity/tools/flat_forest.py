@@ -0,0 +1,369 @@
+"""
+Flat-array inference for fitted tree ensembles.
+
+A fitted RandomForest / ExtraTrees / GradientBoosting classifier (binary)
+is exported into a few contiguous NumPy arrays covering all trees:
+
+    feature[node]         split feature (0 for leaves)
+    threshold[node]       split threshold (+inf for leaves)
+    children[2*node + r]  left (r=0) / right (r=1) child; leaves point to themselves
+    value[node]           leaf contribution: class-1 probability (forests) or
+                          learning_rate * leaf value (boosting)
+    roots[tree]           root node of every tree
+
+Prediction walks all trees of a batch level by level: every step gathers
+the split feature of every (row, tree) pair, compares it with the node's
+threshold and moves to the chosen child. Leaves point to themselves, so
+after max_depth steps every walk has reached its leaf with no per-tree
+Python loop. Rows go through in chunks to bound the (rows, trees) index
+arrays.
+
+The quantized variant replaces every threshold with its index in the sorted
+table of distinct thresholds of its feature, and the batch with per-feature
+codes (number of thresholds below the value, uint8/uint16). x <= t_k holds
+exactly when code(x) <= k, so the quantized walk gives the same leaves
+while gathering 1-2 byte integers instead of floats. It needs NaN-free
+input (the experiment scripts impute before fitting).
+
+Probabilities match sklearn's predict_proba up to float summation order
+(~1e-15): the walk uses the same float32 cast of X and float64 thresholds.
+
+Usage:
+    from tools.flat_forest import FlatForest
+    flat = FlatForest.from_sklearn(model)
+    probs = flat.predict_proba(X)[:, 1]
+    probs = flat.predict_proba(X, quantized=True)[:, 1]
+
+    python -m tools.flat_forest bench                       # 500-tree RF, sklearn vs flat
+    python -m tools.flat_forest bench --model gb --batches 1 100 100000
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# (rows, trees) pairs walked at once; small chunks keep the buffers in cache
+CHUNK_PAIRS = 1 << 16
+
+
+def _code_dtype(n_thresholds):
+    for dtype in (np.uint8, np.uint16):
+        if n_thresholds <= np.iinfo(dtype).max:
+            return dtype
+    return np.int32
+
+
+class FlatForest:
+    """Tree ensemble flattened into contiguous arrays (binary classifiers)."""
+
+    def __init__(self, feature, threshold, children, value, roots, missing_left, depth,
+                 n_features, kind, init=0.0):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.missing_left = missing_left
+        self.depth = int(depth)
+        self.n_features = int(n_features)
+        self.kind = kind  # "forest" (mean of leaf probabilities) or "boosting" (sigmoid of sum)
+        self.init = float(init)
+        self._tables = None
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # EXPORT
+    # ══════════════════════════════════════════════════════════════════════════
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """
+        Flatten a fitted binary RandomForestClassifier, ExtraTreesClassifier or
+        GradientBoostingClassifier.
+
+        Raises ValueError for other estimators, multi-class models and
+        boosting with a non-constant init estimator.
+        """
+        from sklearn.dummy import DummyClassifier
+        from sklearn.ensemble import GradientBoostingClassifier
+        from sklearn.ensemble._forest import ForestClassifier
+
+        if len(getattr(model, "classes_", ())) != 2:
+            raise ValueError(f"FlatForest supports fitted binary classifiers, got {type(model).__name__}")
+        if isinstance(model, ForestClassifier):
+            kind, trees, scale = "forest", [est.tree_ for est in model.estimators_], 1.0
+        elif isinstance(model, GradientBoostingClassifier):
+            if not (model.init_ == "zero" or isinstance(model.init_, DummyClassifier)):
+                raise ValueError("FlatForest supports gradient boosting with a constant init only")
+            kind, trees, scale = "boosting", [est.tree_ for est in model.estimators_[:, 0]], model.learning_rate
+        else:
+            raise ValueError(f"FlatForest does not support {type(model).__name__}")
+
+        sizes = np.array([t.node_count for t in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        n_nodes = int(sizes.sum())
+        index_dtype = np.int32 if 2 * n_nodes < np.iinfo(np.int32).max else np.int64
+
+        feature = np.zeros(n_nodes, dtype=np.int32)
+        threshold = np.full(n_nodes, np.inf)
+        children = np.empty((n_nodes, 2), dtype=index_dtype)
+        value = np.empty(n_nodes)
+        missing_left = np.zeros(n_nodes, dtype=bool)
+        for t, off in zip(trees, offsets):
+            nodes = np.arange(off, off + t.node_count)
+            leaf = t.children_left == -1
+            feature[nodes[~leaf]] = t.feature[~leaf]
+            threshold[nodes[~leaf]] = t.threshold[~leaf]
+            children[:, 0][nodes] = np.where(leaf, nodes, t.children_left + off)
+            children[:, 1][nodes] = np.where(leaf, nodes, t.children_right + off)
+            if hasattr(t, "missing_go_to_left"):
+                missing_left[nodes] = t.missing_go_to_left.astype(bool) & ~leaf
+            v = t.value[:, 0, :]
+            value[nodes] = v[:, 1] / v.sum(axis=1) if kind == "forest" else scale * v[:, 0]
+
+        init = 0.0
+        if kind == "boosting" and model.init_ != "zero":
+            # Constant raw score of the prior: decision function minus the stages
+            probe = np.zeros((1, model.n_features_in_))
+            stages = sum(est.predict(probe)[0] for est in model.estimators_[:, 0])
+            init = model.decision_function(probe)[0] - model.learning_rate * stages
+
+        depth = max(t.max_depth for t in trees)
+        return cls(feature, threshold, children.ravel(), value, offsets.astype(index_dtype),
+                   missing_left, depth, model.n_features_in_, kind, init)
+
+    def to_arrays(self):
+        """Arrays and scalars of the ensemble (inverse of from_arrays)."""
+        return {
+            "feature": self.feature, "threshold": self.threshold, "children": self.children,
+            "value": self.value, "roots": self.roots, "missing_left": self.missing_left,
+            "depth": self.depth, "n_features": self.n_features, "kind": self.kind, "init": self.init,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(**{k: (v.item() if isinstance(v, np.ndarray) and v.ndim == 0 else v)
+                      for k, v in arrays.items()})
+
+    def with_thresholds(self, threshold):
+        """Copy with new split thresholds (leaves keep +inf)."""
+        threshold = np.where(np.isfinite(self.threshold), threshold, np.inf)
+        return FlatForest(self.feature, threshold, self.children, self.value, self.roots,
+                          self.missing_left, self.depth, self.n_features, self.kind, self.init)
+
+    def truncate(self, n_trees=None, depth=None):
+        """
+        Copy keeping the first n_trees trees, cut at depth (nodes at that depth
+        become leaves with their node value). Unreachable nodes are dropped.
+
+        Depth cuts are only valid for forests: boosting leaves hold line-search
+        values that internal nodes lack.
+        """
+        n_trees = min(n_trees or self.n_trees, self.n_trees)
+        depth = self.depth if depth is None else min(depth, self.depth)
+        if depth < self.depth and self.kind != "forest":
+            raise ValueError("Depth truncation is only supported for forests")
+        end = int(self.roots[n_trees]) if n_trees < self.n_trees else len(self.feature)
+        children = self.children[:2 * end].reshape(-1, 2)
+
+        node_depth = np.full(end, -1)
+        frontier = self.roots[:n_trees]
+        for d in range(depth + 1):
+            node_depth[frontier] = d
+            nxt = children[frontier].ravel()
+            frontier = nxt[node_depth[nxt] < 0]  # leaves point to themselves
+            if not len(frontier):
+                break
+
+        kept = np.flatnonzero(node_depth >= 0)
+        cut = node_depth[kept] == depth
+        new_id = np.cumsum(node_depth >= 0) - 1
+        new_children = new_id[children[kept]]
+        new_children[cut] = np.arange(len(kept))[cut, None]
+        feature, threshold = self.feature[kept].copy(), self.threshold[kept].copy()
+        missing_left = self.missing_left[kept].copy()
+        feature[cut], threshold[cut], missing_left[cut] = 0, np.inf, False
+        return FlatForest(feature, threshold, new_children.ravel().astype(self.children.dtype),
+                          self.value[kept], new_id[self.roots[:n_trees]].astype(self.roots.dtype),
+                          missing_left, min(depth, int(node_depth.max())), self.n_features, self.kind, self.init)
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # INFERENCE
+    # ══════════════════════════════════════════════════════════════════════════
+
+    def _threshold_tables(self):
+        """Per-feature sorted distinct thresholds and every node's threshold index."""
+        if self._tables is None:
+            split = np.isfinite(self.threshold)
+            tables = [np.unique(self.threshold[split & (self.feature == f)]) for f in range(self.n_features)]
+            qthreshold = np.zeros(len(self.feature), dtype=np.int32)
+            for f, table in enumerate(tables):
+                nodes = np.flatnonzero(split & (self.feature == f))
+                qthreshold[nodes] = np.searchsorted(table, self.threshold[nodes])
+            dtype = _code_dtype(max((len(t) for t in tables), default=0))
+            # Leaves compare against the largest code, so they always "go left" to themselves
+            qthreshold[~split] = np.iinfo(dtype).max
+            self._tables = (tables, qthreshold.astype(dtype), dtype)
+        return self._tables
+
+    def encode(self, X):
+        """Per-feature threshold codes of X for the quantized walk."""
+        X = np.asarray(X, dtype=np.float32)
+        if np.isnan(X).any():
+            raise ValueError("Quantized inference needs NaN-free input")
+        tables, _, dtype = self._threshold_tables()
+        codes = np.empty(X.shape, dtype=dtype)
+        for f, table in enumerate(tables):
+            codes[:, f] = np.searchsorted(table, X[:, f], side="left")
+        return codes
+
+    def _walk(self, flat, n_rows, threshold):
+        """Leaf node of every (row, tree) pair; flat is the row-major batch."""
+        # np.take into reused buffers is ~2x faster than fancy indexing here
+        shape = (n_rows, self.n_trees)
+        nodes = np.empty(shape, dtype=self.roots.dtype)
+        nodes[:] = self.roots
+        spare, index = np.empty_like(nodes), np.empty_like(nodes)
+        # feature may be a compact uint8 / uint16 array (e.g. memory-mapped from an artifact)
+        split_feature = np.empty(shape, dtype=self.feature.dtype)
+        x, t = np.empty(shape, dtype=flat.dtype), np.empty(shape, dtype=threshold.dtype)
+        right = np.empty(shape, dtype=bool)
+        base = (np.arange(n_rows, dtype=nodes.dtype) * self.n_features)[:, None]
+        has_nan = flat.dtype.kind == "f" and np.isnan(flat).any()
+        for _ in range(self.depth):
+            np.take(self.feature, nodes, out=split_feature, mode="clip")
+            np.add(split_feature, base, out=index)
+            np.take(flat, index, out=x, mode="clip")
+            np.take(threshold, nodes, out=t, mode="clip")
+            np.greater(x, t, out=right)
+            if has_nan:
+                missing = np.isnan(x)
+                right[missing] = ~self.missing_left[nodes[missing]]
+            nodes *= 2
+            nodes += right
+            np.take(self.children, nodes, out=spare, mode="clip")
+            nodes, spare = spare, nodes
+        return nodes
+
+    def decision_function(self, X, quantized=False):
+        """Summed leaf values per row (raw score for boosting, sum of probabilities for forests)."""
+        if quantized:
+            data, threshold = self.encode(X), self._threshold_tables()[1]
+        else:
+            data, threshold = np.ascontiguousarray(X, dtype=np.float32), self.threshold
+        if data.shape[1] != self.n_features:
+            raise ValueError(f"X has {data.shape[1]} features, model expects {self.n_features}")
+        out = np.empty(len(data))
+        chunk = max(1, CHUNK_PAIRS // self.n_trees)
+        for start in range(0, len(data), chunk):
+            block = data[start:start + chunk]
+            leaves = self._walk(block.ravel(), len(block), threshold)
+            out[start:start + chunk] = np.take(self.value, leaves).sum(axis=1)
+        return out + self.init
+
+    def predict_proba(self, X, quantized=False):
+        """(n_rows, 2) class probabilities, as the sklearn estimator's predict_proba."""
+        raw = self.decision_function(X, quantized)
+        if self.kind == "forest":
+            p = raw / self.n_trees
+        else:
+            p = 1.0 / (1.0 + np.exp(-raw))
+        return np.column_stack([1.0 - p, p])
+
+
+def predict_positive(model, X, quantized=False):
+    """Class-1 probabilities through the flat engine, or predict_proba if the model is not supported."""
+    try:
+        flat = FlatForest.from_sklearn(model)
+    except ValueError:
+        return model.predict_proba(X)[:, 1]
+    return flat.predict_proba(X, quantized)[:, 1]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# BENCHMARK
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark(model="rf", batches=(1, 100, 10_000, 100_000), n_train=20_000, repeat=3, seed=0):
+    """
+    Time sklearn predict_proba against the flat engine on synthetic IEDB features.
+
+    Returns a list of dicts (engine, batch, seconds, rows_per_s, max_abs_diff).
+    """
+    from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+    from tools.feature_registry import FEATURE_SETS, compute_features
+    from tools.iedb_transfer import IEDB_MODEL_PARAMS
+    from tools.synthetic import synthetic_iedb
+
+    cols = FEATURE_SETS["iedb_sequence"]
+    pool = synthetic_iedb(n_train + max(batches), seed=seed)
+    X_all = compute_features(pool, cols)[cols].to_numpy(dtype=float)
+    y = pool["immunogenic"].to_numpy()[:n_train]
+    if model == "rf":
+        est = RandomForestClassifier(n_jobs=-1, **IEDB_MODEL_PARAMS)
+    else:
+        est = GradientBoostingClassifier(n_estimators=300, max_depth=3, random_state=42)
+    est.fit(X_all[:n_train], y)
+
+    start = time.perf_counter()
+    flat = FlatForest.from_sklearn(est)
+    flat._threshold_tables()
+    print(f"{type(est).__name__}: {flat.n_trees} trees, {len(flat.feature):,} nodes, depth {flat.depth}; "
+          f"export {time.perf_counter() - start:.2f}s")
+
+    engines = {
+        "sklearn": lambda X: est.predict_proba(X)[:, 1],
+        "flat": lambda X: flat.predict_proba(X)[:, 1],
+        "flat_quantized": lambda X: flat.predict_proba(X, quantized=True)[:, 1],
+    }
+    results = []
+    for batch in batches:
+        X = X_all[n_train:n_train + batch]
+        reference = engines["sklearn"](X)
+        for name, fn in engines.items():
+            seconds = _best_time(lambda: fn(X), repeat if batch < 100_000 else 1)
+            results.append({
+                "engine": name, "batch": batch, "seconds": seconds, "rows_per_s": batch / seconds,
+                "max_abs_diff": float(np.max(np.abs(fn(X) - reference))),
+            })
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.flat_forest", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("bench", help="Throughput of sklearn predict_proba vs the flat engine")
+    p.add_argument("--model", choices=["rf", "gb"], default="rf")
+    p.add_argument("--batches", type=int, nargs="+", default=[1, 100, 10_000, 100_000])
+    p.add_argument("--n-train", type=int, default=20_000)
+    p.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.model, args.batches, args.n_train, args.repeat)
+    sklearn_s = {r["batch"]: r["seconds"] for r in results if r["engine"] == "sklearn"}
+    print(f"\n{'engine':16s} {'batch':>8s} {'seconds':>10s} {'rows/s':>12s} {'speedup':>8s} {'max|diff|':>10s}")
+    for r in results:
+        print(f"{r['engine']:16s} {r['batch']:8,d} {r['seconds']:10.4f} {r['rows_per_s']:12,.0f} "
+              f"{sklearn_s[r['batch']] / r['seconds']:7.1f}x {r['max_abs_diff']:10.2e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    sys.exit(main())
@@ -0,0 +1,419 @@
+"""
+Homology-aware peptide clustering (MinHash LSH) for leak-free IEDB splits.
+
+IEDB holds many near-identical peptides -- point variants, register shifts
+and nested extensions of the same epitope -- so a random IEDB split puts a
+homolog of most test peptides in the training set. Clustering near-duplicates
+and splitting by cluster (GroupKFold, LeaveOneGroupOut) removes that leak.
+
+Exact all-pairs similarity is quadratic; this is near-linear in the number of
+unique peptides:
+
+1. MinHash signatures over residue k-mers: k-mers are base-20 integers, each
+   hash function is a random permutation of the k-mer space and a peptide's
+   signature is its minimum permuted k-mer per hash (computed in row chunks)
+2. LSH banding: the signature is cut into bands of rows; peptides sharing a
+   band key are candidate pairs. Within a band, peptides are ordered by key
+   and then by full signature, and each one is paired with the following
+   WINDOW peptides of its bucket, so a giant bucket costs O(size * WINDOW)
+   instead of O(size^2)
+3. Verification: candidate pairs are scored in vectorized chunks by ungapped
+   alignment over register shifts of up to max_shift residues -- identity
+   (Hamming matches / shorter length) or BLOSUM62 score / smaller self-score
+   -- and kept at >= threshold
+4. Clusters are the connected components of the verified pairs (single
+   linkage), so no verified homolog pair is ever split across CV folds
+
+Identical peptides (the same peptide with several alleles) are collapsed
+before hashing and always share a cluster.
+
+Usage:
+    from tools.homology import cluster_peptides, homology_groups
+    iedb["cluster"] = homology_groups(iedb)
+    for train, test in GroupKFold(5).split(X, y, groups=iedb["cluster"]): ...
+
+    python -m tools.homology --input iedb --output data/iedb_clusters.csv
+    python -m tools.homology --metric blosum --threshold 0.75 --folds 5
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+N_RESIDUES = 20
+
+HOMOLOGY_PARAMS = {
+    "k": 3,              # residues per k-mer
+    "n_hashes": 64,      # MinHash functions (signature length)
+    "bands": 32,         # LSH bands; rows per band = n_hashes // bands
+    "metric": "hamming",
+    "threshold": 0.8,    # minimum similarity of a verified pair
+    "max_shift": 2,      # register shifts tried when aligning two peptides
+    "seed": 0,
+}
+
+# Peptides following each peptide within an LSH bucket that become candidates
+WINDOW = 16
+# Rows per signature chunk and candidate pairs per verification chunk
+SIGNATURE_CHUNK = 1 << 14
+PAIR_CHUNK = 1 << 17
+# Candidate pairs collected across LSH bands per deduplicated verification batch
+COMPACT_PAIRS = 1 << 24
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MINHASH
+# ══════════════════════════════════════════════════════════════════════════════
+
+def kmer_codes(codes, k):
+    """
+    Base-20 k-mer integers of encoded peptides.
+
+    Args:
+        codes: (n, max_len) AA index matrix (tools.iedb_transfer.encode_peptides).
+
+    Returns:
+        (n, max_len - k + 1) int32 array; k-mers touching padding or a
+        non-standard residue are N_RESIDUES ** k (the sentinel).
+    """
+    from tools.iedb_transfer import PAD_IDX
+
+    n, width = codes.shape
+    n_kmers = max(width - k + 1, 0)
+    kmers = np.zeros((n, n_kmers), dtype=np.int32)
+    invalid = np.zeros((n, n_kmers), dtype=bool)
+    for j in range(k):
+        window = codes[:, j:j + n_kmers]
+        kmers = kmers * N_RESIDUES + window
+        invalid |= window == PAD_IDX
+    kmers[invalid] = N_RESIDUES ** k
+    return kmers
+
+
+def minhash_signatures(codes, k, n_hashes, seed=0):
+    """
+    MinHash signatures of encoded peptides over their k-mer sets.
+
+    Returns:
+        (n, n_hashes) array of permuted k-mer ranks; N_RESIDUES ** k in every
+        column for peptides shorter than k.
+    """
+    space = N_RESIDUES ** k
+    dtype = np.uint16 if space < np.iinfo(np.uint16).max else np.uint32
+    rng = np.random.default_rng(seed)
+    # One permutation of the k-mer space per hash; the sentinel ranks last
+    perms = np.empty((n_hashes, space + 1), dtype=dtype)
+    for h in range(n_hashes):
+        perms[h, :space] = rng.permutation(space)
+    perms[:, space] = space
+
+    kmers = kmer_codes(codes, k)
+    signatures = np.full((len(codes), n_hashes), space, dtype=dtype)
+    if kmers.shape[1] == 0:
+        return signatures
+    for start in range(0, len(codes), SIGNATURE_CHUNK):
+        block = kmers[start:start + SIGNATURE_CHUNK]
+        signatures[start:start + len(block)] = perms[:, block].min(axis=2).T
+    return signatures
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# LSH CANDIDATES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def band_keys(signatures, bands):
+    """(bands, n) int64 keys: each band's signature rows combined into one integer."""
+    n, n_hashes = signatures.shape
+    if n_hashes % bands:
+        raise ValueError(f"n_hashes ({n_hashes}) is not a multiple of bands ({bands})")
+    rows = n_hashes // bands
+    base = int(signatures.max(initial=0)) + 1
+    if base ** rows >= 2 ** 63:
+        raise ValueError(f"{rows} rows per band overflow int64 band keys; use more bands")
+    keys = np.zeros((bands, n), dtype=np.int64)
+    for r in range(rows):
+        keys = keys * base + signatures[:, r::rows].T
+    return keys
+
+
+def candidate_pairs(signatures, bands, window=WINDOW, exclude=None):
+    """
+    Candidate near-duplicate pairs from LSH banding, in batches.
+
+    Peptides sharing a band key are paired with up to `window` following
+    members of their bucket, ordered by full signature so the most similar
+    members are adjacent. Pairs are collected over bands and yielded once
+    about COMPACT_PAIRS have accumulated, which bounds memory; a pair found
+    again in a later batch is yielded again.
+
+    Args:
+        exclude: Optional boolean mask of rows never paired (peptides without
+                 a k-mer, whose signatures are all sentinel).
+
+    Yields:
+        (i, j) int32 arrays with i < j, unique within the batch.
+    """
+    n = len(signatures)
+    if n < 2:
+        return
+    # Global rank of every peptide by its full signature (ties broken by index)
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort(signatures.T[::-1])] = np.arange(n)
+    keep = np.ones(n, dtype=bool) if exclude is None else ~np.asarray(exclude, dtype=bool)
+
+    pairs, pending = [], 0
+    for band, key in enumerate(band_keys(signatures, bands)):
+        order = np.lexsort((rank, key))
+        order = order[keep[order]]
+        sorted_key = key[order]
+        for offset in range(1, window + 1):
+            same = sorted_key[:-offset] == sorted_key[offset:]
+            if not same.any():
+                break  # keys are sorted: no bucket has more than `offset` members
+            left, right = order[:-offset][same], order[offset:][same]
+            pairs.append(np.minimum(left, right) * n + np.maximum(left, right))
+            pending += len(left)
+        if pairs and (pending > COMPACT_PAIRS or band == bands - 1):
+            flat = np.concatenate(pairs)
+            pairs, pending = [], 0
+            flat.sort()
+            flat = flat[np.r_[True, flat[1:] != flat[:-1]]]
+            yield (flat // n).astype(np.int32), (flat % n).astype(np.int32)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# VERIFICATION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _aligned(codes_a, codes_b, max_shift):
+    """Yield (a, b) aligned (m, width) blocks for every register shift of b in [-max_shift, max_shift]."""
+    from tools.iedb_transfer import PAD_IDX
+
+    m, width = codes_a.shape
+    padded = np.full((m, width + 2 * max_shift), PAD_IDX, dtype=codes_b.dtype)
+    padded[:, max_shift:max_shift + width] = codes_b
+    for shift in range(2 * max_shift + 1):
+        yield codes_a, padded[:, shift:shift + width]
+
+
+def hamming_identity(codes_a, codes_b, lengths_a, lengths_b, max_shift):
+    """Best ungapped identity over shifts: matching residues / shorter peptide length."""
+    from tools.iedb_transfer import PAD_IDX
+
+    best = np.zeros(len(codes_a), dtype=np.int64)
+    for a, b in _aligned(codes_a, codes_b, max_shift):
+        np.maximum(best, ((a == b) & (a != PAD_IDX)).sum(axis=1), out=best)
+    return best / np.maximum(np.minimum(lengths_a, lengths_b), 1)
+
+
+def blosum_similarity(codes_a, codes_b, lengths_a, lengths_b, max_shift):
+    """Best ungapped BLOSUM62 score over shifts / smaller self-score (<= 1)."""
+    from tools.iedb_transfer import BLOSUM62_PADDED
+
+    self_a = BLOSUM62_PADDED[codes_a, codes_a].sum(axis=1)
+    self_b = BLOSUM62_PADDED[codes_b, codes_b].sum(axis=1)
+    best = np.full(len(codes_a), -np.inf, dtype=np.float32)
+    for a, b in _aligned(codes_a, codes_b, max_shift):
+        np.maximum(best, BLOSUM62_PADDED[a, b].sum(axis=1), out=best)
+    return best / np.maximum(np.minimum(self_a, self_b), 1)
+
+
+SIMILARITIES = {
+    "hamming": hamming_identity,
+    "blosum": blosum_similarity,
+}
+
+
+def verify_pairs(codes, lengths, i, j, metric="hamming", max_shift=2):
+    """Similarity of candidate pairs (i[p], j[p]), scored in chunks of PAIR_CHUNK pairs."""
+    score = SIMILARITIES[metric]
+    similarity = np.empty(len(i), dtype=np.float32)
+    for start in range(0, len(i), PAIR_CHUNK):
+        a, b = i[start:start + PAIR_CHUNK], j[start:start + PAIR_CHUNK]
+        similarity[start:start + len(a)] = score(codes[a], codes[b], lengths[a], lengths[b], max_shift)
+    return similarity
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLUSTERING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def find_homologs(peptides, k=3, n_hashes=64, bands=32, metric="hamming", threshold=0.8, max_shift=2,
+                  seed=0, window=WINDOW, stats=None):
+    """
+    Verified near-duplicate pairs among unique peptides.
+
+    Args:
+        peptides: Unique peptide sequences.
+        stats: Optional dict filled with candidate/verified pair counts and
+               per-step seconds.
+
+    Returns:
+        (i, j, similarity): index pairs into peptides (i < j) with
+        similarity >= threshold.
+    """
+    import time
+
+    from tools.iedb_transfer import encode_peptides
+
+    if metric not in SIMILARITIES:
+        raise ValueError(f"Unknown metric {metric!r}; choose from {sorted(SIMILARITIES)}")
+    stats = {} if stats is None else stats
+    peptides = np.asarray(peptides, dtype=str)
+    start = time.perf_counter()
+    codes = encode_peptides(peptides)
+    lengths = np.char.str_len(peptides)
+    signatures = minhash_signatures(codes, k, n_hashes, seed)
+    hashed = time.perf_counter()
+    found, n_candidates, verify_seconds = [], 0, 0.0
+    for i, j in candidate_pairs(signatures, bands, window, exclude=lengths < k):
+        verify_start = time.perf_counter()
+        similarity = verify_pairs(codes, lengths, i, j, metric, max_shift)
+        keep = similarity >= threshold
+        found.append((i[keep], j[keep], similarity[keep]))
+        n_candidates += len(i)
+        verify_seconds += time.perf_counter() - verify_start
+
+    # Pairs verified in more than one batch are kept once
+    i, j, similarity = (np.concatenate(parts) for parts in zip(*found)) if found else \
+        (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+    _, first = np.unique(i.astype(np.int64) * len(peptides) + j, return_index=True)
+    stats.update(peptides=len(peptides), candidates=n_candidates, verified=len(first),
+                 signature_seconds=hashed - start,
+                 lsh_seconds=time.perf_counter() - hashed - verify_seconds, verify_seconds=verify_seconds)
+    return i[first], j[first], similarity[first]
+
+
+def cluster_peptides(peptides, stats=None, **params):
+    """
+    Homology cluster ID of every peptide.
+
+    Args:
+        peptides: Peptide sequences (duplicates allowed; identical peptides
+                  share a cluster).
+        stats: Optional dict filled as in find_homologs(), plus n_clusters.
+        **params: Overrides of HOMOLOGY_PARAMS.
+
+    Returns:
+        int64 array of cluster IDs (0..n_clusters-1, numbered by first
+        occurrence), aligned with peptides.
+    """
+    import pandas as pd
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    stats = {} if stats is None else stats
+    inverse, unique = pd.factorize(pd.Series(peptides, dtype=str))
+    i, j, _ = find_homologs(unique, stats=stats, **{**HOMOLOGY_PARAMS, **params})
+    n = len(unique)
+    graph = coo_matrix((np.ones(len(i), dtype=np.int8), (i, j)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    # Renumber by first occurrence so IDs do not depend on scipy's traversal
+    _, first = np.unique(labels, return_index=True)
+    renumber = np.empty(len(first), dtype=np.int64)
+    renumber[np.argsort(np.argsort(first))] = np.arange(len(first))
+    stats["n_clusters"] = len(first)
+    return renumber[labels][inverse]
+
+
+def homology_groups(df, column="peptide", **params):
+    """Cluster IDs of df[column] as a Series aligned with df, for GroupKFold / LeaveOneGroupOut."""
+    import pandas as pd
+
+    return pd.Series(cluster_peptides(df[column].to_numpy(), **params), index=df.index, name="cluster")
+
+
+def split_leakage(peptides, folds, homologs=None, **params):
+    """
+    Fraction of test peptides with a verified homolog in the training folds.
+
+    Args:
+        folds: Fold index of every peptide.
+        homologs: Optional (i, j) pairs over the unique peptides in order of
+                  first occurrence (find_homologs() on them); computed with
+                  params when omitted.
+
+    Returns:
+        Leakage fraction pooled over folds (identical peptides count as homologs).
+    """
+    import pandas as pd
+
+    inverse, unique = pd.factorize(pd.Series(peptides, dtype=str))
+    folds = np.asarray(folds)
+    i, j = homologs if homologs is not None else find_homologs(unique, **{**HOMOLOGY_PARAMS, **params})[:2]
+    # Every (peptide, fold) occurrence -> the folds its homologs and duplicates sit in
+    occurrences = pd.DataFrame({"peptide": inverse, "fold": folds})
+    edges = pd.DataFrame({"peptide": np.concatenate([i, j, np.arange(len(unique))]),
+                          "homolog": np.concatenate([j, i, np.arange(len(unique))])})
+    homolog_folds = edges.merge(occurrences.rename(columns={"peptide": "homolog", "fold": "homolog_fold"}),
+                                on="homolog")[["peptide", "homolog_fold"]].drop_duplicates()
+    merged = occurrences.reset_index().merge(homolog_folds, on="peptide")
+    leaked = merged.loc[merged["fold"] != merged["homolog_fold"], "index"].unique()
+    return len(leaked) / max(len(occurrences), 1)
+
+
+def print_summary(labels, stats):
+    sizes = np.bincount(labels)
+    print(f"\n  {stats['peptides']:,} unique peptides -> {stats['n_clusters']:,} clusters "
+          f"({(sizes == 1).sum():,} with one row, largest {sizes.max(initial=0):,} rows)")
+    print(f"  LSH candidates {stats['candidates']:,}, verified pairs {stats['verified']:,}")
+    print(f"  Signatures {stats['signature_seconds']:.1f}s, LSH {stats['lsh_seconds']:.1f}s, "
+          f"verification {stats['verify_seconds']:.1f}s")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv=None):
+    import argparse
+
+    from tools.cli import read_frame, write_frame
+
+    parser = argparse.ArgumentParser(prog="python -m tools.homology", description=__doc__.split("\n")[1])
+    parser.add_argument("--input", default="iedb", help='"iedb" or a table with a peptide column')
+    parser.add_argument("--column", default="peptide")
+    parser.add_argument("--output", help="Write the input with a cluster column (.csv/.tsv/.parquet)")
+    parser.add_argument("--k", type=int, default=HOMOLOGY_PARAMS["k"])
+    parser.add_argument("--hashes", type=int, default=HOMOLOGY_PARAMS["n_hashes"])
+    parser.add_argument("--bands", type=int, default=HOMOLOGY_PARAMS["bands"])
+    parser.add_argument("--metric", choices=list(SIMILARITIES), default=HOMOLOGY_PARAMS["metric"])
+    parser.add_argument("--threshold", type=float, default=HOMOLOGY_PARAMS["threshold"])
+    parser.add_argument("--max-shift", type=int, default=HOMOLOGY_PARAMS["max_shift"])
+    parser.add_argument("--seed", type=int, default=HOMOLOGY_PARAMS["seed"])
+    parser.add_argument("--window", type=int, default=WINDOW, help="Bucket neighbours paired per peptide")
+    parser.add_argument("--folds", type=int, help="Also report homolog leakage of random vs cluster K-fold splits")
+    args = parser.parse_args(argv)
+
+    df = read_frame(args.input)
+    params = {"k": args.k, "n_hashes": args.hashes, "bands": args.bands, "metric": args.metric,
+              "threshold": args.threshold, "max_shift": args.max_shift, "seed": args.seed,
+              "window": args.window}
+    peptides = df[args.column].to_numpy()
+    stats = {}
+    labels = cluster_peptides(peptides, stats=stats, **params)
+    print_summary(labels, stats)
+
+    if args.folds:
+        from sklearn.model_selection import GroupKFold, KFold
+
+        import pandas as pd
+
+        homologs = find_homologs(pd.unique(pd.Series(peptides, dtype=str)), **params)[:2]
+        splits = {"random KFold": KFold(args.folds, shuffle=True, random_state=args.seed).split(labels),
+                  "cluster GroupKFold": GroupKFold(args.folds).split(labels, groups=labels)}
+        print(f"\n  Test peptides with a homolog in training ({args.folds} folds):")
+        for name, split in splits.items():
+            folds = np.empty(len(labels), dtype=np.int64)
+            for fold, (_, test) in enumerate(split):
+                folds[test] = fold
+            print(f"    {name:20s} {split_leakage(peptides, folds, homologs):.1%}")
+
+    if args.output:
+        write_frame(df.assign(cluster=labels), args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    sys.exit(main())
@@ -16,23 +16,26 @@ import sys
 import numpy as np
 import pandas as pd
 from collections import Counter
+from pathlib import Path
 
-sys.path.insert(0, ".")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from tools.data_loader import load_tesla, load_iedb, get_iedb_train_data
-from tools.evaluate import evaluate_predictions, print_metrics, compare_models
+from tools.data_loader import load_tesla, load_iedb, get_iedb_train_data, prefetch
+from tools.flat_forest import predict_positive
+from tools.evaluate import (
+    evaluate_predictions, print_metrics, compare_models, evaluate_groups, print_group_breakdown,
+)
+from tools.importance import column_groups, fold_models, permutation_importance, print_importance
+from tools.ledger import start_session, annotate, print_previous_best
+from tools.oof_store import record_oof
+from tools.replay import record_finding
+from tools.trace import span
 from tools.feature_engineering import (
     AA_PROPERTY_TABLES, HYDROPHOBICITY, MOLECULAR_WEIGHT, CHARGE, AROMATIC, POLAR,
     compute_peptide_global_features, compute_tcr_facing_features,
     get_anchor_positions, get_tcr_positions,
 )
 
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import StandardScaler
-from sklearn.impute import SimpleImputer
-from sklearn.model_selection import LeaveOneGroupOut, cross_val_predict
-
 
 # ══════════════════════════════════════════════════════════════════════════════
 # AMINO ACID ENCODING
@@ -47,10 +50,54 @@ BLOSUM62_SELF = {
     'S': 4, 'T': 5, 'W': 11, 'Y': 7, 'V': 4,
 }
 
+# Approximate amino acid frequencies in the human proteome
+AA_FREQ = {
+    'A': 0.074, 'R': 0.042, 'N': 0.044, 'D': 0.059, 'C': 0.033,
+    'Q': 0.037, 'E': 0.058, 'G': 0.074, 'H': 0.026, 'I': 0.038,
+    'L': 0.076, 'K': 0.072, 'M': 0.018, 'F': 0.040, 'P': 0.050,
+    'S': 0.081, 'T': 0.062, 'W': 0.013, 'Y': 0.033, 'V': 0.068,
+}
+
 # Amino acid one-hot dimension
 AA_LIST = list('ACDEFGHIKLMNPQRSTVWY')
 AA_TO_IDX = {aa: i for i, aa in enumerate(AA_LIST)}
 
+# Full BLOSUM62 matrix, rows/columns in AA_LIST order. BLOSUM62_SELF above is
+# its diagonal; off-diagonal entries score mutant-vs-WT substitutions.
+BLOSUM62 = np.array([
+    #  A   C   D   E   F   G   H   I   K   L   M   N   P   Q   R   S   T   V   W   Y
+    [ 4,  0, -2, -1, -2,  0, -2, -1, -1, -1, -1, -2, -1, -1, -1,  1,  0,  0, -3, -2],  # A
+    [ 0,  9, -3, -4, -2, -3, -3, -1, -3, -1, -1, -3, -3, -3, -3, -1, -1, -1, -2, -2],  # C
+    [-2, -3,  6,  2, -3, -1, -1, -3, -1, -4, -3,  1, -1,  0, -2,  0, -1, -3, -4, -3],  # D
+    [-1, -4,  2,  5, -3, -2,  0, -3,  1, -3, -2,  0, -1,  2,  0,  0, -1, -2, -3, -2],  # E
+    [-2, -2, -3, -3,  6, -3, -1,  0, -3,  0,  0, -3, -4, -3, -3, -2, -2, -1,  1,  3],  # F
+    [ 0, -3, -1, -2, -3,  6, -2, -4, -2, -4, -3,  0, -2, -2, -2,  0, -2, -3, -2, -3],  # G
+    [-2, -3, -1,  0, -1, -2,  8, -3, -1, -3, -2,  1, -2,  0,  0, -1, -2, -3, -2,  2],  # H
+    [-1, -1, -3, -3,  0, -4, -3,  4, -3,  2,  1, -3, -3, -3, -3, -2, -1,  3, -3, -1],  # I
+    [-1, -3, -1,  1, -3, -2, -1, -3,  5, -2, -1,  0, -1,  1,  2,  0, -1, -2, -3, -2],  # K
+    [-1, -1, -4, -3,  0, -4, -3,  2, -2,  4,  2, -3, -3, -2, -2, -2, -1,  1, -2, -1],  # L
+    [-1, -1, -3, -2,  0, -3, -2,  1, -1,  2,  5, -2, -2,  0, -1, -1, -1,  1, -1, -1],  # M
+    [-2, -3,  1,  0, -3,  0,  1, -3,  0, -3, -2,  6, -2,  0,  0,  1,  0, -3, -4, -2],  # N
+    [-1, -3, -1, -1, -4, -2, -2, -3, -1, -3, -2, -2,  7, -1, -2, -1, -1, -2, -4, -3],  # P
+    [-1, -3,  0,  2, -3, -2,  0, -3,  1, -2,  0,  0, -1,  5,  1,  0, -1, -2, -2, -1],  # Q
+    [-1, -3, -2,  0, -3, -2,  0, -3,  2, -2, -1,  0, -2,  1,  5, -1, -1, -3, -3, -2],  # R
+    [ 1, -1,  0,  0, -2,  0, -1, -2,  0, -2, -1,  1, -1,  0, -1,  4,  1, -2, -3, -2],  # S
+    [ 0, -1, -1, -1, -2, -2, -2, -1, -1, -1, -1,  0, -1, -1, -1,  1,  5,  0, -2, -2],  # T
+    [ 0, -1, -3, -2, -1, -3, -3,  3, -2,  1,  1, -3, -2, -2, -3, -2,  0,  4, -3, -1],  # V
+    [-3, -2, -4, -3,  1, -2, -2, -3, -3, -2, -1, -4, -4, -2, -3, -3, -2, -3, 11,  2],  # W
+    [-2, -2, -3, -2,  3, -3,  2, -1, -2, -1, -1, -2, -3, -1, -2, -2, -2, -1,  2,  7],  # Y
+], dtype=np.float32)
+
+# Index used for padding and non-standard residues in encoded peptide matrices.
+# It maps to an all-zero row/column of the padded BLOSUM table.
+PAD_IDX = len(AA_LIST)
+BLOSUM62_PADDED = np.zeros((PAD_IDX + 1, PAD_IDX + 1), dtype=np.float32)
+BLOSUM62_PADDED[:PAD_IDX, :PAD_IDX] = BLOSUM62
+
+AA_CODE_LUT = np.full(256, PAD_IDX, dtype=np.int8)
+for _aa, _i in AA_TO_IDX.items():
+    AA_CODE_LUT[ord(_aa)] = _i
+
 
 def encode_peptide_properties(peptide, max_len=14):
     """
@@ -153,13 +200,6 @@ def reconstruct_wt_and_compute_diff(peptide, mutation_pos):
     features['mut_blosum_self'] = BLOSUM62_SELF.get(mut_aa, 4)
 
     # Amino acid rarity (some amino acids are rare in the human proteome)
-    # Approximate frequencies from human proteome
-    AA_FREQ = {
-        'A': 0.074, 'R': 0.042, 'N': 0.044, 'D': 0.059, 'C': 0.033,
-        'Q': 0.037, 'E': 0.058, 'G': 0.074, 'H': 0.026, 'I': 0.038,
-        'L': 0.076, 'K': 0.072, 'M': 0.018, 'F': 0.040, 'P': 0.050,
-        'S': 0.081, 'T': 0.062, 'W': 0.013, 'Y': 0.033, 'V': 0.068,
-    }
     features['mut_aa_rarity'] = -np.log(AA_FREQ.get(mut_aa, 0.01))
 
     # Properties of the mutant residue
@@ -172,22 +212,229 @@ def reconstruct_wt_and_compute_diff(peptide, mutation_pos):
     return features
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+# BULK BLOSUM SUBSTITUTION FEATURES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def encode_peptides(peptides, max_len=None):
+    """
+    Encode peptides as an integer matrix of AA_LIST indices.
+
+    Peptides are right-padded (or truncated) to max_len; padding and
+    non-standard residues are encoded as PAD_IDX. The conversion goes through
+    a fixed-width byte array and a lookup table, so there is no per-row Python.
+
+    Returns int8 array of shape (n_peptides, max_len).
+
+    Raises ValueError for peptides with non-ASCII characters.
+    """
+    peptides = np.asarray(peptides, dtype=str)
+    if max_len is None:
+        max_len = int(np.char.str_len(peptides).max()) if len(peptides) else 1
+    return AA_CODE_LUT[_peptide_bytes(peptides, max_len)]
+
+
+def _peptide_bytes(peptides, max_len):
+    """(n, max_len) uint8 matrix of zero-padded (or truncated) ASCII peptides."""
+    try:
+        raw = np.asarray(peptides, dtype=str).astype(f'S{max_len}')
+    except UnicodeEncodeError:
+        bad = [p for p in peptides if not str(p).isascii()]
+        raise ValueError(f"{len(bad)} peptide(s) contain non-ASCII characters, e.g. {str(bad[0])!r}") from None
+    return raw.view(np.uint8).reshape(len(raw), max_len)
+
+
+def tcr_position_mask(peptide_lengths, max_len):
+    """
+    Boolean (n_peptides, max_len) mask of the TCR-facing positions from
+    get_tcr_positions(), built once per distinct peptide length.
+    """
+    peptide_lengths = np.asarray(peptide_lengths, dtype=int)
+    table = np.zeros((max(peptide_lengths.max(initial=0), max_len) + 1, max_len), dtype=bool)
+    for length in np.unique(peptide_lengths):
+        positions = [p - 1 for p in get_tcr_positions(int(length)) if p <= min(length, max_len)]
+        table[length, positions] = True
+    return table[peptide_lengths]
+
+
+def tcr_position_weights(peptide_lengths, max_len):
+    """
+    Weights over TCR-facing positions, highest at the peptide centre where
+    TCR contact is maximal (same centre as mut_distance_from_center) and
+    normalized to sum to 1 per peptide. Non-TCR positions get weight 0.
+    """
+    peptide_lengths = np.asarray(peptide_lengths, dtype=float)
+    positions = np.arange(1, max_len + 1, dtype=float)
+    center = (peptide_lengths[:, None] + 1) / 2
+    weights = 1.0 - np.abs(positions[None, :] - center) / center
+    weights = np.where(tcr_position_mask(peptide_lengths.astype(int), max_len), weights, 0.0)
+    totals = weights.sum(axis=1, keepdims=True)
+    return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+
+def compute_blosum_substitution_features(mut_peptides, wt_peptides, mutation_positions):
+    """
+    Mutant-vs-WT BLOSUM62 substitution features for a batch of peptide pairs.
+
+    Unlike mut_blosum_self (the diagonal score of the mutant residue), these
+    score what the residue was substituted FROM. All scores come from one
+    fancy-index gather BLOSUM62[mut, wt] over the encoded matrices.
+
+    Features:
+    - mut_wt_blosum: substitution score at the mutation position
+    - tcr_blosum_weighted: centre-weighted substitution score over TCR-facing positions
+    - tcr_n_substitutions: number of TCR-facing positions that differ from WT
+
+    Pairs with a missing WT peptide or a mutant/WT length mismatch get NaN.
+
+    Returns DataFrame with one row per input pair.
+    """
+    mut_peptides = pd.Series(mut_peptides).reset_index(drop=True)
+    wt_peptides = pd.Series(wt_peptides).reset_index(drop=True)
+    mut_lengths = mut_peptides.str.len().to_numpy()
+    max_len = int(mut_lengths.max()) if len(mut_lengths) else 1
+    mut_enc = encode_peptides(mut_peptides, max_len=max_len)
+    wt_enc, paired = encode_wt_peptides(wt_peptides, mut_lengths, max_len)
+    return substitution_features_from_codes(mut_enc, wt_enc, paired, mut_lengths, mutation_positions)
+
+
+def encode_wt_peptides(wt_peptides, mut_lengths, max_len):
+    """
+    Encoded WT peptides and whether each pairs with its mutant (present and
+    of the same length).
+    """
+    wt_peptides = pd.Series(wt_peptides).reset_index(drop=True)
+    paired = wt_peptides.notna().to_numpy() & (wt_peptides.fillna('').str.len().to_numpy() == mut_lengths)
+    return encode_peptides(wt_peptides.fillna(''), max_len=max_len), paired
+
+
+def wt_code_matrix(mut_enc, mut_lengths, mutation_positions, wt_residues):
+    """
+    Encoded WT peptides from the encoded mutants and the WT residue at the
+    mutation position: AA_CODE_LUT[wt_residue] is written at
+    mutation_position - 1 with one fancy-index assignment, so no WT strings
+    are built.
+
+    Returns (wt_enc, paired): rows with a missing or out-of-range position,
+    or a WT residue that is not a single character, are not paired (their
+    codes are left as the mutant's).
+    """
+    rows, index, residue_bytes, paired = _wt_substitutions(mut_lengths, mutation_positions, wt_residues)
+    wt_enc = mut_enc.copy()
+    wt_enc[rows, index] = AA_CODE_LUT[residue_bytes]
+    return wt_enc, paired
+
+
+def _wt_substitutions(mut_lengths, mutation_positions, wt_residues):
+    """Rows, 0-based positions and ASCII bytes of the valid WT residues, and the validity mask."""
+    positions = np.asarray(mutation_positions, dtype=float)
+    residues = pd.Series(wt_residues, dtype=object).reset_index(drop=True)
+    text = residues.astype(str)
+    valid = (residues.notna().to_numpy() & text.str.len().eq(1).to_numpy() & ~np.isnan(positions)
+             & (positions >= 1) & (positions <= np.asarray(mut_lengths)))
+    rows = np.flatnonzero(valid)
+    return rows, positions[rows].astype(int) - 1, _peptide_bytes(text.to_numpy()[rows], 1)[:, 0], valid
+
+
+def substitution_features_from_codes(mut_enc, wt_enc, paired, mut_lengths, mutation_positions):
+    """Substitution features (as compute_blosum_substitution_features) of encoded mutant/WT pairs."""
+    mutation_positions = np.asarray(mutation_positions, dtype=float)
+    mut_lengths = np.asarray(mut_lengths)
+
+    # One gather for every position of every pair
+    substitution = BLOSUM62_PADDED[mut_enc, wt_enc]
+
+    rows = np.arange(len(mut_enc))
+    pos_valid = (
+        paired & ~np.isnan(mutation_positions)
+        & (mutation_positions >= 1) & (mutation_positions <= mut_lengths)
+    )
+    mut_idx = np.where(pos_valid, mutation_positions, 1).astype(int) - 1
+    mut_wt_blosum = np.where(pos_valid, substitution[rows, mut_idx], np.nan)
+
+    weights = tcr_position_weights(mut_lengths, mut_enc.shape[1])
+    tcr_mask = weights > 0
+    tcr_weighted = np.where(paired, (weights * substitution).sum(axis=1), np.nan)
+    n_subs = ((mut_enc != wt_enc) & tcr_mask).sum(axis=1)
+    tcr_n_subs = np.where(paired, n_subs, np.nan)
+
+    return pd.DataFrame({
+        'mut_wt_blosum': mut_wt_blosum,
+        'tcr_blosum_weighted': tcr_weighted,
+        'tcr_n_substitutions': tcr_n_subs,
+    })
+
+
+def rebuild_wt_peptides(peptides, mutation_positions, wt_residues):
+    """
+    Wild-type peptides (for predictors that need strings, e.g. paired
+    MHCflurry): the mutant with the WT residue written at the 1-indexed
+    mutation position, in one assignment on the byte matrix.
+
+    Rows with a missing or out-of-range position, or a WT residue that is
+    not a single character, get None.
+    """
+    peptides = np.asarray(peptides, dtype=str)
+    lengths = np.char.str_len(peptides)
+    max_len = int(lengths.max()) if len(peptides) else 1
+    raw = _peptide_bytes(peptides, max_len).copy()
+    rows, index, residue_bytes, valid = _wt_substitutions(lengths, mutation_positions, wt_residues)
+    raw[rows, index] = residue_bytes
+    wt = raw.view(f'S{max_len}').ravel().astype(str).astype(object)
+    wt[~valid] = None
+    return wt
+
+
+def compute_blosum_profiles(peptides, max_len=11):
+    """
+    Per-position BLOSUM62 profile vectors: each residue is replaced by its
+    BLOSUM62 row (20 scores), padding positions are all zero.
+
+    Returns float32 array of shape (n_peptides, max_len * 20) and the column names
+    (blosum_p{position}_{aa}, 1-indexed positions).
+    """
+    encoded = encode_peptides(peptides, max_len=max_len)
+    profiles = BLOSUM62_PADDED[encoded][:, :, :PAD_IDX]
+    columns = [f'blosum_p{pos}_{aa}' for pos in range(1, max_len + 1) for aa in AA_LIST]
+    return profiles.reshape(len(encoded), -1), columns
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # IEDB-BASED SEQUENCE MODEL
 # ══════════════════════════════════════════════════════════════════════════════
 
-def prepare_iedb_sequence_features(iedb_df):
-    """Compute sequence features for IEDB peptides."""
-    features_list = []
-    for _, row in iedb_df.iterrows():
-        feat = compute_sequence_features(row['peptide'])
-        features_list.append(feat)
-    return pd.DataFrame(features_list)
+def prepare_iedb_sequence_features(iedb_df, store=None, n_jobs=1):
+    """
+    Compute sequence features for IEDB peptides.
 
+    With a tools.feature_store.FeatureStore, features are only computed for
+    peptides the store has not seen before. Otherwise they are computed in
+    batch by the feature registry, sharded over n_jobs processes.
+    """
+    if store is not None:
+        return store.get(iedb_df, 'sequence')
+    from tools.feature_registry import FEATURE_SETS, compute_features
+    return compute_features(iedb_df[['peptide']], FEATURE_SETS['iedb_sequence'], n_jobs=n_jobs)
+
+
+# RandomForest hyperparameters of the IEDB sequence model
+IEDB_MODEL_PARAMS = {
+    "n_estimators": 500,
+    "class_weight": "balanced",
+    "max_depth": 8,
+    "min_samples_leaf": 10,
+    "random_state": 42,
+}
 
-def train_iedb_model(allele=None, peptide_lengths=[9, 10]):
+
+def train_iedb_model(allele=None, peptide_lengths=[9, 10], store=None, n_jobs=-1, model_params=None):
     """
     Train a model on IEDB data to predict immunogenicity from sequence features.
+    Pass a FeatureStore to reuse cached sequence features; without one,
+    features are computed on n_jobs processes.
+
+    Args:
+        model_params: Overrides of IEDB_MODEL_PARAMS.
 
     Returns trained model + feature columns for scoring TESLA peptides.
     """
@@ -196,11 +443,22 @@ def train_iedb_model(allele=None, peptide_lengths=[9, 10]):
     print(f"  {len(iedb)} unique peptide-allele pairs, {iedb['immunogenic'].mean():.1%} positive")
 
     print("Computing sequence features for IEDB...")
-    iedb_feats = prepare_iedb_sequence_features(iedb)
-    feature_cols = list(iedb_feats.columns)
+    iedb_feats = prepare_iedb_sequence_features(iedb, store=store, n_jobs=n_jobs)
+    return fit_iedb_model(iedb_feats, iedb['immunogenic'].values, model_params)
+
+
+def fit_iedb_model(iedb_feats, y, model_params=None):
+    """
+    Fit imputer, scaler and RandomForest on precomputed IEDB sequence features.
+
+    Returns (model, feature_cols, imputer, scaler).
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
 
+    feature_cols = list(iedb_feats.columns)
     X = iedb_feats.values
-    y = iedb['immunogenic'].values
 
     # Handle NaN
     imputer = SimpleImputer(strategy='median')
@@ -210,11 +468,9 @@ def train_iedb_model(allele=None, peptide_lengths=[9, 10]):
 
     # Train model
     print("Training Random Forest on IEDB...")
-    model = RandomForestClassifier(
-        n_estimators=500, class_weight='balanced',
-        max_depth=8, min_samples_leaf=10, random_state=42, n_jobs=-1,
-    )
-    model.fit(X, y)
+    model = RandomForestClassifier(n_jobs=-1, **{**IEDB_MODEL_PARAMS, **(model_params or {})})
+    with span("fit.iedb_model", rows=len(X)):
+        model.fit(X, y)
 
     # Feature importance
     print("\nTop 15 features:")
@@ -224,13 +480,13 @@ def train_iedb_model(allele=None, peptide_lengths=[9, 10]):
     return model, feature_cols, imputer, scaler
 
 
-def score_tesla_with_iedb_model(tesla_df, model, feature_cols, imputer, scaler):
-    """Score TESLA peptides using the IEDB-trained model."""
-    tesla_feats = []
-    for _, row in tesla_df.iterrows():
-        feat = compute_sequence_features(row['peptide'])
-        tesla_feats.append(feat)
-    tesla_feat_df = pd.DataFrame(tesla_feats)
+def score_tesla_with_iedb_model(tesla_df, model, feature_cols, imputer, scaler, store=None, features=None):
+    """
+    Score TESLA peptides using the IEDB-trained model.
+
+    features: precomputed sequence features for tesla_df's rows (computed if None).
+    """
+    tesla_feat_df = prepare_iedb_sequence_features(tesla_df, store=store) if features is None else features.copy()
 
     # Ensure same columns
     for col in feature_cols:
@@ -241,7 +497,8 @@ def score_tesla_with_iedb_model(tesla_df, model, feature_cols, imputer, scaler):
     X_tesla = imputer.transform(X_tesla)
     X_tesla = scaler.transform(X_tesla)
 
-    probs = model.predict_proba(X_tesla)[:, 1]
+    # Flat-array tree walk: same probabilities, no per-tree predict_proba overhead
+    probs = predict_positive(model, X_tesla)
     return probs
 
 
@@ -250,41 +507,67 @@ def score_tesla_with_iedb_model(tesla_df, model, feature_cols, imputer, scaler):
 # ══════════════════════════════════════════════════════════════════════════════
 
 if __name__ == "__main__":
+    # TESLA, IEDB and MHCflurry load concurrently; TESLA features are computed
+    # while IEDB and the predictor are still loading
+    prefetch("tesla", "iedb", "predictor")
+    from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.impute import SimpleImputer
+    from sklearn.model_selection import LeaveOneGroupOut, cross_val_predict
+
     print("=" * 70)
     print("  TRANSFER LEARNING: IEDB → TESLA")
     print("=" * 70)
 
     # Load TESLA
     tesla = load_tesla()
+    has_wt = bool({'wt_peptide', 'wt_residue'} & set(tesla.columns))
+    if not has_wt:
+        print("  Warning: TESLA has no wt_peptide or wt_residue column; "
+              "the hybrid model runs without substitution features")
+    start_session("iedb_transfer", data=tesla)
     y_true = tesla['immunogenic'].astype(int).values
 
     all_results = []
 
+    # Sequence features are cached per peptide across runs
+    from tools.feature_store import FeatureStore
+    from tools.feature_registry import FEATURE_SETS, add_features
+    store = FeatureStore()
+    tesla_seq = prepare_iedb_sequence_features(tesla, store=store)
+
     # ── Model 1: Pan-allele IEDB model ──
     print("\n\n--- Pan-allele IEDB model ---")
-    model, feat_cols, imp, scl = train_iedb_model(allele=None, peptide_lengths=[8, 9, 10, 11])
-    probs_pan = score_tesla_with_iedb_model(tesla, model, feat_cols, imp, scl)
-    metrics_pan = evaluate_predictions(y_true, probs_pan, name="IEDB pan-allele RF")
+    # Training and scoring both count towards the ledger's wall time
+    iedb_params = RandomForestClassifier(n_jobs=-1, **IEDB_MODEL_PARAMS).get_params()
+    with annotate(features=list(tesla_seq.columns), params=iedb_params):
+        model, feat_cols, imp, scl = train_iedb_model(allele=None, peptide_lengths=[8, 9, 10, 11], store=store)
+        probs_pan = score_tesla_with_iedb_model(tesla, model, feat_cols, imp, scl, features=tesla_seq)
+        metrics_pan = evaluate_predictions(y_true, probs_pan, name="IEDB pan-allele RF")
+    record_oof(metrics_pan["name"], probs_pan, y_true, tesla['patient_id'].values, metrics_pan,
+               feat_cols, model.get_params())
     print_metrics(metrics_pan)
     all_results.append(metrics_pan)
 
     # ── Model 2: HLA-A*02:01-specific (most data) ──
     print("\n\n--- HLA-A*02:01 IEDB model (applied to A02:01 TESLA subset) ---")
-    model_a02, feat_cols_a02, imp_a02, scl_a02 = train_iedb_model(
-        allele="HLA-A*02:01", peptide_lengths=[9, 10]
-    )
-    # Score only A*02:01 peptides in TESLA
-    a02_mask = tesla['allele'] == 'HLA-A*02:01'
-    if a02_mask.sum() > 0:
-        tesla_a02 = tesla[a02_mask].copy()
-        probs_a02 = score_tesla_with_iedb_model(tesla_a02, model_a02, feat_cols_a02, imp_a02, scl_a02)
-        metrics_a02 = evaluate_predictions(
-            tesla_a02['immunogenic'].astype(int).values,
-            probs_a02,
-            name="IEDB A*02:01-specific RF"
+    with annotate(features=list(tesla_seq.columns), params=iedb_params):
+        model_a02, feat_cols_a02, imp_a02, scl_a02 = train_iedb_model(
+            allele="HLA-A*02:01", peptide_lengths=[9, 10], store=store
         )
-        print_metrics(metrics_a02)
-        all_results.append(metrics_a02)
+        # Score only A*02:01 peptides in TESLA
+        a02_mask = tesla['allele'] == 'HLA-A*02:01'
+        if a02_mask.sum() > 0:
+            tesla_a02 = tesla[a02_mask].copy()
+            probs_a02 = score_tesla_with_iedb_model(tesla_a02, model_a02, feat_cols_a02, imp_a02, scl_a02,
+                                                    features=tesla_seq[a02_mask.values])
+            metrics_a02 = evaluate_predictions(
+                tesla_a02['immunogenic'].astype(int).values,
+                probs_a02,
+                name="IEDB A*02:01-specific RF"
+            )
+            print_metrics(metrics_a02)
+            all_results.append(metrics_a02)
 
     # ── Model 3: Combine IEDB scores with TESLA features ──
     print("\n\n--- Hybrid: IEDB sequence score + TESLA binding features ---")
@@ -296,27 +579,14 @@ if __name__ == "__main__":
     from tools.error_analysis_and_multifeature import add_mhcflurry_features
     tesla = add_mhcflurry_features(tesla)
 
-    # Add mutation-site features
-    mut_features = []
-    for _, row in tesla.iterrows():
-        feat = reconstruct_wt_and_compute_diff(row['peptide'], row.get('mutation_position'))
-        mut_features.append(feat)
-    tesla_mut = pd.DataFrame(mut_features)
-    for col in tesla_mut.columns:
-        tesla[col] = tesla_mut[col].values
-
-    hybrid_features = [
-        # TESLA binding features
-        'predicted_affinity', 'binding_stability', 'tumor_abundance',
-        'agretopicity',
-        # MHCflurry
-        'mhcflurry_presentation', 'mhcflurry_affinity', 'mhcflurry_processing',
-        # IEDB transfer score
-        'iedb_score',
-        # Mutation site features
-        'mut_blosum_self', 'mut_aa_rarity',
-        'mut_residue_hydro', 'mut_residue_charge', 'mut_residue_size',
-    ]
+    # TESLA binding + MHCflurry + IEDB transfer score + mutation site features
+    hybrid_features = list(FEATURE_SETS['hybrid'])
+
+    # Substitution-aware features (wt_peptide, or rebuilt from wt_residue)
+    if has_wt:
+        hybrid_features += FEATURE_SETS['substitution']
+
+    tesla = add_features(tesla, hybrid_features)
 
     X_hybrid = tesla[hybrid_features].values.copy()
     # Log-transform
@@ -335,8 +605,12 @@ if __name__ == "__main__":
         n_estimators=500, class_weight='balanced',
         max_depth=5, min_samples_leaf=5, random_state=42
     )
-    rf_probs = cross_val_predict(rf, X_hybrid, y_true, cv=logo, groups=groups, method='predict_proba')[:, 1]
-    rf_metrics = evaluate_predictions(y_true, rf_probs, name="Hybrid RF (IEDB + TESLA + MHCflurry + mut)")
+    with annotate(features=hybrid_features, params=rf.get_params()):
+        with span("cv.fit", model="RF", features="hybrid", rows=len(X_hybrid)):
+            rf_models, rf_probs = fold_models(rf, X_hybrid, y_true, groups)
+        rf_metrics = evaluate_predictions(y_true, rf_probs, name="Hybrid RF (IEDB + TESLA + MHCflurry + mut)")
+    record_finding(rf, X_hybrid, y_true, groups, rf_probs, rf_metrics, features=hybrid_features)
+    record_oof(rf_metrics["name"], rf_probs, y_true, groups, rf_metrics, hybrid_features, rf.get_params())
     print_metrics(rf_metrics)
     all_results.append(rf_metrics)
 
@@ -345,8 +619,13 @@ if __name__ == "__main__":
         n_estimators=200, max_depth=3, learning_rate=0.05,
         min_samples_leaf=5, random_state=42, subsample=0.8,
     )
-    gb_probs = cross_val_predict(gb, X_hybrid, y_true, cv=logo, groups=groups, method='predict_proba')[:, 1]
-    gb_metrics = evaluate_predictions(y_true, gb_probs, name="Hybrid GB (IEDB + TESLA + MHCflurry + mut)")
+    with annotate(features=hybrid_features, params=gb.get_params()):
+        with span("cv.fit", model="GB", features="hybrid", rows=len(X_hybrid)):
+            gb_probs = cross_val_predict(gb, X_hybrid, y_true, cv=logo, groups=groups,
+                                         method='predict_proba')[:, 1]
+        gb_metrics = evaluate_predictions(y_true, gb_probs, name="Hybrid GB (IEDB + TESLA + MHCflurry + mut)")
+    record_finding(gb, X_hybrid, y_true, groups, gb_probs, gb_metrics, features=hybrid_features)
+    record_oof(gb_metrics["name"], gb_probs, y_true, groups, gb_metrics, hybrid_features, gb.get_params())
     print_metrics(gb_metrics)
     all_results.append(gb_metrics)
 
@@ -354,36 +633,28 @@ if __name__ == "__main__":
     best_probs = rf_probs if rf_metrics['auprc'] >= gb_metrics['auprc'] else gb_probs
     best_name = "RF" if rf_metrics['auprc'] >= gb_metrics['auprc'] else "GB"
     print(f"\n--- Per-patient breakdown (Hybrid {best_name}) ---")
-    from sklearn.metrics import roc_auc_score, average_precision_score
-    for patient in sorted(tesla['patient_id'].unique()):
-        mask = groups == patient
-        p_y = y_true[mask]
-        p_scores = best_probs[mask]
-        n_imm = p_y.sum()
-        if n_imm > 0 and (p_y == 0).sum() > 0:
-            auc = roc_auc_score(p_y, p_scores)
-            ap = average_precision_score(p_y, p_scores)
-            print(f"  Patient {patient}: AUC-ROC={auc:.3f}, AUPRC={ap:.3f} "
-                  f"({n_imm} immunogenic / {mask.sum()} total)")
+    breakdown = evaluate_groups(y_true, best_probs, {"patient_id": groups}, names=[best_name])
+    print_group_breakdown(breakdown, "patient_id", prefix="Patient ")
 
     # ── Feature importance ──
-    print("\n--- Hybrid RF Feature Importance ---")
-    rf.fit(X_hybrid, y_true)
-    for feat, imp in sorted(zip(hybrid_features, rf.feature_importances_), key=lambda x: -x[1]):
-        bar = '█' * int(imp * 100)
-        print(f"  {feat:40s} {imp:.4f} {bar}")
+    print("\n--- Hybrid RF Feature Importance (out-of-fold permutation) ---")
+    for by in ("family", "column"):
+        importance = permutation_importance(rf_models, X_hybrid, y_true, groups, column_groups(hybrid_features, by))
+        print_importance(importance, f"Permutation importance by {by}")
 
     # ── Baselines for comparison ──
     valid = ~tesla['mhcflurry_presentation'].isna()
-    mhcf = evaluate_predictions(
-        y_true[valid.values],
-        tesla.loc[valid, 'mhcflurry_presentation'].values,
-        name='MHCflurry single'
-    )
+    with annotate(features=['mhcflurry_presentation']):
+        mhcf = evaluate_predictions(
+            y_true[valid.values],
+            tesla.loc[valid, 'mhcflurry_presentation'].values,
+            name='MHCflurry single'
+        )
     all_results.append(mhcf)
 
     np.random.seed(42)
-    rand = evaluate_predictions(y_true, np.random.rand(len(tesla)), name='Random')
+    with annotate():
+        rand = evaluate_predictions(y_true, np.random.rand(len(tesla)), name='Random')
     all_results.append(rand)
 
     # ── Final comparison ──
@@ -392,4 +663,4 @@ if __name__ == "__main__":
     print("=" * 70)
     compare_models(all_results)
     print("\nPublished TESLA ensemble: AUPRC ~0.28, AUC-ROC ~0.80")
-    print("Previous best (RF TESLA+MHCflurry): AUPRC 0.212, AUC-ROC 0.738")
+    print_previous_best()
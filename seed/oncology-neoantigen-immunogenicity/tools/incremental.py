@@ -0,0 +1,542 @@
+"""
+Incremental retraining when new IEDB exports or new TESLA-style patients arrive.
+
+IEDB: a new export is diffed against the cached deduplicated table at the
+level of peptide-allele groups. Assay counts are compared per group; only
+added and changed groups are relabeled, unchanged groups keep their label.
+Sequence features come from the FeatureStore, so only peptides it has not
+seen are computed. The model is then extended rather than refit:
+
+- forests / boosting: warm_start with extra trees or boosting rounds,
+  proportional to the share of added and changed groups
+- estimators with partial_fit: one partial_fit pass over the new rows
+- anything else: full rebuild
+
+Patients (LOGO models): one fitted model per held-out patient is kept.
+Existing fold models are extended with the new patients' rows (which are
+in every old fold's training set) and new patients get a fresh fold model.
+The imputer and scaler of the first build are reused, so old trees see
+features on the scale they were grown on.
+
+A full rebuild (new preprocessing, fresh trees, new drift reference)
+happens instead when any drift metric crosses DRIFT_THRESHOLDS. All of them
+are cumulative since the last rebuild, so a run of small updates cannot
+drift past the thresholds unnoticed:
+
+- psi          max Population Stability Index of a feature, all rows added
+               since the rebuild vs the training reference (quantile bins)
+- label_shift  absolute change in the positive rate
+- churn        groups relabeled or removed since the rebuild, relative to
+               the rows of the rebuild (appended trees cannot unlearn old
+               labels)
+- growth       rows added since the rebuild, relative to its rows
+
+State (pickled) lives in data/incremental/<name>/state.pkl.
+
+Usage:
+    python -m tools.incremental iedb                          # first call builds
+    python -m tools.incremental iedb --export new_iedb.csv    # later exports update
+    python -m tools.incremental patients --input cohort.csv --features tesla+novel
+    python -m tools.incremental status
+"""
+import math
+import pickle
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_STATE_ROOT = PROJECT_ROOT / "data" / "incremental"
+
+DRIFT_THRESHOLDS = {
+    "psi": 0.25,
+    "label_shift": 0.05,
+    "churn": 0.05,
+    "growth": 0.5,
+}
+PSI_BINS = 10
+# Trees / boosting rounds added per update, as a fraction of the base size
+MIN_EXTRA_FRACTION = 0.02
+
+# Per-patient LOGO model (the experiment scripts' RF)
+LOGO_MODEL_PARAMS = {
+    "n_estimators": 500,
+    "class_weight": "balanced",
+    "max_depth": 5,
+    "min_samples_leaf": 5,
+    "random_state": 42,
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# STATE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def state_path(name, root=None):
+    return Path(root or DEFAULT_STATE_ROOT) / name / "state.pkl"
+
+
+def load_state(name, root=None):
+    path = state_path(name, root)
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_state(name, state, root=None):
+    path = state_path(name, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# DRIFT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def drift_reference(X, y):
+    """Quantile bin edges and bin shares of every column of X, plus the positive rate."""
+    quantiles = np.linspace(0, 1, PSI_BINS + 1)[1:-1]
+    edges = np.nanquantile(X, quantiles, axis=0).T  # (n_features, PSI_BINS - 1)
+    shares = np.vstack([_bin_shares(X[:, j], edges[j]) for j in range(X.shape[1])])
+    return {"edges": edges, "shares": shares, "positive_rate": float(np.mean(y)), "n_rows": len(y)}
+
+
+def _bin_counts(values, edges):
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+
+def _bin_shares(values, edges):
+    counts = _bin_counts(values, edges)
+    return counts / max(counts.sum(), 1)
+
+
+def _psi(reference, counts):
+    """PSI of every feature from bin counts (n_features, PSI_BINS) against the reference shares."""
+    eps = 1e-4
+    expected = np.clip(reference["shares"], eps, None)
+    actual = np.clip(counts / np.maximum(counts.sum(axis=1, keepdims=True), 1), eps, None)
+    return np.sum((actual - expected) * np.log(actual / expected), axis=1)
+
+
+def _binned(reference, X):
+    return np.vstack([_bin_counts(X[:, j], reference["edges"][j]) for j in range(X.shape[1])])
+
+
+def population_stability(reference, X_new):
+    """PSI of every column of X_new against the reference bins."""
+    return _psi(reference, _binned(reference, X_new))
+
+
+def drift_since_rebuild(reference):
+    """Empty cumulative drift counters for a fresh reference."""
+    return {"bin_counts": np.zeros_like(reference["shares"], dtype=np.int64), "added": 0, "churned": 0}
+
+
+def accumulate_drift(since, reference, X_new, n_churned):
+    """Add an update's new rows (binned on the reference edges) and churned groups to the counters."""
+    if len(X_new):
+        since["bin_counts"] += _binned(reference, X_new)
+    since["added"] += len(X_new)
+    since["churned"] += n_churned
+    return since
+
+
+def drift_metrics(reference, since, y_all, feature_cols):
+    """
+    Drift metrics since the last rebuild and the feature with the largest PSI.
+
+    Args:
+        reference: drift_reference() of the last rebuild.
+        since: Counters from accumulate_drift() over every update since then.
+        y_all: Labels of all current rows.
+    """
+    psi = _psi(reference, since["bin_counts"]) if since["added"] else np.zeros(len(feature_cols))
+    worst = int(np.argmax(psi)) if len(psi) else 0
+    return {
+        "psi": float(psi[worst]) if len(psi) else 0.0,
+        "psi_feature": feature_cols[worst] if len(psi) else "",
+        "label_shift": abs(float(np.mean(y_all)) - reference["positive_rate"]),
+        "churn": since["churned"] / max(reference["n_rows"], 1),
+        "growth": since["added"] / max(reference["n_rows"], 1),
+    }
+
+
+def exceeded(metrics, thresholds=None):
+    """Names of the drift metrics above their thresholds."""
+    thresholds = {**DRIFT_THRESHOLDS, **(thresholds or {})}
+    return [name for name, limit in thresholds.items() if metrics[name] > limit]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODEL EXTENSION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def extend_model(model, X, y, new_rows, fraction):
+    """
+    Extend a fitted model with new data in place, if the estimator supports it.
+
+    Args:
+        X, y: Full training data after the update (forests and boosting
+              refit their new trees / rounds on all of it).
+        new_rows: Boolean mask of added or relabeled rows (partial_fit sees
+                  only these).
+        fraction: Share of the data that is new; sets the number of extra
+                  trees or boosting rounds.
+
+    Returns a description of the action, or None if the model cannot be
+    extended (the caller rebuilds).
+    """
+    params = model.get_params()
+    if "warm_start" in params and "n_estimators" in params:
+        base = params["n_estimators"]
+        extra = max(1, math.ceil(base * max(fraction, MIN_EXTRA_FRACTION)))
+        model.set_params(warm_start=True, n_estimators=base + extra)
+        with warnings.catch_warnings():
+            # class_weight="balanced" + warm_start warns; every new tree sees the full data
+            warnings.simplefilter("ignore", UserWarning)
+            model.fit(X, y)
+        model.set_params(warm_start=False)
+        return f"warm_start +{extra} estimators ({base} -> {base + extra})"
+    if hasattr(model, "partial_fit"):
+        model.partial_fit(X[new_rows], y[new_rows])
+        return f"partial_fit on {int(new_rows.sum())} rows"
+    return None
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# IEDB
+# ══════════════════════════════════════════════════════════════════════════════
+
+def diff_dedup(old, assays, strategy="majority"):
+    """
+    Diff an assay-level IEDB export against a deduplicated table.
+
+    Args:
+        old: Previous deduplicate_iedb() output (with n_assays, n_positive).
+        assays: New filtered assays (peptide, allele, immunogenic, peptide_length).
+
+    Returns:
+        (table, diff): the new deduplicated table (same columns and order as
+        deduplicate_iedb(assays, strategy)) and a dict of boolean masks over
+        its rows (added, changed, relabeled) plus n_removed.
+    """
+    from tools.data_loader import label_from_counts
+
+    counts = assays.groupby(["peptide", "allele"]).agg(
+        n_assays=("immunogenic", "count"),
+        n_positive=("immunogenic", "sum"),
+        peptide_length=("peptide_length", "first"),
+    ).reset_index()
+    prev = old[["peptide", "allele", "immunogenic", "n_assays", "n_positive"]]
+    merged = counts.merge(prev, on=["peptide", "allele"], how="left", suffixes=("", "_old"))
+
+    added = merged["n_assays_old"].isna().to_numpy()
+    changed = ~added & ((merged["n_assays"] != merged["n_assays_old"])
+                        | (merged["n_positive"] != merged["n_positive_old"])).to_numpy()
+    # Only added and changed groups are relabeled; the rest keep their label
+    labels = merged["immunogenic"].to_numpy(copy=True)
+    redo = added | changed
+    labels[redo] = label_from_counts(merged.loc[redo, "n_positive"], merged.loc[redo, "n_assays"], strategy)
+    labels = labels.astype(int)
+    relabeled = changed & (labels != merged["immunogenic"].fillna(-1).to_numpy())
+
+    table = counts.copy()
+    table.insert(2, "immunogenic", labels)
+    n_removed = len(old) - int((~added).sum())
+    return table, {"added": added, "changed": changed, "relabeled": relabeled, "n_removed": n_removed}
+
+
+def _iedb_assays(export=None, allele=None, peptide_lengths=None):
+    from tools.data_loader import filter_iedb, load_iedb
+    return filter_iedb(load_iedb(filtered=True, path=export), allele=allele, peptide_lengths=peptide_lengths)
+
+
+def build_iedb(assays, strategy="majority", store=None, model_params=None):
+    """Full build: deduplicate, features, fit_iedb_model and a new drift reference."""
+    from tools.data_loader import deduplicate_iedb
+    from tools.iedb_transfer import fit_iedb_model, prepare_iedb_sequence_features
+
+    dedup = deduplicate_iedb(assays, strategy=strategy)
+    feats = prepare_iedb_sequence_features(dedup, store=store)
+    y = dedup["immunogenic"].to_numpy()
+    model, feature_cols, imputer, scaler = fit_iedb_model(feats, y, model_params)
+    X = scaler.transform(imputer.transform(feats[feature_cols].values))
+    reference = drift_reference(X, y)
+    return {
+        "strategy": strategy,
+        "model_params": model_params,
+        "dedup": dedup,
+        "model": model,
+        "feature_cols": feature_cols,
+        "imputer": imputer,
+        "scaler": scaler,
+        "reference": reference,
+        "since_rebuild": drift_since_rebuild(reference),
+        "history": [],
+    }
+
+
+def update_iedb(state, assays, store=None, thresholds=None, force_rebuild=False):
+    """
+    Bring an IEDB state up to date with a new export.
+
+    Returns (state, record): record describes the diff, drift metrics and the
+    action taken ("unchanged", "extended" or "rebuilt").
+    """
+    from tools.iedb_transfer import prepare_iedb_sequence_features
+
+    start = time.perf_counter()
+    old = state["dedup"]
+    table, diff = diff_dedup(old, assays, state["strategy"])
+    new_rows = diff["added"] | diff["relabeled"]
+    record = {
+        "time": time.time(),
+        "n_groups": len(table),
+        "added": int(diff["added"].sum()),
+        "changed": int(diff["changed"].sum()),
+        "relabeled": int(diff["relabeled"].sum()),
+        "removed": diff["n_removed"],
+    }
+    if not force_rebuild and not (record["added"] or record["changed"] or record["removed"]):
+        record.update(action="unchanged", wall_s=time.perf_counter() - start)
+        state["history"].append(record)
+        return state, record
+
+    feats = prepare_iedb_sequence_features(table, store=store)
+    cols = state["feature_cols"]
+    X = state["scaler"].transform(state["imputer"].transform(feats.reindex(columns=cols, fill_value=0).values))
+    y = table["immunogenic"].to_numpy()
+
+    # States saved before the counters existed start counting at this update
+    since = state.setdefault("since_rebuild", drift_since_rebuild(state["reference"]))
+    accumulate_drift(since, state["reference"], X[diff["added"]], record["relabeled"] + record["removed"])
+    metrics = drift_metrics(state["reference"], since, y, cols)
+    reasons = ["forced"] if force_rebuild else exceeded(metrics, thresholds)
+    action = None
+    if not reasons:
+        action = extend_model(state["model"], X, y, new_rows, new_rows.sum() / max(len(old), 1))
+        if action is None:
+            reasons = ["estimator cannot be extended"]
+
+    if reasons:
+        rebuilt = build_iedb(assays, state["strategy"], store, state.get("model_params"))
+        rebuilt["history"] = state["history"]
+        state = rebuilt
+        action = f"rebuilt ({', '.join(reasons)})"
+    else:
+        state["dedup"] = table
+    record.update(metrics, action=action, wall_s=time.perf_counter() - start)
+    state["history"].append(record)
+    return state, record
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PATIENT COHORTS (LOGO)
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _fold_oof(models, X, groups):
+    oof = np.full(len(X), np.nan)
+    for g, model in models.items():
+        test = groups == g
+        if test.any():
+            oof[test] = model.predict_proba(X[test])[:, 1]
+    return oof
+
+
+def build_patients(tesla, feature_cols, model_params=None):
+    """Full build: preprocessing on all rows and one fitted model per held-out patient."""
+    from sklearn.ensemble import RandomForestClassifier
+
+    from tools.error_analysis_and_multifeature import prepare_features
+
+    X, imputer, scaler = prepare_features(tesla, feature_cols)
+    y = tesla["immunogenic"].astype(int).to_numpy()
+    groups = tesla["patient_id"].astype(str).to_numpy()
+    params = {**LOGO_MODEL_PARAMS, **(model_params or {})}
+    models = {}
+    for g in np.unique(groups):
+        train = groups != g
+        models[g] = RandomForestClassifier(**params).fit(X[train], y[train])
+    reference = drift_reference(X, y)
+    return {
+        "feature_cols": list(feature_cols),
+        "model_params": params,
+        "imputer": imputer,
+        "scaler": scaler,
+        "rows": tesla[["peptide", "allele", "patient_id"]].astype(str).reset_index(drop=True),
+        "models": models,
+        "reference": reference,
+        "oof": _fold_oof(models, X, groups),
+        "since_rebuild": drift_since_rebuild(reference),
+        "history": [],
+    }
+
+
+def update_patients(state, tesla, thresholds=None, force_rebuild=False):
+    """
+    Add new patients to per-patient LOGO models.
+
+    tesla holds all patients (old and new). Rows of existing patients must be
+    unchanged; otherwise the models are rebuilt.
+
+    Returns (state, record) as update_iedb().
+    """
+    from sklearn.base import clone
+
+    from tools.error_analysis_and_multifeature import apply_features
+
+    start = time.perf_counter()
+    y = tesla["immunogenic"].astype(int).to_numpy()
+    groups = tesla["patient_id"].astype(str).to_numpy()
+    known = set(state["models"])
+    new_patient = ~np.isin(groups, list(known))
+    new_patients = sorted(set(groups[new_patient]))
+    record = {"time": time.time(), "n_rows": len(tesla), "new_patients": new_patients,
+              "added": int(new_patient.sum())}
+
+    old_rows = tesla.loc[~new_patient, ["peptide", "allele", "patient_id"]].astype(str).reset_index(drop=True)
+    same_rows = old_rows.equals(state["rows"])
+    if not force_rebuild and same_rows and not new_patients:
+        record.update(action="unchanged", wall_s=time.perf_counter() - start)
+        state["history"].append(record)
+        return state, record
+
+    cols = state["feature_cols"]
+    X = apply_features(tesla, cols, state["imputer"], state["scaler"])
+    # States saved before the counters existed start counting at this update
+    since = state.setdefault("since_rebuild", drift_since_rebuild(state["reference"]))
+    accumulate_drift(since, state["reference"], X[new_patient], 0)
+    metrics = drift_metrics(state["reference"], since, y, cols)
+    reasons = ["forced"] if force_rebuild else exceeded(metrics, thresholds)
+    if not same_rows:
+        reasons.append("existing patients' rows changed")
+
+    if not reasons:
+        actions = []
+        for g, model in state["models"].items():
+            train = groups != g
+            action = extend_model(model, X[train], y[train], new_patient[train],
+                                  new_patient[train].sum() / max(train.sum(), 1))
+            if action is None:
+                reasons = ["estimator cannot be extended"]
+                break
+            actions.append(action)
+        else:
+            for g in new_patients:
+                train = groups != g
+                state["models"][g] = clone(next(iter(state["models"].values()))).fit(X[train], y[train])
+            state["rows"] = tesla[["peptide", "allele", "patient_id"]].astype(str).reset_index(drop=True)
+            state["oof"] = _fold_oof(state["models"], X, groups)
+            action = f"extended {len(actions)} folds ({actions[0] if actions else '-'}), " \
+                     f"{len(new_patients)} new folds"
+
+    if reasons:
+        rebuilt = build_patients(tesla, cols, state["model_params"])
+        rebuilt["history"] = state["history"]
+        state = rebuilt
+        action = f"rebuilt ({', '.join(reasons)})"
+    record.update(metrics, action=action, wall_s=time.perf_counter() - start)
+    state["history"].append(record)
+    return state, record
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _print_record(record):
+    print(f"  Action: {record['action']} in {record['wall_s']:.1f}s")
+    keys = [k for k in ("n_groups", "n_rows", "added", "changed", "relabeled", "removed", "new_patients")
+            if k in record]
+    print("  " + ", ".join(f"{k}={record[k]}" for k in keys))
+    if "psi" in record:
+        print(f"  Drift: psi={record['psi']:.3f} ({record['psi_feature']}), "
+              f"label_shift={record['label_shift']:.3f}, churn={record['churn']:.3f}, "
+              f"growth={record['growth']:.3f}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.incremental", description=__doc__.split("\n")[1])
+    parser.add_argument("--root", help="State directory (default: data/incremental)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    iedb = sub.add_parser("iedb", help="Build or update the pan-allele IEDB model")
+    iedb.add_argument("--export", help="New filtered IEDB export (default: the configured file)")
+    iedb.add_argument("--strategy", default="majority", choices=["majority", "any_positive", "strict_positive"])
+    iedb.add_argument("--lengths", type=int, nargs="+", default=[8, 9, 10, 11])
+    iedb.add_argument("--rebuild", action="store_true", help="Force a full rebuild")
+
+    pat = sub.add_parser("patients", help="Build or update per-patient LOGO models")
+    pat.add_argument("--input", default="tesla", help='"tesla" or a table with all patients')
+    pat.add_argument("--features", default="tesla", help="FEATURE_SETS names joined by '+'")
+    pat.add_argument("--rebuild", action="store_true", help="Force a full rebuild")
+
+    sub.add_parser("status", help="Show stored states and their update history")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        root = Path(args.root or DEFAULT_STATE_ROOT)
+        paths = sorted(root.glob("*/state.pkl")) if root.exists() else []
+        if not paths:
+            print("No incremental states")
+        for path in paths:
+            state = load_state(path.parent.name, args.root)
+            since = state.get("since_rebuild") or {"added": 0, "churned": 0}
+            print(f"{path.parent.name}: {len(state['history'])} updates, "
+                  f"reference {state['reference']['n_rows']:,} rows, since rebuild "
+                  f"{since['added']:,} added / {since['churned']:,} churned")
+            for record in state["history"][-5:]:
+                print(f"  {time.strftime('%Y-%m-%d %H:%M', time.localtime(record['time']))}  {record['action']}")
+        return 0
+
+    if args.command == "iedb":
+        from tools.feature_store import FeatureStore
+
+        store = FeatureStore()
+        assays = _iedb_assays(args.export, peptide_lengths=args.lengths)
+        name = f"iedb_{args.strategy}"
+        state = load_state(name, args.root)
+        if state is None:
+            print(f"No state for {name}; full build on {len(assays):,} assays")
+            state = build_iedb(assays, args.strategy, store)
+        else:
+            state, record = update_iedb(state, assays, store, force_rebuild=args.rebuild)
+            _print_record(record)
+        save_state(name, state, args.root)
+        return 0
+
+    from tools.cli import read_frame
+    from tools.evaluate import evaluate_predictions, print_metrics
+    from tools.feature_registry import FEATURE_SETS, add_features
+
+    tesla = read_frame(args.input)
+    cols = list(dict.fromkeys(col for n in args.features.split("+") for col in FEATURE_SETS[n]))
+    missing = [col for col in cols if col not in tesla.columns]
+    if missing:
+        tesla = add_features(tesla, missing)
+    name = f"patients_{args.features}"
+    state = load_state(name, args.root)
+    if state is None:
+        print(f"No state for {name}; full build on {tesla['patient_id'].nunique()} patients")
+        state = build_patients(tesla, cols)
+    else:
+        state, record = update_patients(state, tesla, force_rebuild=args.rebuild)
+        _print_record(record)
+    save_state(name, state, args.root)
+    print_metrics(evaluate_predictions(tesla["immunogenic"].astype(int).values, state["oof"],
+                                       name=f"LOGO RF ({args.features}, incremental)"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""
+Append-only results ledger with provenance.
+
+Every evaluate_predictions() call made while a ledger session is open is
+appended to a ColumnarLog together with where it came from: a hash of the
+evaluation data, a hash of the feature set, model parameters, the git
+commit, wall time and peak memory. Runtime is tracked as closely as
+accuracy, so a change that keeps AUPRC but doubles the wall time shows up
+in the same diff.
+
+Layout:
+
+    data/ledger/           (ColumnarLog, one row per evaluation)
+
+Usage (in a script):
+    from tools.ledger import start_session, annotate
+    start_session("iedb_transfer", data=tesla)
+    with annotate(features=feature_cols, params=model.get_params()):
+        probs = cross_val_predict(model, X, y, ...)
+        metrics = evaluate_predictions(y, probs, name="RF")   # recorded
+
+Command line:
+    python -m tools.ledger query [--name RF] [--last 20]
+    python -m tools.ledger diff [--run RUN_ID] [--metric auprc]
+
+Setting OPENSCIENCE_LEDGER=<path> records evaluations without an explicit
+start_session(), into that path.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.columnar import STR, ColumnarLog
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_LEDGER_PATH = PROJECT_ROOT / "data" / "ledger"
+LEDGER_ENV = "OPENSCIENCE_LEDGER"
+
+METRIC_COLUMNS = (
+    "auc_roc", "auprc", "fr_top100", "ttif_top20",
+    "f1_median_threshold", "precision_median_threshold", "recall_median_threshold",
+)
+
+SCHEMA = {
+    "run_id": STR,
+    "timestamp": "f8",
+    "script": STR,
+    "name": STR,
+    "git_commit": STR,
+    "data_hash": STR,
+    "feature_hash": STR,
+    "features": STR,        # JSON list
+    "params": STR,          # JSON object
+    "n_total": "i8",
+    "n_positive": "i8",
+    **{metric: "f8" for metric in METRIC_COLUMNS},
+    "wall_time_s": "f8",
+    "peak_mem_mb": "f8",
+}
+
+# Regression thresholds for diff(): absolute metric drop, relative slowdown
+DEFAULT_TOLERANCE = 0.005
+DEFAULT_TIME_TOLERANCE = 0.25
+# Slowdowns smaller than this many seconds are timer noise, never regressions
+MIN_TIME_DELTA_S = 0.5
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PROVENANCE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def hash_data(obj):
+    """Short content hash of a DataFrame, Series or array."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return _digest(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+    return _digest(np.ascontiguousarray(obj).tobytes())
+
+
+def hash_features(features):
+    """Order-insensitive hash of a feature list ("" when unknown)."""
+    if not features:
+        return ""
+    return _digest("\x1f".join(sorted(map(str, features))).encode())
+
+
+def git_commit():
+    """Current commit of the repository, with '+dirty' for uncommitted changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "diff", "--quiet", "HEAD", "--", "."], cwd=PROJECT_ROOT,
+        ).returncode != 0
+        return commit + ("+dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process and its finished children, in MB."""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 ** 2) if sys.platform == "darwin" else peak / 1024
+
+
+def _json(obj):
+    return json.dumps(obj, sort_keys=True, default=str)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# LEDGER
+# ══════════════════════════════════════════════════════════════════════════════
+
+class Ledger:
+    """Columnar append log of evaluation records."""
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        self.path = Path(path)
+
+    def append(self, records):
+        """Append a list of record dicts (keys from SCHEMA)."""
+        if not records:
+            return
+        log = ColumnarLog(self.path, SCHEMA)
+        log.append({col: [r[col] for r in records] for col in log.schema})
+
+    def read(self):
+        """All records as a DataFrame (empty with SCHEMA columns if none)."""
+        if not ColumnarLog.exists(self.path):
+            return pd.DataFrame({col: [] for col in SCHEMA})
+        columns = ColumnarLog(self.path).read(mmap=False)
+        return pd.DataFrame(columns)
+
+    def best(self, metric="auprc", name=None, data_hash=None, exclude_run=None):
+        """Best prior record by metric, optionally restricted by name, data and run."""
+        df = self.read()
+        if name is not None:
+            df = df[df["name"] == name]
+        if data_hash is not None:
+            df = df[df["data_hash"] == data_hash]
+        if exclude_run is not None:
+            df = df[df["run_id"] != exclude_run]
+        df = df.dropna(subset=[metric])
+        if df.empty:
+            return None
+        return df.loc[df[metric].idxmax()].to_dict()
+
+    def diff(self, run_id=None, metric="auprc", tolerance=DEFAULT_TOLERANCE,
+             time_tolerance=DEFAULT_TIME_TOLERANCE):
+        """
+        Compare one run (default: the latest) against all earlier runs.
+
+        For every model name in the run, matched on name and data hash, the
+        run's metric is compared with the best earlier value and its wall time
+        with the fastest earlier time (ignoring slowdowns under MIN_TIME_DELTA_S).
+
+        Returns:
+            DataFrame with name, metric, best_prior, delta, wall_time_s,
+            fastest_prior_s, slowdown, accuracy_regression, runtime_regression
+        """
+        df = self.read()
+        if df.empty:
+            return pd.DataFrame()
+        if run_id is None:
+            run_id = df.loc[df["timestamp"].idxmax(), "run_id"]
+        current = df[df["run_id"] == run_id]
+        prior = df[(df["run_id"] != run_id) & (df["timestamp"] < current["timestamp"].min())]
+
+        rows = []
+        for rec in current.itertuples(index=False):
+            same = prior[(prior["name"] == rec.name) & (prior["data_hash"] == rec.data_hash)]
+            value = getattr(rec, metric)
+            best_prior = same[metric].max() if len(same) else np.nan
+            fastest = same["wall_time_s"].min() if len(same) else np.nan
+            slowdown = rec.wall_time_s / fastest - 1 if fastest > 0 else np.nan
+            rows.append({
+                "name": rec.name,
+                metric: value,
+                "best_prior": best_prior,
+                "delta": value - best_prior,
+                "wall_time_s": rec.wall_time_s,
+                "fastest_prior_s": fastest,
+                "slowdown": slowdown,
+                "accuracy_regression": bool(value < best_prior - tolerance),
+                "runtime_regression": bool(slowdown > time_tolerance
+                                           and rec.wall_time_s - fastest > MIN_TIME_DELTA_S),
+            })
+        return pd.DataFrame(rows)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SESSIONS
+# ══════════════════════════════════════════════════════════════════════════════
+
+class _Session:
+    def __init__(self, script, data_hash, path):
+        self.ledger = Ledger(path)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.script = script
+        self.data_hash = data_hash
+        self.git_commit = git_commit()
+        self.annotations = []
+        self.last_time = time.perf_counter()
+
+
+_SESSION = None
+
+
+def start_session(script=None, data=None, path=DEFAULT_LEDGER_PATH):
+    """
+    Start recording evaluate_predictions() outputs for this process.
+
+    Args:
+        script: Label for the producing script (default: sys.argv[0] stem).
+        data: Evaluation dataset (DataFrame) used for the data hash. Without
+              it, each record hashes its own labels.
+        path: Ledger directory.
+
+    Returns the run id shared by all records of this session.
+    """
+    global _SESSION
+    if script is None:
+        script = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else "interactive"
+    data_hash = hash_data(data) if data is not None else ""
+    _SESSION = _Session(script, data_hash, path)
+    return _SESSION.run_id
+
+
+def end_session():
+    """Stop recording."""
+    global _SESSION
+    _SESSION = None
+
+
+def current_session():
+    """The open session, starting one from OPENSCIENCE_LEDGER if set."""
+    if _SESSION is None and os.environ.get(LEDGER_ENV):
+        start_session(path=os.environ[LEDGER_ENV])
+    return _SESSION
+
+
+@contextmanager
+def annotate(features=None, params=None):
+    """
+    Attach a feature set and model params to evaluations inside the block.
+
+    Wall time of those records is measured from the start of the block, so
+    wrap the training/prediction code along with the evaluate call.
+    """
+    session = current_session()
+    if session is None:
+        yield
+        return
+    session.annotations.append({"features": features, "params": params,
+                                "start": time.perf_counter()})
+    try:
+        yield
+    finally:
+        session.annotations.pop()
+
+
+def record_evaluation(metrics, y_true):
+    """Append one evaluate_predictions() result to the open session's ledger (no-op without one)."""
+    session = current_session()
+    if session is None:
+        return
+    now = time.perf_counter()
+    note = session.annotations[-1] if session.annotations else {}
+    start = note.get("start", session.last_time)
+    features = list(note.get("features") or [])
+    params = note.get("params") or {}
+    session.last_time = now
+
+    record = {
+        "run_id": session.run_id,
+        "timestamp": time.time(),
+        "script": session.script,
+        "name": str(metrics["name"]),
+        "git_commit": session.git_commit,
+        "data_hash": session.data_hash or hash_data(np.asarray(y_true)),
+        "feature_hash": hash_features(features),
+        "features": _json(features),
+        "params": _json(params),
+        "n_total": int(metrics["n_total"]),
+        "n_positive": int(metrics["n_positive"]),
+        "wall_time_s": now - start,
+        "peak_mem_mb": peak_memory_mb(),
+    }
+    record.update({metric: float(metrics.get(metric, np.nan)) for metric in METRIC_COLUMNS})
+    session.ledger.append([record])
+
+
+def print_previous_best(metric="auprc"):
+    """Print the best earlier ledger record on the current data (replaces hard-coded references)."""
+    session = current_session()
+    if session is None:
+        best = Ledger().best(metric=metric)
+    else:
+        best = session.ledger.best(metric=metric, data_hash=session.data_hash or None,
+                                   exclude_run=session.run_id)
+    if best is None:
+        print("Previous best: no earlier runs in the results ledger")
+        return
+    print(f"Previous best ({best['name']}, {best['git_commit'][:8]}): "
+          f"AUPRC {best['auprc']:.3f}, AUC-ROC {best['auc_roc']:.3f}")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.ledger", description=__doc__.split("\n")[1])
+    parser.add_argument("--path", default=str(DEFAULT_LEDGER_PATH), help="Ledger directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    query = sub.add_parser("query", help="List recorded evaluations")
+    query.add_argument("--name", help="Substring of the model name")
+    query.add_argument("--script", help="Producing script")
+    query.add_argument("--run", help="Run id")
+    query.add_argument("--last", type=int, default=20, help="Show the N most recent records")
+
+    diff = sub.add_parser("diff", help="Flag regressions of a run against the best prior runs")
+    diff.add_argument("--run", help="Run id (default: latest)")
+    diff.add_argument("--metric", default="auprc", choices=METRIC_COLUMNS)
+    diff.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                      help="Allowed metric drop before flagging")
+    diff.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE,
+                      help="Allowed relative slowdown before flagging")
+
+    args = parser.parse_args(argv)
+    ledger = Ledger(args.path)
+
+    if args.command == "query":
+        df = ledger.read()
+        if args.name:
+            df = df[df["name"].str.contains(args.name, regex=False)]
+        if args.script:
+            df = df[df["script"] == args.script]
+        if args.run:
+            df = df[df["run_id"] == args.run]
+        if df.empty:
+            print("No matching records")
+            return 0
+        df = df.sort_values("timestamp").tail(args.last).copy()
+        df["time"] = pd.to_datetime(df["timestamp"], unit="s").dt.strftime("%Y-%m-%d %H:%M")
+        df["git_commit"] = df["git_commit"].str[:8]
+        cols = ["time", "run_id", "name", "auc_roc", "auprc", "fr_top100", "ttif_top20",
+                "wall_time_s", "peak_mem_mb", "git_commit"]
+        print(df[cols].to_string(index=False, float_format="%.4f"))
+        return 0
+
+    table = ledger.diff(args.run, args.metric, args.tolerance, args.time_tolerance)
+    if table.empty:
+        print("Ledger is empty")
+        return 0
+    print(table.to_string(index=False, float_format="%.4f"))
+    n_acc = int(table["accuracy_regression"].sum())
+    n_time = int(table["runtime_regression"].sum())
+    print(f"\n{n_acc} accuracy regression(s), {n_time} runtime regression(s)")
+    return 1 if n_acc or n_time else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
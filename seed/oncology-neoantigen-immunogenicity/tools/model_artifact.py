@@ -0,0 +1,487 @@
+"""
+Compact model artifacts for shipping tree ensembles to contributor machines.
+
+A fitted RandomForest / GradientBoosting classifier (with the imputer and
+scaler it was fit behind) is written as one binary file built on the
+tools.flat_forest layout. The file holds no pickled objects. It is a small
+JSON header plus raw arrays:
+
+    feature        split feature per node (uint8 / uint16)
+    qthreshold     index into the feature's threshold table (uint8 / uint16)
+    thresholds     per-feature sorted threshold tables, concatenated
+                   (float64 "exact", float16 "float16", or at most 255 bins
+                   per feature "uint8")
+    children       left / right child per node (int32)
+    leaf_index     index into the deduplicated leaf-value table (uint16 / uint32)
+    leaf_values    distinct leaf values (float64)
+    impute, mean, scale   preprocessing (SimpleImputer + StandardScaler)
+
+Optional pruning keeps the smallest prefix of trees (and, for forests, depth
+cut) whose AUPRC on an evaluation set (TESLA) is within max_loss of the full
+model. Leaves are always deduplicated.
+
+Arrays are compressed with zstd (zlib if the zstandard package is not
+installed), or stored raw and 64-byte aligned with compression="none", in
+which case load_artifact() memory-maps them. The per-node integer arrays
+(feature, qthreshold, children, roots, missing_left) are then used in
+place, so processes scoring with the same file share those pages; the
+float64 node thresholds and leaf values are decoded from the compact
+tables into private memory on load.
+
+Usage:
+    from tools.model_artifact import pack, load_artifact
+    report = pack(model, "iedb_rf.nafm", feature_cols, imputer, scaler,
+                  thresholds="uint8", eval_data=(X_tesla_raw, y), max_loss=0.005)
+    artifact = load_artifact("iedb_rf.nafm")
+    probs = artifact.score(tesla_feature_frame)
+
+    python -m tools.model_artifact pack --state data/incremental/iedb_majority/state.pkl -o iedb.nafm
+    python -m tools.model_artifact info iedb.nafm
+    python -m tools.model_artifact bench          # synthetic IEDB RF, all formats
+"""
+import io
+import json
+import pickle
+import struct
+import sys
+import time
+import zlib
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.flat_forest import FlatForest
+
+MAGIC = b"NAFM"
+FORMAT_VERSION = 1
+ALIGN = 64
+THRESHOLD_MODES = ("exact", "float16", "uint8")
+DEFAULT_COMPRESSION = "zstd"
+UINT8_BINS = 255
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMPRESSION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _zstd():
+    import zstandard
+    return zstandard.ZstdCompressor(level=19).compress, zstandard.ZstdDecompressor().decompress
+
+
+def _zlib():
+    return (lambda data: zlib.compress(data, 9)), zlib.decompress
+
+
+# Name -> factory returning (compress, decompress)
+COMPRESSORS = {"zstd": _zstd, "zlib": _zlib, "none": lambda: (bytes, bytes)}
+
+
+def _compressor(name):
+    try:
+        return name, COMPRESSORS[name]()
+    except ImportError:
+        print("  Warning: zstandard is not installed; compressing with zlib")
+        return "zlib", COMPRESSORS["zlib"]()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# THRESHOLD QUANTIZATION AND PRUNING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def quantize_thresholds(forest, mode="exact"):
+    """Forest with thresholds rounded to float16, or binned to <= 255 per feature ("uint8")."""
+    if mode == "exact":
+        return forest
+    split = np.isfinite(forest.threshold)
+    threshold = forest.threshold.copy()
+    if mode == "float16":
+        if np.abs(threshold[split]).max(initial=0) > np.finfo(np.float16).max:
+            raise ValueError("Thresholds exceed the float16 range; use exact or uint8 thresholds")
+        threshold[split] = threshold[split].astype(np.float16)
+    elif mode == "uint8":
+        tables, _, _ = forest._threshold_tables()
+        for f, table in enumerate(tables):
+            if len(table) <= UINT8_BINS:
+                continue
+            # Representatives: evenly spaced ranks of the distinct thresholds
+            bins = np.unique(table[np.linspace(0, len(table) - 1, UINT8_BINS).round().astype(int)])
+            nodes = np.flatnonzero(split & (forest.feature == f))
+            pos = np.clip(np.searchsorted(bins, threshold[nodes]), 1, len(bins) - 1)
+            lower, upper = bins[pos - 1], bins[pos]
+            threshold[nodes] = np.where(threshold[nodes] - lower <= upper - threshold[nodes], lower, upper)
+    else:
+        raise ValueError(f"Unknown threshold mode {mode!r}; choose from {THRESHOLD_MODES}")
+    return forest.with_thresholds(threshold)
+
+
+def _auprc(y, scores):
+    from tools.evaluate import rank_metrics
+    return float(rank_metrics(y, np.asarray(scores)[None, :])["auprc"][0])
+
+
+def prune(forest, X, y, max_loss=0.005):
+    """
+    Smallest truncation of forest whose AUPRC on (X, y) is within max_loss
+    of the untruncated forest.
+
+    Candidates are prefixes of the trees (and depth cuts for forests),
+    tried from the fewest nodes up.
+
+    Returns (forest, info) with the chosen n_trees, depth and AUPRC values.
+    """
+    full = _auprc(y, forest.predict_proba(X)[:, 1])
+    counts = sorted({k for k in (10, 25, 50, 100, 200, 300, 400) if k < forest.n_trees} | {forest.n_trees})
+    depths = range(3, forest.depth + 1) if forest.kind == "forest" else [forest.depth]
+    candidates = sorted(((forest.truncate(k, d), k, d) for k in counts for d in depths),
+                        key=lambda c: len(c[0].feature))
+    for candidate, k, d in candidates:
+        score = _auprc(y, candidate.predict_proba(X)[:, 1])
+        if full - score <= max_loss:
+            return candidate, {"n_trees": k, "depth": d, "auprc_full": full, "auprc_pruned": score}
+    return forest, {"n_trees": forest.n_trees, "depth": forest.depth, "auprc_full": full, "auprc_pruned": full}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FILE FORMAT
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _smallest_uint(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def artifact_arrays(forest, thresholds="exact", imputer=None, scaler=None):
+    """Compact arrays of a (quantized) forest and its preprocessing."""
+    tables, qthreshold, _ = forest._threshold_tables()
+    leaves = forest.children[0::2] == np.arange(len(forest.feature))
+    leaf_values, leaf_index = np.unique(forest.value[leaves], return_inverse=True)
+    index = np.zeros(len(forest.feature), dtype=_smallest_uint(max(len(leaf_values) - 1, 0)))
+    index[leaves] = leaf_index
+    table_dtype = np.float16 if thresholds == "float16" else np.float64
+    arrays = {
+        "feature": forest.feature.astype(_smallest_uint(forest.n_features - 1)),
+        "qthreshold": qthreshold,
+        "thresholds": np.concatenate(tables).astype(table_dtype) if tables else np.zeros(0, table_dtype),
+        "threshold_offsets": np.cumsum([0] + [len(t) for t in tables]).astype(np.int64),
+        "children": forest.children,
+        "roots": forest.roots,
+        "missing_left": forest.missing_left,
+        "leaf_index": index,
+        "leaf_values": leaf_values,
+    }
+    if imputer is not None:
+        arrays["impute"] = np.asarray(imputer.statistics_, dtype=np.float64)
+    if scaler is not None:
+        arrays["mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+        arrays["scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+    return arrays
+
+
+def save_artifact(path, forest, feature_cols=None, imputer=None, scaler=None, thresholds="exact",
+                  compression=DEFAULT_COMPRESSION, meta=None):
+    """
+    Write a forest (see quantize_thresholds / prune) as a compact artifact.
+
+    Returns the file size in bytes.
+    """
+    compression, (compress, _) = _compressor(compression)
+    arrays = artifact_arrays(forest, thresholds, imputer, scaler)
+    blobs, entries, offset = [], {}, 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        blob = compress(arr.tobytes())
+        pad = -offset % ALIGN
+        blobs.append(b"\0" * pad + blob)
+        offset += pad
+        entries[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset, "nbytes": len(blob)}
+        offset += len(blob)
+    header = {
+        "version": FORMAT_VERSION,
+        "kind": forest.kind,
+        "init": forest.init,
+        "depth": forest.depth,
+        "n_features": forest.n_features,
+        "n_trees": forest.n_trees,
+        "n_nodes": len(forest.feature),
+        "feature_cols": list(feature_cols) if feature_cols is not None else None,
+        "thresholds": thresholds,
+        "compression": compression,
+        "arrays": entries,
+        "meta": meta or {},
+    }
+    header_bytes = json.dumps(header).encode()
+    prefix = MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes
+    prefix += b"\0" * (-len(prefix) % ALIGN)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(prefix)
+        for blob in blobs:
+            f.write(blob)
+    tmp.replace(path)
+    return path.stat().st_size
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a model artifact")
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    start = len(MAGIC) + 8 + length
+    header["data_start"] = start + (-start % ALIGN)
+    return header
+
+
+class ModelArtifact:
+    """Loaded artifact: preprocessing plus a FlatForest."""
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.feature_cols = header["feature_cols"]
+        self.impute = arrays.get("impute")
+        self.mean = arrays.get("mean")
+        self.scale = arrays.get("scale")
+
+        # The per-node integer arrays (feature, qthreshold, children, roots,
+        # missing_left) are used as loaded, so memory-mapped ones stay shared.
+        # Only the float64 node thresholds and leaf values are decoded here.
+        offsets = arrays["threshold_offsets"]
+        table_values = arrays["thresholds"].astype(np.float64)
+        tables = [table_values[offsets[f]:offsets[f + 1]] for f in range(header["n_features"])]
+        feature = arrays["feature"]
+        qthreshold = arrays["qthreshold"]
+        leaves = arrays["children"][0::2] == np.arange(len(feature))
+        # Node thresholds from the tables; leaves keep +inf
+        threshold = np.full(len(feature), np.inf)
+        split = np.flatnonzero(~leaves)
+        threshold[split] = table_values[offsets[feature[split]] + qthreshold[split]]
+        value = np.take(arrays["leaf_values"], arrays["leaf_index"])
+        self.forest = FlatForest(feature, threshold, arrays["children"], value, arrays["roots"],
+                                 arrays["missing_left"], header["depth"], header["n_features"],
+                                 header["kind"], header["init"])
+        self.forest._tables = (tables, qthreshold, qthreshold.dtype)
+
+    def preprocess(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.impute is not None:
+            X = np.where(np.isnan(X), self.impute, X)
+        if self.mean is not None:
+            X = (X - self.mean) / self.scale
+        return X
+
+    def predict_proba(self, X, quantized=False):
+        """Class probabilities of raw (not yet imputed / scaled) feature rows."""
+        return self.forest.predict_proba(self.preprocess(X), quantized)
+
+    def score(self, features):
+        """Class-1 probabilities of a feature DataFrame (missing columns count as 0)."""
+        X = features.reindex(columns=self.feature_cols, fill_value=0).to_numpy(dtype=np.float64)
+        return self.predict_proba(X)[:, 1]
+
+
+def load_artifact(path, mmap=True):
+    """
+    Load an artifact. Uncompressed artifacts are memory-mapped unless mmap=False;
+    compressed ones are read and decompressed.
+    """
+    header = read_header(path)
+    start = header["data_start"]
+    if header["compression"] == "none" and mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        decompress = None
+    else:
+        buffer = Path(path).read_bytes()
+        decompress = COMPRESSORS[header["compression"]]()[1]
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        lo = start + entry["offset"]
+        dtype, shape = np.dtype(entry["dtype"]), tuple(entry["shape"])
+        if decompress is None:
+            arrays[name] = np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=lo).reshape(shape)
+        else:
+            arrays[name] = np.frombuffer(decompress(buffer[lo:lo + entry["nbytes"]]), dtype=dtype).reshape(shape)
+    return ModelArtifact(header, arrays)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PACKING AND REPORTING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _best_time(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def pack(model, path, feature_cols=None, imputer=None, scaler=None, thresholds="exact",
+         compression=DEFAULT_COMPRESSION, eval_data=None, max_loss=None, meta=None):
+    """
+    Export a fitted model as an artifact and report size, load time and AUPRC drift.
+
+    Args:
+        model: Fitted binary RandomForest / ExtraTrees / GradientBoosting classifier.
+        feature_cols, imputer, scaler: Preprocessing the model was fit behind.
+        thresholds: "exact", "float16" or "uint8".
+        eval_data: (X_raw, y) evaluation rows (e.g. TESLA) before imputation
+                   and scaling; needed for pruning and the AUPRC report.
+        max_loss: Largest AUPRC loss accepted from pruning (None: no pruning).
+
+    Returns a report dict (sizes in bytes, load times in seconds, AUPRC of the
+    sklearn model and of the loaded artifact).
+    """
+    forest = quantize_thresholds(FlatForest.from_sklearn(model), thresholds)
+    report = {"path": str(path), "thresholds": thresholds, "n_trees_in": forest.n_trees,
+              "depth_in": forest.depth, "nodes_in": len(forest.feature)}
+    if eval_data is not None:
+        X_raw, y = eval_data
+        X = np.asarray(X_raw, dtype=np.float64)
+        if imputer is not None:
+            X = imputer.transform(X)
+        if scaler is not None:
+            X = scaler.transform(X)
+        if max_loss is not None:
+            forest, info = prune(forest, X, y, max_loss)
+            report["pruning"] = info
+
+    meta = {"estimator": type(model).__name__, "created": time.time(), **(meta or {})}
+    report["artifact_bytes"] = save_artifact(path, forest, feature_cols, imputer, scaler, thresholds,
+                                             compression, meta)
+    report["compression"] = read_header(path)["compression"]
+    report.update(n_trees=forest.n_trees, depth=forest.depth, nodes=len(forest.feature))
+
+    blob = pickle.dumps((model, imputer, scaler), protocol=pickle.HIGHEST_PROTOCOL)
+    report["pickle_bytes"] = len(blob)
+    report["pickle_load_s"] = _best_time(lambda: pickle.load(io.BytesIO(blob)))
+    report["artifact_load_s"] = _best_time(lambda: load_artifact(path))
+
+    if eval_data is not None:
+        artifact = load_artifact(path)
+        sklearn_probs = model.predict_proba(X)[:, 1]
+        artifact_probs = artifact.predict_proba(X_raw)[:, 1]
+        report["auprc_sklearn"] = _auprc(y, sklearn_probs)
+        report["auprc_artifact"] = _auprc(y, artifact_probs)
+        report["auprc_drift"] = report["auprc_artifact"] - report["auprc_sklearn"]
+        report["max_prob_diff"] = float(np.max(np.abs(artifact_probs - sklearn_probs)))
+    return report
+
+
+def print_report(report):
+    print(f"Artifact {report['path']} ({report['thresholds']} thresholds, {report['compression']})")
+    print(f"  Trees {report['n_trees_in']} -> {report['n_trees']}, depth {report['depth_in']} -> "
+          f"{report['depth']}, nodes {report['nodes_in']:,} -> {report['nodes']:,}")
+    print(f"  Size: {report['artifact_bytes'] / 1e3:,.1f} kB vs pickle {report['pickle_bytes'] / 1e3:,.1f} kB "
+          f"({report['pickle_bytes'] / report['artifact_bytes']:.1f}x smaller)")
+    print(f"  Load: {report['artifact_load_s'] * 1e3:.2f} ms vs unpickle {report['pickle_load_s'] * 1e3:.2f} ms")
+    if "auprc_artifact" in report:
+        print(f"  AUPRC: {report['auprc_artifact']:.4f} vs sklearn {report['auprc_sklearn']:.4f} "
+              f"(drift {report['auprc_drift']:+.4f}, max |p diff| {report['max_prob_diff']:.2e})")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _tesla_eval(source, feature_cols):
+    from tools.cli import read_frame
+    from tools.iedb_transfer import prepare_iedb_sequence_features
+
+    tesla = read_frame(source)
+    feats = prepare_iedb_sequence_features(tesla).reindex(columns=feature_cols, fill_value=0)
+    return feats.to_numpy(dtype=np.float64), tesla["immunogenic"].astype(int).to_numpy()
+
+
+def _synthetic_model(n_train=20_000, seed=0):
+    from tools.data_loader import deduplicate_iedb
+    from tools.iedb_transfer import fit_iedb_model, prepare_iedb_sequence_features
+    from tools.synthetic import synthetic_iedb
+
+    iedb = deduplicate_iedb(synthetic_iedb(n_train, seed=seed))
+    with redirect_stdout(io.StringIO()):
+        return fit_iedb_model(prepare_iedb_sequence_features(iedb), iedb["immunogenic"].to_numpy())
+
+
+def main(argv=None):
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(prog="python -m tools.model_artifact", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("pack", help="Export a pickled model as an artifact")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--state", help="tools.incremental state pickle (model, feature_cols, imputer, scaler)")
+    src.add_argument("--pickle", help="Pickled estimator or (model, feature_cols, imputer, scaler) tuple")
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--thresholds", choices=THRESHOLD_MODES, default="exact")
+    p.add_argument("--compression", choices=list(COMPRESSORS), default=DEFAULT_COMPRESSION)
+    p.add_argument("--eval", default="tesla", help='"tesla", a table with immunogenic labels, or "none"')
+    p.add_argument("--max-loss", type=float, help="Prune while TESLA AUPRC drops by at most this much")
+
+    p = sub.add_parser("info", help="Show an artifact's header")
+    p.add_argument("path")
+
+    p = sub.add_parser("bench", help="Pack a synthetic 500-tree IEDB RF in every format")
+    p.add_argument("--max-loss", type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        header = read_header(args.path)
+        sizes = {name: e["nbytes"] for name, e in header.pop("arrays").items()}
+        print(json.dumps({k: v for k, v in header.items() if k != "feature_cols"}, indent=1))
+        for name, size in sorted(sizes.items(), key=lambda kv: -kv[1]):
+            print(f"  {name:18s} {size:>10,d} bytes")
+        return 0
+
+    if args.command == "bench":
+        from tools.synthetic import synthetic_tesla
+
+        model, cols, imputer, scaler = _synthetic_model()
+        compression = _compressor(DEFAULT_COMPRESSION)[0]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "tesla.csv"
+            synthetic_tesla(608).to_csv(path, index=False)
+            eval_data = _tesla_eval(str(path), cols)
+            for thresholds in THRESHOLD_MODES:
+                for codec, max_loss in (("none", None), (compression, None), (compression, args.max_loss)):
+                    name = f"{thresholds}_{codec}{'_pruned' if max_loss else ''}.nafm"
+                    report = pack(model, Path(tmp) / name, cols, imputer, scaler, thresholds, codec,
+                                  eval_data, max_loss)
+                    print_report(report)
+        return 0
+
+    if args.state:
+        with open(args.state, "rb") as f:
+            state = pickle.load(f)
+        model, cols, imputer, scaler = (state[k] for k in ("model", "feature_cols", "imputer", "scaler"))
+    else:
+        with open(args.pickle, "rb") as f:
+            obj = pickle.load(f)
+        model, cols, imputer, scaler = obj if isinstance(obj, tuple) else (obj, None, None, None)
+
+    eval_data = None
+    if args.eval != "none":
+        if cols is None:
+            print("pack: evaluation needs the model's feature columns; use --eval none")
+            return 2
+        eval_data = _tesla_eval(args.eval, cols)
+    report = pack(model, args.output, cols, imputer, scaler, args.thresholds, args.compression,
+                  eval_data, args.max_loss)
+    print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
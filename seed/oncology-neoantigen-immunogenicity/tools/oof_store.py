@@ -0,0 +1,185 @@
+"""
+Keyed store of out-of-fold (out-of-sample) prediction vectors.
+
+Every model score on TESLA that was not fit on the row it scores (LOGO
+out-of-fold probabilities, IEDB-transfer scores, pretrained MHCflurry scores,
+single TESLA features) is kept, aligned row by row, so ensembles can be
+learned over them later without refitting anything (tools.stacking).
+
+Vectors are grouped by dataset: the labels and fold groups they are aligned
+to. Within a dataset each model is keyed by its name, feature set and params,
+so re-running a script replaces its vectors instead of duplicating them.
+
+Layout:
+
+    data/oof/<dataset_key>/
+        _index.json          n_rows and one metadata entry per model
+        labels.npy           0/1 labels
+        groups.npy           fold group (patient) of every row
+        <model_key>.npy      scores, higher = more immunogenic (NaN = no score)
+
+Usage (in a script):
+    from tools.oof_store import record_oof
+    record_oof("RF (novel)", rf_probs, y, groups, metrics=rf_metrics, features=feat_cols)
+
+    from tools.oof_store import OOFStore
+    scores, y, groups = OOFStore().load()     # latest dataset, one column per model
+
+Setting OPENSCIENCE_OOF=<path> uses that directory instead of data/oof.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tools.ledger import current_session, hash_features
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_OOF_ROOT = PROJECT_ROOT / "data" / "oof"
+OOF_ENV = "OPENSCIENCE_OOF"
+INDEX = "_index.json"
+
+
+def dataset_key(y, groups):
+    """Hash of the labels and fold groups a prediction vector is aligned to."""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(np.asarray(y, dtype=np.int8).tobytes())
+    h.update("\x1f".join(map(str, groups)).encode())
+    return h.hexdigest()
+
+
+def model_key(name, features=None, params=None):
+    text = json.dumps([name, hash_features(features), params or {}], sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class OOFStore:
+    """Directory of prediction vectors grouped by the dataset they are aligned to."""
+
+    def __init__(self, root=None):
+        self.root = Path(root or os.environ.get(OOF_ENV) or DEFAULT_OOF_ROOT)
+
+    def _index(self, key):
+        path = self.root / key / INDEX
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def _write_index(self, key, index):
+        tmp = self.root / key / (INDEX + ".tmp")
+        tmp.write_text(json.dumps(index, indent=1, sort_keys=True))
+        os.replace(tmp, self.root / key / INDEX)
+
+    def put(self, name, scores, y, groups, metrics=None, features=None, params=None, meta=None):
+        """
+        Store one model's scores.
+
+        Args:
+            name: Model name (as passed to evaluate_predictions).
+            scores: One score per row of y, higher = more immunogenic.
+            y, groups: Labels and fold groups (patients) of the rows.
+            metrics: Optional evaluate_predictions() output kept in the index.
+            features, params: Part of the model key and kept in the index.
+            meta: Extra index fields (script, run id, ...).
+
+        Returns the model key.
+        """
+        scores = np.asarray(scores, dtype=float)
+        if len(scores) != len(y):
+            raise ValueError(f"{name}: {len(scores)} scores for {len(y)} rows")
+        key = dataset_key(y, groups)
+        path = self.root / key
+        index = self._index(key)
+        if index is None:
+            path.mkdir(parents=True, exist_ok=True)
+            np.save(path / "labels.npy", np.asarray(y, dtype=np.int8))
+            np.save(path / "groups.npy", np.asarray(groups).astype(str))
+            index = {"n_rows": len(scores), "models": {}}
+
+        mkey = model_key(name, features, params)
+        np.save(path / f"{mkey}.npy", scores)
+        index["models"][mkey] = {
+            "name": str(name),
+            "features": list(features or []),
+            "params": params or {},
+            "auprc": float(metrics["auprc"]) if metrics else float("nan"),
+            "auc_roc": float(metrics["auc_roc"]) if metrics else float("nan"),
+            "updated": time.time(),
+            **(meta or {}),
+        }
+        index["updated"] = time.time()
+        self._write_index(key, index)
+        return mkey
+
+    def datasets(self):
+        """One dict per dataset (key, n_rows, n_models, updated), newest first."""
+        if not self.root.exists():
+            return []
+        rows = []
+        for path in self.root.glob(f"*/{INDEX}"):
+            index = json.loads(path.read_text())
+            rows.append({"key": path.parent.name, "n_rows": index["n_rows"],
+                         "n_models": len(index["models"]), "updated": index.get("updated", 0)})
+        return sorted(rows, key=lambda r: -r["updated"])
+
+    def models(self, dataset=None):
+        """Index entries of a dataset (default: the newest) as a DataFrame."""
+        key = dataset or self._latest()
+        index = self._index(key) or {"models": {}}
+        return pd.DataFrame([{"key": k, **v} for k, v in index["models"].items()])
+
+    def _latest(self):
+        datasets = self.datasets()
+        if not datasets:
+            raise FileNotFoundError(f"No out-of-fold predictions in {self.root}")
+        return datasets[0]["key"]
+
+    def load(self, dataset=None, names=None, dedupe=True):
+        """
+        Score matrix of a dataset.
+
+        Args:
+            dataset: Dataset key (default: the newest).
+            names: Model names to load (default: all).
+            dedupe: Drop models whose scores equal an earlier model's.
+
+        Returns:
+            (scores, y, groups): DataFrame with one column per model name, and
+            the aligned labels and groups.
+        """
+        key = dataset or self._latest()
+        path = self.root / key
+        index = self._index(key)
+        if index is None:
+            raise FileNotFoundError(f"No dataset {key} in {self.root}")
+        entries = sorted(index["models"].items(), key=lambda kv: kv[1]["name"])
+        if names is not None:
+            wanted = set(names)
+            entries = [(k, v) for k, v in entries if v["name"] in wanted]
+
+        columns, seen = {}, set()
+        for mkey, entry in entries:
+            scores = np.load(path / f"{mkey}.npy")
+            digest = hashlib.blake2b(scores.tobytes(), digest_size=8).digest()
+            if dedupe and digest in seen:
+                continue
+            seen.add(digest)
+            name = entry["name"] if entry["name"] not in columns else f"{entry['name']} [{mkey[:6]}]"
+            columns[name] = scores
+        y = np.load(path / "labels.npy").astype(int)
+        groups = np.load(path / "groups.npy")
+        return pd.DataFrame(columns), y, groups
+
+
+def record_oof(name, scores, y, groups, metrics=None, features=None, params=None, root=None):
+    """OOFStore.put() with the open ledger session's script, run id and commit."""
+    session = current_session()
+    meta = {
+        "script": session.script if session else Path(sys.argv[0]).stem,
+        "run_id": session.run_id if session else "",
+        "git_commit": session.git_commit if session else "",
+    }
+    return OOFStore(root).put(name, scores, y, groups, metrics, features, params, meta)
@@ -0,0 +1,505 @@
+"""
+Make-style pipeline with content-addressed stage outputs.
+
+The IEDB -> TESLA workflow is a fixed DAG:
+
+    iedb_raw -> iedb_filtered -> iedb_dedup -> iedb_features -> iedb_model ─┐
+                                          └──> iedb_clusters (homology CV groups)
+    tesla ──────> tesla_features ─────────────────────────> tesla_iedb_score ─> evaluate
+         └──────> tesla_binding (MHCflurry) ────────────────────────────────────┘
+
+Each stage declares its inputs (other stages), parameters and, for leaves,
+the data files it reads. A stage's key hashes its name, version, parameters,
+the content hash of every input stage's output and of its files. Outputs are
+pickled under that key and hashed themselves, so:
+
+- a rerun with nothing changed loads cached outputs and runs nothing
+- changing iedb_model's hyperparameters reruns iedb_model, tesla_iedb_score
+  and evaluate only
+- a stage that reruns but produces identical output does not invalidate
+  anything downstream
+
+Stages whose inputs are ready run concurrently on a thread pool (the heavy
+work -- NumPy, sklearn, TensorFlow -- releases the GIL). Slow loads a stage
+needs (the MHCflurry predictor) are prefetched at startup when that stage is
+going to run. Bump a stage's version when its code changes.
+
+Layout:
+
+    data/pipeline/<stage>/<key>.pkl     pickled output
+    data/pipeline/<stage>/<key>.json    manifest (params, input hashes, output hash, seconds)
+
+Usage:
+    python -m tools.pipeline run                                   # everything up to evaluate
+    python -m tools.pipeline run --set iedb_model.max_depth=12
+    python -m tools.pipeline status --set iedb_dedup.strategy=any_positive
+    python -m tools.pipeline run --target iedb_model --force iedb_features
+    python -m tools.pipeline run --target iedb_clusters --set iedb_clusters.threshold=0.7
+
+    from tools.pipeline import Pipeline
+    outputs = Pipeline().run(["evaluate"], overrides={"iedb_model": {"max_depth": 12}})
+"""
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.data_loader import IEDB_FILTERED_PATH, PROJECT_ROOT, TESLA_PATH, prefetch
+from tools.homology import HOMOLOGY_PARAMS
+from tools.iedb_transfer import IEDB_MODEL_PARAMS
+from tools.trace import span
+
+DEFAULT_PIPELINE_ROOT = PROJECT_ROOT / "data" / "pipeline"
+FILE_HASHES = "_files.json"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# STAGES
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# A stage is fn(inputs, params) -> output, where inputs maps each declared
+# input stage to its output. Outputs must be picklable.
+
+# Stage name -> {"inputs", "params", "files", "prefetch", "version", "run"}
+STAGES = {}
+
+
+def stage(name, inputs=(), params=None, files=(), prefetch=(), version=1):
+    """
+    Register a pipeline stage.
+
+    Args:
+        name: Stage name (also its output's name).
+        inputs: Names of the stages whose outputs it consumes.
+        params: Default parameters; overridable per run.
+        files: Data files it reads; their content is part of the key.
+        prefetch: data_loader.prefetch() names to start loading at startup
+                  when the stage will run.
+        version: Bump when the stage's code changes.
+    """
+    def decorator(fn):
+        STAGES[name] = {
+            "inputs": tuple(inputs),
+            "params": dict(params or {}),
+            "files": tuple(Path(f) for f in files),
+            "prefetch": tuple(prefetch),
+            "version": version,
+            "run": fn,
+        }
+        return fn
+    return decorator
+
+
+@stage("iedb_raw", files=[IEDB_FILTERED_PATH])
+def _iedb_raw(inputs, params):
+    from tools.data_loader import load_iedb
+    return load_iedb(filtered=True)
+
+
+@stage("iedb_filtered", inputs=["iedb_raw"], params={"allele": None, "peptide_lengths": [8, 9, 10, 11]})
+def _iedb_filtered(inputs, params):
+    from tools.data_loader import filter_iedb
+    return filter_iedb(inputs["iedb_raw"], **params).reset_index(drop=True)
+
+
+@stage("iedb_dedup", inputs=["iedb_filtered"], params={"strategy": "majority"})
+def _iedb_dedup(inputs, params):
+    from tools.data_loader import deduplicate_iedb
+    return deduplicate_iedb(inputs["iedb_filtered"], strategy=params["strategy"]).reset_index(drop=True)
+
+
+@stage("iedb_clusters", inputs=["iedb_dedup"], params=HOMOLOGY_PARAMS)
+def _iedb_clusters(inputs, params):
+    from tools.homology import cluster_peptides
+    return cluster_peptides(inputs["iedb_dedup"]["peptide"].to_numpy(), **params)
+
+
+@stage("iedb_features", inputs=["iedb_dedup"])
+def _iedb_features(inputs, params):
+    from tools.iedb_transfer import prepare_iedb_sequence_features
+    return prepare_iedb_sequence_features(inputs["iedb_dedup"], n_jobs=-1)
+
+
+@stage("iedb_model", inputs=["iedb_features", "iedb_dedup"], params=IEDB_MODEL_PARAMS)
+def _iedb_model(inputs, params):
+    from tools.iedb_transfer import fit_iedb_model
+    model, feature_cols, imputer, scaler = fit_iedb_model(
+        inputs["iedb_features"], inputs["iedb_dedup"]["immunogenic"].values, params)
+    return {"model": model, "feature_cols": feature_cols, "imputer": imputer, "scaler": scaler}
+
+
+@stage("tesla", files=[TESLA_PATH])
+def _tesla(inputs, params):
+    from tools.data_loader import load_tesla
+    return load_tesla()
+
+
+@stage("tesla_features", inputs=["tesla"])
+def _tesla_features(inputs, params):
+    from tools.iedb_transfer import prepare_iedb_sequence_features
+    return prepare_iedb_sequence_features(inputs["tesla"])
+
+
+@stage("tesla_binding", inputs=["tesla"], prefetch=["predictor"])
+def _tesla_binding(inputs, params):
+    from tools.error_analysis_and_multifeature import predict_mhcflurry
+    return predict_mhcflurry(inputs["tesla"]["peptide"], inputs["tesla"]["allele"])
+
+
+@stage("tesla_iedb_score", inputs=["iedb_model", "tesla", "tesla_features"])
+def _tesla_iedb_score(inputs, params):
+    from tools.iedb_transfer import score_tesla_with_iedb_model
+    return score_tesla_with_iedb_model(inputs["tesla"], **inputs["iedb_model"],
+                                       features=inputs["tesla_features"])
+
+
+@stage("evaluate", inputs=["tesla", "tesla_iedb_score", "tesla_binding"])
+def _evaluate(inputs, params):
+    import numpy as np
+    from tools.evaluate import evaluate_predictions_batch
+
+    binding = inputs["tesla_binding"]
+    scores = {
+        "IEDB pan-allele RF": inputs["tesla_iedb_score"],
+        "MHCflurry presentation": binding["mhcflurry_presentation"].to_numpy(dtype=float),
+        "MHCflurry affinity (inv.)": -binding["mhcflurry_affinity"].to_numpy(dtype=float),
+    }
+    return evaluate_predictions_batch(inputs["tesla"]["immunogenic"].astype(int).values,
+                                      np.vstack(list(scores.values())), names=list(scores))
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# FINGERPRINTS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def content_hash(output, data):
+    """
+    Hash of a stage output. DataFrames and arrays are hashed by value (their
+    pickles are not byte-stable across runs); anything else by its pickle.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(output, pd.DataFrame):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(json.dumps([[str(c) for c in output.columns], [str(t) for t in output.dtypes]]).encode())
+        h.update(pd.util.hash_pandas_object(output, index=True).to_numpy().tobytes())
+        return h.hexdigest()
+    if isinstance(output, np.ndarray) and output.dtype != object:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{output.dtype}{output.shape}".encode())
+        h.update(np.ascontiguousarray(output).tobytes())
+        return h.hexdigest()
+    return _digest(data)
+
+
+def file_hash(path, block_size=1 << 20):
+    """Content hash of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def stage_key(name, version, params, input_hashes, file_hashes):
+    """Key of one stage execution: everything its output depends on."""
+    payload = json.dumps({
+        "stage": name,
+        "version": version,
+        "params": params,
+        "inputs": input_hashes,
+        "files": file_hashes,
+    }, sort_keys=True, default=str)
+    return _digest(payload.encode())
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PIPELINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+class Pipeline:
+    """Runs stages in dependency order, reusing outputs whose key is unchanged."""
+
+    def __init__(self, root=DEFAULT_PIPELINE_ROOT, stages=None):
+        self.root = Path(root)
+        self.stages = stages if stages is not None else STAGES
+        self._file_lock = threading.Lock()
+
+    def plan(self, targets=None):
+        """Stages needed for targets (default: all), in dependency order."""
+        order, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            if name not in self.stages:
+                raise KeyError(f"Unknown stage {name!r}; choose from {list(self.stages)}")
+            seen.add(name)
+            for dep in self.stages[name]["inputs"]:
+                visit(dep)
+            order.append(name)
+
+        for name in targets or list(self.stages):
+            visit(name)
+        return order
+
+    def params(self, name, overrides=None):
+        """Stage parameters with per-run overrides applied."""
+        params = dict(self.stages[name]["params"])
+        extra = (overrides or {}).get(name, {})
+        unknown = set(extra) - set(params)
+        if unknown:
+            raise KeyError(f"Unknown parameters for stage {name!r}: {sorted(unknown)}")
+        params.update(extra)
+        return params
+
+    def _paths(self, name, key):
+        stage_dir = self.root / name
+        return stage_dir / f"{key}.pkl", stage_dir / f"{key}.json"
+
+    def _file_hashes(self, name):
+        """Content hashes of a stage's files, cached by (size, mtime)."""
+        files = self.stages[name]["files"]
+        if not files:
+            return {}
+        with self._file_lock:
+            cache_path = self.root / FILE_HASHES
+            cache = json.loads(cache_path.read_text()) if cache_path.exists() else {}
+            hashes = {}
+            for path in files:
+                st = os.stat(path)
+                entry = cache.get(str(path))
+                if entry is None or (entry["size"], entry["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+                    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": file_hash(path)}
+                    cache[str(path)] = entry
+                hashes[path.name] = entry["hash"]
+            self.root.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(json.dumps(cache, indent=1))
+        return hashes
+
+    def _key(self, name, overrides, output_hashes):
+        spec = self.stages[name]
+        inputs = {dep: output_hashes[dep] for dep in spec["inputs"]}
+        return stage_key(name, spec["version"], self.params(name, overrides), inputs,
+                         self._file_hashes(name))
+
+    def _manifest(self, name, key):
+        artifact, manifest = self._paths(name, key)
+        if not (artifact.exists() and manifest.exists()):
+            return None
+        return json.loads(manifest.read_text())
+
+    def _load(self, name, key):
+        with open(self._paths(name, key)[0], "rb") as f:
+            return pickle.load(f)
+
+    def _execute(self, name, key, params, inputs, input_hashes):
+        """Run one stage and store its output; returns (output, output_hash, seconds)."""
+        start = time.perf_counter()
+        with span(f"pipeline.{name}"):
+            output = self.stages[name]["run"](inputs, params)
+        seconds = time.perf_counter() - start
+
+        data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+        output_hash = content_hash(output, data)
+        artifact, manifest = self._paths(name, key)
+        artifact.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so an interrupted run never leaves a partial artifact
+        tmp = artifact.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, artifact)
+        manifest.write_text(json.dumps({
+            "stage": name,
+            "key": key,
+            "version": self.stages[name]["version"],
+            "params": params,
+            "inputs": input_hashes,
+            "output_hash": output_hash,
+            "seconds": seconds,
+            "created": time.time(),
+        }, indent=1, default=str))
+        return output, output_hash, seconds
+
+    def run(self, targets=None, overrides=None, force=(), n_jobs=None):
+        """
+        Bring targets up to date.
+
+        Args:
+            targets: Stage names (default: all stages).
+            overrides: {stage: {param: value}} for this run.
+            force: Stages to rerun even if their output is cached.
+            n_jobs: Concurrent stages (default: os.cpu_count()).
+
+        Returns:
+            dict target -> output
+        """
+        order = self.plan(targets)
+        targets = list(targets or order)
+        force = set(force)
+        for name in force:
+            if name not in self.stages:
+                raise KeyError(f"Unknown stage {name!r}")
+        for name in overrides or {}:
+            self.params(name, overrides)
+
+        # Overlap slow model loads with the upstream stages
+        to_prefetch = {loader for row in self.status(targets, overrides)
+                       if row["state"] in ("stale", "blocked") or row["stage"] in force
+                       for loader in self.stages[row["stage"]].get("prefetch", ())}
+        if to_prefetch:
+            prefetch(*sorted(to_prefetch))
+
+        keys, output_hashes, outputs = {}, {}, {}
+        pending = list(order)
+        running = {}
+
+        def load_input(dep):
+            if dep not in outputs:
+                outputs[dep] = self._load(dep, keys[dep])
+            return outputs[dep]
+
+        with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as pool:
+            while pending or running:
+                # Schedule every stage whose inputs are done; cached ones complete immediately
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name in list(pending):
+                        spec = self.stages[name]
+                        if any(dep not in output_hashes for dep in spec["inputs"]):
+                            continue
+                        pending.remove(name)
+                        progressed = True
+                        keys[name] = key = self._key(name, overrides, output_hashes)
+                        manifest = None if name in force else self._manifest(name, key)
+                        if manifest is not None:
+                            output_hashes[name] = manifest["output_hash"]
+                            print(f"  [cached]  {name:18s} {key[:8]}")
+                            continue
+                        print(f"  [run]     {name:18s} {key[:8]}")
+                        inputs = {dep: load_input(dep) for dep in spec["inputs"]}
+                        params = self.params(name, overrides)
+                        input_hashes = {dep: output_hashes[dep] for dep in spec["inputs"]}
+                        future = pool.submit(self._execute, name, key, params, inputs, input_hashes)
+                        running[future] = name
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name], output_hashes[name], seconds = future.result()
+                    print(f"  [done]    {name:18s} {keys[name][:8]}  {seconds:.1f}s")
+
+        return {name: load_input(name) for name in targets}
+
+    def status(self, targets=None, overrides=None):
+        """
+        Which stages would run for targets under overrides, without running anything.
+
+        Returns list of dicts with stage, key and state: "cached", "stale"
+        (own key has no output) or "blocked" (an input must run first).
+        """
+        rows, output_hashes = [], {}
+        for name in self.plan(targets):
+            spec = self.stages[name]
+            if any(dep not in output_hashes for dep in spec["inputs"]):
+                rows.append({"stage": name, "key": None, "state": "blocked"})
+                continue
+            try:
+                key = self._key(name, overrides, output_hashes)
+            except FileNotFoundError as e:
+                rows.append({"stage": name, "key": None, "state": f"missing file {e.filename}"})
+                continue
+            manifest = self._manifest(name, key)
+            if manifest is not None:
+                output_hashes[name] = manifest["output_hash"]
+            rows.append({"stage": name, "key": key, "state": "cached" if manifest else "stale"})
+        return rows
+
+    def prune(self, keep=1):
+        """Delete all but the `keep` most recent outputs of every stage."""
+        removed = []
+        for name in self.stages:
+            stage_dir = self.root / name
+            if not stage_dir.exists():
+                continue
+            manifests = sorted(stage_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+            for manifest in manifests[keep:]:
+                artifact = manifest.with_suffix(".pkl")
+                artifact.unlink(missing_ok=True)
+                manifest.unlink()
+                removed.append(str(artifact))
+        return removed
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def parse_overrides(assignments):
+    """["stage.param=value", ...] -> {stage: {param: value}}; values are JSON when they parse."""
+    overrides = {}
+    for assignment in assignments or []:
+        target, _, value = assignment.partition("=")
+        name, _, param = target.partition(".")
+        if not (name and param and _):
+            raise ValueError(f"Expected stage.param=value, got {assignment!r}")
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            pass
+        overrides.setdefault(name, {})[param] = value
+    return overrides
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.pipeline",
+                                     description="Run the IEDB -> TESLA pipeline with cached stages")
+    parser.add_argument("command", choices=["run", "status", "prune"])
+    parser.add_argument("--target", nargs="+", help="Stages to bring up to date (default: all)")
+    parser.add_argument("--set", nargs="+", dest="overrides", metavar="STAGE.PARAM=VALUE",
+                        help="Override stage parameters, e.g. iedb_model.max_depth=12")
+    parser.add_argument("--force", nargs="+", default=[], help="Rerun these stages")
+    parser.add_argument("--jobs", type=int, help="Concurrent stages (default: all cores)")
+    parser.add_argument("--keep", type=int, default=1, help="prune: outputs to keep per stage")
+    parser.add_argument("--root", default=str(DEFAULT_PIPELINE_ROOT))
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(args.root)
+    overrides = parse_overrides(args.overrides)
+
+    if args.command == "status":
+        for row in pipeline.status(args.target, overrides):
+            print(f"  {row['stage']:18s} {(row['key'] or '-')[:8]:8s}  {row['state']}")
+        return 0
+    if args.command == "prune":
+        removed = pipeline.prune(args.keep)
+        print(f"{len(removed)} output(s) removed")
+        return 0
+
+    start = time.perf_counter()
+    outputs = pipeline.run(args.target, overrides, force=args.force, n_jobs=args.jobs)
+    print(f"\nPipeline finished in {time.perf_counter() - start:.1f}s")
+    if "evaluate" in outputs:
+        cols = ["name", "auc_roc", "auprc", "fr_top100", "ttif_top20"]
+        print(outputs["evaluate"][cols].to_string(index=False, float_format="%.4f"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
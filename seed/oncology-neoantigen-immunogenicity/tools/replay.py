@@ -0,0 +1,322 @@
+"""
+Replay bundles: cheap re-verification of cross-validated findings.
+
+A finding's exact inputs are recorded next to its claim, so a verifier
+checks the claim in seconds instead of re-running the research:
+
+    data/replay/<bundle_id>/
+        manifest.json   claim (metrics), data hash, git commit, estimator
+                        class + params (incl. random_state), feature names,
+                        library versions and a hash of every array below
+        X.npy           feature matrix exactly as passed to the model
+        y.npy           labels
+        folds.npy       fold assignment (held-out group of every row)
+        oof.npy         out-of-fold predicted probabilities
+
+Verification has three levels, cheapest first:
+
+1. integrity  every array matches its recorded hash
+2. metrics    the claimed metrics are recomputed from y and oof.npy
+3. folds      k randomly sampled folds are refit from X, y and the estimator
+              spec and must reproduce the recorded out-of-fold predictions
+
+Levels 1-2 take milliseconds. Level 3 costs k/n_folds of the original fit.
+Each verifier draws its own folds (seed from OS entropy unless given), so
+three independent verifiers cover different folds between them.
+
+Usage (in a script, after cross_val_predict and evaluate_predictions):
+    from tools.replay import record_finding
+    record_finding(model, X, y, groups, probs, metrics, features=feature_cols)
+
+Command line:
+    python -m tools.replay list
+    python -m tools.replay verify <bundle_id> [--folds 2] [--seed 7] [--data tesla]
+
+Setting OPENSCIENCE_REPLAY=<path> records bundles into that directory.
+"""
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.ledger import METRIC_COLUMNS, current_session, git_commit, hash_data
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_REPLAY_ROOT = PROJECT_ROOT / "data" / "replay"
+REPLAY_ENV = "OPENSCIENCE_REPLAY"
+
+ARRAYS = ("X", "y", "folds", "oof")
+
+# Recomputed metrics must match the claim this closely
+METRIC_TOLERANCE = 1e-6
+# Refit folds must reproduce the recorded probabilities this closely
+PREDICTION_TOLERANCE = 1e-6
+DEFAULT_VERIFY_FOLDS = 2
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# RECORDING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def replay_root():
+    return Path(os.environ.get(REPLAY_ENV) or DEFAULT_REPLAY_ROOT)
+
+
+def _array_hash(arr):
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{arr.dtype.str}{arr.shape}".encode())
+    h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def _estimator_spec(estimator):
+    """Class path and JSON params, or None if the params do not round-trip."""
+    cls = type(estimator)
+    params = estimator.get_params(deep=False)
+    try:
+        encoded = json.loads(json.dumps(params))
+    except TypeError:
+        return None
+    if encoded != params:
+        return None
+    return {"class": f"{cls.__module__}.{cls.__qualname__}", "params": params}
+
+
+def _build_estimator(spec):
+    module, _, name = spec["class"].rpartition(".")
+    return getattr(importlib.import_module(module), name)(**spec["params"])
+
+
+def _versions():
+    import sklearn
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "sklearn": sklearn.__version__}
+
+
+def record_finding(estimator, X, y, groups, probs, metrics, features=None, root=None):
+    """
+    Write a replay bundle for one cross-validated result.
+
+    Args:
+        estimator: Unfitted estimator given to cross_val_predict (LOGO).
+        X, y, groups: Exactly the arrays given to cross_val_predict.
+        probs: Out-of-fold predict_proba[:, 1].
+        metrics: evaluate_predictions() output for (y, probs): the claim.
+        features: Column names of X.
+        root: Bundle directory (default: OPENSCIENCE_REPLAY or data/replay).
+
+    Returns the bundle id, or None if the estimator cannot be recorded.
+    Identical inputs map to the same id, so re-running a script rewrites
+    its bundles instead of adding new ones.
+    """
+    spec = _estimator_spec(estimator)
+    if spec is None:
+        print(f"  Warning: {type(estimator).__name__} params are not JSON-serializable; "
+              f"no replay bundle for {metrics['name']}")
+        return None
+
+    arrays = {
+        "X": np.asarray(X, dtype=float),
+        "y": np.asarray(y, dtype=np.int8),
+        "folds": np.asarray(groups).astype(str),
+        "oof": np.asarray(probs, dtype=float),
+    }
+    hashes = {key: _array_hash(arr) for key, arr in arrays.items()}
+    bundle_id = hashlib.blake2b(
+        json.dumps([hashes, spec], sort_keys=True).encode(), digest_size=8
+    ).hexdigest()
+
+    session = current_session()
+    manifest = {
+        "bundle_id": bundle_id,
+        "name": str(metrics["name"]),
+        "created": time.time(),
+        "script": session.script if session else Path(sys.argv[0]).stem,
+        "run_id": session.run_id if session else "",
+        "git_commit": session.git_commit if session else git_commit(),
+        "data_hash": session.data_hash if session else "",
+        "cv": "LeaveOneGroupOut",
+        "estimator": spec,
+        "features": list(features) if features is not None else [],
+        "n_folds": int(len(np.unique(arrays["folds"]))),
+        "claim": {key: float(metrics[key]) for key in METRIC_COLUMNS if key in metrics},
+        "hashes": hashes,
+        "versions": _versions(),
+    }
+
+    path = Path(root or replay_root()) / bundle_id
+    path.mkdir(parents=True, exist_ok=True)
+    for key, arr in arrays.items():
+        np.save(path / f"{key}.npy", arr)
+    (path / "manifest.json").write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return bundle_id
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# VERIFICATION
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _resolve(bundle, root=None):
+    path = Path(bundle)
+    if (path / "manifest.json").exists():
+        return path
+    root = Path(root or replay_root())
+    matches = [p for p in root.glob(f"{bundle}*") if (p / "manifest.json").exists()] if root.exists() else []
+    if len(matches) != 1:
+        raise FileNotFoundError(f"No unique replay bundle {bundle!r} in {root}")
+    return matches[0]
+
+
+def load_bundle(bundle, root=None):
+    """(manifest, arrays) of a bundle given by path, id or id prefix."""
+    path = _resolve(bundle, root)
+    manifest = json.loads((path / "manifest.json").read_text())
+    arrays = {key: np.load(path / f"{key}.npy", allow_pickle=False) for key in ARRAYS}
+    return manifest, arrays
+
+
+def _refit_fold(estimator_spec, X, y, folds, held_out):
+    test = folds == held_out
+    model = _build_estimator(estimator_spec)
+    model.fit(X[~test], y[~test])
+    return test, model.predict_proba(X[test])[:, 1]
+
+
+def verify(bundle, n_folds=DEFAULT_VERIFY_FOLDS, seed=None, data=None, root=None):
+    """
+    Re-check a recorded finding.
+
+    Args:
+        bundle: Bundle path, id or unique id prefix.
+        n_folds: Folds to refit (0 = integrity and metrics only, -1 = all).
+        seed: Fold-sampling seed (default: fresh entropy, reported back).
+        data: Optional evaluation DataFrame; its hash must equal the
+              recorded data hash.
+
+    Returns:
+        dict with passed (bool), checks (list of (check, ok, detail)),
+        the fold seed and the folds refit.
+    """
+    from tools.evaluate import evaluate_predictions_batch
+
+    manifest, arrays = load_bundle(bundle, root)
+    checks = []
+
+    # 1. Integrity
+    for key in ARRAYS:
+        ok = _array_hash(arrays[key]) == manifest["hashes"][key]
+        checks.append((f"hash {key}", ok, manifest["hashes"][key][:12]))
+    if data is not None:
+        recorded = manifest["data_hash"]
+        actual = hash_data(data)
+        checks.append(("data hash", actual == recorded, f"recorded {recorded or '-'}, got {actual}"))
+
+    # 2. Claimed metrics from the recorded out-of-fold predictions
+    y, oof = arrays["y"], arrays["oof"]
+    valid = ~np.isnan(oof)
+    table = evaluate_predictions_batch(y[valid], oof[valid][None, :], names=[manifest["name"]])
+    for key, claimed in manifest["claim"].items():
+        actual = float(table[key].iloc[0])
+        ok = bool(abs(actual - claimed) <= METRIC_TOLERANCE or (np.isnan(actual) and np.isnan(claimed)))
+        checks.append((f"metric {key}", ok, f"claimed {claimed:.6f}, recomputed {actual:.6f}"))
+
+    # 3. Refit a random sample of folds
+    fold_ids = np.unique(arrays["folds"])
+    if seed is None:
+        seed = int.from_bytes(os.urandom(4), "little")
+    k = len(fold_ids) if n_folds < 0 else min(n_folds, len(fold_ids))
+    sampled = sorted(np.random.default_rng(seed).choice(fold_ids, size=k, replace=False).tolist())
+    for held_out in sampled:
+        test, probs = _refit_fold(manifest["estimator"], arrays["X"], y, arrays["folds"], held_out)
+        diff = float(np.max(np.abs(probs - oof[test]))) if test.any() else 0.0
+        checks.append((f"fold {held_out}", diff <= PREDICTION_TOLERANCE,
+                       f"{int(test.sum())} rows, max |diff| {diff:.2e}"))
+
+    return {
+        "bundle_id": manifest["bundle_id"],
+        "name": manifest["name"],
+        "passed": all(ok for _, ok, _ in checks),
+        "checks": checks,
+        "seed": seed,
+        "folds": sampled,
+        "manifest": manifest,
+    }
+
+
+def list_bundles(root=None):
+    """Manifests of all bundles, newest first."""
+    root = Path(root or replay_root())
+    if not root.exists():
+        return []
+    manifests = [json.loads(p.read_text()) for p in root.glob("*/manifest.json")]
+    return sorted(manifests, key=lambda m: -m["created"])
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.replay", description=__doc__.split("\n")[1])
+    parser.add_argument("--root", help="Bundle directory (default: data/replay)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ls = sub.add_parser("list", help="List recorded bundles")
+    ls.add_argument("--name", help="Substring of the finding name")
+
+    check = sub.add_parser("verify", help="Re-check a recorded finding")
+    check.add_argument("bundle", help="Bundle id (or unique prefix) or path")
+    check.add_argument("--folds", type=int, default=DEFAULT_VERIFY_FOLDS,
+                       help="Folds to refit (0 = metrics only, -1 = all)")
+    check.add_argument("--seed", type=int, help="Fold-sampling seed (default: random)")
+    check.add_argument("--data", help='Also check the data hash against "tesla" or a table path')
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        manifests = list_bundles(args.root)
+        if args.name:
+            manifests = [m for m in manifests if args.name in m["name"]]
+        if not manifests:
+            print("No replay bundles")
+            return 0
+        for m in manifests:
+            claim = m["claim"]
+            print(f"  {m['bundle_id']}  {m['script']:32s} {m['name']:32s} "
+                  f"AUPRC {claim.get('auprc', float('nan')):.4f}  {m['n_folds']} folds  "
+                  f"{m['git_commit'][:8]}")
+        return 0
+
+    data = None
+    if args.data:
+        from tools.cli import read_frame
+        data = read_frame(args.data)
+
+    start = time.perf_counter()
+    try:
+        report = verify(args.bundle, n_folds=args.folds, seed=args.seed, data=data, root=args.root)
+    except FileNotFoundError as e:
+        print(f"verify: {e}")
+        return 2
+    elapsed = time.perf_counter() - start
+
+    m = report["manifest"]
+    print(f"Bundle {report['bundle_id']}: {report['name']} ({m['script']}, {m['git_commit'][:8]})")
+    for check_name, ok, detail in report["checks"]:
+        print(f"  {'ok  ' if ok else 'FAIL'} {check_name:34s} {detail}")
+    print(f"Fold seed {report['seed']}: refit {len(report['folds'])} of {m['n_folds']} folds")
+    print(f"{'PASS' if report['passed'] else 'FAIL'} in {elapsed:.1f}s")
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""
+Hyperparameter search with successive halving and Hyperband.
+
+Every configuration is first scored on a cheap budget (few trees, or a
+subsample of IEDB rows); only the best 1/eta of each rung is promoted to the
+next, eta times larger budget. Hyperband runs several such brackets that
+trade the number of configurations against the starting budget, so configs
+that only shine with many trees still get a chance.
+
+Scores are LOGO AUPRC on TESLA (patient folds) for the TESLA models. The
+best of many configs scored on the same six folds is an optimistic,
+in-selection estimate; --nested repeats the whole search inside each outer
+held-out patient (inner LOGO on the other patients) and scores the selected
+config on that patient, which gives an unbiased estimate. "iedb"
+configs are scored inside IEDB only -- pooled out-of-fold AUPRC of a
+GroupKFold over homology clusters (tools.homology), so near-identical
+peptides never straddle a split -- and TESLA, the held-out benchmark, is
+scored once, for the selected config. All fits of a rung are
+work units (tools.workunits) run in parallel on one Coordinator, which also
+reuses any (config, budget, fold) already computed by an earlier bracket.
+Feature columns already in the input table are not recomputed.
+
+Usage:
+    from tools.search import SEARCH_SPACES, hyperband, logo_objective
+    evaluate = logo_objective(SEARCH_SPACES["rf"], X, y, groups, coordinator)
+    result = hyperband(SEARCH_SPACES["rf"], evaluate)
+    result["best"], result["rungs"]
+
+Command line:
+    python -m tools.search --model rf --features tesla novel tesla+mhcflurry --n-jobs 8
+    python -m tools.search --model gb --features novel --mode halving --n-configs 27
+    python -m tools.search --model rf --features tesla+novel --nested --n-jobs 8
+    python -m tools.search --model iedb --min-budget 5000
+"""
+import itertools
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ETA = 3
+DEFAULT_METRIC = "auprc"
+
+# Model -> estimator class, fixed params, searched grid and budget parameter.
+# budget "rows" subsamples the training table (IEDB); max_budget None = all rows.
+SEARCH_SPACES = {
+    "rf": {
+        "estimator": "sklearn.ensemble.RandomForestClassifier",
+        "fixed": {"class_weight": "balanced", "random_state": 42},
+        "grid": {
+            "max_depth": [3, 5, 8, None],
+            "min_samples_leaf": [1, 3, 5, 10],
+            "max_features": ["sqrt", 0.3, 0.6],
+        },
+        "budget": "n_estimators",
+        "min_budget": 50,
+        "max_budget": 500,
+    },
+    "gb": {
+        "estimator": "sklearn.ensemble.GradientBoostingClassifier",
+        "fixed": {"random_state": 42},
+        "grid": {
+            "max_depth": [2, 3, 4],
+            "learning_rate": [0.02, 0.05, 0.1],
+            "min_samples_leaf": [3, 5, 10],
+            "subsample": [0.6, 0.8, 1.0],
+        },
+        "budget": "n_estimators",
+        "min_budget": 50,
+        "max_budget": 400,
+    },
+    "iedb": {
+        "estimator": "sklearn.ensemble.RandomForestClassifier",
+        "fixed": {"n_estimators": 200, "class_weight": "balanced", "random_state": 42},
+        "grid": {
+            "max_depth": [6, 8, 12, None],
+            "min_samples_leaf": [1, 5, 10, 20],
+            "max_features": ["sqrt", 0.3],
+        },
+        "budget": "rows",
+        "min_budget": 2000,
+        "max_budget": None,
+    },
+}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CONFIGURATIONS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def build_estimator(space):
+    """Unfitted estimator of a search space with its fixed params."""
+    import importlib
+
+    module, _, name = space["estimator"].rpartition(".")
+    return getattr(importlib.import_module(module), name)(**space["fixed"])
+
+
+def grid_configs(space):
+    """Every combination of the space's grid, as param dicts."""
+    keys = list(space["grid"])
+    return [dict(zip(keys, values)) for values in itertools.product(*(space["grid"][k] for k in keys))]
+
+
+def sample_configs(space, n=None, rng=None):
+    """n distinct grid configs in random order (all of them if n is None or too large)."""
+    configs = grid_configs(space)
+    rng = rng if rng is not None else np.random.default_rng(0)
+    order = rng.permutation(len(configs))
+    if n is not None:
+        order = order[:n]
+    return [configs[i] for i in order]
+
+
+def rung_budgets(min_budget, max_budget, eta=DEFAULT_ETA):
+    """Budgets max/eta^k, ..., max/eta, max (ascending), none below min_budget."""
+    n_rungs = int(math.floor(math.log(max_budget / min_budget, eta) + 1e-9)) + 1
+    return [int(round(max_budget / eta ** k)) for k in reversed(range(n_rungs))]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SEARCH
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# evaluate(configs, budget) -> (scores, compute) scores a batch of configs at
+# one budget; compute is the work spent in budget units (trees x folds, or
+# training rows).
+
+def successive_halving(configs, evaluate, budgets, eta=DEFAULT_ETA, bracket=0):
+    """
+    Score configs on increasing budgets, keeping the top 1/eta after each rung.
+
+    Args:
+        configs: list of param dicts.
+        evaluate: Batch objective, see above.
+        budgets: Ascending budget per rung.
+        bracket: Label stored with the results (Hyperband bracket).
+
+    Returns:
+        (history, rungs) DataFrames: one row per (config, rung) with its score,
+        and one row per rung with n_configs, compute and wall time.
+    """
+    history, rungs = [], []
+    survivors = list(configs)
+    for rung, budget in enumerate(budgets):
+        start = time.perf_counter()
+        scores, compute = evaluate(survivors, budget)
+        rungs.append({"bracket": bracket, "rung": rung, "budget": budget, "n_configs": len(survivors),
+                      "compute": compute, "wall_s": time.perf_counter() - start,
+                      "best_score": np.nanmax(scores) if len(scores) else np.nan})
+        history += [{"bracket": bracket, "rung": rung, "budget": budget, "config": config, "score": score}
+                    for config, score in zip(survivors, scores)]
+        if rung < len(budgets) - 1:
+            keep = max(1, len(survivors) // eta)
+            order = np.argsort(-np.nan_to_num(np.asarray(scores, dtype=float), nan=-np.inf), kind="stable")
+            survivors = [survivors[i] for i in order[:keep]]
+    return pd.DataFrame(history), pd.DataFrame(rungs)
+
+
+def _result(history, rungs, max_budget):
+    final = history[history["budget"] == max_budget]
+    best = final.assign(key=final["config"].map(repr)).drop_duplicates("key")
+    best = best.sort_values("score", ascending=False).drop(columns="key").reset_index(drop=True)
+    return {"history": history, "rungs": rungs, "best": best}
+
+
+def halving_search(space, evaluate, configs=None, min_budget=None, max_budget=None, eta=DEFAULT_ETA):
+    """
+    One successive-halving bracket over configs (default: the full grid).
+
+    Returns dict with history, rungs and best (configs scored on the full
+    budget, best first).
+    """
+    min_budget = min_budget or space["min_budget"]
+    max_budget = max_budget or space["max_budget"]
+    budgets = rung_budgets(min_budget, max_budget, eta)
+    history, rungs = successive_halving(configs or grid_configs(space), evaluate, budgets, eta)
+    return _result(history, rungs, max_budget)
+
+
+def hyperband(space, evaluate, min_budget=None, max_budget=None, eta=DEFAULT_ETA, seed=0):
+    """
+    Hyperband: successive-halving brackets from aggressive to exhaustive.
+
+    Bracket s starts ceil((s_max + 1) / (s + 1) * eta^s) random grid configs at
+    budget max_budget / eta^s. Configs and budgets repeat across brackets, so
+    run evaluate on a shared Coordinator to compute repeats once.
+
+    Returns dict with history, rungs and best (as halving_search).
+    """
+    min_budget = min_budget or space["min_budget"]
+    max_budget = max_budget or space["max_budget"]
+    rng = np.random.default_rng(seed)
+    s_max = len(rung_budgets(min_budget, max_budget, eta)) - 1
+
+    histories, rung_tables = [], []
+    for s in range(s_max, -1, -1):
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        budgets = [int(round(max_budget / eta ** (s - i))) for i in range(s + 1)]
+        history, rungs = successive_halving(sample_configs(space, n, rng), evaluate, budgets, eta, bracket=s)
+        histories.append(history)
+        rung_tables.append(rungs)
+    return _result(pd.concat(histories, ignore_index=True), pd.concat(rung_tables, ignore_index=True),
+                   max_budget)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# OBJECTIVES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def logo_objective(space, X, y, groups, coordinator=None, metric=DEFAULT_METRIC):
+    """
+    Leave-one-patient-out objective: one work unit per (config, fold).
+
+    The budget is the space's budget parameter (e.g. n_estimators).
+    """
+    from tools.workunits import Coordinator, distributed_grid_search
+
+    coordinator = coordinator or Coordinator()
+    estimator = build_estimator(space)
+    n_folds = len(np.unique(groups))
+
+    def evaluate(configs, budget):
+        candidates = [{**config, space["budget"]: budget} for config in configs]
+        table = distributed_grid_search(estimator, candidates, X, y, groups, coordinator)
+        scores = dict(zip(table["name"], table[metric]))
+        return [scores[str(c)] for c in candidates], budget * n_folds * len(configs)
+
+    return evaluate
+
+
+def nested_logo(space, X, y, groups, search, coordinator=None):
+    """
+    Nested leave-one-patient-out estimate of a search procedure.
+
+    For every outer held-out patient, search(evaluate) runs on a LOGO
+    objective over the remaining patients; the config it selects is fit on
+    those patients at the full budget and scores the held-out one.
+
+    Args:
+        search: Callable evaluate -> result dict (e.g. a hyperband() partial).
+
+    Returns:
+        (probs, selected): pooled outer out-of-fold probabilities, and a
+        DataFrame of held_out, config and inner (in-selection) score.
+    """
+    from tools.workunits import Coordinator
+
+    coordinator = coordinator or Coordinator()
+    estimator = build_estimator(space)
+    y = np.asarray(y, dtype=int)
+    groups = np.asarray(groups)
+    probs = np.full(len(X), np.nan)
+    selected = []
+    for g in np.unique(groups):
+        train, test = groups != g, groups == g
+        result = search(logo_objective(space, X[train], y[train], groups[train], coordinator))
+        best = result["best"].iloc[0]
+        params = {**best["config"], space["budget"]: int(best["budget"])}
+        probs[test] = coordinator.run([("transfer_fit", {"estimator": estimator, "params": params,
+                                                         "X": X[train], "y": y[train], "X_eval": X[test]})])[0]
+        selected.append({"held_out": g, "config": best["config"], "inner_score": best["score"]})
+    return probs, pd.DataFrame(selected)
+
+
+def group_kfold_objective(space, X, y, groups, coordinator=None, n_splits=5, metric=DEFAULT_METRIC, seed=0):
+    """
+    Grouped K-fold objective within one table (IEDB split by homology
+    cluster), one work unit per (config, fold).
+
+    The budget is the number of rows used: a fixed random order makes each
+    rung's subsample a superset of the previous one, and the subsample is
+    split with GroupKFold on its groups. The score is the metric of the
+    pooled out-of-fold predictions.
+    """
+    from sklearn.model_selection import GroupKFold
+
+    from tools.evaluate import evaluate_predictions_batch
+    from tools.workunits import Coordinator
+
+    coordinator = coordinator or Coordinator()
+    estimator = build_estimator(space)
+    order = np.random.default_rng(seed).permutation(len(X))
+    y = np.asarray(y, dtype=int)
+    groups = np.asarray(groups)
+
+    def evaluate(configs, budget):
+        rows = np.sort(order[:budget])
+        folds = list(GroupKFold(n_splits).split(rows, groups=groups[rows]))
+        units = [("transfer_fit", {"estimator": estimator, "params": config, "X": X[rows[train]],
+                                   "y": y[rows[train]], "X_eval": X[rows[test]]})
+                 for config in configs for train, test in folds]
+        oof = np.empty((len(configs), len(rows)))
+        for k, probs in enumerate(coordinator.run(units)):
+            oof[k // len(folds), folds[k % len(folds)][1]] = probs
+        table = evaluate_predictions_batch(y[rows], oof)
+        return table[metric].tolist(), sum(len(train) for train, _ in folds) * len(configs)
+
+    return evaluate
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REPORTING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def print_report(result, label="", top=5, metric=DEFAULT_METRIC, unit="budget units"):
+    """Rung table (compute spent per rung) and the top configs on the full budget."""
+    rungs = result["rungs"]
+    print(f"\n{label} rungs:")
+    print(f"  {'bracket':>7s} {'rung':>4s} {'budget':>8s} {'configs':>7s} {'compute':>12s} "
+          f"{'wall_s':>7s} {'best':>7s}")
+    for r in rungs.itertuples(index=False):
+        print(f"  {r.bracket:7d} {r.rung:4d} {r.budget:8d} {r.n_configs:7d} {r.compute:12,d} "
+              f"{r.wall_s:7.1f} {r.best_score:7.4f}")
+    print(f"  Total: {int(rungs['compute'].sum()):,} {unit}, {rungs['wall_s'].sum():.1f}s")
+
+    print(f"\n{label} top {top} configs ({metric} on the full budget; in-selection estimates, "
+          f"optimistic for the best):")
+    for r in result["best"].head(top).itertuples(index=False):
+        print(f"  {r.score:.4f}  {r.config}")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _tesla_matrix(tesla, feature_spec):
+    """Feature set names joined by '+' -> (columns, X) prepared as in the scripts."""
+    from tools.error_analysis_and_multifeature import prepare_features
+    from tools.feature_registry import FEATURE_SETS
+
+    columns = list(dict.fromkeys(col for name in feature_spec.split("+") for col in FEATURE_SETS[name]))
+    X, _, _ = prepare_features(tesla, columns)
+    return columns, X
+
+
+def _iedb_matrices(tesla):
+    """
+    (X_iedb, y_iedb, clusters, X_tesla): cached sequence features imputed and
+    scaled on IEDB, and the IEDB peptides' homology clusters.
+    """
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
+
+    from tools.data_loader import get_iedb_train_data
+    from tools.feature_store import FeatureStore
+    from tools.homology import cluster_peptides
+    from tools.iedb_transfer import prepare_iedb_sequence_features
+
+    store = FeatureStore()
+    iedb = get_iedb_train_data(peptide_lengths=[8, 9, 10, 11])
+    iedb_feats = prepare_iedb_sequence_features(iedb, store=store)
+    tesla_feats = prepare_iedb_sequence_features(tesla, store=store).reindex(columns=iedb_feats.columns,
+                                                                           fill_value=0)
+    imputer = SimpleImputer(strategy="median").fit(iedb_feats.values)
+    scaler = StandardScaler().fit(imputer.transform(iedb_feats.values))
+
+    def prep(df):
+        return scaler.transform(imputer.transform(df.values))
+
+    clusters = cluster_peptides(iedb["peptide"].to_numpy())
+    return prep(iedb_feats), iedb["immunogenic"].astype(int).values, clusters, prep(tesla_feats)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.search", description=__doc__.split("\n")[1])
+    parser.add_argument("--model", choices=list(SEARCH_SPACES), default="rf")
+    parser.add_argument("--features", nargs="+", default=["tesla"],
+                        help="Feature sets to search on, '+' joins sets (TESLA models)")
+    parser.add_argument("--input", default="tesla", help='"tesla" or a TESLA table with feature columns')
+    parser.add_argument("--mode", choices=["hyperband", "halving"], default="hyperband")
+    parser.add_argument("--n-configs", type=int, help="Random grid configs for --mode halving (default: all)")
+    parser.add_argument("--eta", type=int, default=DEFAULT_ETA)
+    parser.add_argument("--min-budget", type=int)
+    parser.add_argument("--max-budget", type=int)
+    parser.add_argument("--metric", default=DEFAULT_METRIC)
+    parser.add_argument("--folds", type=int, default=5, help="Homology-grouped IEDB folds (--model iedb)")
+    parser.add_argument("--nested", action="store_true",
+                        help="TESLA models: also run the search in every outer LOGO fold for an unbiased score")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--output", help="Write all scored (config, budget) rows as CSV")
+    args = parser.parse_args(argv)
+
+    from tools.cli import read_frame
+    from tools.workunits import Coordinator, InlineBackend, LocalProcessBackend
+
+    space = SEARCH_SPACES[args.model]
+    backend = LocalProcessBackend(args.n_jobs) if args.n_jobs != 1 else InlineBackend()
+    coordinator = Coordinator(backend)
+    tesla = read_frame(args.input)
+    y = tesla["immunogenic"].astype(int).values
+
+    if space["budget"] == "rows":
+        X_iedb, y_iedb, clusters, X_tesla = _iedb_matrices(tesla)
+        tasks = {f"iedb ({args.folds}-fold by homology cluster)": group_kfold_objective(
+            space, X_iedb, y_iedb, clusters, coordinator, args.folds, args.metric, args.seed)}
+        max_budget = min(args.max_budget or len(X_iedb), len(X_iedb))
+        unit = "training rows"
+    else:
+        from tools.feature_registry import FEATURE_SETS, add_features
+
+        needed = list(dict.fromkeys(col for spec in args.features for name in spec.split("+")
+                                    for col in FEATURE_SETS[name]))
+        missing = [col for col in needed if col not in tesla.columns]
+        if missing:
+            tesla = add_features(tesla, missing)
+        tasks, matrices = {}, {}
+        for spec in args.features:
+            columns, X = _tesla_matrix(tesla, spec)
+            label = f"{spec} ({len(columns)} features)"
+            tasks[label] = logo_objective(space, X, y, tesla["patient_id"].values, coordinator, args.metric)
+            matrices[label] = X
+        max_budget = args.max_budget or space["max_budget"]
+        unit = f"{space['budget']} x folds"
+
+    def search(evaluate):
+        if args.mode == "halving":
+            configs = sample_configs(space, args.n_configs, np.random.default_rng(args.seed))
+            return halving_search(space, evaluate, configs, args.min_budget, max_budget, args.eta)
+        return hyperband(space, evaluate, args.min_budget, max_budget, args.eta, args.seed)
+
+    results = []
+    try:
+        for label, evaluate in tasks.items():
+            result = search(evaluate)
+            print_report(result, f"{args.model} / {label}", args.top, args.metric, unit)
+            results.append(result["history"].assign(features=label))
+            if args.nested and space["budget"] != "rows":
+                from tools.evaluate import evaluate_predictions, print_metrics
+
+                probs, selected = nested_logo(space, matrices[label], y, tesla["patient_id"].values,
+                                              search, coordinator)
+                print(f"\n{args.model} / {label} nested LOGO (config selected without the held-out patient):")
+                for r in selected.itertuples(index=False):
+                    print(f"  {str(r.held_out):>12s}  inner {r.inner_score:.4f}  {r.config}")
+                print_metrics(evaluate_predictions(y, probs, name=f"{args.model} {label} (nested LOGO)"))
+
+        if space["budget"] == "rows":
+            # TESLA is the held-out benchmark: score the selected config only
+            from tools.evaluate import evaluate_predictions, print_metrics
+
+            best = result["best"]["config"].iloc[0]
+            probs = coordinator.run([("transfer_fit", {"estimator": build_estimator(space), "params": best,
+                                                       "X": X_iedb, "y": y_iedb, "X_eval": X_tesla})])[0]
+            print(f"\nSelected config, trained on all IEDB rows and scored once on TESLA: {best}")
+            print_metrics(evaluate_predictions(y, probs, name="IEDB RF (selected on IEDB folds)"))
+    finally:
+        coordinator.close()
+
+    print(f"\nWork units: {coordinator.stats['submitted']} computed, "
+          f"{coordinator.stats['deduplicated']} reused")
+    if args.output:
+        pd.concat(results, ignore_index=True).to_csv(args.output, index=False)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    sys.exit(main())
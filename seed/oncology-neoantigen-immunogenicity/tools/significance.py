@@ -0,0 +1,404 @@
+"""
+Bootstrap confidence intervals and paired significance tests for TESLA metrics.
+
+With 37 positives out of 608 peptides, AUPRC differences of a few hundredths
+are within resampling noise. This module puts intervals and p-values on the
+numbers compare_models() prints:
+
+- bootstrap_metrics(): patient-stratified bootstrap CIs for many models
+- paired_bootstrap_test(): CI and p-value for a metric difference between two models
+- paired_permutation_test(): sign-flip permutation test on normalized ranks
+- compare_models_significance(): comparison table with CIs and p-values vs the best model
+
+Resamples are drawn as (n_resamples, n_samples) index matrices. Each model is
+sorted once; a resample then only reweights peptides along that fixed order,
+so its metrics are cumulative sums over a multiplicity matrix, computed in
+parallel chunks across processes.
+
+Usage:
+    from tools.significance import compare_models_significance
+    compare_models_significance(y_true, score_matrix, names, groups=tesla["patient_id"])
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.evaluate import rank_metrics
+
+METRICS = ("auc_roc", "auprc", "fr_top100", "ttif_top20")
+
+# Resamples per task; bounds each worker's (chunk, n_samples) multiplicity matrix
+DEFAULT_CHUNK = 500
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# RESAMPLING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def stratified_bootstrap_indices(n_samples, n_resamples, groups=None, seed=0):
+    """
+    Bootstrap index matrix, resampling with replacement within each group.
+
+    Every resample keeps each patient's peptide count, so patients with many
+    candidates cannot be over- or under-represented by chance.
+
+    Args:
+        n_samples: Number of samples.
+        n_resamples: Number of bootstrap replicates.
+        groups: Stratum label per sample (e.g. patient_id); None = one stratum.
+        seed: Random seed.
+
+    Returns:
+        int array of shape (n_resamples, n_samples)
+    """
+    rng = np.random.default_rng(seed)
+    if groups is None:
+        return rng.integers(0, n_samples, size=(n_resamples, n_samples))
+
+    codes, _ = pd.factorize(pd.Series(np.asarray(groups)), use_na_sentinel=False)
+    members = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    # Column j draws from the stratum of members[j]
+    col_start = starts[codes[members]]
+    col_size = sizes[codes[members]]
+    draws = (rng.random((n_resamples, n_samples)) * col_size).astype(np.int64)
+    return members[col_start + draws]
+
+
+def _resolve_jobs(n_jobs, n_tasks):
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    return max(1, min(n_jobs, n_tasks))
+
+
+def _map_chunks(fn, tasks, n_jobs):
+    """Run fn over tasks, in worker processes when n_jobs > 1."""
+    n_jobs = _resolve_jobs(n_jobs, len(tasks))
+    if n_jobs == 1:
+        return [fn(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(fn, tasks))
+
+
+def _sorted_models(y_true, scores):
+    """
+    Per model: sample columns in descending score order (NaN dropped), their
+    labels, and the mask of tie-group ends. Sorting happens once here; every
+    resample reuses it.
+    """
+    models = []
+    for row in scores:
+        valid = np.flatnonzero(~np.isnan(row))
+        cols = valid[np.argsort(-row[valid], kind="stable")]
+        s = row[cols]
+        last = np.ones(len(cols), dtype=bool)
+        last[:-1] = s[1:] != s[:-1]
+        models.append((cols, y_true[cols], last))
+    return models
+
+
+def _weighted_metrics(weights, y_sorted, last, metrics, top_n_fr=100, top_n_ttif=20):
+    """
+    Rank metrics for many resamples of one model, given as per-sample multiplicities.
+
+    A bootstrap resample only changes how often each peptide appears, not the
+    order of the scores, so the metrics follow from cumulative sums of the
+    multiplicities along the model's fixed descending-score order.
+
+    Args:
+        weights: (n_resamples, n_sorted) multiplicities in sorted order.
+        y_sorted: Labels in sorted order.
+        last: Tie-group end mask in sorted order.
+        metrics: Names from METRICS to return.
+
+    Returns:
+        dict of metric name -> (n_resamples,) array
+    """
+    tp_w = weights * y_sorted
+    ctp = np.cumsum(tp_w, axis=1)
+    cw = np.cumsum(weights, axis=1)
+    n_total = cw[:, -1] if cw.shape[1] else np.zeros(len(weights))
+    n_pos = ctp[:, -1] if ctp.shape[1] else np.zeros(len(weights))
+    n_neg = n_total - n_pos
+
+    result = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if "auc_roc" in metrics or "auprc" in metrics:
+            tp = ctp[:, last]
+            fp = cw[:, last] - tp
+            tp_prev = np.zeros_like(tp)
+            fp_prev = np.zeros_like(fp)
+            tp_prev[:, 1:] = tp[:, :-1]
+            fp_prev[:, 1:] = fp[:, :-1]
+            if "auprc" in metrics:
+                gain = tp - tp_prev
+                precision = np.divide(tp, tp + fp, out=np.zeros_like(tp), where=gain > 0)
+                auprc = (gain * precision).sum(axis=1) / n_pos
+                result["auprc"] = np.where(n_pos > 0, auprc, np.nan)
+            if "auc_roc" in metrics:
+                auc = ((fp - fp_prev) * (tp + tp_prev)).sum(axis=1) / (2 * n_pos * n_neg)
+                result["auc_roc"] = np.where((n_pos > 0) & (n_neg > 0), auc, np.nan)
+
+        # Copies of each peptide that fall inside the top-N of the resample
+        before = cw - weights
+        if "fr_top100" in metrics:
+            in_top = np.clip(top_n_fr - before, 0, weights)
+            top = (in_top * y_sorted).sum(axis=1)
+            result["fr_top100"] = np.where(n_pos > 0, top / n_pos, 0.0)
+        if "ttif_top20" in metrics:
+            in_top = np.clip(top_n_ttif - before, 0, weights)
+            top = (in_top * y_sorted).sum(axis=1)
+            result["ttif_top20"] = top / np.minimum(top_n_ttif, n_total)
+    return result
+
+
+def _metric_chunk(task):
+    """
+    Metrics for every (model, resample) pair in one chunk.
+
+    task: (models, n_samples, idx, metrics). Returns array of shape
+    (n_metrics, n_models, n_resamples_in_chunk).
+    """
+    models, n_samples, idx, metrics = task
+    n_rows = len(idx)
+    # Multiplicity of every sample in every resample
+    flat = (np.arange(n_rows)[:, None] * n_samples + idx).ravel()
+    weights = np.bincount(flat, minlength=n_rows * n_samples).reshape(n_rows, n_samples).astype(float)
+
+    out = np.empty((len(metrics), len(models), n_rows))
+    for i, (cols, y_sorted, last) in enumerate(models):
+        m = _weighted_metrics(weights[:, cols], y_sorted, last, metrics)
+        for k, name in enumerate(metrics):
+            out[k, i] = m[name]
+    return out
+
+
+def _resampled_metrics(y_true, scores, idx, metrics, n_jobs, chunk_size):
+    """Metric values for every model under every resample: (n_metrics, n_models, n_resamples)."""
+    models = _sorted_models(y_true, scores)
+    tasks = [(models, len(y_true), idx[i:i + chunk_size], metrics)
+             for i in range(0, len(idx), chunk_size)]
+    return np.concatenate(_map_chunks(_metric_chunk, tasks, n_jobs), axis=2)
+
+
+def _as_inputs(y_true, score_matrix):
+    y_true = np.asarray(y_true, dtype=float)
+    scores = np.atleast_2d(np.asarray(score_matrix, dtype=float))
+    if scores.shape[1] != len(y_true):
+        raise ValueError(f"score_matrix has {scores.shape[1]} columns for {len(y_true)} labels")
+    return y_true, scores
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CONFIDENCE INTERVALS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def bootstrap_metrics(y_true, score_matrix, names=None, groups=None, n_resamples=10000,
+                      metrics=METRICS, ci=0.95, seed=0, n_jobs=-1, chunk_size=DEFAULT_CHUNK):
+    """
+    Percentile bootstrap CIs for every model and metric.
+
+    All models are scored on the same resamples. NaN scores are dropped per
+    model, as in evaluate_predictions().
+
+    Args:
+        y_true: Binary labels, shape (n_samples,)
+        score_matrix: Scores, shape (n_models, n_samples)
+        names: Model names (default: model_0, model_1, ...)
+        groups: Patient id per sample for stratified resampling (None = plain bootstrap)
+        n_resamples: Number of bootstrap replicates
+        metrics: Metric names from evaluate_predictions_batch()
+        ci: Confidence level
+        seed: Random seed
+        n_jobs: Worker processes (-1 = all cores)
+        chunk_size: Resamples per task
+
+    Returns:
+        DataFrame with columns name, metric, estimate, ci_low, ci_high, std
+    """
+    y_true, scores = _as_inputs(y_true, score_matrix)
+    if names is None:
+        names = [f"model_{i}" for i in range(len(scores))]
+    metrics = tuple(metrics)
+
+    point = rank_metrics(y_true, scores)
+    idx = stratified_bootstrap_indices(len(y_true), n_resamples, groups, seed)
+    values = _resampled_metrics(y_true, scores, idx, metrics, n_jobs, chunk_size)
+
+    alpha = (1 - ci) / 2
+    with np.errstate(invalid="ignore"):
+        low, high = np.nanquantile(values, [alpha, 1 - alpha], axis=2)
+        std = np.nanstd(values, axis=2)
+
+    rows = []
+    for k, metric in enumerate(metrics):
+        for i, name in enumerate(names):
+            rows.append({
+                "name": name,
+                "metric": metric,
+                "estimate": point[metric][i],
+                "ci_low": low[k, i],
+                "ci_high": high[k, i],
+                "std": std[k, i],
+            })
+    return pd.DataFrame(rows)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# PAIRED TESTS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _paired_inputs(y_true, score_a, score_b):
+    """Restrict to samples scored by both models."""
+    y_true = np.asarray(y_true, dtype=float)
+    score_a = np.asarray(score_a, dtype=float)
+    score_b = np.asarray(score_b, dtype=float)
+    valid = ~(np.isnan(score_a) | np.isnan(score_b))
+    if not valid.all():
+        print(f"  Warning: {(~valid).sum()} samples without both scores removed")
+    return y_true[valid], score_a[valid], score_b[valid], valid
+
+
+def paired_bootstrap_test(y_true, score_a, score_b, metric="auprc", groups=None,
+                          n_resamples=10000, ci=0.95, seed=0, n_jobs=-1, chunk_size=DEFAULT_CHUNK):
+    """
+    Paired bootstrap of metric(a) - metric(b) on shared resamples.
+
+    Returns:
+        dict with delta, ci_low, ci_high and a two-sided p_value (twice the
+        smaller tail mass of the bootstrap deltas around zero).
+    """
+    y_true, score_a, score_b, valid = _paired_inputs(y_true, score_a, score_b)
+    if groups is not None:
+        groups = np.asarray(groups)[valid]
+    scores = np.vstack([score_a, score_b])
+
+    point = rank_metrics(y_true, scores)
+    idx = stratified_bootstrap_indices(len(y_true), n_resamples, groups, seed)
+    values = _resampled_metrics(y_true, scores, idx, (metric,), n_jobs, chunk_size)[0]
+    deltas = values[0] - values[1]
+    deltas = deltas[~np.isnan(deltas)]
+
+    alpha = (1 - ci) / 2
+    low, high = np.quantile(deltas, [alpha, 1 - alpha])
+    p_value = min(1.0, 2 * min((deltas <= 0).mean(), (deltas >= 0).mean()))
+    return {
+        "metric": metric,
+        "delta": point[metric][0] - point[metric][1],
+        "ci_low": low,
+        "ci_high": high,
+        "p_value": p_value,
+        "n_resamples": len(deltas),
+    }
+
+
+def _normalized_ranks(scores):
+    """Average ranks scaled to (0, 1], so two models' scores become exchangeable."""
+    from scipy.stats import rankdata
+    return rankdata(scores) / len(scores)
+
+
+def _permutation_chunk(task):
+    """metric(a) - metric(b) for a chunk of swap masks."""
+    y_true, rank_a, rank_b, swap, metric = task
+    a = np.where(swap, rank_b, rank_a)
+    b = np.where(swap, rank_a, rank_b)
+    m = rank_metrics(y_true, np.vstack([a, b]))
+    n = len(swap)
+    return m[metric][:n] - m[metric][n:]
+
+
+def paired_permutation_test(y_true, score_a, score_b, metric="auprc", n_permutations=10000,
+                            seed=0, n_jobs=-1, chunk_size=DEFAULT_CHUNK):
+    """
+    Paired permutation test of metric(a) vs metric(b).
+
+    Under the null that both models rank peptides equally well, each peptide's
+    pair of normalized ranks is exchangeable; every permutation swaps a random
+    subset of pairs and re-scores both models.
+
+    Returns:
+        dict with the observed delta and a two-sided p_value
+        ((1 + #|null delta| >= |observed|) / (1 + n_permutations)).
+    """
+    y_true, score_a, score_b, _ = _paired_inputs(y_true, score_a, score_b)
+    rank_a = _normalized_ranks(score_a)
+    rank_b = _normalized_ranks(score_b)
+
+    observed = rank_metrics(y_true, np.vstack([rank_a, rank_b]))
+    delta = observed[metric][0] - observed[metric][1]
+
+    rng = np.random.default_rng(seed)
+    swaps = rng.random((n_permutations, len(y_true))) < 0.5
+    tasks = [(y_true, rank_a, rank_b, swaps[i:i + chunk_size], metric)
+             for i in range(0, n_permutations, chunk_size)]
+    null = np.concatenate(_map_chunks(_permutation_chunk, tasks, n_jobs))
+
+    # Small tolerance so exact ties with the observed delta count as extreme
+    extreme = (np.abs(null) >= abs(delta) - 1e-12).sum()
+    return {
+        "metric": metric,
+        "delta": delta,
+        "p_value": (1 + extreme) / (1 + n_permutations),
+        "n_permutations": n_permutations,
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# REPORTING
+# ══════════════════════════════════════════════════════════════════════════════
+
+def compare_models_significance(y_true, score_matrix, names, groups=None, metric="auprc",
+                                n_resamples=10000, ci=0.95, seed=0, n_jobs=-1):
+    """
+    Print a model comparison with bootstrap CIs and paired p-values vs the best model.
+
+    Returns:
+        DataFrame with one row per model: name, metric estimate, CI bounds,
+        delta vs best and paired bootstrap p-value (NaN for the best model).
+    """
+    y_true, scores = _as_inputs(y_true, score_matrix)
+    intervals = bootstrap_metrics(y_true, scores, names, groups, n_resamples, (metric,),
+                                  ci, seed, n_jobs)
+    best = int(np.nanargmax(intervals["estimate"].to_numpy()))
+
+    deltas, p_values = [], []
+    for i in range(len(scores)):
+        if i == best:
+            deltas.append(0.0)
+            p_values.append(np.nan)
+            continue
+        test = paired_bootstrap_test(y_true, scores[i], scores[best], metric, groups,
+                                     n_resamples, ci, seed, n_jobs)
+        deltas.append(test["delta"])
+        p_values.append(test["p_value"])
+
+    table = intervals.drop(columns=["metric", "std"]).rename(columns={"estimate": metric})
+    table["delta_vs_best"] = deltas
+    table["p_vs_best"] = p_values
+
+    level = f"{ci:.0%}"
+    strata = "patient-stratified" if groups is not None else "plain"
+    print(f"\n=== MODEL COMPARISON ({metric}, {level} CI, {n_resamples} {strata} bootstrap resamples) ===")
+    print(table.to_string(index=False, float_format="%.4f"))
+    print(f"  Best: {names[best]}; p_vs_best is a paired bootstrap test on the same resamples")
+    return table
+
+
+if __name__ == "__main__":
+    # Quick check with random data
+    rng = np.random.default_rng(42)
+    y_true = np.array([1] * 37 + [0] * 571)  # TESLA-like imbalance
+    patients = rng.integers(0, 8, size=len(y_true))
+    signal = rng.random((3, len(y_true)))
+    signal[1] += 0.4 * y_true
+    signal[2] += 0.8 * y_true
+    compare_models_significance(y_true, signal, ["random", "weak", "strong"], groups=patients)
+    print(paired_permutation_test(y_true, signal[2], signal[1]))
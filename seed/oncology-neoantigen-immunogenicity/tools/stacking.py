@@ -0,0 +1,272 @@
+"""
+Stacking and blending over stored out-of-fold predictions.
+
+Combiners are learned on the OOF score matrix from tools.oof_store (one
+column per base model) and never refit a base model, so ensembles of dozens
+of models are searched in seconds.
+
+Evaluation is nested leave-one-patient-out: for every held-out patient, each
+combiner's hyperparameter is chosen by an inner LOGO over the remaining
+patients, the combiner is fit on those patients and then scores the held-out
+one. The held-out predictions form the combiner's own out-of-fold vector,
+scored like any base model.
+
+Caveat: a base model's OOF score for a training patient came from a model
+that saw the held-out patient. This is the usual price of stacking without
+refits. Combiners are low-capacity (selection, averaging, a logistic layer
+on percentiles) to keep that leak small.
+
+Base scores are mapped to percentiles of the training rows, so models on
+different scales (probabilities, nM, raw features) combine; missing scores
+count as the median.
+
+Combiners:
+- best_single   base model with the best training AUPRC
+- mean_top      mean percentile of the top-k base models
+- greedy        forward selection with replacement (Caruana et al. 2004)
+- logistic      L2 logistic regression on percentiles
+
+Usage:
+    from tools.oof_store import OOFStore
+    from tools.stacking import nested_stack
+    scores, y, groups = OOFStore().load()
+    result = nested_stack(scores, y, groups)
+
+Command line:
+    python -m tools.stacking                       # newest dataset, all models
+    python -m tools.stacking --models "RF (ALL features)" "MHCflurry presentation" --combiners greedy
+    python -m tools.stacking --list
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.evaluate import rank_metrics
+
+DEFAULT_METRIC = "auprc"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMBINERS
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# fit(P, y, grid) fits one combiner per grid value on the percentile matrix
+# P (n_rows, n_models) and returns a list of predict(P) -> scores functions in
+# grid order, so one pass can serve a whole path (top-k, greedy steps).
+
+# Name -> {"fit": fit(P, y, grid), "grid": [...]}
+COMBINERS = {}
+
+
+def combiner(name, grid):
+    """Register a combiner fit function with its hyperparameter grid."""
+    def decorator(fn):
+        COMBINERS[name] = {"fit": fn, "grid": list(grid)}
+        return fn
+    return decorator
+
+
+def _scores(y, score_matrix, metric=DEFAULT_METRIC):
+    """Metric of every row of an (n_candidates, n_rows) matrix."""
+    return rank_metrics(y, score_matrix)[metric]
+
+
+def _column_ranking(P, y, metric=DEFAULT_METRIC):
+    return np.argsort(-_scores(y, P.T, metric), kind="stable")
+
+
+@combiner("best_single", grid=[None])
+def _best_single(P, y, grid, metric=DEFAULT_METRIC):
+    best = _column_ranking(P, y, metric)[0]
+    return [lambda Q: Q[:, best]]
+
+
+@combiner("mean_top", grid=[2, 3, 5, 10, 20])
+def _mean_top(P, y, grid, metric=DEFAULT_METRIC):
+    ranking = _column_ranking(P, y, metric)
+    return [lambda Q, cols=ranking[:k]: Q[:, cols].mean(axis=1) for k in grid]
+
+
+@combiner("greedy", grid=[5, 10, 20])
+def _greedy(P, y, grid, metric=DEFAULT_METRIC):
+    # Start from the best model; each step adds the model (repeats allowed)
+    # whose inclusion maximizes the metric of the running mean.
+    counts = np.zeros(P.shape[1])
+    counts[_column_ranking(P, y, metric)[0]] = 1
+    total = P @ counts
+    path = {1: counts.copy()}
+    for step in range(2, max(grid) + 1):
+        candidates = (total[None, :] + P.T) / step
+        best = int(np.argmax(_scores(y, candidates, metric)))
+        counts[best] += 1
+        total += P[:, best]
+        path[step] = counts.copy()
+    return [lambda Q, w=path[n] / path[n].sum(): Q @ w for n in grid]
+
+
+@combiner("logistic", grid=[0.01, 0.1, 1.0])
+def _logistic(P, y, grid, metric=DEFAULT_METRIC):
+    from sklearn.linear_model import LogisticRegression
+
+    fitted = [LogisticRegression(C=C, class_weight="balanced", max_iter=1000).fit(P, y) for C in grid]
+    return [lambda Q, m=m: m.decision_function(Q) for m in fitted]
+
+
+def _percentile_map(P_ref):
+    """Function mapping a score matrix to percentiles of P_ref's columns (NaN -> 0.5)."""
+    ref = [np.sort(col[~np.isnan(col)]) for col in P_ref.T]
+
+    def transform(P):
+        out = np.full(P.shape, 0.5)
+        for j, col in enumerate(ref):
+            if len(col):
+                valid = ~np.isnan(P[:, j])
+                out[valid, j] = np.searchsorted(col, P[valid, j], side="right") / len(col)
+        return out
+    return transform
+
+
+def _fit(name, P_raw, y, grid, metric):
+    transform = _percentile_map(P_raw)
+    predictors = COMBINERS[name]["fit"](transform(P_raw), y, grid, metric=metric)
+    return [lambda Q, f=f: f(transform(Q)) for f in predictors]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# NESTED GROUP CV
+# ══════════════════════════════════════════════════════════════════════════════
+
+def select_param(name, P, y, groups, metric=DEFAULT_METRIC):
+    """Grid value with the best pooled inner-LOGO metric (first one if there is one value)."""
+    grid = COMBINERS[name]["grid"]
+    if len(grid) == 1:
+        return grid[0]
+    pooled = np.full((len(grid), len(y)), np.nan)
+    for g in np.unique(groups):
+        test = groups == g
+        for i, predict in enumerate(_fit(name, P[~test], y[~test], grid, metric)):
+            pooled[i, test] = predict(P[test])
+    return grid[int(np.argmax(_scores(y, pooled, metric)))]
+
+
+def nested_stack(scores, y, groups, combiners=None, metric=DEFAULT_METRIC):
+    """
+    Nested LOGO evaluation of combiners over a base-model score matrix.
+
+    Args:
+        scores: DataFrame (n_rows, n_models) of out-of-fold base scores.
+        y, groups: Labels and patient of every row.
+        combiners: Names from COMBINERS (default: all).
+        metric: Metric optimized by the combiners and the inner selection.
+
+    Returns:
+        dict with table (evaluate_predictions_batch rows: every combiner,
+        then every base model, best first), oof (combiner -> stacked
+        out-of-fold scores), params (combiner -> chosen value per outer
+        fold) and final (combiner -> (param, predict) fit on all rows).
+    """
+    from tools.evaluate import evaluate_predictions_batch
+
+    combiners = list(combiners or COMBINERS)
+    P = scores.to_numpy(dtype=float)
+    y = np.asarray(y, dtype=int)
+    groups = np.asarray(groups)
+
+    oof = {name: np.full(len(y), np.nan) for name in combiners}
+    params = {name: {} for name in combiners}
+    for g in np.unique(groups):
+        test = groups == g
+        P_train, y_train, g_train = P[~test], y[~test], groups[~test]
+        for name in combiners:
+            param = select_param(name, P_train, y_train, g_train, metric)
+            params[name][str(g)] = param
+            oof[name][test] = _fit(name, P_train, y_train, [param], metric)[0](P[test])
+
+    final = {}
+    for name in combiners:
+        param = select_param(name, P, y, groups, metric)
+        final[name] = (param, _fit(name, P, y, [param], metric)[0])
+
+    names = [f"stack:{name}" for name in combiners] + list(scores.columns)
+    matrix = np.vstack([oof[name] for name in combiners] + [P.T])
+    table = evaluate_predictions_batch(y, matrix, names=names)
+    table = table.sort_values(metric, ascending=False).reset_index(drop=True)
+    return {"table": table, "oof": oof, "params": params, "final": final}
+
+
+def greedy_weights(scores, y, groups, metric=DEFAULT_METRIC):
+    """Base-model weights of the greedy ensemble fit on all rows (nonzero only)."""
+    P = scores.to_numpy(dtype=float)
+    n = select_param("greedy", P, np.asarray(y, dtype=int), np.asarray(groups), metric)
+    transform = _percentile_map(P)
+    Q = transform(P)
+    # Recover the weights by predicting unit vectors through the fitted linear combiner
+    predict = COMBINERS["greedy"]["fit"](Q, np.asarray(y, dtype=int), [n], metric=metric)[0]
+    weights = predict(np.eye(P.shape[1]))
+    return pd.Series(weights, index=scores.columns)[lambda w: w > 0].sort_values(ascending=False)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COMMAND LINE
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv=None):
+    import argparse
+
+    from tools.oof_store import OOFStore
+
+    parser = argparse.ArgumentParser(prog="python -m tools.stacking", description=__doc__.split("\n")[1])
+    parser.add_argument("--root", help="OOF store directory (default: data/oof)")
+    parser.add_argument("--dataset", help="Dataset key (default: newest)")
+    parser.add_argument("--models", nargs="+", help="Base model names (default: all)")
+    parser.add_argument("--combiners", nargs="+", choices=list(COMBINERS), help="Default: all")
+    parser.add_argument("--metric", default=DEFAULT_METRIC,
+                        choices=["auprc", "auc_roc", "fr_top100", "ttif_top20"])
+    parser.add_argument("--top", type=int, default=15, help="Rows of the result table")
+    parser.add_argument("--list", action="store_true", help="List datasets and stored models")
+    args = parser.parse_args(argv)
+
+    store = OOFStore(args.root)
+    if args.list:
+        for ds in store.datasets():
+            print(f"Dataset {ds['key']}: {ds['n_rows']} rows, {ds['n_models']} models")
+            models = store.models(ds["key"]).sort_values("auprc", ascending=False)
+            for m in models.itertuples(index=False):
+                print(f"  {m.auprc:7.4f}  {m.name:48s} {m.script}")
+        return 0
+
+    try:
+        scores, y, groups = store.load(args.dataset, args.models)
+    except FileNotFoundError as e:
+        print(f"stacking: {e}")
+        return 2
+    if scores.shape[1] < 2:
+        print(f"stacking: need at least 2 base models, found {scores.shape[1]}")
+        return 2
+
+    print(f"Stacking {scores.shape[1]} base models over {len(y)} rows, "
+          f"{len(np.unique(groups))} patient folds")
+    start = time.perf_counter()
+    result = nested_stack(scores, y, groups, args.combiners, args.metric)
+    elapsed = time.perf_counter() - start
+
+    cols = ["name", "auc_roc", "auprc", "fr_top100", "ttif_top20"]
+    print(result["table"][cols].head(args.top).to_string(index=False, float_format="%.4f"))
+    print("\nChosen hyperparameters per held-out patient:")
+    for name, per_fold in result["params"].items():
+        print(f"  {name:12s} {per_fold}")
+    if "greedy" in result["params"]:
+        print("\nGreedy ensemble on all patients:")
+        for model, w in greedy_weights(scores, y, groups, args.metric).items():
+            print(f"  {w:5.2f}  {model}")
+    print(f"\nNested LOGO stacking in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
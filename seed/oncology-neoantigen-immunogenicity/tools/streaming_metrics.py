@@ -0,0 +1,240 @@
+"""
+Constant-memory metric accumulator for very large score sets.
+
+Scoring full IEDB or proteome-wide candidate lists produces more scores than
+we want to hold and sort just to call average_precision_score/roc_auc_score.
+StreamingMetrics consumes (label, score) chunks and keeps only:
+
+- one fixed-resolution score histogram per class -> AUC-ROC and AUPRC with
+  guaranteed error bounds (peptides within one bin have unknown relative order)
+- a bounded buffer of the current top-N (score, label) pairs -> exact FR/TTIF
+
+Accumulators built on separate shards can be combined with merge().
+
+Usage:
+    from tools.streaming_metrics import StreamingMetrics
+    acc = StreamingMetrics(score_range=(0.0, 1.0))
+    for labels, scores in chunks:
+        acc.update(labels, scores)
+    metrics = acc.result(name="MHCflurry presentation")
+"""
+import numpy as np
+
+DEFAULT_BINS = 65536
+
+
+class StreamingMetrics:
+    """Histogram-based AUC-ROC/AUPRC with error bounds plus exact top-N metrics."""
+
+    def __init__(self, score_range=(0.0, 1.0), n_bins=DEFAULT_BINS, top_n_fr=100, top_n_ttif=20):
+        """
+        Args:
+            score_range: (low, high) of the score scale. Scores outside are
+                         counted in the edge bins; the bounds stay valid but widen.
+            n_bins: Histogram resolution. Error bounds shrink as bins get finer.
+            top_n_fr: Top-N cutoff for Fraction Ranked metric
+            top_n_ttif: Top-N cutoff for TTIF metric
+        """
+        self.low, self.high = float(score_range[0]), float(score_range[1])
+        if not self.high > self.low:
+            raise ValueError(f"Invalid score_range {score_range}")
+        self.n_bins = int(n_bins)
+        self.top_n_fr = top_n_fr
+        self.top_n_ttif = top_n_ttif
+        self.top_k = max(top_n_fr, top_n_ttif)
+
+        self.pos_hist = np.zeros(self.n_bins, dtype=np.int64)
+        self.neg_hist = np.zeros(self.n_bins, dtype=np.int64)
+        self.n_seen = 0
+        self.n_nan = 0
+        self.n_clipped = 0
+        # Top-N buffer; ties are broken by arrival order, as a stable sort would
+        self.top_scores = np.empty(0)
+        self.top_labels = np.empty(0, dtype=np.int8)
+        self.top_arrival = np.empty(0, dtype=np.int64)
+
+    def _bin(self, scores):
+        pos = (scores - self.low) / (self.high - self.low) * self.n_bins
+        self.n_clipped += int(((pos < 0) | (pos > self.n_bins)).sum())
+        return np.clip(pos, 0, self.n_bins - 1).astype(np.int64)
+
+    def _keep_top(self, scores, labels, arrival):
+        """Keep the top_k entries by (score desc, arrival asc)."""
+        if len(scores) > self.top_k:
+            # Cheap pre-selection, then an exact ordered cut
+            cut = np.partition(scores, len(scores) - self.top_k)[len(scores) - self.top_k]
+            keep = scores >= cut
+            scores, labels, arrival = scores[keep], labels[keep], arrival[keep]
+        order = np.lexsort((arrival, -scores))[:self.top_k]
+        self.top_scores = scores[order]
+        self.top_labels = labels[order]
+        self.top_arrival = arrival[order]
+
+    def update(self, y_true, y_score):
+        """Add a chunk of labels and scores. NaN scores are dropped."""
+        y_true = np.asarray(y_true).astype(np.int8, copy=False)
+        y_score = np.asarray(y_score, dtype=float)
+        arrival = self.n_seen + np.arange(len(y_score))
+        self.n_seen += len(y_score)
+
+        valid = ~np.isnan(y_score)
+        if not valid.all():
+            self.n_nan += int((~valid).sum())
+            y_true, y_score, arrival = y_true[valid], y_score[valid], arrival[valid]
+
+        bins = self._bin(y_score)
+        positive = y_true == 1
+        self.pos_hist += np.bincount(bins[positive], minlength=self.n_bins)
+        self.neg_hist += np.bincount(bins[~positive], minlength=self.n_bins)
+
+        self._keep_top(
+            np.concatenate([self.top_scores, y_score]),
+            np.concatenate([self.top_labels, y_true]),
+            np.concatenate([self.top_arrival, arrival]),
+        )
+        return self
+
+    def merge(self, other):
+        """
+        Fold in an accumulator built on a later part of the stream.
+
+        other's arrival indices are offset by this accumulator's count, so
+        top-N tie-breaking matches a single pass over the concatenated stream.
+        """
+        if (other.n_bins, other.low, other.high) != (self.n_bins, self.low, self.high):
+            raise ValueError("Cannot merge accumulators with different histograms")
+        self.pos_hist += other.pos_hist
+        self.neg_hist += other.neg_hist
+        self._keep_top(
+            np.concatenate([self.top_scores, other.top_scores]),
+            np.concatenate([self.top_labels, other.top_labels]),
+            np.concatenate([self.top_arrival, other.top_arrival + self.n_seen]),
+        )
+        self.n_seen += other.n_seen
+        self.n_nan += other.n_nan
+        self.n_clipped += other.n_clipped
+        return self
+
+    def _auc_roc(self, pos, neg, n_pos, n_neg):
+        """Bin-tie AUC and its maximum deviation from the exact AUC."""
+        # Negatives in strictly lower bins (bins ordered by descending score)
+        neg_below = n_neg - np.cumsum(neg)
+        auc = (pos * (neg_below + 0.5 * neg)).sum() / (n_pos * n_neg)
+        # Only within-bin positive/negative pairs have unknown order
+        error = 0.5 * (pos * neg).sum() / (n_pos * n_neg)
+        return auc, error
+
+    def _auprc(self, pos, neg, n_pos):
+        """
+        AUPRC treating each bin as one tie group, plus lower/upper bounds.
+
+        The bounds are exact: within a bin, positives-first ordering maximizes
+        every positive's precision and negatives-first minimizes it. Sums of
+        (a + i) / (b + i) over a bin's positives use the digamma identity
+        sum_{i=1..p} 1 / (b + i) = psi(b + p + 1) - psi(b + 1).
+        """
+        from scipy.special import digamma
+
+        occupied = (pos + neg) > 0
+        pos, neg = pos[occupied].astype(float), neg[occupied].astype(float)
+        tp = np.cumsum(pos)
+        fp = np.cumsum(neg)
+        tp_before = tp - pos
+        fp_before = fp - neg
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            point = np.where(pos > 0, pos * tp / (tp + fp), 0.0).sum() / n_pos
+
+        def precision_sum(a, b, p):
+            # sum_{i=1..p} (a + i) / (b + i) = p - (b - a) * sum_{i=1..p} 1 / (b + i)
+            harmonic = np.where(p > 0, digamma(b + p + 1) - digamma(b + 1), 0.0)
+            return p - (b - a) * harmonic
+
+        has_pos = pos > 0
+        upper = precision_sum(tp_before[has_pos], tp_before[has_pos] + fp_before[has_pos],
+                              pos[has_pos]).sum() / n_pos
+        lower = precision_sum(tp_before[has_pos], tp_before[has_pos] + fp[has_pos],
+                              pos[has_pos]).sum() / n_pos
+        return point, min(lower, point), max(upper, point)
+
+    def result(self, name="model"):
+        """
+        Current metrics, with the evaluate_predictions() keys for the ranking
+        metrics (accepted by compare_models()).
+
+        Returns:
+            dict with n_total, n_positive, n_negative, auc_roc (+ auc_roc_error),
+            auprc (+ auprc_low, auprc_high), exact fr_top100 and ttif_top20.
+        """
+        if self.n_nan:
+            print(f"  Warning: {self.n_nan} NaN scores removed")
+        if self.n_clipped:
+            print(f"  Warning: {self.n_clipped} scores outside score_range; error bounds widened")
+
+        # Highest-score bin first
+        pos = self.pos_hist[::-1]
+        neg = self.neg_hist[::-1]
+        n_pos = int(pos.sum())
+        n_neg = int(neg.sum())
+        n_total = n_pos + n_neg
+
+        if n_pos > 0 and n_neg > 0:
+            auc_roc, auc_error = self._auc_roc(pos, neg, n_pos, n_neg)
+        else:
+            auc_roc, auc_error = float("nan"), float("nan")
+        if n_pos > 0:
+            auprc, auprc_low, auprc_high = self._auprc(pos, neg, n_pos)
+        else:
+            auprc, auprc_low, auprc_high = float("nan"), float("nan"), float("nan")
+
+        fr = self.top_labels[:self.top_n_fr].sum() / n_pos if n_pos > 0 else 0.0
+        top_n2 = min(self.top_n_ttif, n_total)
+        ttif = self.top_labels[:self.top_n_ttif].sum() / top_n2 if top_n2 > 0 else float("nan")
+
+        return {
+            "name": name,
+            "n_total": n_total,
+            "n_positive": n_pos,
+            "n_negative": n_neg,
+            "auc_roc": auc_roc,
+            "auc_roc_error": auc_error,
+            "auprc": auprc,
+            "auprc_low": auprc_low,
+            "auprc_high": auprc_high,
+            "fr_top100": fr,
+            "ttif_top20": ttif,
+        }
+
+
+def evaluate_stream(chunks, name="model", **kwargs):
+    """
+    Evaluate an iterable of (y_true, y_score) chunks with a StreamingMetrics.
+
+    kwargs are passed to StreamingMetrics (score_range, n_bins, top-N cutoffs).
+    """
+    acc = StreamingMetrics(**kwargs)
+    for y_true, y_score in chunks:
+        acc.update(y_true, y_score)
+    return acc.result(name=name)
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+    # Quick check against the exact metrics on random data
+    from tools.evaluate import evaluate_predictions_batch
+
+    rng = np.random.default_rng(42)
+    n = 1_000_000
+    y_true = (rng.random(n) < 0.06).astype(int)
+    y_score = np.clip(rng.normal(0.4 + 0.15 * y_true, 0.15), 0, 1)
+    chunks = ((y_true[i:i + 100_000], y_score[i:i + 100_000]) for i in range(0, n, 100_000))
+    approx = evaluate_stream(chunks, name="streaming")
+    exact = evaluate_predictions_batch(y_true, y_score[None, :], names=["exact"]).iloc[0]
+    for key in ("auc_roc", "auprc", "fr_top100", "ttif_top20"):
+        print(f"  {key:12s} exact={exact[key]:.6f}  streaming={approx[key]:.6f}")
+    print(f"  AUC error bound:  ±{approx['auc_roc_error']:.2e}")
+    print(f"  AUPRC bounds:     [{approx['auprc_low']:.6f}, {approx['auprc_high']:.6f}]")
@@ -0,0 +1,298 @@
+"""
+Stage-level tracing and memory instrumentation.
+
+Wrap pipeline stages in spans to see where an experiment's time and memory
+go (xlsx parse, feature loops, MHCflurry, CV fits, evaluation):
+
+    from tools.trace import span
+    with span("features.compute", rows=len(df)) as s:
+        ...
+        s.set(n_columns=len(columns))
+
+Tracing is off unless OPENSCIENCE_TRACE is set to an output path; span()
+then returns one shared no-op object, so instrumented code pays a function
+call and an attribute check. When on, every span records wall time, nesting,
+row count and throughput, current and peak RSS, and (with
+OPENSCIENCE_TRACE_MEMORY=1) the tracemalloc peak inside the span. At exit
+the spans are written as Chrome trace JSON (open in chrome://tracing or
+https://ui.perfetto.dev) and a per-stage summary is printed.
+
+    OPENSCIENCE_TRACE=trace.json python tools/iedb_transfer.py
+    python -m tools.trace trace.json          # summary of a saved trace
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_ENV = "OPENSCIENCE_TRACE"
+TRACE_MEMORY_ENV = "OPENSCIENCE_TRACE_MEMORY"
+
+
+class _NoopSpan:
+    """Returned by span() when tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _rss_mb():
+    """Current resident set size in MB (Linux /proc; falls back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class _Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.child_mem_peak = 0
+
+    def set(self, **attrs):
+        """Attach attributes (e.g. rows=...) known only inside the span."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if self.tracer.memory:
+            import tracemalloc
+            # Fold the parent's peak so far into it before resetting for this span
+            if stack:
+                stack[-1].child_mem_peak = max(stack[-1].child_mem_peak,
+                                               tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        stack = self.tracer.stack()
+        stack.pop()
+        duration = end - self.start
+
+        args = dict(self.attrs)
+        rows = args.get("rows")
+        if rows and duration > 0:
+            args["rows_per_s"] = round(rows / duration, 1)
+        args["rss_mb"] = round(_rss_mb(), 1)
+        args["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        if self.tracer.memory:
+            import tracemalloc
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_mem_peak)
+            args["tracemalloc_peak_mb"] = round(peak / 1024 ** 2, 2)
+            if stack:
+                stack[-1].child_mem_peak = max(stack[-1].child_mem_peak, peak)
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+
+        self.tracer.record({
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start - self.tracer.origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {"depth": self.depth, **args},
+        })
+        return False
+
+
+class Tracer:
+    """Collects finished spans and writes them as a Chrome trace."""
+
+    def __init__(self, path, memory=False):
+        self.path = path
+        self.memory = memory
+        self.origin = time.perf_counter()
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def record(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path=None):
+        path = path or self.path
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+_TRACER = None
+
+
+def enable(path, memory=False):
+    """Turn tracing on programmatically (the environment variable does this at import)."""
+    global _TRACER
+    _TRACER = Tracer(path, memory=memory)
+    return _TRACER
+
+
+def disable():
+    global _TRACER
+    _TRACER = None
+
+
+def enabled():
+    return _TRACER is not None
+
+
+def span(name, **attrs):
+    """
+    Context manager timing one stage.
+
+    Args:
+        name: Dotted stage name, e.g. "load.tesla", "cv.fit", "evaluate".
+        attrs: Attributes to record; rows=N also yields rows_per_s.
+    """
+    if _TRACER is None:
+        return _NOOP
+    return _Span(_TRACER, name, attrs)
+
+
+def traced(name=None, rows_from=None):
+    """
+    Decorator form of span().
+
+    Args:
+        name: Stage name (default: the function's qualified name).
+        rows_from: Name of an argument whose len() is recorded as rows.
+
+    A DataFrame/array result also records its length as rows_out.
+    """
+    def decorate(fn):
+        import inspect
+
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return fn(*args, **kwargs)
+            attrs = {}
+            if rows_from is not None:
+                bound = signature.bind(*args, **kwargs)
+                if rows_from in bound.arguments:
+                    attrs["rows"] = len(bound.arguments[rows_from])
+            with _Span(_TRACER, label, attrs) as s:
+                result = fn(*args, **kwargs)
+                if hasattr(result, "shape"):
+                    s.set(rows_out=len(result))
+                return result
+        return wrapper
+    return decorate
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# SUMMARY
+# ══════════════════════════════════════════════════════════════════════════════
+
+def summarize(events):
+    """Aggregate spans by name: calls, total/self seconds, rows, max peak memory."""
+    import pandas as pd
+
+    spans = [e for e in events if e.get("ph") == "X"]
+    if not spans:
+        return pd.DataFrame()
+    df = pd.DataFrame({
+        "name": [e["name"] for e in spans],
+        "start": [e["ts"] for e in spans],
+        "dur": [e["dur"] for e in spans],
+        "depth": [e["args"].get("depth", 0) for e in spans],
+        "tid": [e["tid"] for e in spans],
+        "rows": [e["args"].get("rows", 0) or 0 for e in spans],
+        "peak_rss_mb": [e["args"].get("peak_rss_mb", float("nan")) for e in spans],
+        "tracemalloc_peak_mb": [e["args"].get("tracemalloc_peak_mb", float("nan")) for e in spans],
+    })
+    # Self time = duration minus direct children (same thread, depth + 1, inside the span)
+    df = df.sort_values(["tid", "start"]).reset_index(drop=True)
+    child_time = [0.0] * len(df)
+    open_spans = []
+    for i, row in enumerate(df.itertuples(index=False)):
+        if open_spans and df.at[open_spans[-1], "tid"] != row.tid:
+            open_spans = []
+        while open_spans and df.at[open_spans[-1], "start"] + df.at[open_spans[-1], "dur"] <= row.start:
+            open_spans.pop()
+        if open_spans:
+            child_time[open_spans[-1]] += row.dur
+        open_spans.append(i)
+    df["self"] = df["dur"] - child_time
+
+    table = df.groupby("name").agg(
+        calls=("dur", "size"),
+        total_s=("dur", lambda d: d.sum() / 1e6),
+        self_s=("self", lambda d: d.sum() / 1e6),
+        rows=("rows", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        tracemalloc_peak_mb=("tracemalloc_peak_mb", "max"),
+    ).sort_values("total_s", ascending=False)
+    table["rows_per_s"] = table["rows"] / table["total_s"]
+    return table.reset_index()
+
+
+def print_summary(events):
+    table = summarize(events)
+    if table.empty:
+        print("No spans recorded")
+        return
+    print("\n=== TRACE SUMMARY ===")
+    print(table.to_string(index=False, float_format="%.3f"))
+
+
+def _finish():
+    if _TRACER is None or not _TRACER.events:
+        return
+    path = _TRACER.write()
+    print_summary(_TRACER.events)
+    print(f"Trace written to {path}")
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV], memory=os.environ.get(TRACE_MEMORY_ENV) == "1")
+atexit.register(_finish)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"Usage: python -m tools.trace <trace.json>")
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        print_summary(json.load(f)["traceEvents"])
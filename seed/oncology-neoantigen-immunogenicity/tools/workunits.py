@@ -0,0 +1,516 @@
+"""
+Work units: independent, serializable pieces of the heaviest stages.
+
+A work unit is one (kind, payload) pair: a LOGO fold of one model
+configuration, a fit on one table scored on another, the permuted copies of
+one fold's test rows, a row shard of feature computation, or a chunk of
+MHCflurry scoring. Units are packed as compressed
+pickles and identified by a hash of their bytes. Any worker can execute any
+unit and return a result that the unit's kind knows how to merge.
+
+A Coordinator runs units on a backend, computes identical units once,
+retries failed ones and hands back results in submission order:
+
+- InlineBackend: in-process, for debugging
+- LocalProcessBackend: a process pool, the local stand-in for remote workers
+- SpoolBackend: a shared directory that workers on other machines drain
+  (python -m tools.workunits worker --spool DIR); claims are atomic renames
+  and units whose worker dies are requeued after a lease timeout
+
+Units are pickles: only run workers against a spool you trust.
+
+Usage:
+    from tools.workunits import Coordinator, LocalProcessBackend, distributed_cross_val_predict
+    coordinator = Coordinator(LocalProcessBackend(n_workers=8))
+    probs = distributed_cross_val_predict(rf, X, y, groups, coordinator)
+    table = distributed_grid_search(rf, candidates, X, y, groups, coordinator)
+    feats = distributed_features(tesla, FEATURE_SETS["novel"], coordinator)
+    scores = distributed_mhcflurry(peptides, alleles, coordinator)
+"""
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_LEASE_S = 900
+# Workers refresh their claim's mtime this often; must be well below the lease
+DEFAULT_HEARTBEAT_S = 60
+DEFAULT_POLL_S = 0.2
+DEFAULT_FEATURE_SHARD_ROWS = 50_000
+DEFAULT_MHCFLURRY_CHUNK = 5_000
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# UNITS
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# Each kind maps a payload dict to a picklable result. Kinds are looked up by
+# name in the worker, so a worker only needs this module, not the caller's code.
+
+# Kind -> run(payload) -> result
+UNIT_KINDS = {}
+
+
+def unit_kind(name):
+    """Register the function executing units of one kind."""
+    def decorator(fn):
+        UNIT_KINDS[name] = fn
+        return fn
+    return decorator
+
+
+def pack(obj):
+    """Compressed pickle of a unit or result."""
+    return zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def unpack(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+
+def make_unit(kind, payload):
+    """
+    Serialize one unit.
+
+    Returns (unit_id, blob); unit_id is a content hash, so identical units
+    share an id and are computed once per coordinator.
+    """
+    if kind not in UNIT_KINDS:
+        raise KeyError(f"Unknown unit kind {kind!r}; choose from {list(UNIT_KINDS)}")
+    blob = pack((kind, payload))
+    return hashlib.blake2b(blob, digest_size=16).hexdigest(), blob
+
+
+def execute(blob):
+    """Worker entry point: run a packed unit and return its packed result."""
+    from tools.trace import span
+
+    kind, payload = unpack(blob)
+    with span(f"workunit.{kind}"):
+        return pack(UNIT_KINDS[kind](payload))
+
+
+def _fit_fold(payload):
+    from sklearn.base import clone
+
+    X, y, groups = payload["X"], payload["y"], payload["groups"]
+    test = groups == payload["held_out"]
+    model = clone(payload["estimator"]).set_params(**payload["params"])
+    model.fit(X[~test], y[~test])
+    return model, {"index": np.flatnonzero(test), "probs": model.predict_proba(X[test])[:, 1]}
+
+
+@unit_kind("logo_fold")
+def _logo_fold(payload):
+    """Fit on every group but one, predict the held-out group."""
+    return _fit_fold(payload)[1]
+
+
+@unit_kind("logo_fold_model")
+def _logo_fold_model(payload):
+    """logo_fold that also returns the fitted model."""
+    model, result = _fit_fold(payload)
+    return {**result, "model": model}
+
+
+@unit_kind("transfer_fit")
+def _transfer_fit(payload):
+    """Fit on one table, predict another (e.g. IEDB -> TESLA)."""
+    from sklearn.base import clone
+
+    model = clone(payload["estimator"]).set_params(**payload["params"])
+    model.fit(payload["X"], payload["y"])
+    return model.predict_proba(payload["X_eval"])[:, 1]
+
+
+@unit_kind("permutation_fold")
+def _permutation_fold(payload):
+    """Scores of one fold model on its test rows, unpermuted and with column groups permuted."""
+    from tools.importance import permuted_scores
+    return permuted_scores(payload["model"], payload["X"], payload["column_groups"],
+                           payload["n_repeats"], payload["seed"])
+
+
+@unit_kind("feature_shard")
+def _feature_shard(payload):
+    from tools.feature_registry import compute_features
+    return compute_features(payload["df"], payload["columns"])
+
+
+@unit_kind("mhcflurry_chunk")
+def _mhcflurry_chunk(payload):
+    from tools.data_loader import prefetch
+    from tools.error_analysis_and_multifeature import predict_mhcflurry
+
+    # The predictor is loaded once per worker process and reused across chunks
+    prefetch("predictor")
+    return predict_mhcflurry(payload["peptides"], payload["alleles"])
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# BACKENDS
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# A backend has submit(unit_id, blob) -> Future resolving to a packed result,
+# and close().
+
+class InlineBackend:
+    """Runs units immediately in the calling process."""
+
+    def submit(self, unit_id, blob):
+        future = Future()
+        try:
+            future.set_result(execute(blob))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        pass
+
+
+class LocalProcessBackend:
+    """Process pool standing in for remote workers (units cross a process boundary)."""
+
+    def __init__(self, n_workers=None):
+        self.pool = ProcessPoolExecutor(max_workers=n_workers or os.cpu_count() or 1)
+
+    def submit(self, unit_id, blob):
+        return self.pool.submit(execute, blob)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class SpoolBackend:
+    """
+    Shared-directory queue for workers on other machines.
+
+    Layout under root: pending/<id>.unit, claimed/<id>.unit, done/<id>.result,
+    failed/<id>.error. Workers claim a unit by renaming it into claimed/,
+    touch it on claiming and heartbeat it while the unit runs; a claim not
+    touched for lease_s without a result is requeued.
+    """
+
+    def __init__(self, root, lease_s=DEFAULT_LEASE_S, poll_s=DEFAULT_POLL_S):
+        self.root = Path(root)
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        for sub in ("pending", "claimed", "done", "failed"):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = threading.Thread(target=self._poll, daemon=True)
+        self._poller.start()
+
+    def submit(self, unit_id, blob):
+        future = Future()
+        # Clear a previous attempt's error before the poller can see the new future
+        (self.root / "failed" / f"{unit_id}.error").unlink(missing_ok=True)
+        with self._lock:
+            self._futures[unit_id] = future
+        _write_atomic(self.root / "pending" / f"{unit_id}.unit", blob)
+        return future
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_s):
+            with self._lock:
+                waiting = list(self._futures.items())
+            for unit_id, future in waiting:
+                done = self.root / "done" / f"{unit_id}.result"
+                failed = self.root / "failed" / f"{unit_id}.error"
+                claimed = self.root / "claimed" / f"{unit_id}.unit"
+                if done.exists():
+                    future.set_result(done.read_bytes())
+                elif failed.exists():
+                    future.set_exception(RuntimeError(failed.read_text()))
+                elif claimed.exists() and time.time() - claimed.stat().st_mtime > self.lease_s:
+                    # Worker presumed dead: put the unit back
+                    try:
+                        os.replace(claimed, self.root / "pending" / f"{unit_id}.unit")
+                    except FileNotFoundError:
+                        pass
+                    continue
+                else:
+                    continue
+                with self._lock:
+                    # A retry may already have been submitted under the same id
+                    if self._futures.get(unit_id) is future:
+                        del self._futures[unit_id]
+
+    def close(self):
+        self._stop.set()
+        self._poller.join()
+
+
+def _write_atomic(path, data):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _heartbeat(path, interval_s, stop):
+    """Touch a claimed unit every interval_s until stop is set, so its lease stays fresh."""
+    while not stop.wait(interval_s):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+def run_spool_worker(root, idle_exit_s=None, poll_s=DEFAULT_POLL_S, heartbeat_s=DEFAULT_HEARTBEAT_S):
+    """
+    Drain a spool directory: claim, execute and answer units until idle.
+
+    Args:
+        root: SpoolBackend directory (shared with the coordinator).
+        idle_exit_s: Exit after this long without work (None = run forever).
+        heartbeat_s: Interval at which a running unit's claim is touched;
+                     keep it well below the coordinator's lease_s.
+    """
+    root = Path(root)
+    worker = f"{os.uname().nodename}.{os.getpid()}"
+    idle_since = time.time()
+    n_done = 0
+    while True:
+        claimed = None
+        for unit in sorted((root / "pending").glob("*.unit")):
+            target = root / "claimed" / unit.name
+            try:
+                os.rename(unit, target)  # atomic: exactly one worker wins
+            except FileNotFoundError:
+                continue
+            # rename keeps the enqueue mtime; the lease runs from the claim
+            try:
+                os.utime(target)
+            except FileNotFoundError:
+                continue
+            claimed = target
+            break
+
+        if claimed is None:
+            if idle_exit_s is not None and time.time() - idle_since > idle_exit_s:
+                print(f"Worker {worker}: idle, exiting after {n_done} unit(s)")
+                return n_done
+            time.sleep(poll_s)
+            continue
+
+        unit_id = claimed.stem
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(claimed, heartbeat_s, stop), daemon=True)
+        beat.start()
+        try:
+            result = execute(claimed.read_bytes())
+            _write_atomic(root / "done" / f"{unit_id}.result", result)
+        except Exception as e:
+            _write_atomic(root / "failed" / f"{unit_id}.error",
+                          f"{type(e).__name__}: {e} (worker {worker})".encode())
+        finally:
+            stop.set()
+            beat.join()
+        claimed.unlink(missing_ok=True)
+        n_done += 1
+        idle_since = time.time()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# COORDINATOR
+# ══════════════════════════════════════════════════════════════════════════════
+
+class Coordinator:
+    """Dedupes, dispatches, retries and collects work units on a backend."""
+
+    def __init__(self, backend=None, max_retries=DEFAULT_MAX_RETRIES):
+        self.backend = backend if backend is not None else InlineBackend()
+        self.max_retries = max_retries
+        self.results = {}  # unit_id -> result, reused by later identical units
+        self.stats = {"submitted": 0, "deduplicated": 0, "retried": 0}
+
+    def run(self, units):
+        """
+        Execute units and return their results in the same order.
+
+        Args:
+            units: list of (kind, payload).
+
+        Raises RuntimeError if a unit still fails after max_retries retries.
+        """
+        ids, blobs = [], {}
+        for kind, payload in units:
+            unit_id, blob = make_unit(kind, payload)
+            ids.append(unit_id)
+            if unit_id in self.results or unit_id in blobs:
+                self.stats["deduplicated"] += 1
+            else:
+                blobs[unit_id] = blob
+
+        attempts = dict.fromkeys(blobs, 0)
+        futures = {unit_id: self.backend.submit(unit_id, blob) for unit_id, blob in blobs.items()}
+        self.stats["submitted"] += len(futures)
+        while futures:
+            retry = {}
+            for unit_id, future in futures.items():
+                try:
+                    self.results[unit_id] = unpack(future.result())
+                except Exception as e:
+                    attempts[unit_id] += 1
+                    if attempts[unit_id] > self.max_retries:
+                        raise RuntimeError(f"Work unit {unit_id[:8]} failed after "
+                                           f"{attempts[unit_id]} attempts: {e}") from e
+                    print(f"  Warning: work unit {unit_id[:8]} failed ({e}); retrying")
+                    self.stats["retried"] += 1
+                    retry[unit_id] = self.backend.submit(unit_id, blobs[unit_id])
+            futures = retry
+        return [self.results[unit_id] for unit_id in ids]
+
+    def close(self):
+        self.backend.close()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# DISTRIBUTED STAGES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def logo_units(estimator, X, y, groups, params=None):
+    """One logo_fold unit per held-out group."""
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y)
+    groups = np.asarray(groups)
+    return [
+        ("logo_fold", {"estimator": estimator, "params": dict(params or {}),
+                       "X": X, "y": y, "groups": groups, "held_out": g})
+        for g in np.unique(groups)
+    ]
+
+
+def merge_folds(results, n):
+    """Out-of-fold probabilities of n rows from logo_fold results (NaN where missing)."""
+    probs = np.full(n, np.nan)
+    for result in results:
+        probs[result["index"]] = result["probs"]
+    return probs
+
+
+def distributed_cross_val_predict(estimator, X, y, groups, coordinator=None, params=None):
+    """
+    Leave-one-group-out predict_proba[:, 1], one unit per fold.
+
+    Equal to cross_val_predict(estimator, X, y, cv=LeaveOneGroupOut(),
+    groups=groups, method="predict_proba")[:, 1].
+    """
+    coordinator = coordinator or Coordinator()
+    return merge_folds(coordinator.run(logo_units(estimator, X, y, groups, params)), len(X))
+
+
+def distributed_grid_search(estimator, candidates, X, y, groups, coordinator=None):
+    """
+    LOGO-evaluate hyperparameter candidates, one unit per (candidate, fold).
+
+    Args:
+        candidates: list of parameter dicts applied with set_params().
+
+    Returns:
+        DataFrame with one row per candidate (params plus evaluate_predictions_batch
+        metrics), best AUPRC first
+    """
+    from tools.evaluate import evaluate_predictions_batch
+
+    coordinator = coordinator or Coordinator()
+    units, owner = [], []
+    for i, params in enumerate(candidates):
+        fold_units = logo_units(estimator, X, y, groups, params)
+        units += fold_units
+        owner += [i] * len(fold_units)
+    results = coordinator.run(units)
+
+    owner = np.asarray(owner)
+    oof = np.vstack([
+        merge_folds([results[j] for j in np.flatnonzero(owner == i)], len(X))
+        for i in range(len(candidates))
+    ])
+    table = evaluate_predictions_batch(np.asarray(y, dtype=int), oof,
+                                       names=[str(params) for params in candidates])
+    table.insert(0, "params", candidates)
+    return table.sort_values("auprc", ascending=False).reset_index(drop=True)
+
+
+def _feature_input_columns(df, columns):
+    """DataFrame columns the requested features read (the only ones shipped)."""
+    from tools.feature_registry import COLUMN_STAND_INS, PRODUCERS, plan
+
+    needed = set(columns)
+    for producer in plan(columns, available=df.columns):
+        needed.update(PRODUCERS[producer]["inputs"])
+    needed.update(COLUMN_STAND_INS[name][0] for name in needed & set(COLUMN_STAND_INS))
+    return [col for col in df.columns if col in needed]
+
+
+def distributed_features(df, columns, coordinator=None, shard_rows=DEFAULT_FEATURE_SHARD_ROWS):
+    """compute_features() over row shards, one unit per shard."""
+    coordinator = coordinator or Coordinator()
+    df = df.reset_index(drop=True)[_feature_input_columns(df, columns)]
+    units = [
+        ("feature_shard", {"df": df.iloc[start:start + shard_rows].reset_index(drop=True),
+                           "columns": list(columns)})
+        for start in range(0, len(df), shard_rows)
+    ]
+    if not units:
+        from tools.feature_registry import compute_features
+        return compute_features(df, columns)
+    return pd.concat(coordinator.run(units), ignore_index=True)
+
+
+def distributed_mhcflurry(peptides, alleles, coordinator=None, chunk_size=DEFAULT_MHCFLURRY_CHUNK):
+    """
+    predict_mhcflurry() over chunks of unique (peptide, allele) pairs.
+
+    Returns DataFrame aligned with the inputs (see predict_mhcflurry).
+    """
+    from tools.error_analysis_and_multifeature import MHCFLURRY_COLUMNS
+
+    coordinator = coordinator or Coordinator()
+    pairs = pd.DataFrame({"peptide": list(peptides), "allele": list(alleles)})
+    unique = pairs.dropna().drop_duplicates().reset_index(drop=True)
+    units = [
+        ("mhcflurry_chunk", {"peptides": unique["peptide"].iloc[start:start + chunk_size].tolist(),
+                             "alleles": unique["allele"].iloc[start:start + chunk_size].tolist()})
+        for start in range(0, len(unique), chunk_size)
+    ]
+    scores = pd.concat(coordinator.run(units), ignore_index=True) if units else \
+        pd.DataFrame(columns=list(MHCFLURRY_COLUMNS.values()))
+    scored = pd.concat([unique, scores], axis=1)
+    return pairs.merge(scored, on=["peptide", "allele"], how="left")[list(MHCFLURRY_COLUMNS.values())]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# CLI
+# ══════════════════════════════════════════════════════════════════════════════
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m tools.workunits",
+                                     description="Run work units from a shared spool directory")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--spool", required=True, help="SpoolBackend directory")
+    parser.add_argument("--idle-exit", type=float, help="Exit after this many idle seconds")
+    parser.add_argument("--heartbeat", type=float, default=DEFAULT_HEARTBEAT_S,
+                        help="Seconds between lease refreshes of a running unit")
+    args = parser.parse_args(argv)
+    run_spool_worker(args.spool, idle_exit_s=args.idle_exit, heartbeat_s=args.heartbeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    sys.exit(main())